@@ -1,8 +1,11 @@
 from distutils.core import setup
 from distutils.extension import Extension
+from distutils.ccompiler import new_compiler
+from distutils.sysconfig import customize_compiler
 from Cython.Distutils import build_ext
 
 import numpy as np
+import os, tempfile
 
 # Selects the type of math libraries to be used; Available options: lapack, mkl
 math_lib_type = "mkl"
@@ -10,13 +13,19 @@ math_lib_type = "mkl"
 # Directories including the math libraries
 math_lib_dir = "${MKLROOT}/lib/intel64/"
 #math_lib_dir = "/my_disk/my_name/lapack/"
+# Selects whether OpenMP is used for the batched electronic propagation of CTMQC trajectories and the CI overlap;
+# None uses OpenMP when the C compiler supports it
+l_openmp = None
 
-sourcefile1 = ["./src/lib/mqc/el_propagator.pyx", "./src/lib/mqc/rk4.c", "./src/lib/mqc/exponential.c"]
-sourcefile2 = ["./src/lib/mqc/el_propagator_xf.pyx", "./src/lib/mqc/rk4_xf.c"]
-sourcefile3 = ["./src/lib/mqc/el_propagator_ct.pyx", "./src/lib/mqc/rk4_ct.c"]
+sourcefile1 = ["./src/lib/mqc/el_propagator.pyx", "./src/lib/mqc/rk4.c", "./src/lib/mqc/exponential.c", \
+    "./src/lib/mqc/rk45.c", "./src/lib/mqc/krylov.c", "./src/lib/mqc/ld.c"]
+sourcefile2 = ["./src/lib/mqc/el_propagator_xf.pyx", "./src/lib/mqc/rk4_xf.c", "./src/lib/mqc/exponential_xf.c", \
+    "./src/lib/mqc/rk45_xf.c", "./src/lib/mqc/krylov_xf.c"]
+sourcefile3 = ["./src/lib/mqc/el_propagator_ct.pyx", "./src/lib/mqc/rk4_ct.c", "./src/lib/mqc/rk45_ct.c"]
 sourcefile4 = ["./src/lib/cioverlap/cioverlap.pyx", "./src/lib/cioverlap/tdnac.c"]
 
-sourcefile1_qed = ["./src/lib/mqc_qed/el_propagator.pyx", "./src/lib/mqc_qed/rk4.c", "./src/lib/mqc_qed/exponential.c"]
+sourcefile1_qed = ["./src/lib/mqc_qed/el_propagator.pyx", "./src/lib/mqc_qed/rk4.c", "./src/lib/mqc_qed/exponential.c", \
+    "./src/lib/mqc_qed/krylov.c"]
 sourcefile2_qed = ["./src/lib/mqc_qed/el_propagator_xf.pyx", "./src/lib/mqc_qed/rk4_xf.c", "./src/lib/mqc_qed/exponential_xf.c"]
 
 # External libraries to be linked
@@ -39,17 +48,47 @@ else:
     error_vars = f"math_lib_type = {math_lib_type}"
     raise ValueError (f"( setup.py ) {error_message} ( {error_vars} )")
 
+def check_openmp():
+    """ Check whether the C compiler supports OpenMP by building a small test program
+    """
+    compiler = new_compiler()
+    customize_compiler(compiler)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = os.path.join(tmp_dir, "check_openmp.c")
+        with open(source, "w") as f:
+            f.write("#include <omp.h>\nint main(void){ return omp_get_max_threads() > 0 ? 0 : 1; }\n")
+        try:
+            objects = compiler.compile([source], output_dir=tmp_dir, extra_postargs=["-fopenmp"])
+            compiler.link_executable(objects, os.path.join(tmp_dir, "check_openmp"), extra_postargs=["-fopenmp"])
+        except Exception:
+            return False
+    return True
+
+if (l_openmp == None):
+    l_openmp = check_openmp()
+    print (f"OpenMP is {'enabled' if (l_openmp) else 'disabled, since the C compiler does not support it'}", \
+        flush=True)
+
+# Flags for OpenMP compilation and linking
+omp_flags = []
+if (l_openmp):
+    omp_flags += ["-fopenmp"]
+
 extensions = [
     # Electronic propagation in MQC dynamics
     Extension("libmqc", sources=sourcefile1,  include_dirs=[np.get_include()], \
         libraries=libs, library_dirs=lib_dirs),
-    Extension("libmqcxf", sources=sourcefile2, include_dirs=[np.get_include()]),
-    Extension("libctmqc", sources=sourcefile3, include_dirs=[np.get_include()]),
+    Extension("libmqcxf", sources=sourcefile2, include_dirs=[np.get_include()], \
+        libraries=libs, library_dirs=lib_dirs),
+    Extension("libctmqc", sources=sourcefile3, include_dirs=[np.get_include()], \
+        extra_compile_args=omp_flags, extra_link_args=omp_flags),
     Extension("libcioverlap", sources=sourcefile4, include_dirs=[np.get_include()], \
-        libraries=libs, library_dirs=lib_dirs, extra_compile_args=extra_flags),
+        libraries=libs, library_dirs=lib_dirs, extra_compile_args=extra_flags + omp_flags, extra_link_args=omp_flags),
     # Electronic propagation in MQC_QED dynamics
-    Extension("libmqc_qed", sources=sourcefile1_qed, include_dirs=[np.get_include()]),
-    Extension("libmqcxf_qed", sources=sourcefile2_qed, include_dirs=[np.get_include()])
+    Extension("libmqc_qed", sources=sourcefile1_qed, include_dirs=[np.get_include()], \
+        libraries=libs, library_dirs=lib_dirs),
+    Extension("libmqcxf_qed", sources=sourcefile2_qed, include_dirs=[np.get_include()], \
+        libraries=libs, library_dirs=lib_dirs)
 ]
 
 setup(
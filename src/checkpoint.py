@@ -0,0 +1,167 @@
+from __future__ import division
+from misc import call_name, flush_output_writer
+import os, pickle, time, copy, random, threading
+import numpy as np
+
+class Checkpoint(object):
+    """ Class for checkpoints of dynamics containing only the dynamical state of MQC and QM objects.
+        A checkpoint is written when the given number of steps or the given time is passed,
+        and the file is replaced atomically so that the last complete checkpoint is always kept.
+
+        :param integer step_interval: Number of MD steps between checkpoints
+        :param double time_interval: Wall-clock time (s) between checkpoints
+        :param boolean l_background: Logical to write checkpoint files in a background thread
+    """
+    def __init__(self, step_interval=1, time_interval=None, l_background=True):
+        # Save name of Checkpoint class
+        self.checkpoint_type = self.__class__.__name__
+
+        # Initialize input values
+        self.step_interval = step_interval
+        self.time_interval = time_interval
+
+        if (self.step_interval == None and self.time_interval == None):
+            error_message = "Either step interval or time interval must be set!"
+            error_vars = f"step_interval = {self.step_interval}, time_interval = {self.time_interval}"
+            raise ValueError (f"( {self.checkpoint_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        if (self.step_interval != None and self.step_interval < 1):
+            error_message = "Step interval must be a positive integer!"
+            error_vars = f"step_interval = {self.step_interval}"
+            raise ValueError (f"( {self.checkpoint_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        if (self.time_interval != None and self.time_interval <= 0.):
+            error_message = "Time interval must be positive!"
+            error_vars = f"time_interval = {self.time_interval}"
+            raise ValueError (f"( {self.checkpoint_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        self.l_background = l_background
+
+        # Runtime objects such as the writer thread are not saved with the dynamics
+        self.time_last = None
+        self.writer = None
+        self.writer_error = None
+
+    def get_file(self, output_dir, ishard=None):
+        """ Get the name of checkpoint file
+
+            :param string output_dir: Name of directory where the checkpoint file is saved
+            :param integer ishard: Index for the shard, None if the trajectories are not sharded
+        """
+        if (ishard == None):
+            return os.path.join(output_dir, "CHECKPOINT.bin")
+        else:
+            return os.path.join(output_dir, f"CHECKPOINT_SHARD_{ishard}.bin")
+
+    def check(self, istep, nsteps):
+        """ Check whether a checkpoint is written at the current step
+
+            :param integer istep: Current MD step
+            :param integer nsteps: Total step of nuclear propagation
+        """
+        if (self.time_last == None):
+            self.time_last = time.time()
+
+        l_write = (istep == nsteps - 1)
+        if (self.step_interval != None and (istep + 1) % self.step_interval == 0):
+            l_write = True
+        if (self.time_interval != None and time.time() - self.time_last >= self.time_interval):
+            l_write = True
+
+        return l_write
+
+    def write(self, output_dir, md_state, qm_state, ishard=None):
+        """ Write the dynamical state of MQC and QM objects to the checkpoint file.
+            The state is copied in the calling thread, hence the objects can be changed right after the call
+
+            :param string output_dir: Name of directory where the checkpoint file is saved
+            :param dictionary md_state: Dynamical state of MQC object
+            :param dictionary qm_state: Dynamical state of QM object
+            :param integer ishard: Index for the shard, None if the trajectories are not sharded
+        """
+        # Only one checkpoint is written at once, the previous one must be finished
+        self.wait()
+
+        # Output files are flushed to be consistent with the checkpoint
+        flush_output_writer()
+
+        state = copy.deepcopy({'md':md_state, 'qm':qm_state})
+        state['random'] = random.getstate()
+        state['np_random'] = np.random.get_state()
+
+        file_name = self.get_file(output_dir, ishard)
+        if (self.l_background):
+            self.writer = threading.Thread(target=self.dump, args=(file_name, state))
+            self.writer.start()
+        else:
+            self.dump(file_name, state)
+            self.wait()
+
+        self.time_last = time.time()
+
+    def dump(self, file_name, state):
+        """ Dump the state to a temporary file and replace the checkpoint file with it
+
+            :param string file_name: Name of checkpoint file
+            :param dictionary state: State to be saved
+        """
+        tmp_file = file_name + ".tmp"
+        try:
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, file_name)
+        except Exception as error:
+            self.writer_error = error
+
+    def wait(self):
+        """ Wait for the checkpoint being written in the background thread
+        """
+        if (self.writer != None):
+            self.writer.join()
+            self.writer = None
+
+        if (self.writer_error != None):
+            error = self.writer_error
+            self.writer_error = None
+            error_message = "Checkpoint file is not written!"
+            error_vars = f"{type(error).__name__}: {error}"
+            raise RuntimeError (f"( {self.checkpoint_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+    def read(self, output_dir, ishard=None):
+        """ Read the checkpoint file and restore the states of random number generators.
+            The dynamical states of MQC and QM objects are returned
+
+            :param string output_dir: Name of directory where the checkpoint file is saved
+            :param integer ishard: Index for the shard, None if the trajectories are not sharded
+        """
+        file_name = self.get_file(output_dir, ishard)
+        if (not os.path.exists(file_name)):
+            error_message = "Checkpoint file to be read for restart not found!"
+            error_vars = f"file_name = {file_name}"
+            raise FileNotFoundError (f"( {self.checkpoint_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        with open(file_name, 'rb') as f:
+            state = pickle.load(f)
+
+        # 'RESTART.bin' contains only the pickled MQC and QM objects without the states of random number generators
+        if (not isinstance(state, dict) or not all([key in state for key in ["md", "qm", "random", "np_random"]])):
+            error_message = "Checkpoint file is not in the format written by Checkpoint, " + \
+                "restart from 'RESTART.bin' by reading the pickled objects without checkpoint!"
+            error_vars = f"file_name = {file_name}, keys = {list(state.keys()) if isinstance(state, dict) else None}"
+            raise ValueError (f"( {self.checkpoint_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        random.setstate(state['random'])
+        np.random.set_state(state['np_random'])
+
+        return state['md'], state['qm']
+
+    def __getstate__(self):
+        """ Remove runtime objects when the checkpoint is pickled
+        """
+        state = self.__dict__.copy()
+        state["time_last"] = None
+        state["writer"] = None
+        state["writer_error"] = None
+        return state
@@ -61,10 +61,9 @@ class CPA(object):
             error_vars = f"propagator = {self.propagator}"
             raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
 
-        if (self.propagator == "exponential" and self.elec_object != "coefficient"):
-            error_message = "exponential propagator is incompatible with objects other than coefficient"
-            error_vars = f"elec_object = {self.elec_object}, propagator = {self.propagator}"
-            raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+        # NACME terms are not neglected in the electronic propagation of CPA dynamics
+        self.nac_threshold = 0.
+        self.ncouplings = 0
 
         self.l_print_dm = l_print_dm
 
@@ -0,0 +1,65 @@
+from __future__ import division
+from misc import call_name
+import numpy as np
+
+class Ensemble(object):
+    """ Class for an ensemble of coupled trajectories saved in contiguous arrays.
+        Positions, velocities, forces, densities and coefficients of all trajectories are saved in arrays
+        whose first dimension is the index for trajectories, and the molecule (or polariton) objects
+        of the trajectories refer to the rows of the arrays instead of their own data.
+        Coefficients of states are saved in the coefficient arrays of the molecules, hence they also refer to the ensemble.
+
+        :param object,list molecules: List for molecule or polariton objects
+    """
+    def __init__(self, molecules):
+        # Save name of Ensemble class
+        self.ens_type = self.__class__.__name__
+
+        # Initialize input values
+        self.ntrajs = len(molecules)
+        if (self.ntrajs < 1):
+            error_message = "At least one trajectory is needed for the ensemble!"
+            error_vars = f"ntrajs = {self.ntrajs}"
+            raise ValueError (f"( {self.ens_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        self.nat = molecules[0].nat
+        self.nat_qm = molecules[0].nat_qm
+        self.ndim = molecules[0].ndim
+
+        # Polariton objects propagate the adiabatic coefficients of polaritonic states
+        if (hasattr(molecules[0], "pol_states")):
+            self.nst = molecules[0].pst
+            self.coef_name, self.rho_name = "coef_a", "rho_a"
+        else:
+            self.nst = molecules[0].nst
+            self.coef_name, self.rho_name = "coef", "rho"
+
+        # Initialize ensemble variables
+        self.pos = np.zeros((self.ntrajs, self.nat, self.ndim))
+        self.vel = np.zeros((self.ntrajs, self.nat, self.ndim))
+        self.force = np.zeros((self.ntrajs, self.nat_qm, self.ndim))
+        self.rho = np.zeros((self.ntrajs, self.nst, self.nst), dtype=np.complex128)
+        self.coef = np.zeros((self.ntrajs, self.nst), dtype=np.complex128)
+
+        self.bind(molecules, range(self.ntrajs))
+
+    def bind(self, molecules, itrajs):
+        """ Copy current data of molecules to the ensemble and make the molecules refer to the ensemble.
+            This must be called again whenever the data of molecules are replaced, e.g. after pickling
+
+            :param object,list molecules: List for molecule or polariton objects
+            :param integer,list itrajs: Indices for trajectories to be bound
+        """
+        for itraj in itrajs:
+            mol = molecules[itraj]
+
+            self.pos[itraj] = mol.pos
+            self.vel[itraj] = mol.vel
+            self.rho[itraj] = getattr(mol, self.rho_name)
+
+            mol.pos = self.pos[itraj]
+            mol.vel = self.vel[itraj]
+            setattr(mol, self.rho_name, self.rho[itraj])
+
+            self.coef[itraj] = getattr(mol, self.coef_name)
+            setattr(mol, self.coef_name, self.coef[itraj])
@@ -1,24 +1,27 @@
 # cython: language_level=3
-from cpython.mem cimport PyMem_Malloc, PyMem_Free
+import numpy as np
+cimport numpy as np
 
 cdef extern from "tdnac.c":
-    void TD_NAC(int istep, int nst, int nbasis, int norb, int nocc, int nvirt, double dt, \
-        int *orb_ini, int *orb_final, double **nacme, double **ao_overlap, \
-        double **mo_coef_old, double **mo_coef_new, double ***ci_coef_old, double ***ci_coef_new)
+    void TD_NAC(int istep, int nst, int nbasis, int norb, int nocc, int nvirt, double dt, double ci_threshold, \
+        double ci_norm_cutoff, int *orb_ini, int *orb_final, double *nacme, double *st_overlap, double *ci_norm, \
+        double *ao_overlap, double *mo_coef_old, double *mo_coef_new, double *ci_coef_old, double *ci_coef_new) nogil
 
 def wf_overlap(qm, molecule, istep_py, dt_py):
     cdef:
-        int *orb_ini
-        int *orb_final
-        double **nacme
-        double **ao_overlap
-        double **mo_coef_old
-        double **mo_coef_new
-        double ***ci_coef_old
-        double ***ci_coef_new
-
-        int istep, ist, nst, ibasis, jbasis, iorb, jorb, nbasis, norb, nocc, nvirt
-        double dt
+        int[::1] orb_ini
+        int[::1] orb_final
+        double[:, ::1] nacme
+        double[:, ::1] st_overlap
+        double[::1] ci_norm
+        double[:, ::1] ao_overlap
+        double[:, ::1] mo_coef_old
+        double[:, ::1] mo_coef_new
+        double[:, :, ::1] ci_coef_old
+        double[:, :, ::1] ci_coef_new
+
+        int istep, nst, nbasis, norb, nocc, nvirt
+        double dt, ci_threshold, ci_norm_cutoff
 
     # Assign size variables
     dt = dt_py
@@ -29,109 +32,41 @@ def wf_overlap(qm, molecule, istep_py, dt_py):
     nocc = qm.nocc
     nvirt = qm.nvirt
 
-    # Allocate NACME variables
-    orb_ini = <int*> PyMem_Malloc(1 * sizeof(int))
-    orb_final = <int*> PyMem_Malloc(1 * sizeof(int))
-
-    nacme = <double**> PyMem_Malloc(nst * sizeof(double*))
-
-    ao_overlap = <double**> PyMem_Malloc(nbasis * sizeof(double*))
-    mo_coef_old = <double**> PyMem_Malloc(norb * sizeof(double*))
-    mo_coef_new = <double**> PyMem_Malloc(norb * sizeof(double*))
-
-    for ist in range(nst):
-        nacme[ist] = <double*> PyMem_Malloc(nst * sizeof(double))
-
-    for ibasis in range(nbasis):
-        ao_overlap[ibasis] = <double*> PyMem_Malloc(nbasis * sizeof(double))
+    # Truncation of CI coefficients in the overlap between the states
+    ci_threshold = qm.ci_threshold
+    ci_norm_cutoff = qm.ci_norm_cutoff
 
-    for iorb in range(norb):
-        mo_coef_old[iorb] = <double*> PyMem_Malloc(nbasis * sizeof(double))
-        mo_coef_new[iorb] = <double*> PyMem_Malloc(nbasis * sizeof(double))
+    # Assign NACME variables from python to C as contiguous buffers
+    # Coefficients are copied since the phases are corrected and the coefficients are normalized in C
+    orb_ini = np.ascontiguousarray(qm.orb_ini, dtype=np.intc)
+    orb_final = np.ascontiguousarray(qm.orb_final, dtype=np.intc)
 
-    ci_coef_old = <double***> PyMem_Malloc(nst * sizeof(double**))
-    ci_coef_new = <double***> PyMem_Malloc(nst * sizeof(double**))
+    nacme_py = np.zeros((nst, nst))
+    st_overlap_py = np.zeros((nst, nst))
+    ci_norm_py = np.ones(nst)
 
-    for ist in range(nst):
-        ci_coef_old[ist] = <double**> PyMem_Malloc(nocc * sizeof(double*))
-        ci_coef_new[ist] = <double**> PyMem_Malloc(nocc * sizeof(double*))
+    ao_overlap = np.ascontiguousarray(qm.ao_overlap, dtype=np.float64)
+    mo_coef_old = np.array(qm.mo_coef_old, dtype=np.float64)
+    mo_coef_new_py = np.array(qm.mo_coef_new, dtype=np.float64)
+    ci_coef_old = np.array(qm.ci_coef_old, dtype=np.float64)
+    ci_coef_new_py = np.array(qm.ci_coef_new, dtype=np.float64)
 
-    for ist in range(nst):
-        for iorb in range(nocc):
-            ci_coef_old[ist][iorb] = <double*> PyMem_Malloc(nvirt * sizeof(double))
-            ci_coef_new[ist][iorb] = <double*> PyMem_Malloc(nvirt * sizeof(double))
-
-    # Assign NACME variables from python to C
-    orb_ini[0] = qm.orb_ini[0]
-    orb_final[0] = qm.orb_final[0]
-
-    for ist in range(nst):
-        for jst in range(nst):
-            nacme[ist][jst] = 0.
-
-    for ibasis in range(nbasis):
-        for jbasis in range(nbasis):
-            ao_overlap[ibasis][jbasis] = qm.ao_overlap[ibasis, jbasis]
-    
-    for iorb in range(norb):
-        for ibasis in range(nbasis):
-            mo_coef_old[iorb][ibasis] = qm.mo_coef_old[iorb, ibasis]
-            mo_coef_new[iorb][ibasis] = qm.mo_coef_new[iorb, ibasis]
-
-    for ist in range(nst):
-        for iorb in range(nocc):
-            for jorb in range(nvirt):
-                ci_coef_old[ist][iorb][jorb] = qm.ci_coef_old[ist, iorb, jorb]
-                ci_coef_new[ist][iorb][jorb] = qm.ci_coef_new[ist, iorb, jorb]
+    nacme, st_overlap, ci_norm = nacme_py, st_overlap_py, ci_norm_py
+    mo_coef_new, ci_coef_new = mo_coef_new_py, ci_coef_new_py
 
     # Calculate TDNAC term for CIoverlap
-    TD_NAC(istep, nst, nbasis, norb, nocc, nvirt, dt, orb_ini, orb_final, nacme, \
-        ao_overlap, mo_coef_old, mo_coef_new, ci_coef_old, ci_coef_new)
+    with nogil:
+        TD_NAC(istep, nst, nbasis, norb, nocc, nvirt, dt, ci_threshold, ci_norm_cutoff, &orb_ini[0], \
+            &orb_final[0], &nacme[0, 0], &st_overlap[0, 0], &ci_norm[0], &ao_overlap[0, 0], \
+            &mo_coef_old[0, 0], &mo_coef_new[0, 0], &ci_coef_old[0, 0, 0], &ci_coef_new[0, 0, 0])
 
     # Assign NACME variables from C to python
-    for ist in range(nst):
-        for jst in range(nst):
-             molecule.nacme[ist, jst] = nacme[ist][jst]
-
-    for iorb in range(norb):
-        for ibasis in range(nbasis):
-            qm.mo_coef_old[iorb, ibasis] = mo_coef_new[iorb][ibasis]
-
-    for ist in range(nst):
-        for iorb in range(nocc):
-            for jorb in range(nvirt):
-                qm.ci_coef_old[ist, iorb, jorb] = ci_coef_new[ist][iorb][jorb]
-
-    # Deallocate NACME variables
-    PyMem_Free(orb_ini)
-    PyMem_Free(orb_final)
-
-    for ist in range(nst):
-        PyMem_Free(nacme[ist])
-
-    PyMem_Free(nacme)
-
-    for ibasis in range(nbasis):
-        PyMem_Free(ao_overlap[ibasis])
-
-    for iorb in range(norb):
-        PyMem_Free(mo_coef_old[iorb])
-        PyMem_Free(mo_coef_new[iorb])
-
-    PyMem_Free(ao_overlap)
-    PyMem_Free(mo_coef_old)
-    PyMem_Free(mo_coef_new)
-
-    for ist in range(nst):
-        for iorb in range(nocc):
-            PyMem_Free(ci_coef_old[ist][iorb])
-            PyMem_Free(ci_coef_new[ist][iorb])
-
-    for ist in range(nst):
-        PyMem_Free(ci_coef_old[ist])
-        PyMem_Free(ci_coef_new[ist])
-
-    PyMem_Free(ci_coef_old)
-    PyMem_Free(ci_coef_new)
+    molecule.nacme[:] = nacme_py
+    molecule.st_overlap[:] = st_overlap_py
 
+    # Norm of CI coefficients retained in the truncation at time t + dt
+    qm.ci_norm = ci_norm_py
 
+    # Phase-corrected coefficients are used as the reference at next step
+    qm.mo_coef_old[:] = mo_coef_new_py
+    qm.ci_coef_old[:] = ci_coef_new_py
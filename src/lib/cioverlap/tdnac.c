@@ -1,5 +1,6 @@
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
 #include <math.h>
 
 #if defined(HAVE_LAPACK) || defined(HAVE_MKL)
@@ -8,152 +9,96 @@ extern void dgemm_(char* transa, char* transb, int* m, int* n, int* k, double* a
     double* a, int* lda, double* b, int* ldb, double* beta, double* c, int* ldc);
 #endif
 
+// Routine to calculate product of row-major matrices, C = alpha * op(A) * op(B) + beta * C
+static void mat_mul(char *transa, char *transb, int m, int n, int k, double alpha, double *a, double *b,
+    double beta, double *c);
+
 // Routine to calculate overlap and permutation matrix in MO basis between two time steps
-static void calc_MO_over(int nbasis, int norb, double **mo_overlap, double **permut_mat,
-    double **ao_overlap, double **mo_coef_old, double **mo_coef_new);
+static void calc_MO_over(int nbasis, int norb, double *mo_overlap, double *permut_mat,
+    double *ao_overlap, double *mo_coef_old, double *mo_coef_new);
 
 // Routine to match phase of MO coefficients and orderings between two time steps
-static void MO_phase_order(int nbasis, int norb, double **mo_coef_new, double **permut_mat);
+static void MO_phase_order(int nbasis, int norb, double *mo_coef_new, double *permut_mat);
 
 // Routine to match phase of CI coefficients and orderings between two time steps
 static void CI_phase_order(int nst, int norb, int nocc, int nvirt, int *orb_ini, int *orb_final,
-    double ***ci_coef_old, double ***ci_coef_new, double **permut_mat);
+    double *ci_coef_new, double *permut_mat);
 
 // Routine to match phase for the states between two time steps
 static void state_phase(int nst, int nocc, int nvirt, int *orb_ini, int *orb_final,
-    double ***ci_coef_old, double ***ci_coef_new);
+    double *ci_coef_old, double *ci_coef_new);
 
 // Routine to normalize CI coefficients
-static void norm_CI_coef(int nst, int nocc, int nvirt, int *orb_ini, int *orb_final, double ***ci_coef);
+static void norm_CI_coef(int nst, int nocc, int nvirt, int *orb_ini, int *orb_final, double *ci_coef);
 
-// Routine to calculate TDNAC term used in electronic propagation
-static void TD_NAC(int istep, int nst, int nbasis, int norb, int nocc, int nvirt, double dt,
-    int *orb_ini, int *orb_final, double **nacme, double **ao_overlap, double **mo_coef_old,
-    double **mo_coef_new, double ***ci_coef_old, double ***ci_coef_new){
+// Routine to calculate the overlap matrix between the states at two time steps
+static void state_overlap(int nst, int norb, int nocc, int nvirt, int *orb_ini, int *orb_final, double ci_threshold,
+    double ci_norm_cutoff, double *st_overlap, double *ci_norm, double *mo_overlap, double *ci_coef_old,
+    double *ci_coef_new);
+
+// Routine to contract the CI coefficients of the excited states over the whole active space
+static void ci_overlap_dense(int norb, int nocc, int nocc_a, int nvirt_a, int nex, int *orb_ini, double *mo_overlap,
+    double *ci_old, double *ci_new, double *st_ex);
+
+// Routine to contract the CI coefficients of the excited states over the retained excitations
+static void ci_overlap_sparse(int norb, int nocc, int nocc_a, int nvirt_a, int nex, int nret, int *orb_ini,
+    int *ex_ind, double *mo_overlap, double *ci_old, double *ci_new, double *st_ex);
 
-    double **mo_overlap = malloc(norb * sizeof(double*));
-    double **permut_mat = malloc(norb * sizeof(double*));
+// Routine to truncate the CI coefficients with the amplitude threshold and the cumulative norm cutoff
+static void ci_truncate(int nex, int ncis, double threshold, double norm_cutoff, double *ci, double *ci_norm);
 
-    int ist, jst, ibasis, iorb, jorb, aorb, borb, exponent;
-    double fac;
+// Routine to compare the squared amplitudes to sort them in descending order
+static int amp_compare(const void *a, const void *b);
+
+// Routine to print the matrix for debugging
+static void print_mat(char *title, int nrow, int ncol, double *mat);
+
+// Routine to calculate TDNAC term used in electronic propagation
+// Arrays are contiguous buffers with shapes of (nst, nst), (nbasis, nbasis), (norb, nbasis) or (nst, nocc, nvirt)
+// MO and CI coefficients at time t + dt are changed in place to match the phases at time t
+// The overlap matrix between the states at time t and t + dt is also saved in st_overlap
+// CI coefficients are truncated with ci_threshold and ci_norm_cutoff in the overlap between the states,
+// and the norm retained in each state at time t + dt is saved in ci_norm
+static void TD_NAC(int istep, int nst, int nbasis, int norb, int nocc, int nvirt, double dt, double ci_threshold,
+    double ci_norm_cutoff, int *orb_ini, int *orb_final, double *nacme, double *st_overlap, double *ci_norm,
+    double *ao_overlap, double *mo_coef_old, double *mo_coef_new, double *ci_coef_old, double *ci_coef_new){
+
+    double *mo_overlap = malloc((norb * norb) * sizeof(double));
+    double *permut_mat = malloc((norb * norb) * sizeof(double));
+
+    int ist, jst;
     int debug;
 
     // This is temporary option to print several variables
     debug = 0;
 
-    for(iorb = 0; iorb < norb; iorb++){
-        mo_overlap[iorb] = malloc(norb * sizeof(double));
-        permut_mat[iorb] = malloc(norb * sizeof(double));
-        for(jorb = 0; jorb < norb; jorb++){
-            mo_overlap[iorb][jorb] = 0.0;
-            permut_mat[iorb][jorb] = 0.0;
-        }
-    }
-
     calc_MO_over(nbasis, norb, mo_overlap, permut_mat, ao_overlap, mo_coef_old, mo_coef_new);
 
     if(debug == 1){
-        // Print mo_overlap
-        printf("mo_overlap \n");
-        for(iorb = 0; iorb < norb; iorb++){
-            for(jorb = 0; jorb < norb; jorb++){
-                printf("%15.8f ", mo_overlap[iorb][jorb]);
-            }
-            printf("\n");
-        }
-        printf("\n");
-
-        // Print permut_mat
-        printf("permut_mat \n");
-        for(iorb = 0; iorb < norb; iorb++){
-            for(jorb = 0; jorb < norb; jorb++){
-                printf("%15.8f ", permut_mat[iorb][jorb]);
-            }
-            printf("\n");
-        }
-        printf("\n");
-
-        // Print mo_coef_old
-        printf("mo_coef_old \n");
-        for(iorb = 0; iorb < norb; iorb++){
-            for(ibasis = 0; ibasis < nbasis; ibasis++){
-                printf("%15.8f ", mo_coef_old[iorb][ibasis]);
-            }
-            printf("\n");
-        }
-        printf("\n");
-
-        // Print mo_coef_new
-        printf("mo_coef_new \n");
-        for(iorb = 0; iorb < norb; iorb++){
-            for(ibasis = 0; ibasis < nbasis; ibasis++){
-                printf("%15.8f ", mo_coef_new[iorb][ibasis]);
-            }
-            printf("\n");
-        }
-        printf("\n");
+        print_mat("mo_overlap", norb, norb, mo_overlap);
+        print_mat("permut_mat", norb, norb, permut_mat);
+        print_mat("mo_coef_old", norb, nbasis, mo_coef_old);
+        print_mat("mo_coef_new", norb, nbasis, mo_coef_new);
     }
 
     MO_phase_order(nbasis, norb, mo_coef_new, permut_mat);
 
     if(debug == 1){
-        // Print mo_coef_new
-        printf("mo_coef_new after phase correction \n");
-        for(iorb = 0; iorb < norb; iorb++){
-            for(ibasis = 0; ibasis < nbasis; ibasis++){
-                printf("%15.8f ", mo_coef_new[iorb][ibasis]);
-            }
-            printf("\n");
-        }
-        printf("\n");
-
-        // Print ci_coef_old
-        printf("ci_coef_old \n");
-        for(iorb = 0; iorb < nocc; iorb++){
-            for(aorb = 0; aorb < nvirt; aorb++){
-                printf("%15.8f ", ci_coef_old[1][iorb][aorb]);
-            }
-            printf("\n");
-        }
-        printf("\n");
-
-        // Print ci_coef_new
-        printf("ci_coef_new \n");
-        for(iorb = 0; iorb < nocc; iorb++){
-            for(aorb = 0; aorb < nvirt; aorb++){
-                printf("%15.8f ", ci_coef_new[1][iorb][aorb]);
-            }
-            printf("\n");
-        }
-        printf("\n");
+        print_mat("mo_coef_new after phase correction", norb, nbasis, mo_coef_new);
+        print_mat("ci_coef_old", nocc, nvirt, ci_coef_old + nocc * nvirt);
+        print_mat("ci_coef_new", nocc, nvirt, ci_coef_new + nocc * nvirt);
     }
 
-    CI_phase_order(nst, norb, nocc, nvirt, orb_ini, orb_final, ci_coef_old, ci_coef_new, permut_mat);
+    CI_phase_order(nst, norb, nocc, nvirt, orb_ini, orb_final, ci_coef_new, permut_mat);
 
     if(debug == 1){
-        // Print ci_coef_new
-        printf("ci_coef_new after phase correction \n");
-        for(iorb = 0; iorb < nocc; iorb++){
-            for(aorb = 0; aorb < nvirt; aorb++){
-                printf("%15.8f ", ci_coef_new[1][iorb][aorb]);
-            }
-            printf("\n");
-        }
-        printf("\n");
+        print_mat("ci_coef_new after phase correction", nocc, nvirt, ci_coef_new + nocc * nvirt);
     }
 
     state_phase(nst, nocc, nvirt, orb_ini, orb_final, ci_coef_old, ci_coef_new);
 
     if(debug == 1){
-        // Print ci_coef_new
-        printf("ci_coef_new after state correction \n");
-        for(iorb = 0; iorb < nocc; iorb++){
-            for(aorb = 0; aorb < nvirt; aorb++){
-                printf("%15.8f ", ci_coef_new[1][iorb][aorb]);
-            }
-            printf("\n");
-        }
-        printf("\n");
+        print_mat("ci_coef_new after state correction", nocc, nvirt, ci_coef_new + nocc * nvirt);
     }
 
     if(istep == 0){
@@ -163,282 +108,387 @@ static void TD_NAC(int istep, int nst, int nbasis, int norb, int nocc, int nvirt
 
     // Re-calculate mo_overlap with phase-corrected MO coefficients
     // Now, mo_overlap is anti-symmetric
-    for(iorb = 0; iorb < norb; iorb++){
-        for(jorb = 0; jorb < norb; jorb++){
-            mo_overlap[iorb][jorb] = 0.0;
+    calc_MO_over(nbasis, norb, mo_overlap, permut_mat, ao_overlap, mo_coef_old, mo_coef_new);
+
+    if(debug == 1){
+        print_mat("mo_overlap with phase-corrected mo", norb, norb, mo_overlap);
+        print_mat("permut_mat with phase-corrected mo", norb, norb, permut_mat);
+    }
+
+    state_overlap(nst, norb, nocc, nvirt, orb_ini, orb_final, ci_threshold, ci_norm_cutoff, st_overlap, ci_norm,
+        mo_overlap, ci_coef_old, ci_coef_new);
+
+    // Each term of TDNAC in Eq. 15 is the antisymmetric part of the corresponding term of the state overlap,
+    // hence NACME is obtained from the overlap matrix (finite numerical differentiation)
+    for(ist = 0; ist < nst; ist++){
+        for(jst = 0; jst < nst; jst++){
+            nacme[nst * ist + jst] = 0.5 * (st_overlap[nst * ist + jst] - st_overlap[nst * jst + ist]) / dt;
         }
     }
-    calc_MO_over(nbasis, norb, mo_overlap, permut_mat, ao_overlap, mo_coef_old, mo_coef_new);
 
     if(debug == 1){
-        // Print mo_overlap
-        printf("mo_overlap with phase-corrected mo \n");
-        for(iorb = 0; iorb < norb; iorb++){
-            for(jorb = 0; jorb < norb; jorb++){
-                printf("%15.8f ", mo_overlap[iorb][jorb]);
+        print_mat("nacme", nst, nst, nacme);
+    }
+
+    free(mo_overlap);
+    free(permut_mat);
+
+}
+
+// Routine to calculate the overlap matrix between the states at two time steps, S_ij = <Psi_i(t)|Psi_j(t + dt)>
+// The CI coefficients in the active space are gathered into the (nst - 1, nocc_a * nvirt_a) matrices,
+// and the state pairs are contracted at once with the products of the matrices
+// When the CI coefficients are truncated, only the excitations retained in any state are contracted
+// if it is cheaper than the contraction over the whole active space
+static void state_overlap(int nst, int norb, int nocc, int nvirt, int *orb_ini, int *orb_final, double ci_threshold,
+    double ci_norm_cutoff, double *st_overlap, double *ci_norm, double *mo_overlap, double *ci_coef_old,
+    double *ci_coef_new){
+
+    // Numbers of occupied and virtual orbitals in the active space, and the number of excited states
+    int nocc_a = nocc - orb_ini[0];
+    int nvirt_a = orb_final[0] - nocc;
+    int ncis = nocc_a * nvirt_a;
+    int nex = nst - 1;
+
+    double *ci_old, *ci_new, *st_ex;
+    // Indices of the excitations retained in any state
+    int *ex_ind;
+
+    int ist, jst, iorb, aorb, k, nret;
+    double cost_dense, cost_sparse;
+
+    // Overlap of the ground state is unity since the phases of MO coefficients are matched
+    memset(st_overlap, 0, (nst * nst) * sizeof(double));
+    st_overlap[0] = 1.0;
+
+    for(ist = 0; ist < nst; ist++){
+        ci_norm[ist] = 1.0;
+    }
+
+    if(nex == 0 || ncis == 0){
+        return;
+    }
+
+    ci_old = malloc((nex * ncis) * sizeof(double));
+    ci_new = malloc((nex * ncis) * sizeof(double));
+    st_ex = malloc((nex * nex) * sizeof(double));
+    ex_ind = malloc(ncis * sizeof(int));
+
+    // Gather the CI coefficients of the excited states in the active space, CI coefficients for S_0 are zero
+    #pragma omp parallel for private(iorb, aorb) schedule(static)
+    for(ist = 0; ist < nex; ist++){
+        for(iorb = 0; iorb < nocc_a; iorb++){
+            for(aorb = 0; aorb < nvirt_a; aorb++){
+                ci_old[ncis * ist + nvirt_a * iorb + aorb] = ci_coef_old[nocc * nvirt * (ist + 1)
+                    + nvirt * (orb_ini[0] + iorb) + aorb];
+                ci_new[ncis * ist + nvirt_a * iorb + aorb] = ci_coef_new[nocc * nvirt * (ist + 1)
+                    + nvirt * (orb_ini[0] + iorb) + aorb];
             }
-            printf("\n");
         }
-        printf("\n");
+    }
 
-        // Print permut_mat
-        printf("permut_mat with phase-corrected mo \n");
-        for(iorb = 0; iorb < norb; iorb++){
-            for(jorb = 0; jorb < norb; jorb++){
-                printf("%15.8f ", permut_mat[iorb][jorb]);
+    // Truncate the CI coefficients, the norm retained at time t + dt is reported
+    ci_truncate(nex, ncis, ci_threshold, ci_norm_cutoff, ci_old, NULL);
+    ci_truncate(nex, ncis, ci_threshold, ci_norm_cutoff, ci_new, ci_norm + 1);
+
+    nret = 0;
+    for(k = 0; k < ncis; k++){
+        for(ist = 0; ist < nex; ist++){
+            if(ci_old[ncis * ist + k] != 0.0 || ci_new[ncis * ist + k] != 0.0){
+                ex_ind[nret] = k;
+                nret++;
+                break;
             }
-            printf("\n");
         }
-        printf("\n");
     }
 
-    // TODO : ist = jst should be removed
-    // TODO : we need to evaluate only ist < jst cases since NACME is anti-symmetric
-    for(ist = 0; ist < nst; ist++){
-        for(jst = 0; jst < nst; jst++){
+    // Numbers of operations in the contractions over the whole active space and over the retained excitations
+    cost_dense = (double)nex * (double)ncis * (double)(nocc_a + nvirt_a + 2 * nex);
+    cost_sparse = (double)nret * (double)nret * (double)(nex + 1) + 2.0 * (double)nex * (double)nex * (double)nret;
 
-            if(ist == 0 || jst == 0){
+    if(cost_sparse < cost_dense){
+        ci_overlap_sparse(norb, nocc, nocc_a, nvirt_a, nex, nret, orb_ini, ex_ind, mo_overlap, ci_old, ci_new, st_ex);
+    }
+    else{
+        ci_overlap_dense(norb, nocc, nocc_a, nvirt_a, nex, orb_ini, mo_overlap, ci_old, ci_new, st_ex);
+    }
 
-                if(ist > jst){
+    #pragma omp parallel for private(jst, iorb, aorb) schedule(static)
+    for(ist = 1; ist < nst; ist++){
 
-                    // TDNAC between S_i and S_0 state
-                    for(iorb = orb_ini[0]; iorb < nocc; iorb++){
-                        for(aorb = 0; aorb < orb_final[0] - nocc; aorb++){
-                            nacme[ist][jst] += 0.5 * ci_coef_new[ist][iorb][aorb] * (mo_overlap[nocc + aorb][iorb] - mo_overlap[iorb][nocc + aorb]);
-                        }
-                    }
+        // Overlap between S_i and S_0 state, and between S_0 and S_i state
+        for(iorb = 0; iorb < nocc_a; iorb++){
+            for(aorb = 0; aorb < nvirt_a; aorb++){
+                st_overlap[nst * ist] += ci_new[ncis * (ist - 1) + nvirt_a * iorb + aorb]
+                    * mo_overlap[norb * (nocc + aorb) + orb_ini[0] + iorb];
+                st_overlap[ist] += ci_new[ncis * (ist - 1) + nvirt_a * iorb + aorb]
+                    * mo_overlap[norb * (orb_ini[0] + iorb) + nocc + aorb];
+            }
+        }
 
-                }
-                else{
+        for(jst = 1; jst < nst; jst++){
+            st_overlap[nst * ist + jst] = st_ex[nex * (ist - 1) + jst - 1];
+        }
 
-                    // TDNAC between S_0 and S_j state
-                    for(jorb = orb_ini[0]; jorb < nocc; jorb++){
-                        for(borb = 0; borb < orb_final[0] - nocc; borb++){
-                            nacme[ist][jst] += 0.5 * ci_coef_new[jst][jorb][borb] * (mo_overlap[jorb][nocc + borb] - mo_overlap[nocc + borb][jorb]);
-                        }
-                    }
+    }
 
-                }
+    free(ci_old);
+    free(ci_new);
+    free(st_ex);
+    free(ex_ind);
 
-            }
-            else{
+}
 
-                // TDNAC between S_i and S_j state
+// Routine to contract the CI coefficients of the excited states over the whole active space
+static void ci_overlap_dense(int norb, int nocc, int nocc_a, int nvirt_a, int nex, int *orb_ini, double *mo_overlap,
+    double *ci_old, double *ci_new, double *st_ex){
 
-                // 1st term in Eq. 15
-                for(iorb = orb_ini[0]; iorb < nocc; iorb++){
-                    for(aorb = 0; aorb < orb_final[0] - nocc; aorb++){
-                        nacme[ist][jst] += 0.5 * (ci_coef_old[ist][iorb][aorb] * ci_coef_new[jst][iorb][aorb] - ci_coef_old[jst][iorb][aorb] * ci_coef_new[ist][iorb][aorb]);
-                    }
-                }
+    int ncis = nocc_a * nvirt_a;
 
-                // 2nd term in Eq. 15
-                for(iorb = orb_ini[0]; iorb < nocc; iorb++){
-                    for(aorb = 0; aorb < orb_final[0] - nocc; aorb++){
-                        for(borb = 0; borb < orb_final[0] - nocc; borb++){
-                            if(aorb != borb){
-                                nacme[ist][jst] += 0.5 * ci_coef_new[ist][iorb][aorb] * ci_coef_new[jst][iorb][borb] * (mo_overlap[nocc + aorb][nocc + borb] - mo_overlap[nocc + borb][nocc + aorb]);
-                            }
-                        }
-                    }
-                }
+    // Virtual-virtual block of mo_overlap without diagonal terms
+    double *mo_vv = malloc((nvirt_a * nvirt_a) * sizeof(double));
+    // Occupied-occupied block of mo_overlap without diagonal terms, multiplied by the permutation sign
+    double *mo_oo = malloc((nocc_a * nocc_a) * sizeof(double));
+    // Contraction of the CI coefficients at time t + dt with the MO overlap, U = C * mo_vv^T - mo_oo * C
+    double *ci_mo = malloc((nex * ncis) * sizeof(double));
 
-                // 3rd term in Eq. 15
-                for(iorb = orb_ini[0]; iorb < nocc; iorb++){
-                    for(aorb = 0; aorb < orb_final[0] - nocc; aorb++){
-                        for(jorb = orb_ini[0]; jorb < nocc; jorb++){
-                            if(iorb != jorb){
-                                // fac is permutation in 3rd term
-                                exponent = abs(jorb - iorb);
-                                fac = pow(-1.0, exponent);
-                                nacme[ist][jst] -= 0.5 * fac * ci_coef_new[ist][iorb][aorb] * ci_coef_new[jst][jorb][aorb] * (mo_overlap[jorb][iorb] - mo_overlap[iorb][jorb]);
-                            }
-                        }
-                    }
-                }
+    int jst, iorb, jorb, aorb, borb;
 
+    for(aorb = 0; aorb < nvirt_a; aorb++){
+        for(borb = 0; borb < nvirt_a; borb++){
+            mo_vv[nvirt_a * aorb + borb] = 0.0;
+            if(aorb != borb){
+                mo_vv[nvirt_a * aorb + borb] = mo_overlap[norb * (nocc + aorb) + nocc + borb];
             }
-
-            // NACME is divided by time step (finite numerical differentiation)
-            nacme[ist][jst] /= dt;
-
         }
     }
 
-    if(debug == 1){
-        // Print NACME values
-        for(ist = 0; ist < nst; ist++){
-            for(jst = 0; jst < nst; jst++){
-                printf("%15.8f ", nacme[ist][jst]);
+    // fac is permutation in 3rd term, (-1)^|j - i|
+    for(iorb = 0; iorb < nocc_a; iorb++){
+        for(jorb = 0; jorb < nocc_a; jorb++){
+            mo_oo[nocc_a * iorb + jorb] = 0.0;
+            if(iorb != jorb){
+                mo_oo[nocc_a * iorb + jorb] = ((abs(jorb - iorb) % 2 == 0) ? 1.0 : -1.0)
+                    * mo_overlap[norb * (orb_ini[0] + jorb) + orb_ini[0] + iorb];
             }
-            printf("\n");
         }
-        printf("\n");
     }
 
-    for(iorb = 0; iorb < norb; iorb++){
-        free(mo_overlap[iorb]);
-        free(permut_mat[iorb]);
+    // 2nd term in Eq. 15, sum_b C_j(i, b) * S(a, b) for all excited states at once
+    mat_mul("N", "T", nex * nocc_a, nvirt_a, nvirt_a, 1.0, ci_new, mo_vv, 0.0, ci_mo);
+
+    // 3rd term in Eq. 15, - sum_j fac * S(j, i) * C_j(j, a) for each excited state
+    #pragma omp parallel for schedule(static)
+    for(jst = 0; jst < nex; jst++){
+        mat_mul("N", "N", nocc_a, nvirt_a, nocc_a, - 1.0, mo_oo, ci_new + ncis * jst, 1.0, ci_mo + ncis * jst);
     }
 
-    free(mo_overlap);
-    free(permut_mat);
+    // Overlap between S_i and S_j state, 1st term and the others in Eq. 15
+    mat_mul("N", "T", nex, nex, ncis, 1.0, ci_old, ci_new, 0.0, st_ex);
+    mat_mul("N", "T", nex, nex, ncis, 1.0, ci_new, ci_mo, 1.0, st_ex);
+
+    free(mo_vv);
+    free(mo_oo);
+    free(ci_mo);
 
 }
 
-// Routine to calculate overlap and permutation matrix in MO basis between two time steps
-static void calc_MO_over(int nbasis, int norb, double **mo_overlap, double **permut_mat,
-    double **ao_overlap, double **mo_coef_old, double **mo_coef_new){
+// Routine to contract the CI coefficients of the excited states over the retained excitations
+// The 2nd and 3rd terms in Eq. 15 are saved in the coupling matrix between the retained excitations
+static void ci_overlap_sparse(int norb, int nocc, int nocc_a, int nvirt_a, int nex, int nret, int *orb_ini,
+    int *ex_ind, double *mo_overlap, double *ci_old, double *ci_new, double *st_ex){
 
-    double **tmp_sign = malloc(norb * sizeof(double*));
-    int ibasis, jbasis, iorb, jorb;
+    int ncis = nocc_a * nvirt_a;
 
-#if defined(HAVE_LAPACK) || defined(HAVE_MKL)
-    double *mo_overlap_1d = malloc((norb * norb) * sizeof(double));
-    double *ao_overlap_1d = malloc((nbasis * nbasis) * sizeof(double));
-    double *mo_coef_1d = malloc((norb * nbasis) * sizeof(double));
-    double *tmp_mat_1d = malloc((norb * nbasis) * sizeof(double));
+    double *ci_old_ret = malloc((nex * nret) * sizeof(double));
+    double *ci_new_ret = malloc((nex * nret) * sizeof(double));
+    double *coupling = malloc((nret * nret) * sizeof(double));
+    double *ci_mo = malloc((nex * nret) * sizeof(double));
 
-    double one = 1.0;
-    double zero = 0.0;
-#endif
+    int ist, k, l, iorb, jorb, aorb, borb;
 
-    // Initialize temporary array to save sign of overlap in MO basis
-    for(iorb = 0; iorb < norb; iorb++){
-        tmp_sign[iorb] = malloc(norb * sizeof(double));
-        for(jorb = 0; jorb < norb; jorb++){
-            tmp_sign[iorb][jorb] = 0.0;
+    for(ist = 0; ist < nex; ist++){
+        for(k = 0; k < nret; k++){
+            ci_old_ret[nret * ist + k] = ci_old[ncis * ist + ex_ind[k]];
+            ci_new_ret[nret * ist + k] = ci_new[ncis * ist + ex_ind[k]];
         }
     }
 
-    // Calculate overlap in MO basis using external libraries or direct loop calculation; S' = C * S * C^T
-#if defined(HAVE_LAPACK) || defined(HAVE_MKL)
-    // Convert mo_coef_old to column-major 1D array
-    for(iorb = 0; iorb < norb; iorb++){
-        for(ibasis = 0; ibasis < nbasis; ibasis++){
-//            mo_coef_1d[iorb * nbasis + ibasis] = mo_coef_old[iorb][ibasis];
-            mo_coef_1d[ibasis * norb + iorb] = mo_coef_old[iorb][ibasis];
-        }
-    }
-    // Convert ao_overlap to column-major 1D array
-    for(ibasis = 0; ibasis < nbasis; ibasis++){
-        for(jbasis = 0; jbasis < nbasis; jbasis++){
-//            ao_overlap_1d[ibasis * nbasis + jbasis] = ao_overlap[ibasis][jbasis];
-            ao_overlap_1d[jbasis * nbasis + ibasis] = ao_overlap[ibasis][jbasis];
+    // Coupling between the excitations i -> a and j -> b
+    #pragma omp parallel for private(l, iorb, jorb, aorb, borb) schedule(static)
+    for(k = 0; k < nret; k++){
+        iorb = ex_ind[k] / nvirt_a;
+        aorb = ex_ind[k] % nvirt_a;
+        for(l = 0; l < nret; l++){
+            jorb = ex_ind[l] / nvirt_a;
+            borb = ex_ind[l] % nvirt_a;
+            coupling[nret * k + l] = 0.0;
+            if(iorb == jorb && aorb != borb){
+                // 2nd term in Eq. 15
+                coupling[nret * k + l] = mo_overlap[norb * (nocc + aorb) + nocc + borb];
+            }
+            else if(aorb == borb && iorb != jorb){
+                // 3rd term in Eq. 15, fac is permutation, (-1)^|j - i|
+                coupling[nret * k + l] = - ((abs(jorb - iorb) % 2 == 0) ? 1.0 : -1.0)
+                    * mo_overlap[norb * (orb_ini[0] + jorb) + orb_ini[0] + iorb];
+            }
         }
     }
 
-    // Execute following operation; C * S
-    dgemm_("N", "N", &norb, &nbasis, &nbasis, &one, mo_coef_1d, &norb, ao_overlap_1d, &nbasis, &zero, tmp_mat_1d, &norb);
+    // Overlap between S_i and S_j state, 1st term and the others in Eq. 15
+    mat_mul("N", "T", nex, nret, nret, 1.0, ci_new_ret, coupling, 0.0, ci_mo);
+    mat_mul("N", "T", nex, nex, nret, 1.0, ci_old_ret, ci_new_ret, 0.0, st_ex);
+    mat_mul("N", "T", nex, nex, nret, 1.0, ci_new_ret, ci_mo, 1.0, st_ex);
 
-    // Convert mo_coef_new to column-major 1D array
-    for(iorb = 0; iorb < norb; iorb++){
-        for(ibasis = 0; ibasis < nbasis; ibasis++){
-//            mo_coef_1d[iorb * nbasis + ibasis] = mo_coef_new[iorb][ibasis];
-            mo_coef_1d[ibasis * norb + iorb] = mo_coef_new[iorb][ibasis];
-        }
+    free(ci_old_ret);
+    free(ci_new_ret);
+    free(coupling);
+    free(ci_mo);
+
+}
+
+// Routine to truncate the CI coefficients of each state with the amplitude threshold and the cumulative norm cutoff
+// The retained coefficients are renormalized, and the retained fraction of the norm is saved in ci_norm
+static void ci_truncate(int nex, int ncis, double threshold, double norm_cutoff, double *ci, double *ci_norm){
+
+    int ist;
+
+    // The CI coefficients are not truncated with the default values
+    if(threshold <= 0.0 && norm_cutoff >= 1.0){
+        return;
     }
 
-    // Execute following operation; (C * S) * C^T
-    dgemm_("N", "T", &norb, &norb, &nbasis, &one, tmp_mat_1d, &norb, mo_coef_1d, &norb, &zero, mo_overlap_1d, &norb);
+    #pragma omp parallel for schedule(static)
+    for(ist = 0; ist < nex; ist++){
 
-    for(iorb = 0; iorb < norb; iorb++){
-        for(jorb = 0; jorb < norb; jorb++){
+        double *coef = ci + ncis * ist;
+        double *amp = malloc(ncis * sizeof(double));
+        double norm, retained, amp_min;
+        int k;
 
-            // Convert column-major mo_overlap_1d to 2D array
-//            mo_overlap[iorb][jorb] = mo_overlap_1d[iorb * norb + jorb];
-            mo_overlap[iorb][jorb] = mo_overlap_1d[jorb * norb + iorb];
+        norm = 0.0;
+        for(k = 0; k < ncis; k++){
+            amp[k] = coef[k] * coef[k];
+            norm += amp[k];
+        }
+
+        // Minimum squared amplitude of the retained coefficients
+        amp_min = threshold * threshold;
+        if(norm_cutoff < 1.0 && norm > 0.0){
+            // The largest amplitudes are retained until the cumulative norm reaches the cutoff
+            qsort(amp, ncis, sizeof(double), amp_compare);
+            retained = 0.0;
+            for(k = 0; k < ncis; k++){
+                retained += amp[k];
+                if(retained >= norm_cutoff * norm){
+                    break;
+                }
+            }
+            if(k < ncis && amp[k] > amp_min){
+                amp_min = amp[k];
+            }
+        }
 
-            // Save the sign of overlap elements for calculating permutation matrix
-            if(mo_overlap[iorb][jorb] < 0.0){
-                tmp_sign[iorb][jorb] = -1.0;
+        retained = 0.0;
+        for(k = 0; k < ncis; k++){
+            if(coef[k] * coef[k] < amp_min){
+                coef[k] = 0.0;
             }
             else{
-                tmp_sign[iorb][jorb] = 1.0;
+                retained += coef[k] * coef[k];
             }
-
         }
-    }
-#else
-    for(iorb = 0; iorb < norb; iorb++){
-        for(jorb = 0; jorb < norb; jorb++){
 
-            for(ibasis = 0; ibasis < nbasis; ibasis++){
-                for(jbasis = 0; jbasis < nbasis; jbasis++){
-                    mo_overlap[iorb][jorb] += mo_coef_old[iorb][ibasis] * ao_overlap[ibasis][jbasis] * mo_coef_new[jorb][jbasis];
-                    // Save the sign of overlap elements for calculating permutation matrix
-                    if(mo_overlap[iorb][jorb] < 0.0){
-                        tmp_sign[iorb][jorb] = -1.0;
-                    }
-                    else{
-                        tmp_sign[iorb][jorb] = 1.0;
-                    }
-                }
+        if(retained > 0.0){
+            for(k = 0; k < ncis; k++){
+                coef[k] /= sqrt(retained);
             }
-
         }
-    }
-#endif
 
-    for(iorb = 0; iorb < norb; iorb++){
-        for(jorb = 0; jorb < norb; jorb++){
-            // Permutation matrix is obtained by rounding off the square of overlap matrix in MO basis
-            permut_mat[iorb][jorb] = round(pow(mo_overlap[iorb][jorb], 2) * tmp_sign[iorb][jorb]);
+        if(ci_norm != NULL){
+            ci_norm[ist] = (norm > 0.0) ? retained / norm : 1.0;
         }
-    }
 
-    // Deallocate temporary array to save sign of overlap in MO basis
-    for(iorb = 0; iorb < norb; iorb++){
-        free(tmp_sign[iorb]);
+        free(amp);
+
     }
 
-    free(tmp_sign);
+}
 
-#if defined(HAVE_LAPACK) || defined(HAVE_MKL)
-    free(mo_overlap_1d);
-    free(ao_overlap_1d);
-    free(mo_coef_1d);
-    free(tmp_mat_1d);
-#endif
+// Routine to compare the squared amplitudes to sort them in descending order
+static int amp_compare(const void *a, const void *b){
+
+    double amp_a = *(const double*)a;
+    double amp_b = *(const double*)b;
+
+    return (amp_a < amp_b) - (amp_a > amp_b);
 
 }
 
-// Routine to match phase of MO coefficients and orderings between two time steps
-static void MO_phase_order(int nbasis, int norb, double **mo_coef_new, double **permut_mat){
+// Routine to calculate product of row-major matrices, C = alpha * op(A) * op(B) + beta * C
+// op(A) and op(B) are (m, k) and (k, n) matrices, and A or B is transposed when transa or transb is "T"
+static void mat_mul(char *transa, char *transb, int m, int n, int k, double alpha, double *a, double *b,
+    double beta, double *c){
 
-    double **tmp_mo = malloc(norb * sizeof(double*));
-    int ibasis, iorb, jorb;
+    int lda = (transa[0] == 'N') ? k : m;
+    int ldb = (transb[0] == 'N') ? n : k;
 
-    // Initialize temporary MO array; C'
-    for(iorb = 0; iorb < norb; iorb++){
-        tmp_mo[iorb] = malloc(nbasis * sizeof(double));
-        for(ibasis = 0; ibasis < nbasis; ibasis++){
-            tmp_mo[iorb][ibasis] = 0.0;
+#if defined(HAVE_LAPACK) || defined(HAVE_MKL)
+    // Row-major matrices are transposed in column-major order, hence C^T = op(B)^T * op(A)^T is calculated
+    dgemm_(transb, transa, &n, &m, &k, &alpha, b, &ldb, a, &lda, &beta, c, &n);
+#else
+    int i, j, l;
+    double a_il, tmp;
+
+    for(i = 0; i < m; i++){
+        for(j = 0; j < n; j++){
+            tmp = 0.0;
+            for(l = 0; l < k; l++){
+                a_il = (transa[0] == 'N') ? a[lda * i + l] : a[lda * l + i];
+                tmp += a_il * ((transb[0] == 'N') ? b[ldb * l + j] : b[ldb * j + l]);
+            }
+            c[n * i + j] = (beta == 0.0) ? alpha * tmp : alpha * tmp + beta * c[n * i + j];
         }
     }
+#endif
 
-    // Decide the phase and ordering for MO coefficients using permutation matrix; C' = O * C
-    for(iorb = 0; iorb < norb; iorb++){
-        for(ibasis = 0; ibasis < nbasis; ibasis++){
+}
 
-            for(jorb = 0; jorb < norb; jorb++){
-                tmp_mo[iorb][ibasis] += permut_mat[iorb][jorb] * mo_coef_new[jorb][ibasis];
-            }
+// Routine to calculate overlap and permutation matrix in MO basis between two time steps
+static void calc_MO_over(int nbasis, int norb, double *mo_overlap, double *permut_mat,
+    double *ao_overlap, double *mo_coef_old, double *mo_coef_new){
 
-        }
-    }
+    double *tmp_mat = malloc((norb * nbasis) * sizeof(double));
+
+    int iorb, jorb;
+    double sign;
+
+    // Calculate overlap in MO basis; S' = C * S * C^T
+    mat_mul("N", "N", norb, nbasis, nbasis, 1.0, mo_coef_old, ao_overlap, 0.0, tmp_mat);
+    mat_mul("N", "T", norb, norb, nbasis, 1.0, tmp_mat, mo_coef_new, 0.0, mo_overlap);
 
-    // Apply new phase correction for the MO coefficients; C = C'
     for(iorb = 0; iorb < norb; iorb++){
-        for(ibasis = 0; ibasis < nbasis; ibasis++){
-            mo_coef_new[iorb][ibasis] = tmp_mo[iorb][ibasis];
+        for(jorb = 0; jorb < norb; jorb++){
+            // Permutation matrix is obtained by rounding off the square of overlap matrix in MO basis
+            sign = (mo_overlap[norb * iorb + jorb] < 0.0) ? -1.0 : 1.0;
+            permut_mat[norb * iorb + jorb] = round(pow(mo_overlap[norb * iorb + jorb], 2) * sign);
         }
     }
 
-    // Deallocate temporary MO array; C'
-    for(iorb = 0; iorb < norb; iorb++){
-        free(tmp_mo[iorb]);
-    }
+    free(tmp_mat);
+
+}
+
+// Routine to match phase of MO coefficients and orderings between two time steps
+static void MO_phase_order(int nbasis, int norb, double *mo_coef_new, double *permut_mat){
+
+    double *tmp_mo = malloc((norb * nbasis) * sizeof(double));
+
+    // Decide the phase and ordering for MO coefficients using permutation matrix; C' = O * C
+    mat_mul("N", "N", norb, nbasis, norb, 1.0, permut_mat, mo_coef_new, 0.0, tmp_mo);
+
+    // Apply new phase correction for the MO coefficients; C = C'
+    memcpy(mo_coef_new, tmp_mo, (norb * nbasis) * sizeof(double));
 
     free(tmp_mo);
 
@@ -447,75 +497,74 @@ static void MO_phase_order(int nbasis, int norb, double **mo_coef_new, double **
 // Routine to match phase of CI coefficients and orderings between two time steps
 // TODO : Is this correct method to match phase (or order) for CI coefficients?
 static void CI_phase_order(int nst, int norb, int nocc, int nvirt, int *orb_ini, int *orb_final,
-    double ***ci_coef_old, double ***ci_coef_new, double **permut_mat){
+    double *ci_coef_new, double *permut_mat){
 
-    double **tmp_ci = malloc(norb * sizeof(double*));
-    double **tmp_ci_new = malloc(norb * sizeof(double*));
-    int ist, iorb, jorb, aorb, borb;
+    // Number of orbitals in the active space
+    int nact = orb_final[0] - orb_ini[0];
 
-    // Initialize temporary CI arrays; C' and C
-    for(iorb = 0; iorb < norb; iorb++){
-        tmp_ci[iorb] = malloc(norb * sizeof(double));
-        tmp_ci_new[iorb] = malloc(norb * sizeof(double));
+    double *permut_act = malloc((nact * nact) * sizeof(double));
+
+    int ist, iorb, aorb;
+
+    // Permutation matrix in the active space
+    for(iorb = 0; iorb < nact; iorb++){
+        for(aorb = 0; aorb < nact; aorb++){
+            permut_act[nact * iorb + aorb] = permut_mat[norb * (orb_ini[0] + iorb) + orb_ini[0] + aorb];
+        }
     }
 
-    // CI coefficients for S_0 are zero
+    // CI coefficients for S_0 are zero, and the states are independent of each other
+    #pragma omp parallel for private(iorb, aorb) schedule(dynamic)
     for(ist = 1; ist < nst; ist++){
 
-        for(iorb = orb_ini[0]; iorb < orb_final[0]; iorb++){
-            for(aorb = orb_ini[0]; aorb < orb_final[0]; aorb++){
+        double *tmp_ci = malloc((nact * nact) * sizeof(double));
+        double *tmp_mat = malloc((nact * nact) * sizeof(double));
+        double *tmp_ci_new = malloc((nact * nact) * sizeof(double));
+        double *ci_coef = ci_coef_new + nocc * nvirt * ist;
+        int ind_iorb, ind_aorb;
+
+        for(iorb = 0; iorb < nact; iorb++){
+            ind_iorb = orb_ini[0] + iorb;
+            for(aorb = 0; aorb < nact; aorb++){
+                ind_aorb = orb_ini[0] + aorb;
                 // Assign CI coefficients at time t to new symmetric array
-                if(iorb < nocc && aorb >= nocc){
-                    tmp_ci[iorb][aorb] = ci_coef_new[ist][iorb][aorb - nocc];
+                if(ind_iorb < nocc && ind_aorb >= nocc){
+                    tmp_ci[nact * iorb + aorb] = ci_coef[nvirt * ind_iorb + ind_aorb - nocc];
                 }
-                else if(iorb >= nocc && aorb < nocc){
-                    tmp_ci[iorb][aorb] = ci_coef_new[ist][aorb][iorb - nocc];
+                else if(ind_iorb >= nocc && ind_aorb < nocc){
+                    tmp_ci[nact * iorb + aorb] = ci_coef[nvirt * ind_aorb + ind_iorb - nocc];
                 }
                 else{
-                    tmp_ci[iorb][aorb] = 0.0;
+                    tmp_ci[nact * iorb + aorb] = 0.0;
                 }
-                // Initialize new empty array for phase correction
-                tmp_ci_new[iorb][aorb] = 0.0;
             }
         }
 
         // Decide the phase and ordering for CI coefficients using permutation matrix; C' = O * C * O
         // TODO : The phases for occupied and virtual orbitals are matched when permutation is diagonal matrix
-        for(jorb = orb_ini[0]; jorb < orb_final[0]; jorb++){
-            for(borb = orb_ini[0]; borb < orb_final[0]; borb++){
-
-                for(iorb = orb_ini[0]; iorb < orb_final[0]; iorb++){
-                    for(aorb = orb_ini[0]; aorb < orb_final[0]; aorb++){
-                        tmp_ci_new[jorb][borb] += permut_mat[jorb][iorb] * tmp_ci[iorb][aorb] * permut_mat[aorb][borb];
-                    }
-                }
-
-            }
-        }
+        mat_mul("N", "N", nact, nact, nact, 1.0, permut_act, tmp_ci, 0.0, tmp_mat);
+        mat_mul("N", "N", nact, nact, nact, 1.0, tmp_mat, permut_act, 0.0, tmp_ci_new);
 
         // Apply new phase correction for the CI coefficients; C = C'
         for(iorb = orb_ini[0]; iorb < nocc; iorb++){
             for(aorb = 0; aorb < orb_final[0] - nocc; aorb++){
-                ci_coef_new[ist][iorb][aorb] = tmp_ci_new[iorb][nocc + aorb];
+                ci_coef[nvirt * iorb + aorb] = tmp_ci_new[nact * (iorb - orb_ini[0]) + nocc + aorb - orb_ini[0]];
             }
         }
 
-    }
+        free(tmp_ci);
+        free(tmp_mat);
+        free(tmp_ci_new);
 
-    // Deallocate temporary CI arrays; C' and C
-    for(iorb = 0; iorb < norb; iorb++){
-        free(tmp_ci[iorb]);
-        free(tmp_ci_new[iorb]);
     }
 
-    free(tmp_ci);
-    free(tmp_ci_new);
+    free(permut_act);
 
 }
 
 // Routine to match phase for the states between two time steps
 static void state_phase(int nst, int nocc, int nvirt, int *orb_ini, int *orb_final,
-    double ***ci_coef_old, double ***ci_coef_new){
+    double *ci_coef_old, double *ci_coef_new){
 
     double val;
     int ist, iorb, aorb;
@@ -526,14 +575,15 @@ static void state_phase(int nst, int nocc, int nvirt, int *orb_ini, int *orb_fin
         val = 0.0;
         for(iorb = orb_ini[0]; iorb < nocc; iorb++){
             for(aorb = 0; aorb < orb_final[0] - nocc; aorb++){
-                val += ci_coef_old[ist][iorb][aorb] * ci_coef_new[ist][iorb][aorb];
+                val += ci_coef_old[nocc * nvirt * ist + nvirt * iorb + aorb]
+                    * ci_coef_new[nocc * nvirt * ist + nvirt * iorb + aorb];
             }
         }
 
         if(val < 0.0){
             for(iorb = orb_ini[0]; iorb < nocc; iorb++){
                 for(aorb = 0; aorb < orb_final[0] - nocc; aorb++){
-                    ci_coef_new[ist][iorb][aorb] *= -1.0;
+                    ci_coef_new[nocc * nvirt * ist + nvirt * iorb + aorb] *= -1.0;
                 }
             }
         }
@@ -543,7 +593,7 @@ static void state_phase(int nst, int nocc, int nvirt, int *orb_ini, int *orb_fin
 }
 
 // Routine to normalize CI coefficients
-static void norm_CI_coef(int nst, int nocc, int nvirt, int *orb_ini, int *orb_final, double ***ci_coef){
+static void norm_CI_coef(int nst, int nocc, int nvirt, int *orb_ini, int *orb_final, double *ci_coef){
 
     double norm;
     int ist, iorb, aorb;
@@ -555,7 +605,7 @@ static void norm_CI_coef(int nst, int nocc, int nvirt, int *orb_ini, int *orb_fi
         norm = 0.0;
         for(iorb = orb_ini[0]; iorb < nocc; iorb++){
             for(aorb = 0; aorb < orb_final[0] - nocc; aorb++){
-                norm += pow(ci_coef[ist][iorb][aorb], 2);
+                norm += pow(ci_coef[nocc * nvirt * ist + nvirt * iorb + aorb], 2);
             }
         }
         norm = sqrt(norm);
@@ -563,7 +613,7 @@ static void norm_CI_coef(int nst, int nocc, int nvirt, int *orb_ini, int *orb_fi
         // Normalize the CI coefficients
         for(iorb = orb_ini[0]; iorb < nocc; iorb++){
             for(aorb = 0; aorb < orb_final[0] - nocc; aorb++){
-                ci_coef[ist][iorb][aorb] /= norm;
+                ci_coef[nocc * nvirt * ist + nvirt * iorb + aorb] /= norm;
             }
         }
 
@@ -571,3 +621,18 @@ static void norm_CI_coef(int nst, int nocc, int nvirt, int *orb_ini, int *orb_fi
 
 }
 
+// Routine to print the matrix for debugging
+static void print_mat(char *title, int nrow, int ncol, double *mat){
+
+    int irow, icol;
+
+    printf("%s \n", title);
+    for(irow = 0; irow < nrow; irow++){
+        for(icol = 0; icol < ncol; icol++){
+            printf("%15.8f ", mat[ncol * irow + icol]);
+        }
+        printf("\n");
+    }
+    printf("\n");
+
+}
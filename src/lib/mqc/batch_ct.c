@@ -0,0 +1,36 @@
+// Interface routines of the propagators for a batch of trajectories, parallelized with OpenMP
+// This file is included only in el_propagator_ct.pyx after the propagators, hence the routines are not compiled
+// with the propagators themselves
+
+// Interface routine for elec_object scheme in rk4 solver for a batch of trajectories
+// Arrays are contiguous buffers with shapes of (ntrajs, nst) or (ntrajs, nst, nst)
+static void rk4_batch(int ntrajs, int nst, int nesteps, double dt, double nac_threshold, char *elec_object,
+    double *energy, double *energy_old, double *nacme, double *nacme_old, double *k_lk, double complex *coef){
+
+    int itraj;
+
+    // Electronic propagations of trajectories are independent of each other
+    #pragma omp parallel for schedule(static)
+    for(itraj = 0; itraj < ntrajs; itraj++){
+        long offset = (long)itraj * nst;
+        rk4(nst, nesteps, dt, nac_threshold, elec_object, energy + offset, energy_old + offset,
+            nacme + offset * nst, nacme_old + offset * nst, k_lk + offset * nst, coef + offset, NULL);
+    }
+}
+
+// Interface routine for elec_object scheme in rk45 solver for a batch of trajectories
+// Arrays are contiguous buffers with shapes of (ntrajs, nst) or (ntrajs, nst, nst)
+static void rk45_batch(int ntrajs, int nst, int nesteps, double dt, double elec_tol, double nac_threshold,
+    char *elec_object, double *energy, double *energy_old, double *nacme, double *nacme_old, double *k_lk,
+    double complex *coef, int *nsubsteps){
+
+    int itraj;
+
+    // Electronic propagations of trajectories are independent of each other
+    #pragma omp parallel for schedule(dynamic)
+    for(itraj = 0; itraj < ntrajs; itraj++){
+        long offset = (long)itraj * nst;
+        rk45(nst, nesteps, dt, elec_tol, nac_threshold, elec_object, energy + offset, energy_old + offset,
+            nacme + offset * nst, nacme_old + offset * nst, k_lk + offset * nst, coef + offset, nsubsteps + itraj);
+    }
+}
@@ -0,0 +1,72 @@
+#ifndef COUPLING_H
+#define COUPLING_H
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <complex.h>
+#include <math.h>
+#include "scratch.h"
+
+// NACME terms saved in compressed sparse row format
+// Only the terms larger than the threshold at time t or t + dt are saved, hence the pattern is fixed during
+// the nuclear step and only the saved terms are interpolated at the electronic substeps
+struct coupling {
+    int nst, nnz;
+    // Range of the saved terms in each row, and the column indices of the saved terms
+    int *row_ptr, *col_ind;
+    // Saved terms at time t and t + dt, and the interpolated terms at the current substep
+    double *nacme_old, *nacme, *dv;
+};
+
+// Routine to build the sparse NACME terms with the threshold, which is done once per nuclear step
+// The arrays are taken from the scratch memory, hence they are given back by the calling routine
+static void coupling_init(struct coupling *nac, int nst, double threshold, double **nacme, double **nacme_old){
+
+    int ist, jst, k;
+
+    nac->nst = nst;
+    nac->row_ptr = scratch_alloc((nst + 1) * sizeof(int));
+
+    nac->nnz = 0;
+    for(ist = 0; ist < nst; ist++){
+        for(jst = 0; jst < nst; jst++){
+            if(fabs(nacme[ist][jst]) > threshold || fabs(nacme_old[ist][jst]) > threshold){
+                nac->nnz++;
+            }
+        }
+    }
+
+    nac->col_ind = scratch_alloc(nac->nnz * sizeof(int));
+    nac->nacme_old = scratch_alloc(nac->nnz * sizeof(double));
+    nac->nacme = scratch_alloc(nac->nnz * sizeof(double));
+    nac->dv = scratch_alloc(nac->nnz * sizeof(double));
+
+    k = 0;
+    for(ist = 0; ist < nst; ist++){
+        nac->row_ptr[ist] = k;
+        for(jst = 0; jst < nst; jst++){
+            if(fabs(nacme[ist][jst]) > threshold || fabs(nacme_old[ist][jst]) > threshold){
+                nac->col_ind[k] = jst;
+                nac->nacme_old[k] = nacme_old[ist][jst];
+                nac->nacme[k] = nacme[ist][jst];
+                nac->dv[k] = nacme_old[ist][jst];
+                k++;
+            }
+        }
+    }
+    nac->row_ptr[nst] = k;
+
+}
+
+// Routine to interpolate the saved NACME terms, frac is the fraction of the nuclear step from time t
+static void coupling_interpolate(struct coupling *nac, double frac){
+
+    int k;
+
+    for(k = 0; k < nac->nnz; k++){
+        nac->dv[k] = nac->nacme_old[k] + (nac->nacme[k] - nac->nacme_old[k]) * frac;
+    }
+
+}
+
+#endif
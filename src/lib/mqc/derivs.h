@@ -1,7 +1,11 @@
+#ifndef DERIVS_H
+#define DERIVS_H
+
 #include <stdio.h>
 #include <stdlib.h>
 #include <complex.h>
 #include <math.h>
+#include "coupling.h"
 
 // Routine to calculate dot product from two temporary arrays
 static double dot(int nst, double complex *u, double complex *v){
@@ -21,18 +25,21 @@ static double dot(int nst, double complex *u, double complex *v){
 }
 
 // Routine to calculate cdot contribution originated from Ehrenfest term
-static void cdot(int nst, double *e, double **dv, double complex *c, double complex *c_dot){
+// Only the NACME terms saved in the sparse format are considered
+static void cdot(int nst, double *e, struct coupling *nac, double complex *c, double complex *c_dot){
 
-    double complex *na_term = malloc(nst * sizeof(double complex));
+    size_t mark = scratch_mark();
+    double complex *na_term = scratch_alloc(nst * sizeof(double complex));
 
-    int ist, jst;
+    int ist, jst, k;
     double egs;
 
     for(ist = 0; ist < nst; ist++){
         na_term[ist] = 0.0 + 0.0 * I;
-        for(jst = 0; jst < nst; jst++){
+        for(k = nac->row_ptr[ist]; k < nac->row_ptr[ist + 1]; k++){
+            jst = nac->col_ind[k];
             if(ist != jst){
-                na_term[ist] -= dv[ist][jst] * c[jst];
+                na_term[ist] -= nac->dv[k] * c[jst];
             }
         }
     }
@@ -42,14 +49,15 @@ static void cdot(int nst, double *e, double **dv, double complex *c, double comp
         c_dot[ist] = - 1.0 * I * c[ist] * (e[ist] - egs) + na_term[ist];
     }
 
-    free(na_term);
+    scratch_release(mark);
 
 }
 
 // Routine to calculate rhodot contribution originated from Ehrenfest term
-static void rhodot(int nst, double *e, double **dv, double complex **rho, double complex **rho_dot){
+// Only the NACME terms saved in the sparse format are considered
+static void rhodot(int nst, double *e, struct coupling *nac, double complex **rho, double complex **rho_dot){
 
-    int ist, jst, kst;
+    int ist, jst, kst, k, l, k_end, l_end;
 
     for(ist = 0; ist < nst; ist++){
         for(jst = 0; jst < nst; jst++){
@@ -58,9 +66,10 @@ static void rhodot(int nst, double *e, double **dv, double complex **rho, double
     }
 
     for(ist = 0; ist < nst; ist++){
-        for(jst = 0; jst < nst; jst++){
+        for(k = nac->row_ptr[ist]; k < nac->row_ptr[ist + 1]; k++){
+            jst = nac->col_ind[k];
             if(ist != jst){
-                rho_dot[ist][ist] -= dv[ist][jst] * 2.0 * creal(rho[ist][jst]);
+                rho_dot[ist][ist] -= nac->dv[k] * 2.0 * creal(rho[ist][jst]);
             }
         }
     }
@@ -68,8 +77,28 @@ static void rhodot(int nst, double *e, double **dv, double complex **rho, double
     for(ist = 0; ist < nst; ist++){
         for(jst = ist + 1; jst < nst; jst++){
             rho_dot[ist][jst] -=  1.0 * I * (e[jst] - e[ist]) * rho[ist][jst];
-            for(kst = 0; kst < nst; kst++){
-                rho_dot[ist][jst] -= dv[ist][kst] * rho[kst][jst] + dv[jst][kst] * rho[ist][kst];
+            // Merge the saved terms in the rows of ist and jst in the order of kst
+            k = nac->row_ptr[ist];
+            k_end = nac->row_ptr[ist + 1];
+            l = nac->row_ptr[jst];
+            l_end = nac->row_ptr[jst + 1];
+            while(k < k_end || l < l_end){
+                if(l == l_end || (k < k_end && nac->col_ind[k] < nac->col_ind[l])){
+                    kst = nac->col_ind[k];
+                    rho_dot[ist][jst] -= nac->dv[k] * rho[kst][jst];
+                    k++;
+                }
+                else if(k == k_end || nac->col_ind[l] < nac->col_ind[k]){
+                    kst = nac->col_ind[l];
+                    rho_dot[ist][jst] -= nac->dv[l] * rho[ist][kst];
+                    l++;
+                }
+                else{
+                    kst = nac->col_ind[k];
+                    rho_dot[ist][jst] -= nac->dv[k] * rho[kst][jst] + nac->dv[l] * rho[ist][kst];
+                    k++;
+                    l++;
+                }
             }
             rho_dot[jst][ist] = conj(rho_dot[ist][jst]);
         }
@@ -77,4 +106,4 @@ static void rhodot(int nst, double *e, double **dv, double complex **rho, double
 
 }
 
-
+#endif
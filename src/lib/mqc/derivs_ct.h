@@ -1,7 +1,11 @@
+#ifndef DERIVS_CT_H
+#define DERIVS_CT_H
+
 #include <stdio.h>
 #include <stdlib.h>
 #include <complex.h>
 #include <math.h>
+#include "coupling.h"
 
 // Routine to calculate dot product from two temporary arrays
 static double dot(int nst, double complex *u, double complex *v){
@@ -21,13 +25,15 @@ static double dot(int nst, double complex *u, double complex *v){
 }
 
 // Routine to calculate cdot contribution originated from Ehrenfest term
-static void ct_cdot(int nst, double *e, double **dv, double **k_lk, double complex *c, double complex *c_dot){
+// Only the NACME terms saved in the sparse format are considered, while the CT term is dense
+static void ct_cdot(int nst, double *e, struct coupling *nac, double **k_lk, double complex *c, double complex *c_dot){
 
-    double complex *na_term = malloc(nst * sizeof(double complex));
-    double *ct_term = malloc(nst * sizeof(double));
-    double *rho = malloc(nst * sizeof (double));
+    size_t mark = scratch_mark();
+    double complex *na_term = scratch_alloc(nst * sizeof(double complex));
+    double *ct_term = scratch_alloc(nst * sizeof(double));
+    double *rho = scratch_alloc(nst * sizeof (double));
 
-    int ist, jst;
+    int ist, jst, k;
     double egs;
 
     // Calculate densities from current coefficients
@@ -37,10 +43,15 @@ static void ct_cdot(int nst, double *e, double **dv, double **k_lk, double compl
 
     for(ist = 0; ist < nst; ist++){
         na_term[ist] = 0.0 + 0.0 * I;
+        for(k = nac->row_ptr[ist]; k < nac->row_ptr[ist + 1]; k++){
+            jst = nac->col_ind[k];
+            if(ist != jst){
+                na_term[ist] -= nac->dv[k] * c[jst];
+            }
+        }
         ct_term[ist] = 0.0;
         for(jst = 0; jst < nst; jst++){
             if(ist != jst){
-                na_term[ist] -= dv[ist][jst] * c[jst];
                 ct_term[ist] += 0.25 * (k_lk[jst][ist] - k_lk[ist][jst]) * rho[jst]
                     * (rho[ist] + rho[jst]) / (nst - 1);
             }
@@ -52,8 +63,7 @@ static void ct_cdot(int nst, double *e, double **dv, double **k_lk, double compl
         c_dot[ist] = - 1.0 * I * c[ist] * (e[ist] - egs) + na_term[ist] + ct_term[ist] * c[ist];
     }
 
-    free(na_term);
-    free(ct_term);
+    scratch_release(mark);
 }
 
 /*
@@ -88,3 +98,5 @@ static void ct_rhodot(int nst, double *e, double **dv, double complex **rho, dou
 
 }
 */
+
+#endif
@@ -1,14 +1,19 @@
+#ifndef DERIVS_XF_H
+#define DERIVS_XF_H
+
 #include <stdio.h>
 #include <stdlib.h>
 #include <complex.h>
 #include <math.h>
+#include "scratch.h"
 
 // Routine to calculate cdot contribution originated from XF term
 static void xf_cdot(int nat, int ndim, int nst, int *l_coh, double *mass, double **sigma,
     double **pos, double **qmom, double ***aux_pos, double ***phase, double complex *c, double complex *xfcdot){
 
-    double **dec = malloc(nst * sizeof(double*));
-    double *rho = malloc(nst * sizeof(double));
+    size_t mark = scratch_mark();
+    double **dec = scratch_alloc(nst * sizeof(double*));
+    double *rho = scratch_alloc(nst * sizeof(double));
 
     int ist, jst, iat, isp;
 
@@ -20,7 +25,7 @@ static void xf_cdot(int nat, int ndim, int nst, int *l_coh, double *mass, double
     }
 
     for(ist = 0; ist < nst; ist++){
-        dec[ist] = malloc(nst * sizeof(double));
+        dec[ist] = scratch_alloc(nst * sizeof(double));
         for(jst = 0; jst < nst; jst++){
             dec[ist][jst] = 0.0;
         }
@@ -70,12 +75,7 @@ static void xf_cdot(int nat, int ndim, int nst, int *l_coh, double *mass, double
     }
 
     // Deallocate temporary arrays
-    for(ist = 0; ist < nst; ist++){
-        free(dec[ist]);
-    }
-
-    free(dec);
-    free(rho);
+    scratch_release(mark);
 
 }
 
@@ -92,7 +92,8 @@ static void xf_print_coef(int nst, double complex *coef, double complex *xfcdot,
 static void xf_rhodot(int nat, int ndim, int nst, int *l_coh, double *mass, double **sigma,
     double **pos, double **qmom, double ***aux_pos, double ***phase, double complex **rho, double complex **xfrhodot){
 
-    double **dec = malloc(nst * sizeof(double*));
+    size_t mark = scratch_mark();
+    double **dec = scratch_alloc(nst * sizeof(double*));
 
     int ist, jst, kst, iat, isp;
 
@@ -104,7 +105,7 @@ static void xf_rhodot(int nat, int ndim, int nst, int *l_coh, double *mass, doub
     }
 
     for(ist = 0; ist < nst; ist++){
-        dec[ist] = malloc(nst * sizeof(double));
+        dec[ist] = scratch_alloc(nst * sizeof(double));
         for(jst = 0; jst < nst; jst++){
             dec[ist][jst] = 0.0;
         }
@@ -158,11 +159,7 @@ static void xf_rhodot(int nat, int ndim, int nst, int *l_coh, double *mass, doub
     }
 
     // Deallocate temporary arrays
-    for(ist = 0; ist < nst; ist++){
-        free(dec[ist]);
-    }
-
-    free(dec);
+    scratch_release(mark);
 
 }
 
@@ -175,3 +172,4 @@ static void xf_print_rho(int nst, double complex **xfrhodot, double *dotpopdec){
     }
 }
 
+#endif
@@ -1,127 +1,108 @@
 # cython: language_level=3
-from cpython.mem cimport PyMem_Malloc, PyMem_Free
 from cpython.complex cimport complex
 import numpy as np
 cimport numpy as np
 
 cdef extern from "rk4.c":
-    void rk4(int nst, int nesteps, double dt, char *elec_object, double *energy, \
-        double *energy_old, double **nacme, double **nacme_old, double complex *coef, \
-        double complex **rho)
+    void rk4(int nst, int nesteps, double dt, double nac_threshold, char *elec_object, double *energy, \
+        double *energy_old, double *nacme, double *nacme_old, double complex *coef, \
+        double complex *rho) nogil
 
 cdef extern from "exponential.c":
     void exponential(int nst, int nesteps, double dt, char *elec_object, double *energy, \
-        double *energy_old, double **nacme, double **nacme_old, double complex *coef)
+        double *energy_old, double *nacme, double *nacme_old, double complex *coef, \
+        double complex *rho) nogil
+
+cdef extern from "rk45.c":
+    void rk45(int nst, int nesteps, double dt, double elec_tol, double nac_threshold, char *elec_object, \
+        double *energy, double *energy_old, double *nacme, double *nacme_old, double complex *coef, \
+        double complex *rho, int *nsubsteps) nogil
+
+cdef extern from "krylov.c":
+    void krylov(int nst, int nesteps, double dt, double elec_tol, double nac_threshold, char *elec_object, \
+        double *energy, double *energy_old, double *nacme, double *nacme_old, double complex *coef) nogil
+
+cdef extern from "ld.c":
+    void ld(int nst, int nesteps, double dt, char *elec_object, double *energy, double *energy_old, \
+        double *st_overlap, double complex *coef, double complex *rho) nogil
 
 def el_run(md):
     cdef:
         char *elec_object_c
-        double *energy
-        double *energy_old
-        double **nacme
-        double **nacme_old
-        double complex *coef
-        double complex **rho
+        double[::1] energy
+        double[::1] energy_old
+        double[:, ::1] nacme
+        double[:, ::1] nacme_old
+        double[:, ::1] st_overlap
+        double complex[::1] coef
+        double complex[:, ::1] rho
+        double[::1] dotpopnac
 
         bytes py_bytes
-        int ist, jst, nst, nesteps, verbosity
-        double dt
+        int ist, jst, nst, nesteps, nsubsteps, verbosity
+        double dt, elec_tol, nac_threshold
 
     # Assign size variables
     nst = md.mol.nst
     nesteps, dt = md.nesteps, md.dt
+    nac_threshold = md.nac_threshold
 
-    # Allocate variables
-    energy = <double*> PyMem_Malloc(nst * sizeof(double))
-    energy_old = <double*> PyMem_Malloc(nst * sizeof(double))
-
-    nacme = <double**> PyMem_Malloc(nst * sizeof(double*))
-    nacme_old = <double**> PyMem_Malloc(nst * sizeof(double*))
-
-    for ist in range(nst):
-        nacme[ist] = <double*> PyMem_Malloc(nst * sizeof(double))
-        nacme_old[ist] = <double*> PyMem_Malloc(nst * sizeof(double))
-
-    # Assign variables from python to C
-    for ist in range(nst):
-        energy[ist] = md.mol.states[ist].energy
-        energy_old[ist] = md.mol.states[ist].energy_old
-
-    for ist in range(nst):
-        for jst in range(nst):
-            nacme[ist][jst] = md.mol.nacme[ist, jst]
-            nacme_old[ist][jst] = md.mol.nacme_old[ist, jst]
+    # Arrays of molecule object are propagated in place, hence the data are not copied
+    energy, energy_old = md.mol.energy, md.mol.energy_old
+    nacme, nacme_old = md.mol.nacme, md.mol.nacme_old
+    coef, rho = md.mol.coef, md.mol.rho
 
     # Debug related
     verbosity = md.verbosity
 
-    # Assign coef or rho with respect to propagation scheme
-    if (md.elec_object == "coefficient"):
-
-        coef = <double complex*> PyMem_Malloc(nst * sizeof(double complex))
-
-        for ist in range(nst):
-            coef[ist] = md.mol.states[ist].coef
-
-    elif (md.elec_object == "density"):
-
-        rho = <double complex**> PyMem_Malloc(nst * sizeof(double complex*))
-        for ist in range(nst):
-            rho[ist] = <double complex*> PyMem_Malloc(nst * sizeof(double complex))
-
-        for ist in range(nst):
-            for jst in range(nst):
-                rho[ist][jst] = md.mol.rho[ist, jst]
-
     py_bytes = md.elec_object.encode()
     elec_object_c = py_bytes
 
     # Propagate electrons depending on the propagator
     if (md.propagator == "rk4"):
-        rk4(nst, nesteps, dt, elec_object_c, energy, energy_old, nacme, nacme_old, coef, rho)
+        with nogil:
+            rk4(nst, nesteps, dt, nac_threshold, elec_object_c, &energy[0], &energy_old[0], &nacme[0, 0], \
+                &nacme_old[0, 0], &coef[0], &rho[0, 0])
 
     elif (md.propagator == "exponential"):
-        exponential(nst, nesteps, dt, elec_object_c, energy, energy_old, nacme, nacme_old, coef)
-
-    # Assign variables from C to python
+        with nogil:
+            exponential(nst, nesteps, dt, elec_object_c, &energy[0], &energy_old[0], &nacme[0, 0], \
+                &nacme_old[0, 0], &coef[0], &rho[0, 0])
+
+    elif (md.propagator == "rk45"):
+        elec_tol = md.elec_tol
+        with nogil:
+            rk45(nst, nesteps, dt, elec_tol, nac_threshold, elec_object_c, &energy[0], &energy_old[0], &nacme[0, 0], \
+                &nacme_old[0, 0], &coef[0], &rho[0, 0], &nsubsteps)
+        md.nsubsteps = nsubsteps
+
+    elif (md.propagator == "krylov"):
+        elec_tol = md.elec_tol
+        with nogil:
+            krylov(nst, nesteps, dt, elec_tol, nac_threshold, elec_object_c, &energy[0], &energy_old[0], &nacme[0, 0], \
+                &nacme_old[0, 0], &coef[0])
+
+    elif (md.propagator == "ld"):
+        st_overlap = md.mol.st_overlap
+        with nogil:
+            ld(nst, nesteps, dt, elec_object_c, &energy[0], &energy_old[0], &st_overlap[0, 0], &coef[0], &rho[0, 0])
+
+    # Update densities from the propagated coefficients
     if (md.elec_object == "coefficient"):
-
-        for ist in range(nst):
-            md.mol.states[ist].coef = coef[ist]
-
-        for ist in range(nst):
-            for jst in range(nst):
-                md.mol.rho[ist, jst] = np.conj(md.mol.states[ist].coef) * md.mol.states[jst].coef
-
-        PyMem_Free(coef)
-
-    elif (md.elec_object == "density"):
-
         for ist in range(nst):
             for jst in range(nst):
-                md.mol.rho[ist, jst] = rho[ist][jst]
-
-        for ist in range(nst):
-            PyMem_Free(rho[ist])
-        PyMem_Free(rho)
+                rho[ist, jst] = coef[ist].conjugate() * coef[jst]
 
     # Debug
     if (verbosity >= 1):
+        dotpopnac = md.dotpopnac
         for ist in range(nst):
-            md.dotpopnac[ist] = 0.
+            dotpopnac[ist] = 0.
             for jst in range(nst):
                 if (jst != ist):
-                    md.dotpopnac[ist] -= 2. * nacme[ist][jst] * md.mol.rho.real[jst, ist]
-
-    # Deallocate variables
-    for ist in range(nst):
-        PyMem_Free(nacme[ist])
-        PyMem_Free(nacme_old[ist])
-
-    PyMem_Free(energy)
-    PyMem_Free(energy_old)
-
-    PyMem_Free(nacme)
-    PyMem_Free(nacme_old)
-
+                    dotpopnac[ist] -= 2. * nacme[ist, jst] * rho[jst, ist].real
 
+        # Count off-diagonal NACME terms used in the propagation, which are larger than the threshold
+        off_diag = 1. - np.eye(nst)
+        md.ncouplings = int(np.count_nonzero(off_diag * np.maximum(np.abs(md.mol.nacme), \
+            np.abs(md.mol.nacme_old)) > nac_threshold))
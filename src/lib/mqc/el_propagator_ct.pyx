@@ -1,132 +1,176 @@
 # cython: language_level=3
-from cpython.mem cimport PyMem_Malloc, PyMem_Free
 from cpython.complex cimport complex
 import numpy as np
 cimport numpy as np
 
 cdef extern from "rk4_ct.c":
-    void rk4(int nst, int nesteps, double dt, char *elec_object, double *energy, \
-        double *energy_old, double **nacme, double **nacme_old, double **k_lk, \
-        double complex *coef, double complex **rho)
+    void rk4(int nst, int nesteps, double dt, double nac_threshold, char *elec_object, double *energy, \
+        double *energy_old, double *nacme, double *nacme_old, double *k_lk, \
+        double complex *coef, double complex *rho) nogil
+
+cdef extern from "rk45_ct.c":
+    void rk45(int nst, int nesteps, double dt, double elec_tol, double nac_threshold, char *elec_object, \
+        double *energy, double *energy_old, double *nacme, double *nacme_old, double *k_lk, \
+        double complex *coef, int *nsubsteps) nogil
+
+cdef extern from "batch_ct.c":
+    void rk4_batch(int ntrajs, int nst, int nesteps, double dt, double nac_threshold, char *elec_object, \
+        double *energy, double *energy_old, double *nacme, double *nacme_old, double *k_lk, \
+        double complex *coef) nogil
+
+    void rk45_batch(int ntrajs, int nst, int nesteps, double dt, double elec_tol, double nac_threshold, \
+        char *elec_object, double *energy, double *energy_old, double *nacme, double *nacme_old, double *k_lk, \
+        double complex *coef, int *nsubsteps) nogil
 
 def el_run(md, itrajectory):
     cdef:
         char *elec_object_c
-        double *energy
-        double *energy_old
-        double **nacme
-        double **nacme_old
-        double **k_lk
-        double complex *coef
-        double complex **rho
+        double[::1] energy
+        double[::1] energy_old
+        double[:, ::1] nacme
+        double[:, ::1] nacme_old
+        double[:, ::1] k_lk
+        double complex[::1] coef
+        double complex[:, ::1] rho
+        double[::1] dotpopnac
+        double[::1] dotpopdec
 
         bytes py_bytes
-        int ist, jst, nst, nesteps, verbosity
-        double dt
+        int ist, jst, nst, nesteps, nsubsteps, verbosity
+        double dt, elec_tol, nac_threshold
 
     # Assign size variables
     nst = md.nst
     nesteps, dt = md.nesteps, md.dt
+    nac_threshold = md.nac_threshold
 
-    # Allocate variables
-    energy = <double*> PyMem_Malloc(nst * sizeof(double))
-    energy_old = <double*> PyMem_Malloc(nst * sizeof(double))
+    # Arrays of molecule and MQC objects are propagated in place, hence the data are not copied
+    energy, energy_old = md.mol.energy, md.mol.energy_old
+    nacme, nacme_old = md.mol.nacme, md.mol.nacme_old
+    k_lk = md.K_lk[itrajectory]
+    coef, rho = md.mol.coef, md.mol.rho
 
-    nacme = <double**> PyMem_Malloc(nst * sizeof(double*))
-    nacme_old = <double**> PyMem_Malloc(nst * sizeof(double*))
+    # Debug related
+    verbosity = md.verbosity
 
-    k_lk = <double**> PyMem_Malloc(nst * sizeof(double))
+    py_bytes = md.elec_object.encode()
+    elec_object_c = py_bytes
 
-    for ist in range(nst):
-        nacme[ist] = <double*> PyMem_Malloc(nst * sizeof(double))
-        nacme_old[ist] = <double*> PyMem_Malloc(nst * sizeof(double))
+    # Propagate electrons depending on the propagator
+    if (md.propagator == "rk4"):
+        with nogil:
+            rk4(nst, nesteps, dt, nac_threshold, elec_object_c, &energy[0], &energy_old[0], &nacme[0, 0], \
+                &nacme_old[0, 0], &k_lk[0, 0], &coef[0], &rho[0, 0])
+
+    elif (md.propagator == "rk45"):
+        elec_tol = md.elec_tol
+        with nogil:
+            rk45(nst, nesteps, dt, elec_tol, nac_threshold, elec_object_c, &energy[0], &energy_old[0], &nacme[0, 0], \
+                &nacme_old[0, 0], &k_lk[0, 0], &coef[0], &nsubsteps)
+        md.nsubsteps[itrajectory] = nsubsteps
+
+    # Update densities from the propagated coefficients
+    if (md.elec_object == "coefficient"):
+        for ist in range(nst):
+            for jst in range(nst):
+                rho[ist, jst] = coef[ist].conjugate() * coef[jst]
 
-        k_lk[ist] = <double*> PyMem_Malloc(nst * sizeof(double))
-    
-    # Debug related
-    verbosity = md.verbosity
+    # Debug
+    if (verbosity >= 1):
+        dotpopnac, dotpopdec = md.dotpopnac[itrajectory], md.dotpopdec[itrajectory]
+        for ist in range(nst):
+            dotpopnac[ist] = 0.
+            dotpopdec[ist] = 0.
+            for jst in range(nst):
+                if (jst != ist):
+                    dotpopnac[ist] -= 2. * nacme[ist, jst] * rho[jst, ist].real
+                    dotpopdec[ist] -= 0.5 * (k_lk[ist, jst] - k_lk[jst, ist]) * \
+                        rho[jst, jst].real * rho[ist, ist].real
 
-    # Assign variables from python to C
-    for ist in range(nst):
-        energy[ist] = md.mol.states[ist].energy
-        energy_old[ist] = md.mol.states[ist].energy_old
+        # Count off-diagonal NACME terms used in the propagation, which are larger than the threshold
+        off_diag = 1. - np.eye(nst)
+        md.ncouplings[itrajectory] = np.count_nonzero(off_diag * np.maximum(np.abs(md.mol.nacme), \
+            np.abs(md.mol.nacme_old)) > nac_threshold)
 
-    for ist in range(nst):
-        for jst in range(nst):
-            nacme[ist][jst] = md.mol.nacme[ist, jst]
-            nacme_old[ist][jst] = md.mol.nacme_old[ist, jst]
+def el_run_batch(md, itrajectories):
+    cdef:
+        char *elec_object_c
+        double[:, ::1] energy
+        double[:, ::1] energy_old
+        double[:, :, ::1] nacme
+        double[:, :, ::1] nacme_old
+        double[:, :, ::1] k_lk
+        double complex[:, ::1] coef
+        int[::1] nsubsteps
 
-            k_lk[ist][jst] = md.K_lk[itrajectory, ist, jst]
+        bytes py_bytes
+        int ntrajs, nst, nesteps, verbosity
+        double dt, elec_tol, nac_threshold
 
-    # Assign coef or rho with respect to elec_object scheme
-    if (md.elec_object == "coefficient"):
+    # Assign size variables
+    ntrajs = len(itrajectories)
+    nst = md.nst
+    nesteps, dt = md.nesteps, md.dt
+    nac_threshold = md.nac_threshold
 
-        coef = <double complex*> PyMem_Malloc(nst * sizeof(double complex))
+    # Debug related
+    verbosity = md.verbosity
 
-        for ist in range(nst):
-            coef[ist] = md.mol.states[ist].coef
-        
-    #elif (md.elec_object == "density"):
+    # Gather variables of the trajectories into contiguous buffers
+    # Coefficients and densities are already saved in contiguous arrays of the ensemble
+    mols = [md.mols[itraj] for itraj in itrajectories]
+
+    energy_py = np.array([mol.energy for mol in mols], dtype=np.float64)
+    energy_old_py = np.array([mol.energy_old for mol in mols], dtype=np.float64)
+
+    nacme_py = np.array([mol.nacme for mol in mols], dtype=np.float64)
+    nacme_old_py = np.array([mol.nacme_old for mol in mols], dtype=np.float64)
 
-    #    rho = <double complex**> PyMem_Malloc(nst * sizeof(double complex*))
-    #    for ist in range(nst):
-    #        rho[ist] = <double complex*> PyMem_Malloc(nst * sizeof(double complex))
+    k_lk_py = np.ascontiguousarray(md.K_lk[itrajectories], dtype=np.float64)
 
-    #    for ist in range(nst):
-    #        for jst in range(nst):
-    #            rho[ist][jst] = md.mol.rho[ist, jst]
+    energy, energy_old = energy_py, energy_old_py
+    nacme, nacme_old, k_lk = nacme_py, nacme_old_py, k_lk_py
+
+    # Assign coef or rho with respect to elec_object scheme
+    if (md.elec_object == "coefficient"):
+        coef_py = np.ascontiguousarray(md.ens.coef[itrajectories])
+        coef = coef_py
 
     py_bytes = md.elec_object.encode()
     elec_object_c = py_bytes
 
-    # Propagate electrons depending on the propagator
+    # Propagate electrons of all trajectories depending on the propagator
     if (md.propagator == "rk4"):
-        rk4(nst, nesteps, dt, elec_object_c, energy, energy_old, nacme, nacme_old, k_lk, coef, rho)
+        with nogil:
+            rk4_batch(ntrajs, nst, nesteps, dt, nac_threshold, elec_object_c, &energy[0, 0], &energy_old[0, 0], \
+                &nacme[0, 0, 0], &nacme_old[0, 0, 0], &k_lk[0, 0, 0], &coef[0, 0])
+
+    elif (md.propagator == "rk45"):
+        elec_tol = md.elec_tol
+        nsubsteps_py = np.zeros(ntrajs, dtype=np.intc)
+        nsubsteps = nsubsteps_py
+        with nogil:
+            rk45_batch(ntrajs, nst, nesteps, dt, elec_tol, nac_threshold, elec_object_c, &energy[0, 0], \
+                &energy_old[0, 0], &nacme[0, 0, 0], &nacme_old[0, 0, 0], &k_lk[0, 0, 0], &coef[0, 0], \
+                &nsubsteps[0])
+        md.nsubsteps[itrajectories] = nsubsteps_py
 
     # Assign variables from C to python
     if (md.elec_object == "coefficient"):
 
-        for ist in range(nst):
-            md.mol.states[ist].coef = coef[ist]
+        rho_py = np.conj(coef_py)[:, :, np.newaxis] * coef_py[:, np.newaxis, :]
 
-        for ist in range(nst):
-            for jst in range(nst):
-                md.mol.rho[ist, jst] = np.conj(md.mol.states[ist].coef) * md.mol.states[jst].coef
-
-        PyMem_Free(coef)
-
-    #elif (md.elec_object == "density"):
-
-    #    for ist in range(nst):
-    #        for jst in range(nst):
-    #            md.mol.rho[ist, jst] = rho[ist][jst]
-
-    #    for ist in range(nst):
-    #        PyMem_Free(rho[ist])
-    #    PyMem_Free(rho)
+        md.ens.coef[itrajectories] = coef_py
+        md.ens.rho[itrajectories] = rho_py
 
     # Debug
     if (verbosity >= 1):
-        for ist in range(nst):
-            md.dotpopnac[itrajectory, ist] = 0.
-            md.dotpopdec[itrajectory, ist] = 0.
-            for jst in range(nst):
-                if (jst != ist):
-                    md.dotpopnac[itrajectory, ist] -= 2. * nacme[ist][jst] * md.mol.rho.real[jst, ist]
-                    md.dotpopdec[itrajectory, ist] -= 0.5 * (k_lk[ist][jst] - k_lk[jst][ist]) * \
-                        md.mol.rho.real[jst, jst] * md.mol.rho.real[ist, ist]
-
-    # Deallocate variables
-    for ist in range(nst):
-        PyMem_Free(nacme[ist])
-        PyMem_Free(nacme_old[ist])
-
-        PyMem_Free(k_lk[ist])
-
-    PyMem_Free(energy)
-    PyMem_Free(energy_old)
-
-    PyMem_Free(nacme)
-    PyMem_Free(nacme_old)
-        
-    PyMem_Free(k_lk)
+        rho_real = rho_py.real
+        pop = np.diagonal(rho_real, axis1=1, axis2=2)
+        off_diag = 1. - np.eye(nst)
+
+        md.dotpopnac[itrajectories] = - 2. * np.sum(off_diag * nacme_py * np.transpose(rho_real, (0, 2, 1)), axis=2)
+        md.dotpopdec[itrajectories] = - 0.5 * pop * np.einsum("ijk,ik->ij", \
+            off_diag * (k_lk_py - np.transpose(k_lk_py, (0, 2, 1))), pop)
+        md.ncouplings[itrajectories] = np.count_nonzero(off_diag * np.maximum(np.abs(nacme_py), \
+            np.abs(nacme_old_py)) > nac_threshold, axis=(1, 2))
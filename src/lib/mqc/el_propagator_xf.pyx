@@ -1,199 +1,128 @@
 # cython: language_level=3
-from cpython.mem cimport PyMem_Malloc, PyMem_Free
 from cpython.complex cimport complex
 import numpy as np
 cimport numpy as np
 
 cdef extern from "rk4_xf.c":
-    void rk4(int nat, int ndim, int nst, int nesteps, double dt, char *elec_object, \
-        bint *l_coh, double *mass, double *energy, double *energy_old, double **sigma, \
-        double **nacme, double **nacme_old, double **pos, double **qmom, double ***aux_pos, \
-        double ***phase, double complex *coef, double complex **rho, int verbosity, \
-        double *dotpopdec)
+    void rk4(int nat, int ndim, int nst, int nesteps, double dt, double nac_threshold, char *elec_object, \
+        int *l_coh, double *mass, double *energy, double *energy_old, double *sigma, \
+        double *nacme, double *nacme_old, double *pos, double *qmom, double *aux_pos, \
+        double *phase, double complex *coef, double complex *rho, int verbosity, \
+        double *dotpopdec) nogil
+
+cdef extern from "exponential_xf.c":
+    void exponential(int nat, int ndim, int nst, int nesteps, double dt, char *elec_object, \
+        int *l_coh, double *mass, double *energy, double *energy_old, double *sigma, \
+        double *nacme, double *nacme_old, double *pos, double *qmom, double *aux_pos, \
+        double *phase, double complex *coef, double complex *rho, int verbosity, \
+        double *dotpopdec) nogil
+
+cdef extern from "rk45_xf.c":
+    void rk45(int nat, int ndim, int nst, int nesteps, double dt, double elec_tol, double nac_threshold, \
+        char *elec_object, int *l_coh, double *mass, double *energy, double *energy_old, double *sigma, \
+        double *nacme, double *nacme_old, double *pos, double *qmom, double *aux_pos, double *phase, \
+        double complex *coef, double complex *rho, int verbosity, double *dotpopdec, int *nsubsteps) nogil
+
+cdef extern from "krylov_xf.c":
+    void krylov(int nat, int ndim, int nst, int nesteps, double dt, double elec_tol, double nac_threshold, \
+        char *elec_object, int *l_coh, double *mass, double *energy, double *energy_old, double *sigma, \
+        double *nacme, double *nacme_old, double *pos, double *qmom, double *aux_pos, double *phase, \
+        double complex *coef, int verbosity, double *dotpopdec) nogil
 
 def el_run(md):
     cdef:
         char *elec_object_c
-        bint *l_coh
-        double *mass
-        double *energy
-        double *energy_old
-        double **sigma
-        double **nacme
-        double **nacme_old
-        double **pos
-        double **qmom
-        double ***aux_pos
-        double ***phase
-        double complex *coef
-        double complex **rho
-        double *dotpopdec
+        int[::1] l_coh
+        double[::1] mass
+        double[::1] energy
+        double[::1] energy_old
+        double[:, ::1] sigma
+        double[:, ::1] nacme
+        double[:, ::1] nacme_old
+        double[:, ::1] pos
+        double[:, ::1] qmom
+        double[:, :, ::1] aux_pos
+        double[:, :, ::1] phase
+        double complex[::1] coef
+        double complex[:, ::1] rho
+        double[::1] dotpopdec
+        double[::1] dotpopnac
 
         bytes py_bytes
-        int ist, jst, nst, nesteps, iat, aux_nat, aux_ndim, verbosity
-        double dt
+        int ist, jst, nst, nesteps, nsubsteps, aux_nat, aux_ndim, verbosity
+        double dt, elec_tol, nac_threshold
 
     # Assign size variables
     nst = md.mol.nst
     nesteps, dt = md.nesteps, md.dt
+    nac_threshold = md.nac_threshold
     aux_nat, aux_ndim = md.aux.nat, md.aux.ndim
 
-    # Allocate variables
-    l_coh = <bint*> PyMem_Malloc(nst * sizeof(bint))
-    mass = <double*> PyMem_Malloc(aux_nat * sizeof(double))
-    energy = <double*> PyMem_Malloc(nst * sizeof(double))
-    energy_old = <double*> PyMem_Malloc(nst * sizeof(double))
-
-    nacme = <double**> PyMem_Malloc(nst * sizeof(double*))
-    nacme_old = <double**> PyMem_Malloc(nst * sizeof(double*))
-    pos = <double**> PyMem_Malloc(aux_nat * sizeof(double*))
-    qmom = <double**> PyMem_Malloc(aux_nat * sizeof(double*))
-    sigma = <double**> PyMem_Malloc(aux_nat * sizeof(double*))
-
-    aux_pos = <double***> PyMem_Malloc(nst * sizeof(double**))
-    phase = <double***> PyMem_Malloc(nst * sizeof(double**))
-
-    for ist in range(nst):
-        nacme[ist] = <double*> PyMem_Malloc(nst * sizeof(double))
-        nacme_old[ist] = <double*> PyMem_Malloc(nst * sizeof(double))
-
-    for iat in range(aux_nat):
-        pos[iat] = <double*> PyMem_Malloc(aux_ndim * sizeof(double))
-        qmom[iat] = <double*> PyMem_Malloc(aux_ndim * sizeof(double))
-        sigma[iat] = <double*> PyMem_Malloc(aux_ndim * sizeof(double))
-
-    for ist in range(nst):
-        aux_pos[ist] = <double**> PyMem_Malloc(aux_nat * sizeof(double*))
-        phase[ist] = <double**> PyMem_Malloc(aux_nat * sizeof(double*))
-        for iat in range(aux_nat):
-            aux_pos[ist][iat] = <double*> PyMem_Malloc(aux_ndim * sizeof(double))
-            phase[ist][iat] = <double*> PyMem_Malloc(aux_ndim * sizeof(double))
-    
-    # Debug related
-    verbosity = md.verbosity
-    if (verbosity >= 1):
-        dotpopdec = <double*> PyMem_Malloc(nst * sizeof(double))
-
-    # Assign variables from python to C
-    for ist in range(nst):
-        energy[ist] = md.mol.states[ist].energy
-        energy_old[ist] = md.mol.states[ist].energy_old
-
-    for iat in range(aux_nat):
-        mass[iat] = md.aux.mass[iat]
-
-    for ist in range(nst):
-        for jst in range(nst):
-            nacme[ist][jst] = md.mol.nacme[ist, jst]
-            nacme_old[ist][jst] = md.mol.nacme_old[ist, jst]
-
-    for iat in range(aux_nat):
-        for isp in range(aux_ndim):
-            pos[iat][isp] = md.pos_0[iat, isp]
-            sigma[iat][isp] = md.sigma[iat, isp]
-
-    for ist in range(nst):
-        l_coh[ist] = md.l_coh[ist]
-        for iat in range(aux_nat):
-            for isp in range(aux_ndim):
-                aux_pos[ist][iat][isp] = md.aux.pos[ist, iat, isp]
-                phase[ist][iat][isp] = md.phase[ist, iat, isp]
-
-    # Assign coef or rho with respect to propagation scheme
-    if (md.elec_object == "coefficient"):
-
-        coef = <double complex*> PyMem_Malloc(nst * sizeof(double complex))
-
-        for ist in range(nst):
-            coef[ist] = md.mol.states[ist].coef
+    # Arrays of molecule and MQC objects are propagated in place, hence the data are not copied
+    # Only the list of decoherence flags is converted to an array
+    l_coh = np.array(md.l_coh, dtype=np.intc)
+    mass = np.ascontiguousarray(md.aux.mass, dtype=np.float64)
+    sigma = np.ascontiguousarray(md.sigma, dtype=np.float64)
 
-    elif (md.elec_object == "density"):
+    energy, energy_old = md.mol.energy, md.mol.energy_old
+    nacme, nacme_old = md.mol.nacme, md.mol.nacme_old
+    pos, qmom = md.pos_0, md.qmom
+    aux_pos, phase = md.aux.pos, md.phase
+    coef, rho = md.mol.coef, md.mol.rho
 
-        rho = <double complex**> PyMem_Malloc(nst * sizeof(double complex*))
-        for ist in range(nst):
-            rho[ist] = <double complex*> PyMem_Malloc(nst * sizeof(double complex))
-
-        for ist in range(nst):
-            for jst in range(nst):
-                rho[ist][jst] = md.mol.rho[ist, jst]
+    # Debug related
+    verbosity = md.verbosity
+    dotpopdec = md.dotpopdec
 
     py_bytes = md.elec_object.encode()
     elec_object_c = py_bytes
 
     # Propagate electrons depending on the propagator
     if (md.propagator == "rk4"):
-        rk4(aux_nat, aux_ndim, nst, nesteps, dt, elec_object_c, l_coh, mass, energy, \
-            energy_old, sigma, nacme, nacme_old, pos, qmom, aux_pos, phase, coef, rho, verbosity, dotpopdec)
-
-    # Assign variables from C to python
+        with nogil:
+            rk4(aux_nat, aux_ndim, nst, nesteps, dt, nac_threshold, elec_object_c, &l_coh[0], &mass[0], &energy[0], \
+                &energy_old[0], &sigma[0, 0], &nacme[0, 0], &nacme_old[0, 0], &pos[0, 0], &qmom[0, 0], \
+                &aux_pos[0, 0, 0], &phase[0, 0, 0], &coef[0], &rho[0, 0], verbosity, &dotpopdec[0])
+
+    elif (md.propagator == "exponential"):
+        with nogil:
+            exponential(aux_nat, aux_ndim, nst, nesteps, dt, elec_object_c, &l_coh[0], &mass[0], &energy[0], \
+                &energy_old[0], &sigma[0, 0], &nacme[0, 0], &nacme_old[0, 0], &pos[0, 0], &qmom[0, 0], \
+                &aux_pos[0, 0, 0], &phase[0, 0, 0], &coef[0], &rho[0, 0], verbosity, &dotpopdec[0])
+
+    elif (md.propagator == "rk45"):
+        elec_tol = md.elec_tol
+        with nogil:
+            rk45(aux_nat, aux_ndim, nst, nesteps, dt, elec_tol, nac_threshold, elec_object_c, &l_coh[0], \
+                &mass[0], &energy[0], &energy_old[0], &sigma[0, 0], &nacme[0, 0], &nacme_old[0, 0], \
+                &pos[0, 0], &qmom[0, 0], &aux_pos[0, 0, 0], &phase[0, 0, 0], &coef[0], &rho[0, 0], verbosity, \
+                &dotpopdec[0], &nsubsteps)
+        md.nsubsteps = nsubsteps
+
+    elif (md.propagator == "krylov"):
+        elec_tol = md.elec_tol
+        with nogil:
+            krylov(aux_nat, aux_ndim, nst, nesteps, dt, elec_tol, nac_threshold, elec_object_c, &l_coh[0], \
+                &mass[0], &energy[0], &energy_old[0], &sigma[0, 0], &nacme[0, 0], &nacme_old[0, 0], \
+                &pos[0, 0], &qmom[0, 0], &aux_pos[0, 0, 0], &phase[0, 0, 0], &coef[0], verbosity, \
+                &dotpopdec[0])
+
+    # Update densities from the propagated coefficients
     if (md.elec_object == "coefficient"):
-
-        for ist in range(nst):
-            md.mol.states[ist].coef = coef[ist]
-
         for ist in range(nst):
             for jst in range(nst):
-                md.mol.rho[ist, jst] = np.conj(md.mol.states[ist].coef) * md.mol.states[jst].coef
-
-        PyMem_Free(coef)
-
-    elif (md.elec_object == "density"):
-
-        for ist in range(nst):
-            for jst in range(nst):
-                md.mol.rho[ist, jst] = rho[ist][jst]
-
-        for ist in range(nst):
-            PyMem_Free(rho[ist])
-        PyMem_Free(rho)
+                rho[ist, jst] = coef[ist].conjugate() * coef[jst]
 
     # Debug
     if (verbosity >= 1):
+        dotpopnac = md.dotpopnac
         for ist in range(nst):
-            md.dotpopdec[ist] = dotpopdec[ist]
-            md.dotpopnac[ist] = 0.
+            dotpopnac[ist] = 0.
             for jst in range(nst):
                 if (jst != ist):
-                    md.dotpopnac[ist] -= 2. * nacme[ist][jst] * md.mol.rho.real[jst, ist]
-
-    if (verbosity >= 2):
-        for iat in range(aux_nat):
-            for isp in range(aux_ndim):
-                md.qmom[iat, isp] = qmom[iat][isp]
-
-    # Deallocate variables
-    for ist in range(nst):
-        for iat in range(aux_nat):
-            PyMem_Free(aux_pos[ist][iat])
-            PyMem_Free(phase[ist][iat])
-
-    for ist in range(nst):
-        PyMem_Free(nacme[ist])
-        PyMem_Free(nacme_old[ist])
-
-    for iat in range(aux_nat):
-        PyMem_Free(pos[iat])
-        PyMem_Free(qmom[iat])
-        PyMem_Free(sigma[iat])
-
-    for ist in range(nst):
-        PyMem_Free(aux_pos[ist])
-        PyMem_Free(phase[ist])
-
-    PyMem_Free(l_coh)
-    PyMem_Free(mass)
-    PyMem_Free(energy)
-    PyMem_Free(energy_old)
-    PyMem_Free(sigma)
-
-    PyMem_Free(nacme)
-    PyMem_Free(nacme_old)
-    PyMem_Free(pos)
-    PyMem_Free(qmom)
-
-    PyMem_Free(aux_pos)
-    PyMem_Free(phase)
-
-    if (verbosity >= 1):
-        PyMem_Free(dotpopdec)
+                    dotpopnac[ist] -= 2. * nacme[ist, jst] * rho[jst, ist].real
 
+        # Count off-diagonal NACME terms used in the propagation, which are larger than the threshold
+        off_diag = 1. - np.eye(nst)
+        md.ncouplings = int(np.count_nonzero(off_diag * np.maximum(np.abs(md.mol.nacme), \
+            np.abs(md.mol.nacme_old)) > nac_threshold))
@@ -0,0 +1,158 @@
+#ifndef EXPM_H
+#define EXPM_H
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <complex.h>
+#include <math.h>
+#include <string.h>
+#include "scratch.h"
+
+// Complex datatype
+struct _dcomplex {double real, imag;};
+typedef struct _dcomplex dcomplex;
+
+// Importing heev and gemm
+extern void zheev_(char *jobz, char *uplo, int *n, dcomplex *a, int *lda, double *w, dcomplex *work, int *lwork, double *rwork, int *info);
+extern void zgemm_(char *transa, char *transb, int *m, int *n, int *k, dcomplex *alpha, dcomplex *a, int *lda,
+    dcomplex *b, int *ldb, dcomplex *beta, dcomplex *c, int *ldc);
+
+// Eigendecomposition of the exponent and the workspace of zheev, which are reused over the electronic substeps
+// Matrices are saved in column-major order to exploit external math libraries
+struct expm_work {
+    int nst, lwork, l_eig;
+    // Eigenvalues of (energy - i * NACME) * dt, D
+    double *eigenvalues;
+    double *rwork;
+    // Diagonal elements of exp(- i * D)
+    double complex *exp_idiag;
+    // Exponent of the current eigendecomposition, (energy - i * NACME) * dt
+    double complex *exponent;
+    // Eigenvectors of (energy - i * NACME) * dt, P
+    double complex *eigenvectors;
+    double complex *tmp_mat;
+    dcomplex *work;
+};
+
+// Routine to allocate the workspace, the optimal size of zheev workspace is queried only once
+// The arrays are taken from the scratch memory, hence they are given back by the calling routine
+static void expm_init(struct expm_work *w, int nst){
+
+    int info;
+    dcomplex wkopt;
+
+    w->nst = nst;
+    w->l_eig = 0;
+    w->eigenvalues = scratch_alloc(nst * sizeof(double));
+    w->rwork = scratch_alloc((3 * nst - 2) * sizeof(double));
+    w->exp_idiag = scratch_alloc(nst * sizeof(double complex));
+    w->exponent = scratch_alloc((nst * nst) * sizeof(double complex));
+    w->eigenvectors = scratch_alloc((nst * nst) * sizeof(double complex));
+    w->tmp_mat = scratch_alloc((nst * nst) * sizeof(double complex));
+
+    w->lwork = -1;
+    zheev_("Vectors", "Lower", &nst, (dcomplex*)w->eigenvectors, &nst, w->eigenvalues, &wkopt, &w->lwork,
+        w->rwork, &info);
+    w->lwork = (int)wkopt.real;
+    w->work = scratch_alloc(w->lwork * sizeof(dcomplex));
+
+}
+
+// Routine to construct (energy - i * NACME) * dt, which is a hermitian matrix
+static void expm_exponent(int nst, double edt, double *eenergy, double **dv, double complex *exponent){
+
+    int ist, jst;
+
+    for(ist = 0; ist < nst; ist++){
+        for(jst = 0; jst < nst; jst++){
+            if(ist == jst){
+                exponent[nst * jst + ist] = (eenergy[ist] - eenergy[0]) * edt;
+            }
+            else{
+                exponent[nst * jst + ist] = - 1.0 * I * dv[ist][jst] * edt;
+            }
+        }
+    }
+
+}
+
+// Routine to diagonalize the exponent, exponent = P * D * P^-1
+// The eigendecomposition is reused when the exponent is unchanged from the previous substep
+static void expm_decompose(struct expm_work *w, double complex *exponent){
+
+    int nst = w->nst;
+    int ist, info;
+
+    if(w->l_eig && memcmp(w->exponent, exponent, (nst * nst) * sizeof(double complex)) == 0){
+        return;
+    }
+
+    // After this operation, eigenvectors becomes the eigenvectors defined as P
+    memcpy(w->exponent, exponent, (nst * nst) * sizeof(double complex));
+    memcpy(w->eigenvectors, exponent, (nst * nst) * sizeof(double complex));
+    zheev_("Vectors", "Lower", &nst, (dcomplex*)w->eigenvectors, &nst, w->eigenvalues, w->work, &w->lwork,
+        w->rwork, &info);
+    w->l_eig = 1;
+
+    for(ist = 0; ist < nst; ist++){
+        w->exp_idiag[ist] = cexp(- 1.0 * I * w->eigenvalues[ist]);
+    }
+
+}
+
+// Routine to multiply exp(- i * exponent) = P * exp(- i * D) * P^-1 to the (nst, ncol) matrix in place, ncol <= nst
+// The propagation matrix is not constructed, hence P^-1 and exp(- i * D) are applied in turn
+static void expm_apply(struct expm_work *w, int ncol, double complex *mat){
+
+    int nst = w->nst;
+    int ist, icol;
+
+    double complex *tmp_mat = w->tmp_mat;
+
+    dcomplex dcone = {1.0, 0.0};
+    dcomplex dczero = {0.0, 0.0};
+
+    zgemm_("C", "N", &nst, &ncol, &nst, &dcone, (dcomplex*)w->eigenvectors, &nst, (dcomplex*)mat, &nst,
+        &dczero, (dcomplex*)tmp_mat, &nst);
+    for(icol = 0; icol < ncol; icol++){
+        for(ist = 0; ist < nst; ist++){
+            tmp_mat[nst * icol + ist] *= w->exp_idiag[ist];
+        }
+    }
+    zgemm_("N", "N", &nst, &ncol, &nst, &dcone, (dcomplex*)w->eigenvectors, &nst, (dcomplex*)tmp_mat, &nst,
+        &dczero, (dcomplex*)mat, &nst);
+
+}
+
+// Routine to propagate the density matrix with the propagation matrix of coefficients, U
+// The density matrix is defined as rho_ij = C_i^* C_j, hence rho = U^* * rho * U^T
+static void expm_rho(int nst, double complex *propagator, double complex **rho){
+
+    double complex tmp_mat[nst * nst];
+
+    int ist, jst, kst;
+    double complex tmp;
+
+    for(ist = 0; ist < nst; ist++){
+        for(jst = 0; jst < nst; jst++){
+            tmp = 0.0 + 0.0 * I;
+            for(kst = 0; kst < nst; kst++){
+                tmp += conj(propagator[nst * kst + ist]) * rho[kst][jst];
+            }
+            tmp_mat[nst * ist + jst] = tmp;
+        }
+    }
+
+    for(ist = 0; ist < nst; ist++){
+        for(jst = 0; jst < nst; jst++){
+            tmp = 0.0 + 0.0 * I;
+            for(kst = 0; kst < nst; kst++){
+                tmp += tmp_mat[nst * ist + kst] * propagator[nst * kst + jst];
+            }
+            rho[ist][jst] = tmp;
+        }
+    }
+
+}
+
+#endif
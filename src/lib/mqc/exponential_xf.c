@@ -0,0 +1,227 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <complex.h>
+#include <math.h>
+#include <string.h>
+#include "derivs.h"
+#include "derivs_xf.h"
+#include "expm.h"
+
+// Routine for coefficient propagation scheme in exponential propagator
+static void exponential_coef(int nat, int ndim, int nst, int nesteps, double dt, int *l_coh,
+    double *mass, double *energy, double *energy_old, double **sigma, double **nacme,
+    double **nacme_old, double **pos, double **qmom, double ***aux_pos, double ***phase, double complex *coef,
+    int verbosity, double *dotpopdec);
+
+// Routine for density propagation scheme in exponential propagator
+static void exponential_rho(int nat, int ndim, int nst, int nesteps, double dt, int *l_coh,
+    double *mass, double *energy, double *energy_old, double **sigma, double **nacme,
+    double **nacme_old, double **pos, double **qmom, double ***aux_pos, double ***phase, double complex **rho,
+    int verbosity, double *dotpopdec);
+
+// Interface routine for propagation scheme in exponential propagator
+// Arrays are contiguous buffers with shapes of (nst), (nat), (nst, nst), (nat, ndim) or (nst, nat, ndim),
+// which are changed in place
+static void exponential(int nat, int ndim, int nst, int nesteps, double dt, char *elec_object, int *l_coh,
+    double *mass, double *energy, double *energy_old, double *sigma, double *nacme, double *nacme_old,
+    double *pos, double *qmom, double *aux_pos, double *phase, double complex *coef, double complex *rho,
+    int verbosity, double *dotpopdec){
+
+    double *nacme_rows[nst];
+    double *nacme_old_rows[nst];
+    double complex *rho_rows[nst];
+    double *sigma_rows[nat];
+    double *pos_rows[nat];
+    double *qmom_rows[nat];
+    double *aux_pos_rows[nst * nat];
+    double *phase_rows[nst * nat];
+    double **aux_pos_mats[nst];
+    double **phase_mats[nst];
+
+    int ist, iat;
+
+    // Row pointers refer to the buffers directly, hence the data are not copied
+    for(ist = 0; ist < nst; ist++){
+        nacme_rows[ist] = nacme + ist * nst;
+        nacme_old_rows[ist] = nacme_old + ist * nst;
+        rho_rows[ist] = rho + ist * nst;
+    }
+
+    for(iat = 0; iat < nat; iat++){
+        sigma_rows[iat] = sigma + iat * ndim;
+        pos_rows[iat] = pos + iat * ndim;
+        qmom_rows[iat] = qmom + iat * ndim;
+    }
+
+    for(ist = 0; ist < nst; ist++){
+        for(iat = 0; iat < nat; iat++){
+            aux_pos_rows[ist * nat + iat] = aux_pos + (ist * nat + iat) * ndim;
+            phase_rows[ist * nat + iat] = phase + (ist * nat + iat) * ndim;
+        }
+        aux_pos_mats[ist] = aux_pos_rows + ist * nat;
+        phase_mats[ist] = phase_rows + ist * nat;
+    }
+
+    if(strcmp(elec_object, "coefficient") == 0){
+        exponential_coef(nat, ndim, nst, nesteps, dt, l_coh, mass, energy, energy_old, sigma_rows,
+            nacme_rows, nacme_old_rows, pos_rows, qmom_rows, aux_pos_mats, phase_mats, coef, verbosity, dotpopdec);
+    }
+    else if(strcmp(elec_object, "density") == 0){
+        exponential_rho(nat, ndim, nst, nesteps, dt, l_coh, mass, energy, energy_old, sigma_rows,
+            nacme_rows, nacme_old_rows, pos_rows, qmom_rows, aux_pos_mats, phase_mats, rho_rows, verbosity, dotpopdec);
+    }
+
+}
+
+// Routine for coefficient propagation scheme in exponential propagator
+// The XF term is fixed during the substep and is applied in halves before and after exp(- i * exponent)
+static void exponential_coef(int nat, int ndim, int nst, int nesteps, double dt, int *l_coh,
+    double *mass, double *energy, double *energy_old, double **sigma, double **nacme,
+    double **nacme_old, double **pos, double **qmom, double ***aux_pos, double ***phase, double complex *coef,
+    int verbosity, double *dotpopdec){
+
+    size_t mark = scratch_mark();
+    double complex *xf_c_dot = scratch_alloc(nst * sizeof(double complex));
+    double *eenergy = scratch_alloc(nst * sizeof(double));
+    double **dv = scratch_alloc(nst * sizeof(double*));
+    // (energy - i * NACME) * dt
+    double complex *exponent = scratch_alloc((nst * nst) * sizeof(double complex));
+
+    struct expm_work work;
+
+    int ist, jst, iestep;
+    double frac, edt, norm;
+
+    for(ist = 0; ist < nst; ist++){
+        dv[ist] = scratch_alloc(nst * sizeof(double));
+    }
+
+    expm_init(&work, nst);
+
+    frac = 1.0 / (double)nesteps;
+    edt = dt * frac;
+
+    for(iestep = 0; iestep < nesteps; iestep++){
+
+        // Calculate cdot contribution originated from XF term
+        xf_cdot(nat, ndim, nst, l_coh, mass, sigma, pos, qmom, aux_pos, phase, coef, xf_c_dot);
+
+        // Interpolate energy and NACME terms between time t and t + dt
+        for(ist = 0; ist < nst; ist++){
+            eenergy[ist] = energy_old[ist] + (energy[ist] - energy_old[ist]) * (double)iestep * frac;
+            for(jst = 0; jst < nst; jst++){
+                dv[ist][jst] = nacme_old[ist][jst] + (nacme[ist][jst] - nacme_old[ist][jst])
+                    * (double)iestep * frac;
+            }
+        }
+
+        // Construct (i * propagation matrix) to make hermitian matrix
+        expm_exponent(nst, edt, eenergy, dv, exponent);
+        expm_decompose(&work, exponent);
+
+        // Apply the half of XF term, exp(- i * exponent) and the remaining half of XF term
+        for(ist = 0; ist < nst; ist++){
+            coef[ist] += 0.5 * edt * xf_c_dot[ist];
+        }
+
+        expm_apply(&work, 1, coef);
+
+        for(ist = 0; ist < nst; ist++){
+            coef[ist] += 0.5 * edt * xf_c_dot[ist];
+        }
+
+        // Renormalize the coefficients
+        norm = dot(nst, coef, coef);
+        for(ist = 0; ist < nst; ist++){
+            coef[ist] /= sqrt(norm);
+        }
+
+    }
+
+    if(verbosity >= 1){
+        xf_print_coef(nst, coef, xf_c_dot, dotpopdec);
+    }
+
+    scratch_release(mark);
+
+}
+
+// Routine for density propagation scheme in exponential propagator
+// The XF term is fixed during the substep and is applied in halves before and after exp(- i * exponent)
+static void exponential_rho(int nat, int ndim, int nst, int nesteps, double dt, int *l_coh,
+    double *mass, double *energy, double *energy_old, double **sigma, double **nacme,
+    double **nacme_old, double **pos, double **qmom, double ***aux_pos, double ***phase, double complex **rho,
+    int verbosity, double *dotpopdec){
+
+    size_t mark = scratch_mark();
+    double complex **xf_rho_dot = scratch_alloc(nst * sizeof(double complex*));
+    double *eenergy = scratch_alloc(nst * sizeof(double));
+    double **dv = scratch_alloc(nst * sizeof(double*));
+    // (energy - i * NACME) * dt
+    double complex *exponent = scratch_alloc((nst * nst) * sizeof(double complex));
+    // exp(- i * exponent) of the current step, U
+    double complex *propagator = scratch_alloc((nst * nst) * sizeof(double complex));
+
+    struct expm_work work;
+
+    int ist, jst, iestep;
+    double frac, edt;
+
+    for(ist = 0; ist < nst; ist++){
+        xf_rho_dot[ist] = scratch_alloc(nst * sizeof(double complex));
+        dv[ist] = scratch_alloc(nst * sizeof(double));
+    }
+
+    expm_init(&work, nst);
+
+    frac = 1.0 / (double)nesteps;
+    edt = dt * frac;
+
+    for(iestep = 0; iestep < nesteps; iestep++){
+
+        // Calculate rhodot contribution originated from XF term
+        xf_rhodot(nat, ndim, nst, l_coh, mass, sigma, pos, qmom, aux_pos, phase, rho, xf_rho_dot);
+
+        // Interpolate energy and NACME terms between time t and t + dt
+        for(ist = 0; ist < nst; ist++){
+            eenergy[ist] = energy_old[ist] + (energy[ist] - energy_old[ist]) * (double)iestep * frac;
+            for(jst = 0; jst < nst; jst++){
+                dv[ist][jst] = nacme_old[ist][jst] + (nacme[ist][jst] - nacme_old[ist][jst])
+                    * (double)iestep * frac;
+            }
+        }
+
+        // Construct (i * propagation matrix) to make hermitian matrix
+        expm_exponent(nst, edt, eenergy, dv, exponent);
+        expm_decompose(&work, exponent);
+
+        memset(propagator, 0, (nst * nst) * sizeof(double complex));
+        for(ist = 0; ist < nst; ist++){
+            propagator[nst * ist + ist] = 1.0 + 0.0 * I;
+        }
+        expm_apply(&work, nst, propagator);
+
+        // Apply the half of XF term, exp(- i * exponent) and the remaining half of XF term
+        for(ist = 0; ist < nst; ist++){
+            for(jst = 0; jst < nst; jst++){
+                rho[ist][jst] += 0.5 * edt * xf_rho_dot[ist][jst];
+            }
+        }
+
+        expm_rho(nst, propagator, rho);
+
+        for(ist = 0; ist < nst; ist++){
+            for(jst = 0; jst < nst; jst++){
+                rho[ist][jst] += 0.5 * edt * xf_rho_dot[ist][jst];
+            }
+        }
+
+    }
+
+    if(verbosity >= 1){
+        xf_print_rho(nst, xf_rho_dot, dotpopdec);
+    }
+
+    scratch_release(mark);
+
+}
@@ -0,0 +1,107 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <complex.h>
+#include <math.h>
+#include <string.h>
+#include "coupling.h"
+#include "krylov.h"
+
+// Variables needed to calculate the product of the exponent and the vector at the electronic substep
+struct krylov_params {
+    int nst;
+    double edt;
+    double *eenergy;
+    struct coupling *nac;
+};
+
+// Routine for coefficient propagation scheme in krylov propagator
+static void krylov_coef(int nst, int nesteps, double dt, double elec_tol, double *energy, double *energy_old,
+    struct coupling *nac, double complex *coef);
+
+// Routine to calculate the product of (energy - i * NACME) * dt and the vector
+static void krylov_exponent(void *params, double complex *x, double complex *y);
+
+// Interface routine for propagation scheme in krylov propagator
+// Arrays are contiguous buffers with shapes of (nst) or (nst, nst), which are changed in place
+// NACME terms not larger than nac_threshold are neglected in the propagation
+static void krylov(int nst, int nesteps, double dt, double elec_tol, double nac_threshold, char *elec_object,
+    double *energy, double *energy_old, double *nacme, double *nacme_old, double complex *coef){
+
+    size_t mark = scratch_mark();
+    double *nacme_rows[nst];
+    double *nacme_old_rows[nst];
+
+    struct coupling nac;
+    int ist;
+
+    // Row pointers refer to the buffers directly, hence the data are not copied
+    for(ist = 0; ist < nst; ist++){
+        nacme_rows[ist] = nacme + ist * nst;
+        nacme_old_rows[ist] = nacme_old + ist * nst;
+    }
+
+    coupling_init(&nac, nst, nac_threshold, nacme_rows, nacme_old_rows);
+
+    if(strcmp(elec_object, "coefficient") == 0){
+        krylov_coef(nst, nesteps, dt, elec_tol, energy, energy_old, &nac, coef);
+    }
+
+    scratch_release(mark);
+
+}
+
+// Routine for coefficient propagation scheme in krylov propagator
+static void krylov_coef(int nst, int nesteps, double dt, double elec_tol, double *energy, double *energy_old,
+    struct coupling *nac, double complex *coef){
+
+    size_t mark = scratch_mark();
+    double *eenergy = scratch_alloc(nst * sizeof(double));
+
+    struct krylov_params params;
+    int ist, iestep;
+    double frac, edt;
+
+    frac = 1.0 / (double)nesteps;
+    edt = dt * frac;
+
+    params.nst = nst;
+    params.edt = edt;
+    params.eenergy = eenergy;
+    params.nac = nac;
+
+    for(iestep = 0; iestep < nesteps; iestep++){
+
+        // Interpolate energy and NACME terms between time t and t + dt
+        for(ist = 0; ist < nst; ist++){
+            eenergy[ist] = energy_old[ist] + (energy[ist] - energy_old[ist]) * (double)iestep * frac;
+        }
+        coupling_interpolate(nac, (double)iestep * frac);
+
+        // Update the coefficients using exp(- i * exponent) in the Krylov subspace
+        krylov_expm(nst, elec_tol, krylov_exponent, &params, coef);
+    }
+
+    scratch_release(mark);
+
+}
+
+// Routine to calculate the product of (energy - i * NACME) * dt and the vector
+static void krylov_exponent(void *params, double complex *x, double complex *y){
+
+    struct krylov_params *p = params;
+
+    int ist, jst, k;
+
+    // Only the saved NACME terms contribute to the product
+    for(ist = 0; ist < p->nst; ist++){
+        y[ist] = (p->eenergy[ist] - p->eenergy[0]) * x[ist];
+        for(k = p->nac->row_ptr[ist]; k < p->nac->row_ptr[ist + 1]; k++){
+            jst = p->nac->col_ind[k];
+            if(ist != jst){
+                y[ist] -= 1.0 * I * p->nac->dv[k] * x[jst];
+            }
+        }
+        y[ist] *= p->edt;
+    }
+
+}
@@ -0,0 +1,186 @@
+#ifndef KRYLOV_H
+#define KRYLOV_H
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <complex.h>
+#include <math.h>
+#include <string.h>
+#include "scratch.h"
+
+// Importing stev to diagonalize the real symmetric tridiagonal matrix
+extern void dstev_(char *jobz, int *n, double *d, double *e, double *z, int *ldz, double *work, int *info);
+
+// Maximum dimension of the Krylov subspace
+#define KRYLOV_MAX_DIM 30
+
+// Product of the hermitian exponent and the vector, y = A * x
+typedef void (*krylov_matvec)(void *params, double complex *x, double complex *y);
+
+// Routine to calculate exp(- i * tau * T) * e_1 for the (m, m) real symmetric tridiagonal matrix T
+// alpha and beta are the diagonal and subdiagonal elements of T
+static void krylov_small_expm(int m, double tau, double *alpha, double *beta, double complex *s){
+
+    size_t mark = scratch_mark();
+    double *eigenvalues = scratch_alloc(m * sizeof(double));
+    double *offdiag = scratch_alloc(m * sizeof(double));
+    double *eigenvectors = scratch_alloc((m * m) * sizeof(double));
+    double *work = scratch_alloc((2 * m) * sizeof(double));
+
+    int ist, jst, info;
+
+    for(ist = 0; ist < m; ist++){
+        eigenvalues[ist] = alpha[ist];
+        offdiag[ist] = beta[ist + 1];
+    }
+
+    dstev_("V", &m, eigenvalues, offdiag, eigenvectors, &m, work, &info);
+
+    // s = Q * exp(- i * tau * L) * Q^T * e_1, Q is saved in column-major order
+    for(ist = 0; ist < m; ist++){
+        s[ist] = 0.0 + 0.0 * I;
+        for(jst = 0; jst < m; jst++){
+            s[ist] += eigenvectors[m * jst + ist] * cexp(- 1.0 * I * tau * eigenvalues[jst]) * eigenvectors[m * jst];
+        }
+    }
+
+    scratch_release(mark);
+
+}
+
+// Routine to calculate v = exp(- i * A) * v for the (n, n) hermitian matrix A with the Lanczos process
+// Only the products of A and vectors are needed. The dimension of the Krylov subspace grows until the
+// estimated error is below tol, and the interval is divided when the maximum dimension is not enough
+// The maximum dimension of the Krylov subspace used in the propagation is returned
+static int krylov_expm(int n, double tol, krylov_matvec matvec, void *params, double complex *v){
+
+    int max_dim = (n < KRYLOV_MAX_DIM) ? n : KRYLOV_MAX_DIM;
+
+    size_t mark = scratch_mark();
+    double complex **basis = scratch_alloc((max_dim + 1) * sizeof(double complex*));
+    double complex *w = scratch_alloc(n * sizeof(double complex));
+    double complex *s = scratch_alloc(max_dim * sizeof(double complex));
+    double *alpha = scratch_alloc(max_dim * sizeof(double));
+    double *beta = scratch_alloc((max_dim + 1) * sizeof(double));
+
+    int i, j, k, m, l_conv, dim_used;
+    double t, tau, beta0, err, anorm;
+    double complex overlap;
+
+    for(j = 0; j <= max_dim; j++){
+        basis[j] = scratch_alloc(n * sizeof(double complex));
+    }
+
+    t = 0.0;
+    tau = 1.0;
+    dim_used = 0;
+
+    while(1.0 - t > 1.0E-12){
+
+        beta0 = 0.0;
+        for(i = 0; i < n; i++){
+            beta0 += creal(conj(v[i]) * v[i]);
+        }
+        beta0 = sqrt(beta0);
+        if(beta0 == 0.0){
+            break;
+        }
+
+        for(i = 0; i < n; i++){
+            basis[0][i] = v[i] / beta0;
+        }
+
+        // Build the Krylov subspace until the error estimate of the remaining interval is converged
+        tau = 1.0 - t;
+        beta[0] = 0.0;
+        anorm = 0.0;
+        l_conv = 0;
+        m = 0;
+        for(j = 0; j < max_dim; j++){
+
+            matvec(params, basis[j], w);
+
+            overlap = 0.0 + 0.0 * I;
+            for(i = 0; i < n; i++){
+                overlap += conj(basis[j][i]) * w[i];
+            }
+            alpha[j] = creal(overlap);
+
+            for(i = 0; i < n; i++){
+                w[i] -= alpha[j] * basis[j][i];
+                if(j > 0){
+                    w[i] -= beta[j] * basis[j - 1][i];
+                }
+            }
+
+            // Reorthogonalize against the whole basis to keep the basis orthonormal
+            for(k = 0; k <= j; k++){
+                overlap = 0.0 + 0.0 * I;
+                for(i = 0; i < n; i++){
+                    overlap += conj(basis[k][i]) * w[i];
+                }
+                for(i = 0; i < n; i++){
+                    w[i] -= overlap * basis[k][i];
+                }
+            }
+
+            beta[j + 1] = 0.0;
+            for(i = 0; i < n; i++){
+                beta[j + 1] += creal(conj(w[i]) * w[i]);
+            }
+            beta[j + 1] = sqrt(beta[j + 1]);
+
+            m = j + 1;
+            krylov_small_expm(m, tau, alpha, beta, s);
+
+            // The subspace is invariant under A when the new vector vanishes, hence the result is exact
+            anorm = fmax(anorm, fabs(alpha[j]) + beta[j] + beta[j + 1]);
+            if(beta[j + 1] <= 1.0E-14 * anorm || m == n){
+                l_conv = 1;
+                break;
+            }
+
+            // Error estimate from the residual of the Lanczos relation
+            err = beta0 * beta[j + 1] * cabs(s[m - 1]);
+            if(err <= tol){
+                l_conv = 1;
+                break;
+            }
+
+            for(i = 0; i < n; i++){
+                basis[j + 1][i] = w[i] / beta[j + 1];
+            }
+        }
+
+        // Divide the interval when the maximum dimension of the Krylov subspace is not enough
+        while(!l_conv){
+            tau *= 0.5;
+            krylov_small_expm(m, tau, alpha, beta, s);
+            err = beta0 * beta[m] * cabs(s[m - 1]);
+            if(err <= tol || tau <= 1.0E-10){
+                l_conv = 1;
+            }
+        }
+
+        // v = beta0 * V_m * exp(- i * tau * T_m) * e_1
+        for(i = 0; i < n; i++){
+            v[i] = 0.0 + 0.0 * I;
+            for(j = 0; j < m; j++){
+                v[i] += basis[j][i] * s[j];
+            }
+            v[i] *= beta0;
+        }
+
+        if(m > dim_used){
+            dim_used = m;
+        }
+        t += tau;
+    }
+
+    scratch_release(mark);
+
+    return dim_used;
+
+}
+
+#endif
@@ -0,0 +1,162 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <complex.h>
+#include <math.h>
+#include <string.h>
+#include "derivs.h"
+#include "derivs_xf.h"
+#include "krylov.h"
+
+// Variables needed to calculate the product of the exponent and the vector at the electronic substep
+struct krylov_xf_params {
+    int nst;
+    double edt;
+    double *eenergy;
+    struct coupling *nac;
+};
+
+// Routine for coefficient propagation scheme in krylov propagator
+static void krylov_coef(int nat, int ndim, int nst, int nesteps, double dt, double elec_tol, int *l_coh,
+    double *mass, double *energy, double *energy_old, double **sigma, struct coupling *nac,
+    double **pos, double **qmom, double ***aux_pos, double ***phase, double complex *coef,
+    int verbosity, double *dotpopdec);
+
+// Routine to calculate the product of (energy - i * NACME) * dt and the vector
+static void krylov_xf_exponent(void *params, double complex *x, double complex *y);
+
+// Interface routine for propagation scheme in krylov propagator
+// Arrays are contiguous buffers with shapes of (nst), (nat), (nst, nst), (nat, ndim) or (nst, nat, ndim),
+// which are changed in place
+// NACME terms not larger than nac_threshold are neglected in the propagation
+static void krylov(int nat, int ndim, int nst, int nesteps, double dt, double elec_tol, double nac_threshold,
+    char *elec_object, int *l_coh, double *mass, double *energy, double *energy_old, double *sigma, double *nacme,
+    double *nacme_old, double *pos, double *qmom, double *aux_pos, double *phase, double complex *coef, int verbosity,
+    double *dotpopdec){
+
+    size_t mark = scratch_mark();
+    double *nacme_rows[nst];
+    double *nacme_old_rows[nst];
+    double *sigma_rows[nat];
+    double *pos_rows[nat];
+    double *qmom_rows[nat];
+    double *aux_pos_rows[nst * nat];
+    double *phase_rows[nst * nat];
+    double **aux_pos_mats[nst];
+    double **phase_mats[nst];
+
+    struct coupling nac;
+    int ist, iat;
+
+    // Row pointers refer to the buffers directly, hence the data are not copied
+    for(ist = 0; ist < nst; ist++){
+        nacme_rows[ist] = nacme + ist * nst;
+        nacme_old_rows[ist] = nacme_old + ist * nst;
+    }
+
+    for(iat = 0; iat < nat; iat++){
+        sigma_rows[iat] = sigma + iat * ndim;
+        pos_rows[iat] = pos + iat * ndim;
+        qmom_rows[iat] = qmom + iat * ndim;
+    }
+
+    for(ist = 0; ist < nst; ist++){
+        for(iat = 0; iat < nat; iat++){
+            aux_pos_rows[ist * nat + iat] = aux_pos + (ist * nat + iat) * ndim;
+            phase_rows[ist * nat + iat] = phase + (ist * nat + iat) * ndim;
+        }
+        aux_pos_mats[ist] = aux_pos_rows + ist * nat;
+        phase_mats[ist] = phase_rows + ist * nat;
+    }
+
+    coupling_init(&nac, nst, nac_threshold, nacme_rows, nacme_old_rows);
+
+    if(strcmp(elec_object, "coefficient") == 0){
+        krylov_coef(nat, ndim, nst, nesteps, dt, elec_tol, l_coh, mass, energy, energy_old, sigma_rows,
+            &nac, pos_rows, qmom_rows, aux_pos_mats, phase_mats, coef, verbosity, dotpopdec);
+    }
+
+    scratch_release(mark);
+
+}
+
+// Routine for coefficient propagation scheme in krylov propagator
+// The XF term is fixed during the substep and is applied in halves before and after exp(- i * exponent)
+static void krylov_coef(int nat, int ndim, int nst, int nesteps, double dt, double elec_tol, int *l_coh,
+    double *mass, double *energy, double *energy_old, double **sigma, struct coupling *nac,
+    double **pos, double **qmom, double ***aux_pos, double ***phase, double complex *coef,
+    int verbosity, double *dotpopdec){
+
+    size_t mark = scratch_mark();
+    double complex *xf_c_dot = scratch_alloc(nst * sizeof(double complex));
+    double *eenergy = scratch_alloc(nst * sizeof(double));
+
+    struct krylov_xf_params params;
+    int ist, iestep;
+    double frac, edt, norm;
+
+    frac = 1.0 / (double)nesteps;
+    edt = dt * frac;
+
+    params.nst = nst;
+    params.edt = edt;
+    params.eenergy = eenergy;
+    params.nac = nac;
+
+    for(iestep = 0; iestep < nesteps; iestep++){
+
+        // Calculate cdot contribution originated from XF term
+        xf_cdot(nat, ndim, nst, l_coh, mass, sigma, pos, qmom, aux_pos, phase, coef, xf_c_dot);
+
+        // Interpolate energy and NACME terms between time t and t + dt
+        for(ist = 0; ist < nst; ist++){
+            eenergy[ist] = energy_old[ist] + (energy[ist] - energy_old[ist]) * (double)iestep * frac;
+        }
+        coupling_interpolate(nac, (double)iestep * frac);
+
+        // Apply the half of XF term, exp(- i * exponent) and the remaining half of XF term
+        for(ist = 0; ist < nst; ist++){
+            coef[ist] += 0.5 * edt * xf_c_dot[ist];
+        }
+
+        krylov_expm(nst, elec_tol, krylov_xf_exponent, &params, coef);
+
+        for(ist = 0; ist < nst; ist++){
+            coef[ist] += 0.5 * edt * xf_c_dot[ist];
+        }
+
+        // Renormalize the coefficients
+        norm = dot(nst, coef, coef);
+        for(ist = 0; ist < nst; ist++){
+            coef[ist] /= sqrt(norm);
+        }
+
+    }
+
+    if(verbosity >= 1){
+        xf_print_coef(nst, coef, xf_c_dot, dotpopdec);
+    }
+
+    scratch_release(mark);
+
+}
+
+// Routine to calculate the product of (energy - i * NACME) * dt and the vector
+static void krylov_xf_exponent(void *params, double complex *x, double complex *y){
+
+    struct krylov_xf_params *p = params;
+
+    int ist, jst, k;
+
+    // Only the saved NACME terms contribute to the product
+    for(ist = 0; ist < p->nst; ist++){
+        y[ist] = (p->eenergy[ist] - p->eenergy[0]) * x[ist];
+        for(k = p->nac->row_ptr[ist]; k < p->nac->row_ptr[ist + 1]; k++){
+            jst = p->nac->col_ind[k];
+            if(ist != jst){
+                y[ist] -= 1.0 * I * p->nac->dv[k] * x[jst];
+            }
+        }
+        y[ist] *= p->edt;
+    }
+
+}
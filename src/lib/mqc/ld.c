@@ -0,0 +1,208 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <complex.h>
+#include <math.h>
+#include <string.h>
+#include "expm.h"
+
+// Importing gesvd to orthonormalize the overlap matrix between the states
+extern void dgesvd_(char *jobu, char *jobvt, int *m, int *n, double *a, int *lda, double *s, double *u, int *ldu,
+    double *vt, int *ldvt, double *work, int *lwork, int *info);
+
+// Routine to orthonormalize the overlap matrix between the states at time t and t + dt
+static void ld_transform(int nst, double **st_overlap, double *transform);
+
+// Routine to calculate the product of exp(- i * H_d * dt) over the electronic substeps in the diabatic basis
+static void ld_diabatic(int nst, int nesteps, int ncol, double dt, double *energy, double *energy_old,
+    double *transform, double complex *mat);
+
+// Routine for coefficient propagation scheme in local diabatization propagator
+static void ld_coef(int nst, int nesteps, double dt, double *energy, double *energy_old, double **st_overlap,
+    double complex *coef);
+
+// Routine for density propagation scheme in local diabatization propagator
+static void ld_rho(int nst, int nesteps, double dt, double *energy, double *energy_old, double **st_overlap,
+    double complex **rho);
+
+// Interface routine for propagation scheme in local diabatization propagator
+// Arrays are contiguous buffers with shapes of (nst) or (nst, nst), which are changed in place
+// The states at time t are used as the diabatic basis during the nuclear step, and the states at time t + dt
+// are connected to the basis with the overlap matrix, hence NACME terms are not needed in the propagation
+static void ld(int nst, int nesteps, double dt, char *elec_object, double *energy, double *energy_old,
+    double *st_overlap, double complex *coef, double complex *rho){
+
+    double *st_overlap_rows[nst];
+    double complex *rho_rows[nst];
+
+    int ist;
+
+    // Row pointers refer to the buffers directly, hence the data are not copied
+    for(ist = 0; ist < nst; ist++){
+        st_overlap_rows[ist] = st_overlap + ist * nst;
+        rho_rows[ist] = rho + ist * nst;
+    }
+
+    if(strcmp(elec_object, "coefficient") == 0){
+        ld_coef(nst, nesteps, dt, energy, energy_old, st_overlap_rows, coef);
+    }
+    else if(strcmp(elec_object, "density") == 0){
+        ld_rho(nst, nesteps, dt, energy, energy_old, st_overlap_rows, rho_rows);
+    }
+
+}
+
+// The overlap matrix is not exactly orthogonal due to the approximations in the wavefunction overlap,
+// hence the closest orthogonal matrix is used, T = U * V^T where S = U * Sigma * V^T
+// T is saved in column-major order
+static void ld_transform(int nst, double **st_overlap, double *transform){
+
+    size_t mark = scratch_mark();
+    double *overlap = scratch_alloc((nst * nst) * sizeof(double));
+    double *sigma = scratch_alloc(nst * sizeof(double));
+    double *u = scratch_alloc((nst * nst) * sizeof(double));
+    double *vt = scratch_alloc((nst * nst) * sizeof(double));
+    double *work;
+
+    int ist, jst, kst, lwork, info;
+    double wkopt;
+
+    for(ist = 0; ist < nst; ist++){
+        for(jst = 0; jst < nst; jst++){
+            overlap[nst * jst + ist] = st_overlap[ist][jst];
+        }
+    }
+
+    lwork = -1;
+    dgesvd_("A", "A", &nst, &nst, overlap, &nst, sigma, u, &nst, vt, &nst, &wkopt, &lwork, &info);
+    lwork = (int)wkopt;
+    work = scratch_alloc(lwork * sizeof(double));
+    dgesvd_("A", "A", &nst, &nst, overlap, &nst, sigma, u, &nst, vt, &nst, work, &lwork, &info);
+
+    for(ist = 0; ist < nst; ist++){
+        for(jst = 0; jst < nst; jst++){
+            transform[nst * jst + ist] = 0.0;
+            for(kst = 0; kst < nst; kst++){
+                transform[nst * jst + ist] += u[nst * kst + ist] * vt[nst * jst + kst];
+            }
+        }
+    }
+
+    scratch_release(mark);
+
+}
+
+// The diabatic Hamiltonian is diag(energy_old) at time t and T * diag(energy) * T^T at time t + dt,
+// which is interpolated at the midpoint of each electronic substep
+static void ld_diabatic(int nst, int nesteps, int ncol, double dt, double *energy, double *energy_old,
+    double *transform, double complex *mat){
+
+    size_t mark = scratch_mark();
+    double *ham_new = scratch_alloc((nst * nst) * sizeof(double));
+    // H_d * dt, which is a real symmetric matrix
+    double complex *exponent = scratch_alloc((nst * nst) * sizeof(double complex));
+
+    struct expm_work work;
+
+    int ist, jst, kst, iestep;
+    double frac, edt, tfrac, eref;
+
+    // Diabatic Hamiltonian at time t + dt, T * diag(energy) * T^T
+    for(ist = 0; ist < nst; ist++){
+        for(jst = 0; jst < nst; jst++){
+            ham_new[nst * jst + ist] = 0.0;
+            for(kst = 0; kst < nst; kst++){
+                ham_new[nst * jst + ist] += transform[nst * kst + ist] * energy[kst] * transform[nst * kst + jst];
+            }
+        }
+    }
+
+    expm_init(&work, nst);
+
+    frac = 1.0 / (double)nesteps;
+    edt = dt * frac;
+
+    for(iestep = 0; iestep < nesteps; iestep++){
+
+        // Interpolate the diabatic Hamiltonian between time t and t + dt
+        // Energy of the ground state is subtracted from the diagonal terms, which only changes the global phase
+        tfrac = ((double)iestep + 0.5) * frac;
+        eref = energy_old[0] + (energy[0] - energy_old[0]) * tfrac;
+        for(ist = 0; ist < nst; ist++){
+            for(jst = 0; jst < nst; jst++){
+                exponent[nst * jst + ist] = ham_new[nst * jst + ist] * tfrac * edt;
+            }
+            exponent[nst * ist + ist] += (energy_old[ist] * (1.0 - tfrac) - eref) * edt;
+        }
+
+        // Update the matrix using exp(- i * H_d * dt) for every electronic step
+        expm_decompose(&work, exponent);
+        expm_apply(&work, ncol, mat);
+    }
+
+    scratch_release(mark);
+
+}
+
+static void ld_coef(int nst, int nesteps, double dt, double *energy, double *energy_old, double **st_overlap,
+    double complex *coef){
+
+    size_t mark = scratch_mark();
+    double *transform = scratch_alloc((nst * nst) * sizeof(double));
+    double complex *coef_d = scratch_alloc(nst * sizeof(double complex));
+
+    int ist, jst;
+
+    ld_transform(nst, st_overlap, transform);
+
+    // Coefficients at time t are same in the diabatic basis
+    memcpy(coef_d, coef, nst * sizeof(double complex));
+    ld_diabatic(nst, nesteps, 1, dt, energy, energy_old, transform, coef_d);
+
+    // Transform the coefficients to the states at time t + dt, C = T^T * C_d
+    for(ist = 0; ist < nst; ist++){
+        coef[ist] = 0.0 + 0.0 * I;
+        for(jst = 0; jst < nst; jst++){
+            coef[ist] += transform[nst * ist + jst] * coef_d[jst];
+        }
+    }
+
+    scratch_release(mark);
+
+}
+
+static void ld_rho(int nst, int nesteps, double dt, double *energy, double *energy_old, double **st_overlap,
+    double complex **rho){
+
+    size_t mark = scratch_mark();
+    double *transform = scratch_alloc((nst * nst) * sizeof(double));
+    // Product of exp(- i * H_d * dt) until current step in the diabatic basis
+    double complex *product = scratch_alloc((nst * nst) * sizeof(double complex));
+    // Propagation matrix of the coefficients, U = T^T * product
+    double complex *propagator = scratch_alloc((nst * nst) * sizeof(double complex));
+
+    int ist, jst, kst;
+
+    ld_transform(nst, st_overlap, transform);
+
+    memset(product, 0, (nst * nst) * sizeof(double complex));
+    for(ist = 0; ist < nst; ist++){
+        product[nst * ist + ist] = 1.0 + 0.0 * I;
+    }
+
+    ld_diabatic(nst, nesteps, nst, dt, energy, energy_old, transform, product);
+
+    for(ist = 0; ist < nst; ist++){
+        for(jst = 0; jst < nst; jst++){
+            propagator[nst * jst + ist] = 0.0 + 0.0 * I;
+            for(kst = 0; kst < nst; kst++){
+                propagator[nst * jst + ist] += transform[nst * ist + kst] * product[nst * jst + kst];
+            }
+        }
+    }
+
+    // Update the densities using the propagation matrix of the coefficients
+    expm_rho(nst, propagator, rho);
+
+    scratch_release(mark);
+
+}
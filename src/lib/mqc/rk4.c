@@ -7,48 +7,65 @@
 
 // Routine for coefficient propagation scheme in rk4 propagator
 static void rk4_coef(int nst, int nesteps, double dt, double *energy, double *energy_old,
-    double **nacme, double **nacme_old, double complex *coef);
+    struct coupling *nac, double complex *coef);
 
 // Routine for density propagation scheme in rk4 propagator
 static void rk4_rho(int nst, int nesteps, double dt, double *energy, double *energy_old,
-    double **nacme, double **nacme_old, double complex **rho);
+    struct coupling *nac, double complex **rho);
 
 // Interface routine for propagation scheme in rk4 propagator
-static void rk4(int nst, int nesteps, double dt, char *elec_object, double *energy, double *energy_old,
-    double **nacme, double **nacme_old, double complex *coef, double complex **rho){
+// Arrays are contiguous buffers with shapes of (nst) or (nst, nst), which are changed in place
+// NACME terms not larger than nac_threshold are neglected in the propagation
+static void rk4(int nst, int nesteps, double dt, double nac_threshold, char *elec_object, double *energy,
+    double *energy_old, double *nacme, double *nacme_old, double complex *coef, double complex *rho){
+
+    size_t mark = scratch_mark();
+    double *nacme_rows[nst];
+    double *nacme_old_rows[nst];
+    double complex *rho_rows[nst];
+
+    struct coupling nac;
+    int ist;
+
+    // Row pointers refer to the buffers directly, hence the data are not copied
+    for(ist = 0; ist < nst; ist++){
+        nacme_rows[ist] = nacme + ist * nst;
+        nacme_old_rows[ist] = nacme_old + ist * nst;
+        rho_rows[ist] = rho + ist * nst;
+    }
+
+    coupling_init(&nac, nst, nac_threshold, nacme_rows, nacme_old_rows);
 
     if(strcmp(elec_object, "coefficient") == 0){
-        rk4_coef(nst, nesteps, dt, energy, energy_old, nacme, nacme_old, coef);
+        rk4_coef(nst, nesteps, dt, energy, energy_old, &nac, coef);
     }
     else if(strcmp(elec_object, "density") == 0){
-        rk4_rho(nst, nesteps, dt, energy, energy_old, nacme, nacme_old, rho);
+        rk4_rho(nst, nesteps, dt, energy, energy_old, &nac, rho_rows);
     }
 
+    scratch_release(mark);
+
 }
 
 // Routine for coefficient propagation scheme in rk4 propagator
 static void rk4_coef(int nst, int nesteps, double dt, double *energy, double *energy_old,
-    double **nacme, double **nacme_old, double complex *coef){
-
-    double complex *k1 = malloc(nst * sizeof(double complex));
-    double complex *k2 = malloc(nst * sizeof(double complex));
-    double complex *k3 = malloc(nst * sizeof(double complex));
-    double complex *k4 = malloc(nst * sizeof(double complex));
-    double complex *kfunction = malloc(nst * sizeof(double complex));
-    double complex *variation = malloc(nst * sizeof(double complex));
-    double complex *c_dot = malloc(nst * sizeof(double complex));
-    double complex *coef_new = malloc(nst * sizeof(double complex));
-    double *eenergy = malloc(nst * sizeof(double));
+    struct coupling *nac, double complex *coef){
+
+    size_t mark = scratch_mark();
+    double complex *k1 = scratch_alloc(nst * sizeof(double complex));
+    double complex *k2 = scratch_alloc(nst * sizeof(double complex));
+    double complex *k3 = scratch_alloc(nst * sizeof(double complex));
+    double complex *k4 = scratch_alloc(nst * sizeof(double complex));
+    double complex *kfunction = scratch_alloc(nst * sizeof(double complex));
+    double complex *variation = scratch_alloc(nst * sizeof(double complex));
+    double complex *c_dot = scratch_alloc(nst * sizeof(double complex));
+    double complex *coef_new = scratch_alloc(nst * sizeof(double complex));
+    double *eenergy = scratch_alloc(nst * sizeof(double));
 //    double *na_term = malloc(nst * sizeof(double));
-    double **dv = malloc(nst * sizeof(double*));
 
-    int ist, jst, iestep;
+    int ist, iestep;
     double frac, edt, norm;
 
-    for(ist = 0; ist < nst; ist++){
-        dv[ist] = malloc(nst * sizeof(double));
-    }
-
     frac = 1.0 / (double)nesteps;
     edt = dt * frac;
 
@@ -57,14 +74,11 @@ static void rk4_coef(int nst, int nesteps, double dt, double *energy, double *en
         // Interpolate energy and NACME terms between time t and t + dt
         for(ist = 0; ist < nst; ist++){
             eenergy[ist] = energy_old[ist] + (energy[ist] - energy_old[ist]) * (double)iestep * frac;
-            for(jst = 0; jst < nst; jst++){
-                dv[ist][jst] = nacme_old[ist][jst] + (nacme[ist][jst] - nacme_old[ist][jst])
-                    * (double)iestep * frac;
-            }
         }
+        coupling_interpolate(nac, (double)iestep * frac);
 
         // Calculate k1
-        cdot(nst, eenergy, dv, coef, c_dot);
+        cdot(nst, eenergy, nac, coef, c_dot);
 
         for(ist = 0; ist < nst; ist++){
             k1[ist] = edt * c_dot[ist];
@@ -73,7 +87,7 @@ static void rk4_coef(int nst, int nesteps, double dt, double *energy, double *en
         }
 
         // Calculate k2
-        cdot(nst, eenergy, dv, coef_new, c_dot);
+        cdot(nst, eenergy, nac, coef_new, c_dot);
 
         for(ist = 0; ist < nst; ist++){
             k2[ist] = edt * c_dot[ist];
@@ -82,7 +96,7 @@ static void rk4_coef(int nst, int nesteps, double dt, double *energy, double *en
         }
 
         // Calculate k3
-        cdot(nst, eenergy, dv, coef_new, c_dot);
+        cdot(nst, eenergy, nac, coef_new, c_dot);
 
         for(ist = 0; ist < nst; ist++){
             k3[ist] = edt * c_dot[ist];
@@ -91,7 +105,7 @@ static void rk4_coef(int nst, int nesteps, double dt, double *energy, double *en
         }
 
         // Calculate k4
-        cdot(nst, eenergy, dv, coef_new, c_dot);
+        cdot(nst, eenergy, nac, coef_new, c_dot);
 
         for(ist = 0; ist < nst; ist++){
             k4[ist] = edt * c_dot[ist];
@@ -123,53 +137,40 @@ static void rk4_coef(int nst, int nesteps, double dt, double *energy, double *en
     printf("RK4_COEF : NORM = %15.8f\n", creal(norm));
     */
 
-    for(ist = 0; ist < nst; ist++){
-        free(dv[ist]);
-    }
-
-    free(k1);
-    free(k2);
-    free(k3);
-    free(k4);
-    free(kfunction);
-    free(variation);
-    free(c_dot);
-    free(coef_new);
-    free(eenergy);
 //    free(na_term);
-    free(dv);
+
+    scratch_release(mark);
 
 }
 
 // Routine for density propagation scheme in rk4 propagator
 static void rk4_rho(int nst, int nesteps, double dt, double *energy, double *energy_old,
-    double **nacme, double **nacme_old, double complex **rho){
-
-    double complex **k1 = malloc(nst * sizeof(double complex*));
-    double complex **k2 = malloc(nst * sizeof(double complex*));
-    double complex **k3 = malloc(nst * sizeof(double complex*));
-    double complex **k4 = malloc(nst * sizeof(double complex*));
-    double complex **kfunction = malloc(nst * sizeof(double complex*));
-    double complex **variation = malloc(nst * sizeof(double complex*));
-    double complex **rho_dot = malloc(nst * sizeof(double complex*));
-    double complex **rho_new = malloc(nst * sizeof(double complex*));
-    double *eenergy = malloc(nst * sizeof(double));
+    struct coupling *nac, double complex **rho){
+
+    size_t mark = scratch_mark();
+    double complex **k1 = scratch_alloc(nst * sizeof(double complex*));
+    double complex **k2 = scratch_alloc(nst * sizeof(double complex*));
+    double complex **k3 = scratch_alloc(nst * sizeof(double complex*));
+    double complex **k4 = scratch_alloc(nst * sizeof(double complex*));
+    double complex **kfunction = scratch_alloc(nst * sizeof(double complex*));
+    double complex **variation = scratch_alloc(nst * sizeof(double complex*));
+    double complex **rho_dot = scratch_alloc(nst * sizeof(double complex*));
+    double complex **rho_new = scratch_alloc(nst * sizeof(double complex*));
+    double *eenergy = scratch_alloc(nst * sizeof(double));
 //    double *na_term = malloc(nst * sizeof(double));
-    double **dv = malloc(nst * sizeof(double*));
 
     int ist, jst, iestep;
     double frac, edt;
 
     for(ist = 0; ist < nst; ist++){
-        k1[ist] = malloc(nst * sizeof(double complex));
-        k2[ist] = malloc(nst * sizeof(double complex));
-        k3[ist] = malloc(nst * sizeof(double complex));
-        k4[ist] = malloc(nst * sizeof(double complex));
-        kfunction[ist] = malloc(nst * sizeof(double complex));
-        variation[ist] = malloc(nst * sizeof(double complex));
-        rho_dot[ist] = malloc(nst * sizeof(double complex));
-        rho_new[ist] = malloc(nst * sizeof(double complex));
-        dv[ist] = malloc(nst * sizeof(double));
+        k1[ist] = scratch_alloc(nst * sizeof(double complex));
+        k2[ist] = scratch_alloc(nst * sizeof(double complex));
+        k3[ist] = scratch_alloc(nst * sizeof(double complex));
+        k4[ist] = scratch_alloc(nst * sizeof(double complex));
+        kfunction[ist] = scratch_alloc(nst * sizeof(double complex));
+        variation[ist] = scratch_alloc(nst * sizeof(double complex));
+        rho_dot[ist] = scratch_alloc(nst * sizeof(double complex));
+        rho_new[ist] = scratch_alloc(nst * sizeof(double complex));
     }
 
     frac = 1.0 / (double)nesteps;
@@ -180,14 +181,11 @@ static void rk4_rho(int nst, int nesteps, double dt, double *energy, double *ene
         // Interpolate energy and NACME terms between time t and t + dt
         for(ist = 0; ist < nst; ist++){
             eenergy[ist] = energy_old[ist] + (energy[ist] - energy_old[ist]) * (double)iestep * frac;
-            for(jst = 0; jst < nst; jst++){
-                dv[ist][jst] = nacme_old[ist][jst] + (nacme[ist][jst] - nacme_old[ist][jst])
-                    * (double)iestep * frac;
-            }
         }
+        coupling_interpolate(nac, (double)iestep * frac);
 
         // Calculate k1
-        rhodot(nst, eenergy, dv, rho, rho_dot);
+        rhodot(nst, eenergy, nac, rho, rho_dot);
 
         for(ist = 0; ist < nst; ist++){
             for(jst = 0; jst < nst; jst++){
@@ -198,7 +196,7 @@ static void rk4_rho(int nst, int nesteps, double dt, double *energy, double *ene
         }
 
         // Calculate k2
-        rhodot(nst, eenergy, dv, rho_new, rho_dot);
+        rhodot(nst, eenergy, nac, rho_new, rho_dot);
 
         for(ist = 0; ist < nst; ist++){
             for(jst = 0; jst < nst; jst++){
@@ -210,7 +208,7 @@ static void rk4_rho(int nst, int nesteps, double dt, double *energy, double *ene
         }
 
         // Calculate k3
-        rhodot(nst, eenergy, dv, rho_new, rho_dot);
+        rhodot(nst, eenergy, nac, rho_new, rho_dot);
 
         for(ist = 0; ist < nst; ist++){
             for(jst = 0; jst < nst; jst++){
@@ -222,7 +220,7 @@ static void rk4_rho(int nst, int nesteps, double dt, double *energy, double *ene
         }
 
         // Calculate k4
-        rhodot(nst, eenergy, dv, rho_new, rho_dot);
+        rhodot(nst, eenergy, nac, rho_new, rho_dot);
 
         for(ist = 0; ist < nst; ist++){
             for(jst = 0; jst < nst; jst++){
@@ -252,29 +250,10 @@ static void rk4_rho(int nst, int nesteps, double dt, double *energy, double *ene
     printf("RK4_COEF : NORM = %15.8f\n", norm);
     */
 
-    for(ist = 0; ist < nst; ist++){
-        free(k1[ist]);
-        free(k2[ist]);
-        free(k3[ist]);
-        free(k4[ist]);
-        free(kfunction[ist]);
-        free(variation[ist]);
-        free(rho_dot[ist]);
-        free(rho_new[ist]);
-        free(dv[ist]);
-    }
 
-    free(k1);
-    free(k2);
-    free(k3);
-    free(k4);
-    free(kfunction);
-    free(variation);
-    free(rho_dot);
-    free(rho_new);
-    free(eenergy);
 //    free(na_term);
-    free(dv);
+
+    scratch_release(mark);
 
 }
 
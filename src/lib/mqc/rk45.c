@@ -0,0 +1,98 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <complex.h>
+#include <math.h>
+#include <string.h>
+#include "derivs.h"
+#include "rk45.h"
+
+// Variables needed to calculate the time derivatives during the nuclear step
+struct rk45_params {
+    int nst;
+    double dt;
+    double *energy, *energy_old, *eenergy;
+    struct coupling *nac;
+};
+
+// Routine to calculate time derivative of coefficients for the rk45 propagator
+static void rk45_cdot(void *params, double t, double complex *coef, double complex *c_dot);
+
+// Routine to calculate time derivative of densities for the rk45 propagator
+static void rk45_rhodot(void *params, double t, double complex *rho, double complex *rho_dot);
+
+// Interface routine for propagation scheme in rk45 propagator
+// Arrays are contiguous buffers with shapes of (nst) or (nst, nst), which are changed in place
+// The number of substeps used in the nuclear step is saved in nsubsteps
+// NACME terms not larger than nac_threshold are neglected in the propagation
+static void rk45(int nst, int nesteps, double dt, double elec_tol, double nac_threshold, char *elec_object,
+    double *energy, double *energy_old, double *nacme, double *nacme_old, double complex *coef,
+    double complex *rho, int *nsubsteps){
+
+    size_t mark = scratch_mark();
+    double *nacme_rows[nst];
+    double *nacme_old_rows[nst];
+    double eenergy[nst];
+
+    struct rk45_params params;
+    struct coupling nac;
+    int ist;
+
+    // Row pointers refer to the buffers directly, hence the data are not copied
+    for(ist = 0; ist < nst; ist++){
+        nacme_rows[ist] = nacme + ist * nst;
+        nacme_old_rows[ist] = nacme_old + ist * nst;
+    }
+
+    params.nst = nst;
+    params.dt = dt;
+    params.energy = energy;
+    params.energy_old = energy_old;
+    params.eenergy = eenergy;
+    params.nac = &nac;
+
+    coupling_init(&nac, nst, nac_threshold, nacme_rows, nacme_old_rows);
+
+    if(strcmp(elec_object, "coefficient") == 0){
+        *nsubsteps = rk45_solve(nst, nesteps, dt, elec_tol, 1, rk45_cdot, &params, coef);
+    }
+    else if(strcmp(elec_object, "density") == 0){
+        *nsubsteps = rk45_solve(nst * nst, nesteps, dt, elec_tol, 0, rk45_rhodot, &params, rho);
+    }
+
+    scratch_release(mark);
+
+}
+
+// Routine to calculate time derivative of coefficients for the rk45 propagator
+static void rk45_cdot(void *params, double t, double complex *coef, double complex *c_dot){
+
+    struct rk45_params *p = params;
+
+    // Interpolate energy and NACME terms at time t
+    rk45_interpolate(p->nst, t, p->dt, p->energy, p->energy_old, p->eenergy, p->nac);
+
+    cdot(p->nst, p->eenergy, p->nac, coef, c_dot);
+
+}
+
+// Routine to calculate time derivative of densities for the rk45 propagator
+static void rk45_rhodot(void *params, double t, double complex *rho, double complex *rho_dot){
+
+    struct rk45_params *p = params;
+
+    double complex *rho_rows[p->nst];
+    double complex *rho_dot_rows[p->nst];
+
+    int ist;
+
+    for(ist = 0; ist < p->nst; ist++){
+        rho_rows[ist] = rho + ist * p->nst;
+        rho_dot_rows[ist] = rho_dot + ist * p->nst;
+    }
+
+    // Interpolate energy and NACME terms at time t
+    rk45_interpolate(p->nst, t, p->dt, p->energy, p->energy_old, p->eenergy, p->nac);
+
+    rhodot(p->nst, p->eenergy, p->nac, rho_rows, rho_dot_rows);
+
+}
@@ -0,0 +1,146 @@
+#ifndef RK45_H
+#define RK45_H
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <complex.h>
+#include <math.h>
+#include <string.h>
+#include "coupling.h"
+
+// Nodes of the Dormand-Prince 5(4) embedded Runge-Kutta pair
+static const double rk45_c[7] = {0.0, 1.0 / 5.0, 3.0 / 10.0, 4.0 / 5.0, 8.0 / 9.0, 1.0, 1.0};
+
+// Runge-Kutta matrix of the Dormand-Prince 5(4) embedded Runge-Kutta pair
+static const double rk45_a[7][6] = {
+    {0.0, 0.0, 0.0, 0.0, 0.0, 0.0},
+    {1.0 / 5.0, 0.0, 0.0, 0.0, 0.0, 0.0},
+    {3.0 / 40.0, 9.0 / 40.0, 0.0, 0.0, 0.0, 0.0},
+    {44.0 / 45.0, - 56.0 / 15.0, 32.0 / 9.0, 0.0, 0.0, 0.0},
+    {19372.0 / 6561.0, - 25360.0 / 2187.0, 64448.0 / 6561.0, - 212.0 / 729.0, 0.0, 0.0},
+    {9017.0 / 3168.0, - 355.0 / 33.0, 46732.0 / 5247.0, 49.0 / 176.0, - 5103.0 / 18656.0, 0.0},
+    {35.0 / 384.0, 0.0, 500.0 / 1113.0, 125.0 / 192.0, - 2187.0 / 6784.0, 11.0 / 84.0}
+};
+
+// Weights of the fifth-order solution
+static const double rk45_b[7] = {35.0 / 384.0, 0.0, 500.0 / 1113.0, 125.0 / 192.0, - 2187.0 / 6784.0, 11.0 / 84.0, 0.0};
+
+// Differences between the weights of the fifth- and fourth-order solutions
+static const double rk45_e[7] = {71.0 / 57600.0, 0.0, - 71.0 / 16695.0, 71.0 / 1920.0, - 17253.0 / 339200.0,
+    22.0 / 525.0, - 1.0 / 40.0};
+
+// Time derivative of the electronic variables at time t within the nuclear step
+typedef void (*rk45_deriv)(void *params, double t, double complex *y, double complex *y_dot);
+
+// Routine to interpolate energy and NACME terms at time t between time 0 and dt
+static void rk45_interpolate(int nst, double t, double dt, double *energy, double *energy_old,
+    double *eenergy, struct coupling *nac){
+
+    int ist;
+    double frac;
+
+    frac = t / dt;
+    for(ist = 0; ist < nst; ist++){
+        eenergy[ist] = energy_old[ist] + (energy[ist] - energy_old[ist]) * frac;
+    }
+    coupling_interpolate(nac, frac);
+
+}
+
+// Routine to propagate the electronic variables during dt with adaptive substeps
+// The initial substep is dt / nesteps and the substeps are adjusted by the local error estimate
+// The error is measured relative to elec_tol * (1 + |y|), and the number of accepted substeps is returned
+static int rk45_solve(int ny, int nesteps, double dt, double elec_tol, int l_norm, rk45_deriv deriv,
+    void *params, double complex *y){
+
+    size_t mark = scratch_mark();
+    double complex **k = scratch_alloc(7 * sizeof(double complex*));
+    double complex *y_stage = scratch_alloc(ny * sizeof(double complex));
+    double complex *y_new = scratch_alloc(ny * sizeof(double complex));
+
+    int iy, istage, jstage, nsubsteps, l_last;
+    double t, edt, edt_min, err, scale, factor, norm;
+    double complex y_err;
+
+    for(istage = 0; istage < 7; istage++){
+        k[istage] = scratch_alloc(ny * sizeof(double complex));
+    }
+
+    t = 0.0;
+    edt = dt / (double)nesteps;
+    // Substeps are not reduced below this limit to guarantee the termination
+    edt_min = dt * 1.0E-10;
+    nsubsteps = 0;
+    l_last = 0;
+
+    while(!l_last){
+
+        // Shorten the substep to finish at the end of the nuclear step
+        if(edt >= dt - t){
+            edt = dt - t;
+            l_last = 1;
+        }
+
+        // Calculate the stages of the embedded pair
+        for(istage = 0; istage < 7; istage++){
+            for(iy = 0; iy < ny; iy++){
+                y_stage[iy] = y[iy];
+                for(jstage = 0; jstage < istage; jstage++){
+                    y_stage[iy] += edt * rk45_a[istage][jstage] * k[jstage][iy];
+                }
+            }
+            deriv(params, t + rk45_c[istage] * edt, y_stage, k[istage]);
+        }
+
+        // Estimate the local error from the difference between the fifth- and fourth-order solutions
+        err = 0.0;
+        for(iy = 0; iy < ny; iy++){
+            y_new[iy] = y[iy];
+            y_err = 0.0 + 0.0 * I;
+            for(istage = 0; istage < 7; istage++){
+                y_new[iy] += edt * rk45_b[istage] * k[istage][iy];
+                y_err += edt * rk45_e[istage] * k[istage][iy];
+            }
+            scale = elec_tol * (1.0 + fmax(cabs(y[iy]), cabs(y_new[iy])));
+            err += pow(cabs(y_err) / scale, 2);
+        }
+        err = sqrt(err / (double)ny);
+
+        if(err <= 1.0 || edt <= edt_min){
+            // Accept the substep
+            t += edt;
+            nsubsteps++;
+
+            // Renormalize the coefficients
+            norm = 1.0;
+            if(l_norm){
+                norm = 0.0;
+                for(iy = 0; iy < ny; iy++){
+                    norm += creal(conj(y_new[iy]) * y_new[iy]);
+                }
+            }
+            for(iy = 0; iy < ny; iy++){
+                y[iy] = y_new[iy] / sqrt(norm);
+            }
+
+            factor = 5.0;
+            if(err > 0.0){
+                factor = fmin(5.0, fmax(0.2, 0.9 * pow(err, - 0.2)));
+            }
+        }
+        else{
+            // Reject the substep and retry from the same time
+            l_last = 0;
+            factor = fmax(0.2, 0.9 * pow(err, - 0.2));
+        }
+
+        edt = fmax(edt * factor, edt_min);
+    }
+
+    scratch_release(mark);
+
+    return nsubsteps;
+
+}
+
+#endif
@@ -0,0 +1,73 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <complex.h>
+#include <math.h>
+#include <string.h>
+#include "derivs_ct.h"
+#include "rk45.h"
+
+// Variables needed to calculate the time derivatives during the nuclear step
+struct rk45_ct_params {
+    int nst;
+    double dt;
+    double *energy, *energy_old, *eenergy;
+    double **k_lk;
+    struct coupling *nac;
+};
+
+// Routine to calculate time derivative of coefficients including CT term for the rk45 solver
+static void rk45_ct_cdot(void *params, double t, double complex *coef, double complex *c_dot);
+
+// Interface routine for elec_object scheme in rk45 solver
+// Arrays are contiguous buffers with shapes of (nst) or (nst, nst), which are changed in place
+// The number of substeps used in the nuclear step is saved in nsubsteps
+// NACME terms not larger than nac_threshold are neglected in the propagation
+static void rk45(int nst, int nesteps, double dt, double elec_tol, double nac_threshold, char *elec_object,
+    double *energy, double *energy_old, double *nacme, double *nacme_old, double *k_lk, double complex *coef,
+    int *nsubsteps){
+
+    size_t mark = scratch_mark();
+    double *nacme_rows[nst];
+    double *nacme_old_rows[nst];
+    double *k_lk_rows[nst];
+    double eenergy[nst];
+
+    struct rk45_ct_params params;
+    struct coupling nac;
+    int ist;
+
+    // Row pointers refer to the buffers directly, hence the data are not copied
+    for(ist = 0; ist < nst; ist++){
+        nacme_rows[ist] = nacme + ist * nst;
+        nacme_old_rows[ist] = nacme_old + ist * nst;
+        k_lk_rows[ist] = k_lk + ist * nst;
+    }
+
+    params.nst = nst;
+    params.dt = dt;
+    params.energy = energy;
+    params.energy_old = energy_old;
+    params.eenergy = eenergy;
+    params.nac = &nac;
+    params.k_lk = k_lk_rows;
+
+    coupling_init(&nac, nst, nac_threshold, nacme_rows, nacme_old_rows);
+
+    if(strcmp(elec_object, "coefficient") == 0){
+        *nsubsteps = rk45_solve(nst, nesteps, dt, elec_tol, 1, rk45_ct_cdot, &params, coef);
+    }
+
+    scratch_release(mark);
+}
+
+// Routine to calculate time derivative of coefficients including CT term for the rk45 solver
+static void rk45_ct_cdot(void *params, double t, double complex *coef, double complex *c_dot){
+
+    struct rk45_ct_params *p = params;
+
+    // Interpolate energy and NACME terms at time t
+    rk45_interpolate(p->nst, t, p->dt, p->energy, p->energy_old, p->eenergy, p->nac);
+
+    ct_cdot(p->nst, p->eenergy, p->nac, p->k_lk, coef, c_dot);
+
+}
@@ -0,0 +1,177 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <complex.h>
+#include <math.h>
+#include <string.h>
+#include "derivs.h"
+#include "derivs_xf.h"
+#include "rk45.h"
+
+// Variables needed to calculate the time derivatives during the nuclear step
+struct rk45_xf_params {
+    int nat, ndim, nst;
+    int *l_coh;
+    double dt;
+    double *mass, *energy, *energy_old, *eenergy;
+    double **sigma, **pos, **qmom;
+    struct coupling *nac;
+    double ***aux_pos, ***phase;
+};
+
+// Routine to calculate time derivative of coefficients including XF term for the rk45 propagator
+static void rk45_xf_cdot(void *params, double t, double complex *coef, double complex *c_dot);
+
+// Routine to calculate time derivative of densities including XF term for the rk45 propagator
+static void rk45_xf_rhodot(void *params, double t, double complex *rho, double complex *rho_dot);
+
+// Interface routine for propagation scheme in rk45 propagator
+// Arrays are contiguous buffers with shapes of (nst), (nat), (nst, nst), (nat, ndim) or (nst, nat, ndim),
+// which are changed in place
+// The number of substeps used in the nuclear step is saved in nsubsteps
+// NACME terms not larger than nac_threshold are neglected in the propagation
+static void rk45(int nat, int ndim, int nst, int nesteps, double dt, double elec_tol, double nac_threshold,
+    char *elec_object, int *l_coh, double *mass, double *energy, double *energy_old, double *sigma, double *nacme,
+    double *nacme_old, double *pos, double *qmom, double *aux_pos, double *phase, double complex *coef,
+    double complex *rho, int verbosity, double *dotpopdec, int *nsubsteps){
+
+    size_t mark = scratch_mark();
+    double *nacme_rows[nst];
+    double *nacme_old_rows[nst];
+    double complex *rho_rows[nst];
+    double *sigma_rows[nat];
+    double *pos_rows[nat];
+    double *qmom_rows[nat];
+    double *aux_pos_rows[nst * nat];
+    double *phase_rows[nst * nat];
+    double **aux_pos_mats[nst];
+    double **phase_mats[nst];
+    double eenergy[nst];
+    double complex xf_c_dot[nst];
+    double complex xf_rho_dot_buffer[nst * nst];
+    double complex *xf_rho_dot[nst];
+
+    struct rk45_xf_params params;
+    struct coupling nac;
+    int ist, iat;
+
+    // Row pointers refer to the buffers directly, hence the data are not copied
+    for(ist = 0; ist < nst; ist++){
+        nacme_rows[ist] = nacme + ist * nst;
+        nacme_old_rows[ist] = nacme_old + ist * nst;
+        rho_rows[ist] = rho + ist * nst;
+        xf_rho_dot[ist] = xf_rho_dot_buffer + ist * nst;
+    }
+
+    for(iat = 0; iat < nat; iat++){
+        sigma_rows[iat] = sigma + iat * ndim;
+        pos_rows[iat] = pos + iat * ndim;
+        qmom_rows[iat] = qmom + iat * ndim;
+    }
+
+    for(ist = 0; ist < nst; ist++){
+        for(iat = 0; iat < nat; iat++){
+            aux_pos_rows[ist * nat + iat] = aux_pos + (ist * nat + iat) * ndim;
+            phase_rows[ist * nat + iat] = phase + (ist * nat + iat) * ndim;
+        }
+        aux_pos_mats[ist] = aux_pos_rows + ist * nat;
+        phase_mats[ist] = phase_rows + ist * nat;
+    }
+
+    params.nat = nat;
+    params.ndim = ndim;
+    params.nst = nst;
+    params.l_coh = l_coh;
+    params.dt = dt;
+    params.mass = mass;
+    params.energy = energy;
+    params.energy_old = energy_old;
+    params.eenergy = eenergy;
+    params.sigma = sigma_rows;
+    params.nac = &nac;
+    params.pos = pos_rows;
+    params.qmom = qmom_rows;
+    params.aux_pos = aux_pos_mats;
+    params.phase = phase_mats;
+
+    coupling_init(&nac, nst, nac_threshold, nacme_rows, nacme_old_rows);
+
+    // Quantum momentum and decoherence term are evaluated again with the propagated variables
+    if(strcmp(elec_object, "coefficient") == 0){
+        *nsubsteps = rk45_solve(nst, nesteps, dt, elec_tol, 1, rk45_xf_cdot, &params, coef);
+        xf_cdot(nat, ndim, nst, l_coh, mass, sigma_rows, pos_rows, qmom_rows, aux_pos_mats, phase_mats,
+            coef, xf_c_dot);
+        if(verbosity >= 1){
+            xf_print_coef(nst, coef, xf_c_dot, dotpopdec);
+        }
+    }
+    else if(strcmp(elec_object, "density") == 0){
+        *nsubsteps = rk45_solve(nst * nst, nesteps, dt, elec_tol, 0, rk45_xf_rhodot, &params, rho);
+        xf_rhodot(nat, ndim, nst, l_coh, mass, sigma_rows, pos_rows, qmom_rows, aux_pos_mats, phase_mats,
+            rho_rows, xf_rho_dot);
+        if(verbosity >= 1){
+            xf_print_rho(nst, xf_rho_dot, dotpopdec);
+        }
+    }
+
+    scratch_release(mark);
+
+}
+
+// Routine to calculate time derivative of coefficients including XF term for the rk45 propagator
+static void rk45_xf_cdot(void *params, double t, double complex *coef, double complex *c_dot){
+
+    struct rk45_xf_params *p = params;
+
+    double complex xf_c_dot[p->nst];
+
+    int ist;
+
+    // Interpolate energy and NACME terms at time t
+    rk45_interpolate(p->nst, t, p->dt, p->energy, p->energy_old, p->eenergy, p->nac);
+
+    cdot(p->nst, p->eenergy, p->nac, coef, c_dot);
+
+    // Calculate cdot contribution originated from XF term
+    xf_cdot(p->nat, p->ndim, p->nst, p->l_coh, p->mass, p->sigma, p->pos, p->qmom, p->aux_pos, p->phase,
+        coef, xf_c_dot);
+
+    for(ist = 0; ist < p->nst; ist++){
+        c_dot[ist] += xf_c_dot[ist];
+    }
+
+}
+
+// Routine to calculate time derivative of densities including XF term for the rk45 propagator
+static void rk45_xf_rhodot(void *params, double t, double complex *rho, double complex *rho_dot){
+
+    struct rk45_xf_params *p = params;
+
+    double complex *rho_rows[p->nst];
+    double complex *rho_dot_rows[p->nst];
+    double complex xf_rho_dot_buffer[p->nst * p->nst];
+    double complex *xf_rho_dot[p->nst];
+
+    int ist, jst;
+
+    for(ist = 0; ist < p->nst; ist++){
+        rho_rows[ist] = rho + ist * p->nst;
+        rho_dot_rows[ist] = rho_dot + ist * p->nst;
+        xf_rho_dot[ist] = xf_rho_dot_buffer + ist * p->nst;
+    }
+
+    // Interpolate energy and NACME terms at time t
+    rk45_interpolate(p->nst, t, p->dt, p->energy, p->energy_old, p->eenergy, p->nac);
+
+    rhodot(p->nst, p->eenergy, p->nac, rho_rows, rho_dot_rows);
+
+    // Calculate rhodot contribution originated from XF term
+    xf_rhodot(p->nat, p->ndim, p->nst, p->l_coh, p->mass, p->sigma, p->pos, p->qmom, p->aux_pos, p->phase,
+        rho_rows, xf_rho_dot);
+
+    for(ist = 0; ist < p->nst; ist++){
+        for(jst = 0; jst < p->nst; jst++){
+            rho_dot_rows[ist][jst] += xf_rho_dot[ist][jst];
+        }
+    }
+
+}
@@ -7,7 +7,7 @@
 
 // Routine for coefficient elec_object scheme in rk4 solver
 static void rk4_coef(int nst, int nesteps, double dt, double *energy, double *energy_old,
-    double **nacme, double **nacme_old, double **k_lk, double complex *coef);
+    struct coupling *nac, double **k_lk, double complex *coef);
 
 // Routine for density elec_object scheme in rk4 solver
 /*
@@ -16,42 +16,59 @@ static void rk4_rho(int nst, int nesteps, double dt, double *energy, double *ene
 */
 
 // Interface routine for elec_object scheme in rk4 solver
-static void rk4(int nst, int nesteps, double dt, char *elec_object, double *energy, double *energy_old,
-    double **nacme, double **nacme_old, double **k_lk, double complex *coef, double complex **rho){
+// Arrays are contiguous buffers with shapes of (nst) or (nst, nst), which are changed in place
+// NACME terms not larger than nac_threshold are neglected in the propagation
+static void rk4(int nst, int nesteps, double dt, double nac_threshold, char *elec_object, double *energy,
+    double *energy_old, double *nacme, double *nacme_old, double *k_lk, double complex *coef, double complex *rho){
+
+    size_t mark = scratch_mark();
+    double *nacme_rows[nst];
+    double *nacme_old_rows[nst];
+    double *k_lk_rows[nst];
+
+    struct coupling nac;
+    int ist;
+
+    // Row pointers refer to the buffers directly, hence the data are not copied
+    for(ist = 0; ist < nst; ist++){
+        nacme_rows[ist] = nacme + ist * nst;
+        nacme_old_rows[ist] = nacme_old + ist * nst;
+        k_lk_rows[ist] = k_lk + ist * nst;
+    }
+
+    coupling_init(&nac, nst, nac_threshold, nacme_rows, nacme_old_rows);
 
     if(strcmp(elec_object, "coefficient") == 0){
-        rk4_coef(nst, nesteps, dt, energy, energy_old, nacme, nacme_old, k_lk, coef);
+        rk4_coef(nst, nesteps, dt, energy, energy_old, &nac, k_lk_rows, coef);
     }
     /*
     else if(strcmp(elec_object, "density") == 0){
-        rk4_rho(nst, nesteps, dt, energy, energy_old, nacme, nacme_old, k_lk, rho);
+        rk4_rho(nst, nesteps, dt, energy, energy_old, nacme_rows, nacme_old_rows, k_lk_rows, rho_rows);
     }
     */
+
+    scratch_release(mark);
 }
 
 // Routine for coefficient elec_object scheme in rk4 solver
 static void rk4_coef(int nst, int nesteps, double dt, double *energy, double *energy_old,
-    double **nacme, double **nacme_old, double **k_lk, double complex *coef){
-
-    double complex *k1 = malloc(nst * sizeof(double complex));
-    double complex *k2 = malloc(nst * sizeof(double complex));
-    double complex *k3 = malloc(nst * sizeof(double complex));
-    double complex *k4 = malloc(nst * sizeof(double complex));
-    double complex *kfunction = malloc(nst * sizeof(double complex));
-    double complex *variation = malloc(nst * sizeof(double complex));
-    double complex *c_dot = malloc(nst * sizeof(double complex));
-    double complex *coef_new = malloc(nst * sizeof(double complex));
-    double *eenergy = malloc(nst * sizeof(double));
+    struct coupling *nac, double **k_lk, double complex *coef){
+
+    size_t mark = scratch_mark();
+    double complex *k1 = scratch_alloc(nst * sizeof(double complex));
+    double complex *k2 = scratch_alloc(nst * sizeof(double complex));
+    double complex *k3 = scratch_alloc(nst * sizeof(double complex));
+    double complex *k4 = scratch_alloc(nst * sizeof(double complex));
+    double complex *kfunction = scratch_alloc(nst * sizeof(double complex));
+    double complex *variation = scratch_alloc(nst * sizeof(double complex));
+    double complex *c_dot = scratch_alloc(nst * sizeof(double complex));
+    double complex *coef_new = scratch_alloc(nst * sizeof(double complex));
+    double *eenergy = scratch_alloc(nst * sizeof(double));
 //    double *na_term = malloc(nst * sizeof(double));
-    double **dv = malloc(nst * sizeof(double*));
 
-    int ist, jst, iestep;
+    int ist, iestep;
     double frac, edt, norm;
 
-    for(ist = 0; ist < nst; ist++){
-        dv[ist] = malloc(nst * sizeof(double));
-    }
-
     frac = 1.0 / (double)nesteps;
     edt = dt * frac;
 
@@ -59,14 +76,11 @@ static void rk4_coef(int nst, int nesteps, double dt, double *energy, double *en
         // Interpolate energy and NACME terms between time t and t + dt
         for(ist = 0; ist < nst; ist++){
             eenergy[ist] = energy_old[ist] + (energy[ist] - energy_old[ist]) * (double)iestep * frac;
-            for(jst = 0; jst < nst; jst++){
-                dv[ist][jst] = nacme_old[ist][jst] + (nacme[ist][jst] - nacme_old[ist][jst])
-                    * (double)iestep * frac;
-            }
         }
+        coupling_interpolate(nac, (double)iestep * frac);
 
         // Calculate k1
-        ct_cdot(nst, eenergy, dv, k_lk, coef, c_dot);
+        ct_cdot(nst, eenergy, nac, k_lk, coef, c_dot);
 
         for(ist = 0; ist < nst; ist++){
             k1[ist] = edt * c_dot[ist];
@@ -75,7 +89,7 @@ static void rk4_coef(int nst, int nesteps, double dt, double *energy, double *en
         }
 
         // Calculate k2
-        ct_cdot(nst, eenergy, dv, k_lk, coef_new, c_dot);
+        ct_cdot(nst, eenergy, nac, k_lk, coef_new, c_dot);
 
         for(ist = 0; ist < nst; ist++){
             k2[ist] = edt * c_dot[ist];
@@ -84,7 +98,7 @@ static void rk4_coef(int nst, int nesteps, double dt, double *energy, double *en
         }
 
         // Calculate k3
-        ct_cdot(nst, eenergy, dv, k_lk, coef_new, c_dot);
+        ct_cdot(nst, eenergy, nac, k_lk, coef_new, c_dot);
 
         for(ist = 0; ist < nst; ist++){
             k3[ist] = edt * c_dot[ist];
@@ -93,7 +107,7 @@ static void rk4_coef(int nst, int nesteps, double dt, double *energy, double *en
         }
 
         // Calculate k4
-        ct_cdot(nst, eenergy, dv, k_lk, coef_new, c_dot);
+        ct_cdot(nst, eenergy, nac, k_lk, coef_new, c_dot);
 
         for(ist = 0; ist < nst; ist++){
             k4[ist] = edt * c_dot[ist];
@@ -125,21 +139,10 @@ static void rk4_coef(int nst, int nesteps, double dt, double *energy, double *en
     printf("RK4_COEF : NORM = %15.8f\n", creal(norm));
     */
 
-    for(ist = 0; ist < nst; ist++){
-        free(dv[ist]);
-    }
 
-    free(k1);
-    free(k2);
-    free(k3);
-    free(k4);
-    free(kfunction);
-    free(variation);
-    free(c_dot);
-    free(coef_new);
-    free(eenergy);
 //    free(na_term);
-    free(dv);
+
+    scratch_release(mark);
 
 }
 
@@ -8,58 +8,98 @@
 
 // Routine for coefficient propagation scheme in rk4 propagator
 static void rk4_coef(int nat, int ndim, int nst, int nesteps, double dt, int *l_coh,
-    double *mass, double *energy, double *energy_old, double **sigma, double **nacme,
-    double **nacme_old, double **pos, double **qmom, double ***aux_pos, double ***phase, double complex *coef,
+    double *mass, double *energy, double *energy_old, double **sigma, struct coupling *nac,
+    double **pos, double **qmom, double ***aux_pos, double ***phase, double complex *coef,
     int verbosity, double *dotpopdec);
 
 // Routine for density propagation scheme in rk4 propagator
 static void rk4_rho(int nat, int ndim, int nst, int nesteps, double dt, int *l_coh,
-    double *mass, double *energy, double *energy_old, double **sigma, double **nacme,
-    double **nacme_old, double **pos, double **qmom, double ***aux_pos, double ***phase, double complex **rho,
+    double *mass, double *energy, double *energy_old, double **sigma, struct coupling *nac,
+    double **pos, double **qmom, double ***aux_pos, double ***phase, double complex **rho,
     int verbosity, double *dotpopdec);
 
 // Interface routine for propagation scheme in rk4 propagator
-static void rk4(int nat, int ndim, int nst, int nesteps, double dt, char *elec_object, int *l_coh,
-    double *mass, double *energy, double *energy_old, double **sigma, double **nacme, double **nacme_old,
-    double **pos, double **qmom, double ***aux_pos, double ***phase, double complex *coef, double complex **rho,
+// Arrays are contiguous buffers with shapes of (nst), (nat), (nst, nst), (nat, ndim) or (nst, nat, ndim),
+// which are changed in place
+// NACME terms not larger than nac_threshold are neglected in the propagation
+static void rk4(int nat, int ndim, int nst, int nesteps, double dt, double nac_threshold, char *elec_object,
+    int *l_coh, double *mass, double *energy, double *energy_old, double *sigma, double *nacme, double *nacme_old,
+    double *pos, double *qmom, double *aux_pos, double *phase, double complex *coef, double complex *rho,
     int verbosity, double *dotpopdec){
 
+    size_t mark = scratch_mark();
+    double *nacme_rows[nst];
+    double *nacme_old_rows[nst];
+    double complex *rho_rows[nst];
+    double *sigma_rows[nat];
+    double *pos_rows[nat];
+    double *qmom_rows[nat];
+    double *aux_pos_rows[nst * nat];
+    double *phase_rows[nst * nat];
+    double **aux_pos_mats[nst];
+    double **phase_mats[nst];
+
+    struct coupling nac;
+    int ist, iat;
+
+    // Row pointers refer to the buffers directly, hence the data are not copied
+    for(ist = 0; ist < nst; ist++){
+        nacme_rows[ist] = nacme + ist * nst;
+        nacme_old_rows[ist] = nacme_old + ist * nst;
+        rho_rows[ist] = rho + ist * nst;
+    }
+
+    for(iat = 0; iat < nat; iat++){
+        sigma_rows[iat] = sigma + iat * ndim;
+        pos_rows[iat] = pos + iat * ndim;
+        qmom_rows[iat] = qmom + iat * ndim;
+    }
+
+    for(ist = 0; ist < nst; ist++){
+        for(iat = 0; iat < nat; iat++){
+            aux_pos_rows[ist * nat + iat] = aux_pos + (ist * nat + iat) * ndim;
+            phase_rows[ist * nat + iat] = phase + (ist * nat + iat) * ndim;
+        }
+        aux_pos_mats[ist] = aux_pos_rows + ist * nat;
+        phase_mats[ist] = phase_rows + ist * nat;
+    }
+
+    coupling_init(&nac, nst, nac_threshold, nacme_rows, nacme_old_rows);
+
     if(strcmp(elec_object, "coefficient") == 0){
-        rk4_coef(nat, ndim, nst, nesteps, dt, l_coh, mass, energy, energy_old, sigma,
-            nacme, nacme_old, pos, qmom, aux_pos, phase, coef, verbosity, dotpopdec);
+        rk4_coef(nat, ndim, nst, nesteps, dt, l_coh, mass, energy, energy_old, sigma_rows,
+            &nac, pos_rows, qmom_rows, aux_pos_mats, phase_mats, coef, verbosity, dotpopdec);
     }
     else if(strcmp(elec_object, "density") == 0){
-        rk4_rho(nat, ndim, nst, nesteps, dt, l_coh, mass, energy, energy_old, sigma,
-            nacme, nacme_old, pos, qmom, aux_pos, phase, rho, verbosity, dotpopdec);
+        rk4_rho(nat, ndim, nst, nesteps, dt, l_coh, mass, energy, energy_old, sigma_rows,
+            &nac, pos_rows, qmom_rows, aux_pos_mats, phase_mats, rho_rows, verbosity, dotpopdec);
     }
 
+    scratch_release(mark);
+
 }
 
 // Routine for coefficient propagation scheme in rk4 propagator
 static void rk4_coef(int nat, int ndim, int nst, int nesteps, double dt, int *l_coh,
-    double *mass, double *energy, double *energy_old, double **sigma, double **nacme,
-    double **nacme_old, double **pos, double **qmom, double ***aux_pos, double ***phase, double complex *coef,
+    double *mass, double *energy, double *energy_old, double **sigma, struct coupling *nac,
+    double **pos, double **qmom, double ***aux_pos, double ***phase, double complex *coef,
     int verbosity, double *dotpopdec){
 
-    double complex *k1 = malloc(nst * sizeof(double complex));
-    double complex *k2 = malloc(nst * sizeof(double complex));
-    double complex *k3 = malloc(nst * sizeof(double complex));
-    double complex *k4 = malloc(nst * sizeof(double complex));
-    double complex *kfunction = malloc(nst * sizeof(double complex));
-    double complex *variation = malloc(nst * sizeof(double complex));
-    double complex *c_dot = malloc(nst * sizeof(double complex));
-    double complex *xf_c_dot = malloc(nst * sizeof(double complex));
-    double complex *coef_new = malloc(nst * sizeof(double complex));
-    double *eenergy = malloc(nst * sizeof(double));
-    double **dv = malloc(nst * sizeof(double*));
-
-    int ist, jst, iestep;
+    size_t mark = scratch_mark();
+    double complex *k1 = scratch_alloc(nst * sizeof(double complex));
+    double complex *k2 = scratch_alloc(nst * sizeof(double complex));
+    double complex *k3 = scratch_alloc(nst * sizeof(double complex));
+    double complex *k4 = scratch_alloc(nst * sizeof(double complex));
+    double complex *kfunction = scratch_alloc(nst * sizeof(double complex));
+    double complex *variation = scratch_alloc(nst * sizeof(double complex));
+    double complex *c_dot = scratch_alloc(nst * sizeof(double complex));
+    double complex *xf_c_dot = scratch_alloc(nst * sizeof(double complex));
+    double complex *coef_new = scratch_alloc(nst * sizeof(double complex));
+    double *eenergy = scratch_alloc(nst * sizeof(double));
+
+    int ist, iestep;
     double frac, edt, norm;
 
-    for(ist = 0; ist < nst; ist++){
-        dv[ist] = malloc(nst * sizeof(double));
-    }
-
     frac = 1.0 / (double)nesteps;
     edt = dt * frac;
 
@@ -71,14 +111,11 @@ static void rk4_coef(int nat, int ndim, int nst, int nesteps, double dt, int *l_
         // Interpolate energy and NACME terms between time t and t + dt
         for(ist = 0; ist < nst; ist++){
             eenergy[ist] = energy_old[ist] + (energy[ist] - energy_old[ist]) * (double)iestep * frac;
-            for(jst = 0; jst < nst; jst++){
-                dv[ist][jst] = nacme_old[ist][jst] + (nacme[ist][jst] - nacme_old[ist][jst])
-                    * (double)iestep * frac;
-            }
         }
+        coupling_interpolate(nac, (double)iestep * frac);
 
         // Calculate k1
-        cdot(nst, eenergy, dv, coef, c_dot);
+        cdot(nst, eenergy, nac, coef, c_dot);
 
         for(ist = 0; ist < nst; ist++){
             k1[ist] = edt * (c_dot[ist] + xf_c_dot[ist]);
@@ -87,7 +124,7 @@ static void rk4_coef(int nat, int ndim, int nst, int nesteps, double dt, int *l_
         }
 
         // Calculate k2
-        cdot(nst, eenergy, dv, coef_new, c_dot);
+        cdot(nst, eenergy, nac, coef_new, c_dot);
 
         for(ist = 0; ist < nst; ist++){
             k2[ist] = edt * (c_dot[ist] + xf_c_dot[ist]);
@@ -96,7 +133,7 @@ static void rk4_coef(int nat, int ndim, int nst, int nesteps, double dt, int *l_
         }
 
         // Calculate k3
-        cdot(nst, eenergy, dv, coef_new, c_dot);
+        cdot(nst, eenergy, nac, coef_new, c_dot);
 
         for(ist = 0; ist < nst; ist++){
             k3[ist] = edt * (c_dot[ist] + xf_c_dot[ist]);
@@ -105,7 +142,7 @@ static void rk4_coef(int nat, int ndim, int nst, int nesteps, double dt, int *l_
         }
 
         // Calculate k4
-        cdot(nst, eenergy, dv, coef_new, c_dot);
+        cdot(nst, eenergy, nac, coef_new, c_dot);
 
         for(ist = 0; ist < nst; ist++){
             k4[ist] = edt * (c_dot[ist] + xf_c_dot[ist]);
@@ -128,56 +165,41 @@ static void rk4_coef(int nat, int ndim, int nst, int nesteps, double dt, int *l_
         xf_print_coef(nst, coef, xf_c_dot, dotpopdec);
     }
 
-    for(ist = 0; ist < nst; ist++){
-        free(dv[ist]);
-    }
-
-    free(k1);
-    free(k2);
-    free(k3);
-    free(k4);
-    free(kfunction);
-    free(variation);
-    free(c_dot);
-    free(xf_c_dot);
-    free(coef_new);
-    free(eenergy);
-    free(dv);
+    scratch_release(mark);
 
 }
 
 // Routine for density propagation scheme in rk4 propagator
 static void rk4_rho(int nat, int ndim, int nst, int nesteps, double dt, int *l_coh,
-    double *mass, double *energy, double *energy_old, double **sigma, double **nacme,
-    double **nacme_old, double **pos, double **qmom, double ***aux_pos, double ***phase, double complex **rho,
+    double *mass, double *energy, double *energy_old, double **sigma, struct coupling *nac,
+    double **pos, double **qmom, double ***aux_pos, double ***phase, double complex **rho,
     int verbosity, double *dotpopdec){
 
-    double complex **k1 = malloc(nst * sizeof(double complex*));
-    double complex **k2 = malloc(nst * sizeof(double complex*));
-    double complex **k3 = malloc(nst * sizeof(double complex*));
-    double complex **k4 = malloc(nst * sizeof(double complex*));
-    double complex **kfunction = malloc(nst * sizeof(double complex*));
-    double complex **variation = malloc(nst * sizeof(double complex*));
-    double complex **rho_dot = malloc(nst * sizeof(double complex*));
-    double complex **xf_rho_dot = malloc(nst * sizeof(double complex*));
-    double complex **rho_new = malloc(nst * sizeof(double complex*));
-    double *eenergy = malloc(nst * sizeof(double));
-    double **dv = malloc(nst * sizeof(double*));
+    size_t mark = scratch_mark();
+    double complex **k1 = scratch_alloc(nst * sizeof(double complex*));
+    double complex **k2 = scratch_alloc(nst * sizeof(double complex*));
+    double complex **k3 = scratch_alloc(nst * sizeof(double complex*));
+    double complex **k4 = scratch_alloc(nst * sizeof(double complex*));
+    double complex **kfunction = scratch_alloc(nst * sizeof(double complex*));
+    double complex **variation = scratch_alloc(nst * sizeof(double complex*));
+    double complex **rho_dot = scratch_alloc(nst * sizeof(double complex*));
+    double complex **xf_rho_dot = scratch_alloc(nst * sizeof(double complex*));
+    double complex **rho_new = scratch_alloc(nst * sizeof(double complex*));
+    double *eenergy = scratch_alloc(nst * sizeof(double));
 
     int ist, jst, iestep;
     double frac, edt;
 
     for(ist = 0; ist < nst; ist++){
-        k1[ist] = malloc(nst * sizeof(double complex));
-        k2[ist] = malloc(nst * sizeof(double complex));
-        k3[ist] = malloc(nst * sizeof(double complex));
-        k4[ist] = malloc(nst * sizeof(double complex));
-        kfunction[ist] = malloc(nst * sizeof(double complex));
-        variation[ist] = malloc(nst * sizeof(double complex));
-        rho_dot[ist] = malloc(nst * sizeof(double complex));
-        xf_rho_dot[ist] = malloc(nst * sizeof(double complex));
-        rho_new[ist] = malloc(nst * sizeof(double complex));
-        dv[ist] = malloc(nst * sizeof(double));
+        k1[ist] = scratch_alloc(nst * sizeof(double complex));
+        k2[ist] = scratch_alloc(nst * sizeof(double complex));
+        k3[ist] = scratch_alloc(nst * sizeof(double complex));
+        k4[ist] = scratch_alloc(nst * sizeof(double complex));
+        kfunction[ist] = scratch_alloc(nst * sizeof(double complex));
+        variation[ist] = scratch_alloc(nst * sizeof(double complex));
+        rho_dot[ist] = scratch_alloc(nst * sizeof(double complex));
+        xf_rho_dot[ist] = scratch_alloc(nst * sizeof(double complex));
+        rho_new[ist] = scratch_alloc(nst * sizeof(double complex));
     }
 
     frac = 1.0 / (double)nesteps;
@@ -191,14 +213,11 @@ static void rk4_rho(int nat, int ndim, int nst, int nesteps, double dt, int *l_c
         // Interpolate energy and NACME terms between time t and t + dt
         for(ist = 0; ist < nst; ist++){
             eenergy[ist] = energy_old[ist] + (energy[ist] - energy_old[ist]) * (double)iestep * frac;
-            for(jst = 0; jst < nst; jst++){
-                dv[ist][jst] = nacme_old[ist][jst] + (nacme[ist][jst] - nacme_old[ist][jst])
-                    * (double)iestep * frac;
-            }
         }
+        coupling_interpolate(nac, (double)iestep * frac);
 
         // Calculate k1
-        rhodot(nst, eenergy, dv, rho, rho_dot);
+        rhodot(nst, eenergy, nac, rho, rho_dot);
 
         for(ist = 0; ist < nst; ist++){
             for(jst = 0; jst < nst; jst++){
@@ -209,7 +228,7 @@ static void rk4_rho(int nat, int ndim, int nst, int nesteps, double dt, int *l_c
         }
 
         // Calculate k2
-        rhodot(nst, eenergy, dv, rho_new, rho_dot);
+        rhodot(nst, eenergy, nac, rho_new, rho_dot);
 
         for(ist = 0; ist < nst; ist++){
             for(jst = 0; jst < nst; jst++){
@@ -221,7 +240,7 @@ static void rk4_rho(int nat, int ndim, int nst, int nesteps, double dt, int *l_c
         }
 
         // Calculate k3
-        rhodot(nst, eenergy, dv, rho_new, rho_dot);
+        rhodot(nst, eenergy, nac, rho_new, rho_dot);
 
         for(ist = 0; ist < nst; ist++){
             for(jst = 0; jst < nst; jst++){
@@ -233,7 +252,7 @@ static void rk4_rho(int nat, int ndim, int nst, int nesteps, double dt, int *l_c
         }
 
         // Calculate k4
-        rhodot(nst, eenergy, dv, rho_new, rho_dot);
+        rhodot(nst, eenergy, nac, rho_new, rho_dot);
 
         for(ist = 0; ist < nst; ist++){
             for(jst = 0; jst < nst; jst++){
@@ -250,30 +269,7 @@ static void rk4_rho(int nat, int ndim, int nst, int nesteps, double dt, int *l_c
         xf_print_rho(nst, xf_rho_dot, dotpopdec); 
     }
 
-    for(ist = 0; ist < nst; ist++){
-        free(k1[ist]);
-        free(k2[ist]);
-        free(k3[ist]);
-        free(k4[ist]);
-        free(kfunction[ist]);
-        free(variation[ist]);
-        free(rho_dot[ist]);
-        free(xf_rho_dot[ist]);
-        free(rho_new[ist]);
-        free(dv[ist]);
-    }
-
-    free(k1);
-    free(k2);
-    free(k3);
-    free(k4);
-    free(kfunction);
-    free(variation);
-    free(rho_dot);
-    free(xf_rho_dot);
-    free(rho_new);
-    free(eenergy);
-    free(dv);
+    scratch_release(mark);
 
 }
 
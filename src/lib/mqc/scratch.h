@@ -0,0 +1,82 @@
+#ifndef SCRATCH_H
+#define SCRATCH_H
+
+#include <stdio.h>
+#include <stdlib.h>
+
+// Scratch memory of the electronic propagators, which is kept between the calls for each thread
+// Arrays are taken from the block in the order of the calls and given back at the end of each routine,
+// hence the memory is allocated only at the first nuclear step or when a larger size is needed
+struct scratch {
+    char *block;
+    // Size of the block, the position of the next array and the largest position reached in the calls
+    size_t size, used, peak;
+    // Arrays which do not fit in the block are allocated separately with their positions,
+    // and the block is enlarged to the largest position when all arrays are given back
+    void **extra;
+    size_t *extra_pos;
+    int nextra, max_extra;
+};
+
+static _Thread_local struct scratch scratch_mem = {NULL, 0, 0, 0, NULL, NULL, 0, 0};
+
+// Routine to get an array of given size in bytes from the scratch memory
+static void *scratch_alloc(size_t size){
+
+    struct scratch *s = &scratch_mem;
+    void *ptr;
+
+    // Arrays are aligned to 16 bytes for double complex numbers
+    size = (size + 15) & ~((size_t)15);
+
+    if(s->used + size <= s->size){
+        ptr = s->block + s->used;
+    }
+    else{
+        if(s->nextra == s->max_extra){
+            s->max_extra = (s->max_extra == 0) ? 16 : 2 * s->max_extra;
+            s->extra = realloc(s->extra, s->max_extra * sizeof(void*));
+            s->extra_pos = realloc(s->extra_pos, s->max_extra * sizeof(size_t));
+        }
+        ptr = malloc(size);
+        s->extra[s->nextra] = ptr;
+        s->extra_pos[s->nextra] = s->used;
+        s->nextra++;
+    }
+
+    s->used += size;
+    if(s->used > s->peak){
+        s->peak = s->used;
+    }
+    return ptr;
+
+}
+
+// Routine to save the current position of the scratch memory at the beginning of a routine
+static size_t scratch_mark(void){
+
+    return scratch_mem.used;
+
+}
+
+// Routine to give back the arrays taken after the position, at the end of the routine
+static void scratch_release(size_t mark){
+
+    struct scratch *s = &scratch_mem;
+
+    while(s->nextra > 0 && s->extra_pos[s->nextra - 1] >= mark){
+        s->nextra--;
+        free(s->extra[s->nextra]);
+    }
+    s->used = mark;
+
+    // The block is enlarged when the outermost routine is finished
+    if(mark == 0 && s->peak > s->size){
+        free(s->block);
+        s->block = malloc(s->peak);
+        s->size = s->peak;
+    }
+
+}
+
+#endif
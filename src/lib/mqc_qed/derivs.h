@@ -1,7 +1,11 @@
+#ifndef DERIVS_H
+#define DERIVS_H
+
 #include <stdio.h>
 #include <stdlib.h>
 #include <complex.h>
 #include <math.h>
+#include "prop_mat.h"
 
 //// Routine to calculate dot product from two temporary arrays
 //static double dot(int nst, double complex *u, double complex *v){
@@ -21,17 +25,18 @@
 //}
 
 // Routine to calculate cdot contribution originated from Ehrenfest term
-static void cdot(int pst, double complex **prop_mat_d, double complex *c, double complex *c_dot){
+// Only the saved terms of the sparse propagation matrix in uncoupled basis are multiplied
+static void cdot(struct prop_mat *prop_mat_d, double complex *c, double complex *c_dot){
 
-    int ist, jst;
+    int ist, k;
 
-    for(ist = 0; ist < pst; ist++){
+    for(ist = 0; ist < prop_mat_d->pst; ist++){
         c_dot[ist] = 0.0 + 0.0 * I;
     }
 
-    for(ist = 0; ist < pst; ist++){
-        for(jst = 0; jst < pst; jst++){
-            c_dot[ist] += prop_mat_d[ist][jst] * c[jst];
+    for(ist = 0; ist < prop_mat_d->pst; ist++){
+        for(k = prop_mat_d->row_ptr[ist]; k < prop_mat_d->row_ptr[ist + 1]; k++){
+            c_dot[ist] += prop_mat_d->val[k] * c[prop_mat_d->col_ind[k]];
         }
     }
 
@@ -68,4 +73,4 @@ static void cdot(int pst, double complex **prop_mat_d, double complex *c, double
 //
 //}
 
-
+#endif
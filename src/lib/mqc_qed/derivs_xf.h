@@ -5,11 +5,15 @@
 #include <stdlib.h>
 #include <complex.h>
 #include <math.h>
+#include "../mqc/scratch.h"
 
 // Routine to calculate cdot contribution originating from XF term
+// The XF term is evaluated with the polaritonic state coefficients and transformed to uncoupled basis once
 static void xf_cdot(int pst, double **unitary, double **dec_mat, double complex *c, double complex *xfcdot){
 
-    double *rho = malloc(pst * sizeof(double));
+    size_t mark = scratch_mark();
+    double *rho = scratch_alloc(pst * sizeof(double));
+    double complex *xfcdot_a = scratch_alloc(pst * sizeof(double complex));
 
     int ast, ist, jst;
 
@@ -18,21 +22,23 @@ static void xf_cdot(int pst, double **unitary, double **dec_mat, double complex
         rho[ist] = creal(conj(c[ist]) * c[ist]);
     }
 
-    for(ast = 0; ast < pst; ast++){
-        xfcdot[ast] = 0.0 + 0.0 * I;
+    // XF term for polaritonic states
+    for(ist = 0; ist < pst; ist++){
+        xfcdot_a[ist] = 0.0 + 0.0 * I;
+        for(jst = 0; jst < pst; jst++){
+            xfcdot_a[ist] -= rho[jst] * dec_mat[jst][ist] * c[ist];
+        }
     }
 
+    // Transform the XF term to uncoupled basis, D = U * C
     for(ast = 0; ast < pst; ast++){
-
+        xfcdot[ast] = 0.0 + 0.0 * I;
         for(ist = 0; ist < pst; ist++){
-            for(jst = 0; jst < pst; jst++){
-                xfcdot[ast] -= unitary[ast][ist] * rho[jst] * dec_mat[jst][ist] * c[ist];
-            }
+            xfcdot[ast] += unitary[ast][ist] * xfcdot_a[ist];
         }
-
     }
 
-    free(rho);
+    scratch_release(mark);
 
 }
 
@@ -40,7 +46,9 @@ static void xf_cdot(int pst, double **unitary, double **dec_mat, double complex
 static void xf_print_coef(int pst, double **unitary, double **dec_mat, double complex *coef_d,
     double complex *coef_a, double *dotpopdec_d){
 
-    double *rho = malloc(pst * sizeof(double));
+    size_t mark = scratch_mark();
+    double *rho = scratch_alloc(pst * sizeof(double));
+    double *dec_sum = scratch_alloc(pst * sizeof(double));
 
     int ast, ist, jst;
 
@@ -48,22 +56,23 @@ static void xf_print_coef(int pst, double **unitary, double **dec_mat, double co
         rho[ist] = creal(conj(coef_a[ist]) * coef_a[ist]);
     }
 
-    for(ast = 0; ast < pst; ast++){
-        dotpopdec_d[ast] = 0.0;
+    // Decoherence terms summed over the polaritonic states, which are independent of the uncoupled states
+    for(ist = 0; ist < pst; ist++){
+        dec_sum[ist] = 0.0;
+        for(jst = 0; jst < pst; jst++){
+            dec_sum[ist] += rho[jst] * dec_mat[jst][ist];
+        }
     }
 
     for(ast = 0; ast < pst; ast++){
-
+        dotpopdec_d[ast] = 0.0;
         for(ist = 0; ist < pst; ist++){
-            for(jst = 0; jst < pst; jst++){
-                dotpopdec_d[ast] -= unitary[ast][ist] * rho[jst] * dec_mat[jst][ist]
-                    * creal( conj(coef_a[ist]) * coef_d[ast] + coef_a[ist] * conj(coef_d[ast]) );
-            }
+            dotpopdec_d[ast] -= unitary[ast][ist] * dec_sum[ist]
+                * creal( conj(coef_a[ist]) * coef_d[ast] + coef_a[ist] * conj(coef_d[ast]) );
         }
-
     }
 
-    free(rho);
+    scratch_release(mark);
 
 }
 #endif
@@ -2,6 +2,7 @@
 #include <stdlib.h>
 #include <complex.h>
 #include <math.h>
+#include "../mqc/scratch.h"
 #include <string.h>
 
 // Complex datatype
@@ -25,11 +26,32 @@ static void exponential_coef(int pst, int nesteps, double dt, int **get_d_ind, d
 //    int verbosity, double *dotpopdec);
 
 // Interface routine for propagation scheme in exponential propagator
-static void exponential(int pst, int nesteps, double dt, char *elec_object, int **get_d_ind, double **ham_d,
-    double **ham_d_old, double **nacme, double **nacme_old, double complex *coef_d){
+// Arrays are contiguous buffers with shapes of (pst), (pst, 2), (pst, pst) or (nst, nst), which are changed in place
+static void exponential(int nst, int pst, int nesteps, double dt, char *elec_object, int *get_d_ind, double *ham_d,
+    double *ham_d_old, double *nacme, double *nacme_old, double complex *coef_d){
+
+    int *get_d_ind_rows[pst];
+    double *ham_d_rows[pst];
+    double *ham_d_old_rows[pst];
+    double *nacme_rows[nst];
+    double *nacme_old_rows[nst];
+
+    int ist;
+
+    // Row pointers refer to the buffers directly, hence the data are not copied
+    for(ist = 0; ist < pst; ist++){
+        get_d_ind_rows[ist] = get_d_ind + ist * 2;
+        ham_d_rows[ist] = ham_d + ist * pst;
+        ham_d_old_rows[ist] = ham_d_old + ist * pst;
+    }
+
+    for(ist = 0; ist < nst; ist++){
+        nacme_rows[ist] = nacme + ist * nst;
+        nacme_old_rows[ist] = nacme_old + ist * nst;
+    }
 
     if(strcmp(elec_object, "coefficient") == 0){
-        exponential_coef(pst, nesteps, dt, get_d_ind, ham_d, ham_d_old, nacme, nacme_old, coef_d);
+        exponential_coef(pst, nesteps, dt, get_d_ind_rows, ham_d_rows, ham_d_old_rows, nacme_rows, nacme_old_rows, coef_d);
     }
 //    else if(strcmp(elec_object, "density") == 0){
 //        rk4_rho(nat, ndim, nst, nesteps, dt, l_coh, mass, energy, energy_old, sigma,
@@ -42,33 +64,34 @@ static void exponential(int pst, int nesteps, double dt, char *elec_object, int
 static void exponential_coef(int pst, int nesteps, double dt, int **get_d_ind, double **ham_d,
     double **ham_d_old, double **nacme, double **nacme_old, double complex *coef_d){
 
-    double complex *coef_new = malloc(pst * sizeof(double complex));
-    double complex **prop_mat_d = malloc(pst * sizeof(double complex*));
+    size_t mark = scratch_mark(), work_mark;
+    double complex *coef_new = scratch_alloc(pst * sizeof(double complex));
+    double complex **prop_mat_d = scratch_alloc(pst * sizeof(double complex*));
 
     // (Hamiltonian - i * (NACME + decoherence)) * dt
-    double complex **exponent = malloc((pst) * sizeof(double complex*));
+    double complex **exponent = scratch_alloc((pst) * sizeof(double complex*));
     // eigenvectors of (Hamiltonian - i * (NACME + decoherence)) * dt, P
-    dcomplex *eigenvectors = malloc((pst * pst) * sizeof(dcomplex));
+    dcomplex *eigenvectors = scratch_alloc((pst * pst) * sizeof(dcomplex));
     // eigenvalues of (Hamiltonian - i * (NACME + decoherence)) * dt, D
-    double *eigenvalues = malloc(pst * sizeof(double));
+    double *eigenvalues = scratch_alloc(pst * sizeof(double));
 
     // diagonal matrix using eigenvalues, exp(- i * D)
-    dcomplex *exp_idiag = malloc((pst * pst) * sizeof(dcomplex));
+    dcomplex *exp_idiag = scratch_alloc((pst * pst) * sizeof(dcomplex));
     // exp(- i * exponent) = P * exp(- i * D) * P^-1
-    dcomplex *exp_iexponent = malloc((pst * pst) * sizeof(dcomplex));
+    dcomplex *exp_iexponent = scratch_alloc((pst * pst) * sizeof(dcomplex));
     // product of (P * exp(- i * D) * P^-1) until previous step
-    dcomplex *product_old = malloc((pst * pst) * sizeof(dcomplex));
+    dcomplex *product_old = scratch_alloc((pst * pst) * sizeof(dcomplex));
     // product of (P * exp(- i * D) * P^-1) until current step
-    dcomplex *product_new = malloc((pst * pst) * sizeof(dcomplex));
+    dcomplex *product_new = scratch_alloc((pst * pst) * sizeof(dcomplex));
     // final product of exp(- i * exponent)
-    double complex **propagator = malloc((pst) * sizeof(double complex*));
+    double complex **propagator = scratch_alloc((pst) * sizeof(double complex*));
 
-    dcomplex *tmp_mat = malloc((pst * pst) * sizeof(dcomplex));
-    dcomplex *identity = malloc((pst * pst) * sizeof(dcomplex));
+    dcomplex *tmp_mat = scratch_alloc((pst * pst) * sizeof(dcomplex));
+    dcomplex *identity = scratch_alloc((pst * pst) * sizeof(dcomplex));
 
     dcomplex wkopt;
     dcomplex *work;
-    double *rwork = malloc((3 * pst - 2) * sizeof(double));
+    double *rwork = scratch_alloc((3 * pst - 2) * sizeof(double));
     int lwork, info;
 
     dcomplex dcone = {1.0, 0.0};
@@ -80,12 +103,12 @@ static void exponential_coef(int pst, int nesteps, double dt, int **get_d_ind, d
     double complex tmp_coef;
 
     for(ist = 0; ist < pst; ist++){
-        prop_mat_d[ist] = malloc(pst * sizeof(double complex));
+        prop_mat_d[ist] = scratch_alloc(pst * sizeof(double complex));
     }
 
     for(ist = 0; ist < pst; ist++){
-        exponent[ist] = malloc(pst * sizeof(double complex));
-        propagator[ist] = malloc(pst * sizeof(double complex));
+        exponent[ist] = scratch_alloc(pst * sizeof(double complex));
+        propagator[ist] = scratch_alloc(pst * sizeof(double complex));
     }
 
     for(ist = 0; ist < pst; ist++){
@@ -171,9 +194,10 @@ static void exponential_coef(int pst, int nesteps, double dt, int **get_d_ind, d
         lwork = - 1;
         zheev_("Vectors", "Lower", &pst, eigenvectors, &pst, eigenvalues, &wkopt, &lwork, rwork, &info);
         lwork = (int)wkopt.real;
-        work = (dcomplex*)malloc(lwork * sizeof(dcomplex));
+        work_mark = scratch_mark();
+        work = (dcomplex*)scratch_alloc(lwork * sizeof(dcomplex));
         zheev_("Vectors", "Lower", &pst, eigenvectors, &pst, eigenvalues, work, &lwork, rwork, &info);
-        free(work);
+        scratch_release(work_mark);
 
         // Create the diagonal matrix (exp(- i * eigenvalues))
         kst = 0;
@@ -222,31 +246,7 @@ static void exponential_coef(int pst, int nesteps, double dt, int **get_d_ind, d
         coef_d[ist] = coef_new[ist];
     }
 
-    for(ist = 0; ist < pst; ist++){
-        free(prop_mat_d[ist]);
-    }
-    for(ist = 0; ist < pst; ist++){
-        free(exponent[ist]);
-        free(propagator[ist]);
-    }
-
-    free(coef_new);
-    free(prop_mat_d);
-
-    free(exponent);
-    free(propagator);
-
-    free(eigenvectors);
-    free(eigenvalues);
-
-    free(exp_idiag);
-    free(exp_iexponent);
-    free(product_old);
-    free(product_new);
-
-    free(tmp_mat);
-    free(identity);
-    free(rwork);
+    scratch_release(mark);
 
 }
 
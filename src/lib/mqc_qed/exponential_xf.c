@@ -29,14 +29,62 @@ static void exponential_coef(int nat, int ndim, int pst, int nesteps, int verbos
 //    int verbosity, double *dotpopdec);
 
 // Interface routine for propagation scheme in exponential propagator
-static void exponential(int nat, int ndim, int pst, int nesteps, int verbosity, double dt, char *elec_object,
-    int *l_coh, double *mass, double *sigma, int **get_d_ind, double **unitary, double **ham_d,
-    double **ham_d_old, double **nacme, double **nacme_old, double **pos, double ***aux_pos,
-    double ***phase, double *dotpopdec_d, double complex *coef_d, double **qmom){
+// Arrays are contiguous buffers with shapes of (pst), (nat), (pst, 2), (pst, pst), (nst, nst), (nat, ndim)
+// or (pst, nat, ndim), which are changed in place
+static void exponential(int nat, int ndim, int nst, int pst, int nesteps, int verbosity, double dt, char *elec_object,
+    int *l_coh, double *mass, double *sigma, int *get_d_ind, double *unitary, double *ham_d,
+    double *ham_d_old, double *nacme, double *nacme_old, double *pos, double *aux_pos,
+    double *phase, double *dotpopdec_d, double complex *coef_d, double *qmom){
+
+    int *get_d_ind_rows[pst];
+    double *ham_d_rows[pst];
+    double *ham_d_old_rows[pst];
+    double *nacme_rows[nst];
+    double *nacme_old_rows[nst];
+    double *unitary_rows[pst];
+    double *pos_rows[nat];
+    double *qmom_rows[nat];
+    double *aux_pos_rows[pst * nat];
+    double *phase_rows[pst * nat];
+    double **aux_pos_mats[pst];
+    double **phase_mats[pst];
+
+    int ist, iat;
+
+    // Row pointers refer to the buffers directly, hence the data are not copied
+    for(ist = 0; ist < pst; ist++){
+        get_d_ind_rows[ist] = get_d_ind + ist * 2;
+        ham_d_rows[ist] = ham_d + ist * pst;
+        ham_d_old_rows[ist] = ham_d_old + ist * pst;
+    }
+
+    for(ist = 0; ist < nst; ist++){
+        nacme_rows[ist] = nacme + ist * nst;
+        nacme_old_rows[ist] = nacme_old + ist * nst;
+    }
+
+    for(ist = 0; ist < pst; ist++){
+        unitary_rows[ist] = unitary + ist * pst;
+    }
+
+    for(iat = 0; iat < nat; iat++){
+        pos_rows[iat] = pos + iat * ndim;
+        qmom_rows[iat] = qmom + iat * ndim;
+    }
+
+    for(ist = 0; ist < pst; ist++){
+        for(iat = 0; iat < nat; iat++){
+            aux_pos_rows[ist * nat + iat] = aux_pos + (ist * nat + iat) * ndim;
+            phase_rows[ist * nat + iat] = phase + (ist * nat + iat) * ndim;
+        }
+        aux_pos_mats[ist] = aux_pos_rows + ist * nat;
+        phase_mats[ist] = phase_rows + ist * nat;
+    }
 
     if(strcmp(elec_object, "coefficient") == 0){
-        exponential_coef(nat, ndim, pst, nesteps, verbosity, dt, l_coh, mass, sigma, get_d_ind, unitary,
-            ham_d, ham_d_old, nacme, nacme_old, pos, aux_pos, phase, dotpopdec_d, coef_d, qmom);
+        exponential_coef(nat, ndim, pst, nesteps, verbosity, dt, l_coh, mass, sigma, get_d_ind_rows, unitary_rows,
+            ham_d_rows, ham_d_old_rows, nacme_rows, nacme_old_rows, pos_rows, aux_pos_mats, phase_mats,
+            dotpopdec_d, coef_d, qmom_rows);
     }
 //    else if(strcmp(elec_object, "density") == 0){
 //        rk4_rho(nat, ndim, nst, nesteps, dt, l_coh, mass, energy, energy_old, sigma,
@@ -51,37 +99,38 @@ static void exponential_coef(int nat, int ndim, int pst, int nesteps, int verbos
     double **ham_d_old, double **nacme, double **nacme_old, double **pos, double ***aux_pos,
     double ***phase, double *dotpopdec_d, double complex *coef_d, double **qmom){
 
-    double complex *coef_a = malloc(pst * sizeof(double complex));
-    double complex *coef_new = malloc(pst * sizeof(double complex));
-    double complex **prop_mat_d = malloc(pst * sizeof(double complex*));
-    double complex **rho_a = malloc(pst * sizeof(double complex*));
-    double **dec_mat = malloc(pst * sizeof(double*));
-    double complex **dec_mat_d = malloc(pst * sizeof(double complex*));
+    size_t mark = scratch_mark(), work_mark;
+    double complex *coef_a = scratch_alloc(pst * sizeof(double complex));
+    double complex *coef_new = scratch_alloc(pst * sizeof(double complex));
+    double complex **prop_mat_d = scratch_alloc(pst * sizeof(double complex*));
+    double complex **rho_a = scratch_alloc(pst * sizeof(double complex*));
+    double **dec_mat = scratch_alloc(pst * sizeof(double*));
+    double complex **dec_mat_d = scratch_alloc(pst * sizeof(double complex*));
 
     // (Hamiltonian - i * (NACME + decoherence)) * dt
-    double complex **exponent = malloc((pst) * sizeof(double complex*));
+    double complex **exponent = scratch_alloc((pst) * sizeof(double complex*));
     // eigenvectors of (Hamiltonian - i * (NACME + decoherence)) * dt, P
-    dcomplex *eigenvectors = malloc((pst * pst) * sizeof(dcomplex));
+    dcomplex *eigenvectors = scratch_alloc((pst * pst) * sizeof(dcomplex));
     // eigenvalues of (Hamiltonian - i * (NACME + decoherence)) * dt, D
-    double *eigenvalues = malloc(pst * sizeof(double));
+    double *eigenvalues = scratch_alloc(pst * sizeof(double));
 
     // diagonal matrix using eigenvalues, exp(- i * D)
-    dcomplex *exp_idiag = malloc((pst * pst) * sizeof(dcomplex));
+    dcomplex *exp_idiag = scratch_alloc((pst * pst) * sizeof(dcomplex));
     // exp(- i * exponent) = P * exp(- i * D) * P^-1
-    dcomplex *exp_iexponent = malloc((pst * pst) * sizeof(dcomplex));
+    dcomplex *exp_iexponent = scratch_alloc((pst * pst) * sizeof(dcomplex));
     // product of (P * exp(- i * D) * P^-1) until previous step
-    dcomplex *product_old = malloc((pst * pst) * sizeof(dcomplex));
+    dcomplex *product_old = scratch_alloc((pst * pst) * sizeof(dcomplex));
     // product of (P * exp(- i * D) * P^-1) until current step
-    dcomplex *product_new = malloc((pst * pst) * sizeof(dcomplex));
+    dcomplex *product_new = scratch_alloc((pst * pst) * sizeof(dcomplex));
     // final product of exp(- i * exponent)
-    double complex **propagator = malloc((pst) * sizeof(double complex*));
+    double complex **propagator = scratch_alloc((pst) * sizeof(double complex*));
 
-    dcomplex *tmp_mat = malloc((pst * pst) * sizeof(dcomplex));
-    dcomplex *identity = malloc((pst * pst) * sizeof(dcomplex));
+    dcomplex *tmp_mat = scratch_alloc((pst * pst) * sizeof(dcomplex));
+    dcomplex *identity = scratch_alloc((pst * pst) * sizeof(dcomplex));
 
     dcomplex wkopt;
     dcomplex *work;
-    double *rwork = malloc((3 * pst - 2) * sizeof(double));
+    double *rwork = scratch_alloc((3 * pst - 2) * sizeof(double));
     int lwork, info;
 
     dcomplex dcone = {1.0, 0.0};
@@ -94,18 +143,18 @@ static void exponential_coef(int nat, int ndim, int pst, int nesteps, int verbos
     double complex tmp_coef;
 
     for(ist = 0; ist < pst; ist++){
-        prop_mat_d[ist] = malloc(pst * sizeof(double complex));
+        prop_mat_d[ist] = scratch_alloc(pst * sizeof(double complex));
     }
 
     for(ist = 0; ist < pst; ist++){
-        rho_a[ist] = malloc(pst * sizeof(double complex));
-        dec_mat[ist] = malloc(pst * sizeof(double));
-        dec_mat_d[ist] = malloc(pst * sizeof(double complex));
+        rho_a[ist] = scratch_alloc(pst * sizeof(double complex));
+        dec_mat[ist] = scratch_alloc(pst * sizeof(double));
+        dec_mat_d[ist] = scratch_alloc(pst * sizeof(double complex));
     }
 
     for(ist = 0; ist < pst; ist++){
-        exponent[ist] = malloc(pst * sizeof(double complex));
-        propagator[ist] = malloc(pst * sizeof(double complex));
+        exponent[ist] = scratch_alloc(pst * sizeof(double complex));
+        propagator[ist] = scratch_alloc(pst * sizeof(double complex));
     }
 
     for(ist = 0; ist < pst; ist++){
@@ -256,9 +305,10 @@ static void exponential_coef(int nat, int ndim, int pst, int nesteps, int verbos
         lwork = - 1;
         zheev_("Vectors", "Lower", &pst, eigenvectors, &pst, eigenvalues, &wkopt, &lwork, rwork, &info);
         lwork = (int)wkopt.real;
-        work = (dcomplex*)malloc(lwork * sizeof(dcomplex));
+        work_mark = scratch_mark();
+        work = (dcomplex*)scratch_alloc(lwork * sizeof(dcomplex));
         zheev_("Vectors", "Lower", &pst, eigenvectors, &pst, eigenvalues, work, &lwork, rwork, &info);
-        free(work);
+        scratch_release(work_mark);
 
         // Create the diagonal matrix (exp(- i * eigenvalues))
         kst = 0;
@@ -312,40 +362,7 @@ static void exponential_coef(int nat, int ndim, int pst, int nesteps, int verbos
         xf_print_coef(pst, unitary, dec_mat, coef_d, coef_a, dotpopdec_d);
     }
 
-    for(ist = 0; ist < pst; ist++){
-        free(prop_mat_d[ist]);
-    }
-    for(ist = 0; ist < pst; ist++){
-        free(rho_a[ist]);
-        free(dec_mat[ist]);
-        free(dec_mat_d[ist]);
-    }
-    for(ist = 0; ist < pst; ist++){
-        free(exponent[ist]);
-        free(propagator[ist]);
-    }
-
-    free(coef_a);
-    free(coef_new);
-    free(prop_mat_d);
-    free(rho_a);
-    free(dec_mat);
-    free(dec_mat_d);
-
-    free(exponent);
-    free(propagator);
-
-    free(eigenvectors);
-    free(eigenvalues);
-
-    free(exp_idiag);
-    free(exp_iexponent);
-    free(product_old);
-    free(product_new);
-
-    free(tmp_mat);
-    free(identity);
-    free(rwork);
+    scratch_release(mark);
 
 }
 
@@ -0,0 +1,103 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <complex.h>
+#include <math.h>
+#include <string.h>
+#include "derivs.h"
+#include "../mqc/krylov.h"
+
+// Variables needed to calculate the product of the exponent and the vector at the electronic substep
+struct krylov_params {
+    int pst;
+    double edt;
+    struct prop_mat *prop_mat_d;
+};
+
+// Routine for coefficient propagation scheme in krylov propagator
+static void krylov_coef(int pst, int nesteps, double dt, double elec_tol, int **get_d_ind, double **ham_d,
+    double **ham_d_old, double **nacme, double **nacme_old, double complex *coef_d);
+
+// Routine to calculate the product of (Hamiltonian - i * NACME) * dt and the vector
+static void krylov_exponent(void *params, double complex *x, double complex *y);
+
+// Interface routine for propagation scheme in krylov propagator
+// Arrays are contiguous buffers with shapes of (pst), (pst, 2), (pst, pst) or (nst, nst), which are changed in place
+static void krylov(int nst, int pst, int nesteps, double dt, double elec_tol, char *elec_object, int *get_d_ind,
+    double *ham_d, double *ham_d_old, double *nacme, double *nacme_old, double complex *coef_d){
+
+    int *get_d_ind_rows[pst];
+    double *ham_d_rows[pst];
+    double *ham_d_old_rows[pst];
+    double *nacme_rows[nst];
+    double *nacme_old_rows[nst];
+
+    int ist;
+
+    // Row pointers refer to the buffers directly, hence the data are not copied
+    for(ist = 0; ist < pst; ist++){
+        get_d_ind_rows[ist] = get_d_ind + ist * 2;
+        ham_d_rows[ist] = ham_d + ist * pst;
+        ham_d_old_rows[ist] = ham_d_old + ist * pst;
+    }
+
+    for(ist = 0; ist < nst; ist++){
+        nacme_rows[ist] = nacme + ist * nst;
+        nacme_old_rows[ist] = nacme_old + ist * nst;
+    }
+
+    if(strcmp(elec_object, "coefficient") == 0){
+        krylov_coef(pst, nesteps, dt, elec_tol, get_d_ind_rows, ham_d_rows, ham_d_old_rows, nacme_rows,
+            nacme_old_rows, coef_d);
+    }
+
+}
+
+// Routine for coefficient propagation scheme in krylov propagator
+static void krylov_coef(int pst, int nesteps, double dt, double elec_tol, int **get_d_ind, double **ham_d,
+    double **ham_d_old, double **nacme, double **nacme_old, double complex *coef_d){
+
+    size_t mark = scratch_mark();
+    struct prop_mat prop_mat_d;
+    struct krylov_params params;
+    int iestep;
+    double frac, edt;
+
+    // Pattern of the propagation matrix is fixed during the nuclear step
+    prop_mat_init(&prop_mat_d, pst, get_d_ind, ham_d, ham_d_old, nacme, nacme_old);
+
+    frac = 1.0 / (double)nesteps;
+    edt = dt * frac;
+
+    params.pst = pst;
+    params.edt = edt;
+    params.prop_mat_d = &prop_mat_d;
+
+    for(iestep = 0; iestep < nesteps; iestep++){
+
+        // Interpolate ham_d and NACME terms between time t and t + dt
+        prop_mat_interpolate(&prop_mat_d, iestep, frac);
+
+        // Update the coefficients using exp(- i * exponent) in the Krylov subspace
+        krylov_expm(pst, elec_tol, krylov_exponent, &params, coef_d);
+
+    }
+
+    scratch_release(mark);
+
+}
+
+// Routine to calculate the product of (Hamiltonian - i * NACME) * dt and the vector
+// The exponent is defined as i * (propagation matrix) * dt, which is a hermitian matrix
+static void krylov_exponent(void *params, double complex *x, double complex *y){
+
+    struct krylov_params *p = params;
+
+    int ist;
+
+    cdot(p->prop_mat_d, x, y);
+
+    for(ist = 0; ist < p->pst; ist++){
+        y[ist] *= 1.0 * I * p->edt;
+    }
+
+}
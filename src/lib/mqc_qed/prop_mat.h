@@ -0,0 +1,103 @@
+#ifndef PROP_MAT_H
+#define PROP_MAT_H
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <complex.h>
+#include <math.h>
+#include "../mqc/scratch.h"
+
+// Propagation matrix in uncoupled basis saved in compressed sparse row format
+// The JC Hamiltonian couples only the states differing by one photon, and NACME terms couple only the states
+// with the same photon number, hence only the nonzero terms at time t or t + dt are saved and interpolated
+struct prop_mat {
+    int pst, nnz;
+    // Range of the saved terms in each row, and the column indices of the saved terms
+    int *row_ptr, *col_ind;
+    // ham_d and NACME terms at time t and t + dt, NACME terms are zero for the states with different photon numbers
+    double *ham_old, *ham, *nac_old, *nac;
+    // Propagation matrix at the current substep, - i * (ham_d - erel) - NACME
+    double complex *val;
+};
+
+// Routine to build the sparse propagation matrix, which is done once per nuclear step
+// Diagonal terms are always saved since the relative energy is subtracted from them
+// The arrays are taken from the scratch memory, hence they are given back by the calling routine
+static void prop_mat_init(struct prop_mat *pm, int pst, int **get_d_ind, double **ham_d, double **ham_d_old,
+    double **nacme, double **nacme_old){
+
+    int ist, jst, k, ind_mol1, ind_mol2, l_photon;
+
+    pm->pst = pst;
+    pm->row_ptr = scratch_alloc((pst + 1) * sizeof(int));
+
+    pm->nnz = 0;
+    for(ist = 0; ist < pst; ist++){
+        for(jst = 0; jst < pst; jst++){
+            ind_mol1 = get_d_ind[ist][0];
+            ind_mol2 = get_d_ind[jst][0];
+            l_photon = (get_d_ind[ist][1] == get_d_ind[jst][1]);
+            if(ist == jst || ham_d[ist][jst] != 0.0 || ham_d_old[ist][jst] != 0.0
+                || (l_photon && (nacme[ind_mol1][ind_mol2] != 0.0 || nacme_old[ind_mol1][ind_mol2] != 0.0))){
+                pm->nnz++;
+            }
+        }
+    }
+
+    pm->col_ind = scratch_alloc(pm->nnz * sizeof(int));
+    pm->ham_old = scratch_alloc(pm->nnz * sizeof(double));
+    pm->ham = scratch_alloc(pm->nnz * sizeof(double));
+    pm->nac_old = scratch_alloc(pm->nnz * sizeof(double));
+    pm->nac = scratch_alloc(pm->nnz * sizeof(double));
+    pm->val = scratch_alloc(pm->nnz * sizeof(double complex));
+
+    k = 0;
+    for(ist = 0; ist < pst; ist++){
+        pm->row_ptr[ist] = k;
+        for(jst = 0; jst < pst; jst++){
+            ind_mol1 = get_d_ind[ist][0];
+            ind_mol2 = get_d_ind[jst][0];
+            l_photon = (get_d_ind[ist][1] == get_d_ind[jst][1]);
+            if(ist == jst || ham_d[ist][jst] != 0.0 || ham_d_old[ist][jst] != 0.0
+                || (l_photon && (nacme[ind_mol1][ind_mol2] != 0.0 || nacme_old[ind_mol1][ind_mol2] != 0.0))){
+                pm->col_ind[k] = jst;
+                pm->ham_old[k] = ham_d_old[ist][jst];
+                pm->ham[k] = ham_d[ist][jst];
+                pm->nac_old[k] = 0.0;
+                pm->nac[k] = 0.0;
+                if(l_photon){
+                    pm->nac_old[k] = nacme_old[ind_mol1][ind_mol2];
+                    pm->nac[k] = nacme[ind_mol1][ind_mol2];
+                }
+                k++;
+            }
+        }
+    }
+    pm->row_ptr[pst] = k;
+
+}
+
+// Routine to interpolate the saved terms between time t and t + dt at the electronic substep
+static void prop_mat_interpolate(struct prop_mat *pm, int iestep, double frac){
+
+    int ist, k;
+    double erel, tmp1, tmp2;
+
+    // Save the lowest energy at current electronic step, the first saved term is the (0, 0) diagonal term
+    erel = pm->ham_old[0] + (pm->ham[0] - pm->ham_old[0]) * (double)iestep * frac;
+
+    for(ist = 0; ist < pm->pst; ist++){
+        for(k = pm->row_ptr[ist]; k < pm->row_ptr[ist + 1]; k++){
+            tmp1 = pm->ham_old[k] + (pm->ham[k] - pm->ham_old[k]) * (double)iestep * frac;
+            // To increase the stability of electronic propagation, subtract the relative energy
+            if(pm->col_ind[k] == ist){
+                tmp1 -= erel;
+            }
+            tmp2 = pm->nac_old[k] + (pm->nac[k] - pm->nac_old[k]) * (double)iestep * frac;
+            pm->val[k] = - 1.0 * tmp1 * I - tmp2;
+        }
+    }
+
+}
+
+#endif
@@ -14,11 +14,32 @@ static void rk4_coef(int pst, int nesteps, double dt, int **get_d_ind, double **
 //    double **nacme, double **nacme_old, double complex **rho);
 
 // Interface routine for propagation scheme in rk4 propagator
-static void rk4(int pst, int nesteps, double dt, char *elec_object, int **get_d_ind, double **ham_d,
-    double **ham_d_old, double **nacme, double **nacme_old, double complex *coef_d){
+// Arrays are contiguous buffers with shapes of (pst), (pst, 2), (pst, pst) or (nst, nst), which are changed in place
+static void rk4(int nst, int pst, int nesteps, double dt, char *elec_object, int *get_d_ind, double *ham_d,
+    double *ham_d_old, double *nacme, double *nacme_old, double complex *coef_d){
+
+    int *get_d_ind_rows[pst];
+    double *ham_d_rows[pst];
+    double *ham_d_old_rows[pst];
+    double *nacme_rows[nst];
+    double *nacme_old_rows[nst];
+
+    int ist;
+
+    // Row pointers refer to the buffers directly, hence the data are not copied
+    for(ist = 0; ist < pst; ist++){
+        get_d_ind_rows[ist] = get_d_ind + ist * 2;
+        ham_d_rows[ist] = ham_d + ist * pst;
+        ham_d_old_rows[ist] = ham_d_old + ist * pst;
+    }
+
+    for(ist = 0; ist < nst; ist++){
+        nacme_rows[ist] = nacme + ist * nst;
+        nacme_old_rows[ist] = nacme_old + ist * nst;
+    }
 
     if(strcmp(elec_object, "coefficient") == 0){
-        rk4_coef(pst, nesteps, dt, get_d_ind, ham_d, ham_d_old, nacme, nacme_old, coef_d);
+        rk4_coef(pst, nesteps, dt, get_d_ind_rows, ham_d_rows, ham_d_old_rows, nacme_rows, nacme_old_rows, coef_d);
     }
 //    else if(strcmp(elec_object, "density") == 0){
 //        rk4_rho(nst, nesteps, dt, energy, energy_old, nacme, nacme_old, rho);
@@ -30,23 +51,23 @@ static void rk4(int pst, int nesteps, double dt, char *elec_object, int **get_d_
 static void rk4_coef(int pst, int nesteps, double dt, int **get_d_ind, double **ham_d,
     double **ham_d_old, double **nacme, double **nacme_old, double complex *coef_d){
 
-    double complex *k1 = malloc(pst * sizeof(double complex));
-    double complex *k2 = malloc(pst * sizeof(double complex));
-    double complex *k3 = malloc(pst * sizeof(double complex));
-    double complex *k4 = malloc(pst * sizeof(double complex));
-    double complex *kfunction = malloc(pst * sizeof(double complex));
-    double complex *variation = malloc(pst * sizeof(double complex));
-    double complex *c_dot = malloc(pst * sizeof(double complex));
-    double complex *coef_new = malloc(pst * sizeof(double complex));
-    double complex **prop_mat_d = malloc(pst * sizeof(double complex*));
+    size_t mark = scratch_mark();
+    double complex *k1 = scratch_alloc(pst * sizeof(double complex));
+    double complex *k2 = scratch_alloc(pst * sizeof(double complex));
+    double complex *k3 = scratch_alloc(pst * sizeof(double complex));
+    double complex *k4 = scratch_alloc(pst * sizeof(double complex));
+    double complex *kfunction = scratch_alloc(pst * sizeof(double complex));
+    double complex *variation = scratch_alloc(pst * sizeof(double complex));
+    double complex *c_dot = scratch_alloc(pst * sizeof(double complex));
+    double complex *coef_new = scratch_alloc(pst * sizeof(double complex));
 
-    int ist, jst, iestep, ind_mol1, ind_mol2, ind_photon1, ind_photon2;
+    struct prop_mat prop_mat_d;
+    int ist, iestep;
     // TODO : Is norm necessary?
-    double frac, edt, erel, tmp1, tmp2;//, norm;
+    double frac, edt;//, norm;
 
-    for(ist = 0; ist < pst; ist++){
-        prop_mat_d[ist] = malloc(pst * sizeof(double complex));
-    }
+    // Pattern of the propagation matrix is fixed during the nuclear step
+    prop_mat_init(&prop_mat_d, pst, get_d_ind, ham_d, ham_d_old, nacme, nacme_old);
 
     frac = 1.0 / (double)nesteps;
     edt = dt * frac;
@@ -54,35 +75,10 @@ static void rk4_coef(int pst, int nesteps, double dt, int **get_d_ind, double **
     for(iestep = 0; iestep < nesteps; iestep++){
 
         // Interpolate ham_d and NACME terms between time t and t + dt
-        for(ist = 0; ist < pst; ist++){
-            ind_mol1 = get_d_ind[ist][0];
-            ind_photon1 = get_d_ind[ist][1];
-            for(jst = 0; jst < pst; jst++){
-                ind_mol2 = get_d_ind[jst][0];
-                ind_photon2 = get_d_ind[jst][1];
-
-                tmp1 = ham_d_old[ist][jst] + (ham_d[ist][jst] - ham_d_old[ist][jst])
-                    * (double)iestep * frac;
-                // Save the lowest energy at current electronic step
-                if(ist == 0 && jst == 0){
-                    erel = tmp1;
-                }
-                // To increase the stability of electronic propagation, subtract the relative energy
-                if(ist == jst){
-                    tmp1 -= erel;
-                }
-                tmp2 = 0.0;
-                if(ind_photon1 == ind_photon2){
-                    tmp2 = nacme_old[ind_mol1][ind_mol2] + (nacme[ind_mol1][ind_mol2] - nacme_old[ind_mol1][ind_mol2])
-                        * (double)iestep * frac;
-                }
-                prop_mat_d[ist][jst] = - 1.0 * tmp1 * I - tmp2;
-
-            }
-        }
+        prop_mat_interpolate(&prop_mat_d, iestep, frac);
 
         // Calculate k1
-        cdot(pst, prop_mat_d, coef_d, c_dot);
+        cdot(&prop_mat_d, coef_d, c_dot);
 
         for(ist = 0; ist < pst; ist++){
             k1[ist] = edt * c_dot[ist];
@@ -91,7 +87,7 @@ static void rk4_coef(int pst, int nesteps, double dt, int **get_d_ind, double **
         }
 
         // Calculate k2
-        cdot(pst, prop_mat_d, coef_new, c_dot);
+        cdot(&prop_mat_d, coef_new, c_dot);
 
         for(ist = 0; ist < pst; ist++){
             k2[ist] = edt * c_dot[ist];
@@ -100,7 +96,7 @@ static void rk4_coef(int pst, int nesteps, double dt, int **get_d_ind, double **
         }
 
         // Calculate k3
-        cdot(pst, prop_mat_d, coef_new, c_dot);
+        cdot(&prop_mat_d, coef_new, c_dot);
 
         for(ist = 0; ist < pst; ist++){
             k3[ist] = edt * c_dot[ist];
@@ -109,7 +105,7 @@ static void rk4_coef(int pst, int nesteps, double dt, int **get_d_ind, double **
         }
 
         // Calculate k4
-        cdot(pst, prop_mat_d, coef_new, c_dot);
+        cdot(&prop_mat_d, coef_new, c_dot);
 
         for(ist = 0; ist < pst; ist++){
             k4[ist] = edt * c_dot[ist];
@@ -128,19 +124,7 @@ static void rk4_coef(int pst, int nesteps, double dt, int **get_d_ind, double **
 
     }
 
-    for(ist = 0; ist < pst; ist++){
-        free(prop_mat_d[ist]);
-    }
-
-    free(k1);
-    free(k2);
-    free(k3);
-    free(k4);
-    free(kfunction);
-    free(variation);
-    free(c_dot);
-    free(coef_new);
-    free(prop_mat_d);
+    scratch_release(mark);
 
 }
 
@@ -20,14 +20,62 @@ static void rk4_coef(int nat, int ndim, int pst, int nesteps, int verbosity, dou
 //    int verbosity, double *dotpopdec);
 
 // Interface routine for propagation scheme in rk4 propagator
-static void rk4(int nat, int ndim, int pst, int nesteps, int verbosity, double dt, char *elec_object,
-    int *l_coh, double *mass, double *sigma, int **get_d_ind, double **unitary, double **ham_d,
-    double **ham_d_old, double **nacme, double **nacme_old, double **pos, double ***aux_pos,
-    double ***phase, double *dotpopdec_d, double complex *coef_d, double **qmom){
+// Arrays are contiguous buffers with shapes of (pst), (nat), (pst, 2), (pst, pst), (nst, nst), (nat, ndim)
+// or (pst, nat, ndim), which are changed in place
+static void rk4(int nat, int ndim, int nst, int pst, int nesteps, int verbosity, double dt, char *elec_object,
+    int *l_coh, double *mass, double *sigma, int *get_d_ind, double *unitary, double *ham_d,
+    double *ham_d_old, double *nacme, double *nacme_old, double *pos, double *aux_pos,
+    double *phase, double *dotpopdec_d, double complex *coef_d, double *qmom){
+
+    int *get_d_ind_rows[pst];
+    double *ham_d_rows[pst];
+    double *ham_d_old_rows[pst];
+    double *nacme_rows[nst];
+    double *nacme_old_rows[nst];
+    double *unitary_rows[pst];
+    double *pos_rows[nat];
+    double *qmom_rows[nat];
+    double *aux_pos_rows[pst * nat];
+    double *phase_rows[pst * nat];
+    double **aux_pos_mats[pst];
+    double **phase_mats[pst];
+
+    int ist, iat;
+
+    // Row pointers refer to the buffers directly, hence the data are not copied
+    for(ist = 0; ist < pst; ist++){
+        get_d_ind_rows[ist] = get_d_ind + ist * 2;
+        ham_d_rows[ist] = ham_d + ist * pst;
+        ham_d_old_rows[ist] = ham_d_old + ist * pst;
+    }
+
+    for(ist = 0; ist < nst; ist++){
+        nacme_rows[ist] = nacme + ist * nst;
+        nacme_old_rows[ist] = nacme_old + ist * nst;
+    }
+
+    for(ist = 0; ist < pst; ist++){
+        unitary_rows[ist] = unitary + ist * pst;
+    }
+
+    for(iat = 0; iat < nat; iat++){
+        pos_rows[iat] = pos + iat * ndim;
+        qmom_rows[iat] = qmom + iat * ndim;
+    }
+
+    for(ist = 0; ist < pst; ist++){
+        for(iat = 0; iat < nat; iat++){
+            aux_pos_rows[ist * nat + iat] = aux_pos + (ist * nat + iat) * ndim;
+            phase_rows[ist * nat + iat] = phase + (ist * nat + iat) * ndim;
+        }
+        aux_pos_mats[ist] = aux_pos_rows + ist * nat;
+        phase_mats[ist] = phase_rows + ist * nat;
+    }
 
     if(strcmp(elec_object, "coefficient") == 0){
-        rk4_coef(nat, ndim, pst, nesteps, verbosity, dt, l_coh, mass, sigma, get_d_ind, unitary,
-            ham_d, ham_d_old, nacme, nacme_old, pos, aux_pos, phase, dotpopdec_d, coef_d, qmom);
+        rk4_coef(nat, ndim, pst, nesteps, verbosity, dt, l_coh, mass, sigma, get_d_ind_rows, unitary_rows,
+            ham_d_rows, ham_d_old_rows, nacme_rows, nacme_old_rows, pos_rows, aux_pos_mats, phase_mats,
+            dotpopdec_d, coef_d, qmom_rows);
     }
 //    else if(strcmp(elec_object, "density") == 0){
 //        rk4_rho(nat, ndim, nst, nesteps, dt, l_coh, mass, energy, energy_old, sigma,
@@ -42,32 +90,32 @@ static void rk4_coef(int nat, int ndim, int pst, int nesteps, int verbosity, dou
     double **ham_d_old, double **nacme, double **nacme_old, double **pos, double ***aux_pos,
     double ***phase, double *dotpopdec_d, double complex *coef_d, double **qmom){
 
-    double complex *k1 = malloc(pst * sizeof(double complex));
-    double complex *k2 = malloc(pst * sizeof(double complex));
-    double complex *k3 = malloc(pst * sizeof(double complex));
-    double complex *k4 = malloc(pst * sizeof(double complex));
-    double complex *kfunction = malloc(pst * sizeof(double complex));
-    double complex *variation = malloc(pst * sizeof(double complex));
-    double complex *c_dot = malloc(pst * sizeof(double complex));
-    double complex *xf_c_dot = malloc(pst * sizeof(double complex));
-    double complex *coef_a = malloc(pst * sizeof(double complex));
-    double complex *coef_new = malloc(pst * sizeof(double complex));
-    double complex **prop_mat_d = malloc(pst * sizeof(double complex*));
-    double **dec_mat = malloc(pst * sizeof(double*));
-
-    int ist, jst, iestep, ind_mol1, ind_mol2, ind_photon1, ind_photon2;
+    size_t mark = scratch_mark();
+    double complex *k1 = scratch_alloc(pst * sizeof(double complex));
+    double complex *k2 = scratch_alloc(pst * sizeof(double complex));
+    double complex *k3 = scratch_alloc(pst * sizeof(double complex));
+    double complex *k4 = scratch_alloc(pst * sizeof(double complex));
+    double complex *kfunction = scratch_alloc(pst * sizeof(double complex));
+    double complex *variation = scratch_alloc(pst * sizeof(double complex));
+    double complex *c_dot = scratch_alloc(pst * sizeof(double complex));
+    double complex *xf_c_dot = scratch_alloc(pst * sizeof(double complex));
+    double complex *coef_a = scratch_alloc(pst * sizeof(double complex));
+    double complex *coef_new = scratch_alloc(pst * sizeof(double complex));
+    double **dec_mat = scratch_alloc(pst * sizeof(double*));
+
+    struct prop_mat prop_mat_d;
+    int ist, jst, iestep;
     int iat, isp;
     // TODO : Is norm necessary?
-    double frac, edt, erel, tmp1, tmp2;//, norm;
+    double frac, edt;//, norm;
     double rho;
 
     for(ist = 0; ist < pst; ist++){
-        prop_mat_d[ist] = malloc(pst * sizeof(double complex));
+        dec_mat[ist] = scratch_alloc(pst * sizeof(double));
     }
 
-    for(ist = 0; ist < pst; ist++){
-        dec_mat[ist] = malloc(pst * sizeof(double));
-    }
+    // Pattern of the propagation matrix is fixed during the nuclear step
+    prop_mat_init(&prop_mat_d, pst, get_d_ind, ham_d, ham_d_old, nacme, nacme_old);
 
     frac = 1.0 / (double)nesteps;
     edt = dt * frac;
@@ -122,35 +170,10 @@ static void rk4_coef(int nat, int ndim, int pst, int nesteps, int verbosity, dou
         xf_cdot(pst, unitary, dec_mat, coef_a, xf_c_dot);
 
         // Interpolate ham_d and NACME terms between time t and t + dt
-        for(ist = 0; ist < pst; ist++){
-            ind_mol1 = get_d_ind[ist][0];
-            ind_photon1 = get_d_ind[ist][1];
-            for(jst = 0; jst < pst; jst++){
-                ind_mol2 = get_d_ind[jst][0];
-                ind_photon2 = get_d_ind[jst][1];
-
-                tmp1 = ham_d_old[ist][jst] + (ham_d[ist][jst] - ham_d_old[ist][jst])
-                    * (double)iestep * frac;
-                // Save the lowest energy at current electronic step
-                if(ist == 0 && jst == 0){
-                    erel = tmp1;
-                }
-                // To increase the stability of electronic propagation, subtract the relative energy
-                if(ist == jst){
-                    tmp1 -= erel;
-                }
-                tmp2 = 0.0;
-                if(ind_photon1 == ind_photon2){
-                    tmp2 = nacme_old[ind_mol1][ind_mol2] + (nacme[ind_mol1][ind_mol2] - nacme_old[ind_mol1][ind_mol2])
-                        * (double)iestep * frac;
-                }
-                prop_mat_d[ist][jst] = - 1.0 * tmp1 * I - tmp2;
-
-            }
-        }
+        prop_mat_interpolate(&prop_mat_d, iestep, frac);
 
         // Calculate k1
-        cdot(pst, prop_mat_d, coef_d, c_dot);
+        cdot(&prop_mat_d, coef_d, c_dot);
 
         for(ist = 0; ist < pst; ist++){
             k1[ist] = edt * (c_dot[ist] + xf_c_dot[ist]);
@@ -159,7 +182,7 @@ static void rk4_coef(int nat, int ndim, int pst, int nesteps, int verbosity, dou
         }
 
         // Calculate k2
-        cdot(pst, prop_mat_d, coef_new, c_dot);
+        cdot(&prop_mat_d, coef_new, c_dot);
 
         for(ist = 0; ist < pst; ist++){
             k2[ist] = edt * (c_dot[ist] + xf_c_dot[ist]);
@@ -168,7 +191,7 @@ static void rk4_coef(int nat, int ndim, int pst, int nesteps, int verbosity, dou
         }
 
         // Calculate k3
-        cdot(pst, prop_mat_d, coef_new, c_dot);
+        cdot(&prop_mat_d, coef_new, c_dot);
 
         for(ist = 0; ist < pst; ist++){
             k3[ist] = edt * (c_dot[ist] + xf_c_dot[ist]);
@@ -177,7 +200,7 @@ static void rk4_coef(int nat, int ndim, int pst, int nesteps, int verbosity, dou
         }
 
         // Calculate k4
-        cdot(pst, prop_mat_d, coef_new, c_dot);
+        cdot(&prop_mat_d, coef_new, c_dot);
 
         for(ist = 0; ist < pst; ist++){
             k4[ist] = edt * (c_dot[ist] + xf_c_dot[ist]);
@@ -201,25 +224,7 @@ static void rk4_coef(int nat, int ndim, int pst, int nesteps, int verbosity, dou
         xf_print_coef(pst, unitary, dec_mat, coef_d, coef_a, dotpopdec_d);
     }
 
-    for(ist = 0; ist < pst; ist++){
-        free(prop_mat_d[ist]);
-    }
-    for(ist = 0; ist < pst; ist++){
-        free(dec_mat[ist]);
-    }
-
-    free(k1);
-    free(k2);
-    free(k3);
-    free(k4);
-    free(kfunction);
-    free(variation);
-    free(c_dot);
-    free(xf_c_dot);
-    free(coef_a);
-    free(coef_new);
-    free(prop_mat_d);
-    free(dec_mat);
+    scratch_release(mark);
 
 }
 
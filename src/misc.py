@@ -1,5 +1,5 @@
 from functools import wraps
-import sys, time, os
+import sys, time, os, atexit
 import numpy as np
 
 # Atomic weight
@@ -62,6 +62,121 @@ def elapsed_time(func):
 def call_name():
     return sys._getframe(1).f_code.co_name
 
+class Output_Writer(object):
+    """ Class for output files written with buffers in memory during dynamics.
+        The text of each file is kept in memory and appended to the file at once when the buffer is full,
+        when the flush interval is passed, or when it is requested, hence the files are not kept open.
+        Rows of binary arrays are kept in memory and appended to the files in chunks
+
+        :param integer buffer_size: Size (byte) of buffer for each output file
+        :param double flush_interval: Wall-clock time (s) between flushes of all output files
+        :param integer chunk_size: Number of rows appended at once to a binary array file
+    """
+    def __init__(self, buffer_size=65536, flush_interval=10., chunk_size=100):
+        # Initialize input values
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.chunk_size = chunk_size
+
+        # Fileopen mode, strings and size of the buffer for each output file
+        self.texts = {}
+        self.arrays = {}
+        self.time_flush = time.time()
+
+    def write(self, string, file_name, mode):
+        """ Write a string to the buffer of the output file, the buffer is discarded
+            and the file is truncated at next flush if it is opened with write mode
+
+            :param string string: Text string for output file
+            :param string file_name: Name of output file
+            :param string mode: Fileopen mode
+        """
+        if (mode != "a" or not file_name in self.texts):
+            self.texts[file_name] = [mode, [], 0]
+        text = self.texts[file_name]
+        text[1].append(string)
+        text[2] += len(string)
+
+        if (text[2] >= self.buffer_size):
+            self.write_text(file_name)
+
+        if (time.time() - self.time_flush >= self.flush_interval):
+            self.flush()
+
+    def write_text(self, file_name):
+        """ Write the buffer to the output file, the file is opened only while it is written
+
+            :param string file_name: Name of output file
+        """
+        mode, strings, size = self.texts.pop(file_name)
+        with open(file_name, mode) as f:
+            f.write("".join(strings))
+
+    def write_array(self, array, file_name):
+        """ Add a row to the binary array file, the rows are appended when a chunk is filled
+
+            :param double,complex,integer array: Row to be appended
+            :param string file_name: Name of binary array file
+        """
+        rows = self.arrays.setdefault(file_name, [])
+        rows.append(np.array(array))
+
+        if (len(rows) >= self.chunk_size):
+            append_npy(file_name, np.stack(rows))
+            rows.clear()
+
+        if (time.time() - self.time_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """ Flush buffers of all output files
+        """
+        for file_name in list(self.texts.keys()):
+            self.write_text(file_name)
+        for file_name, rows in self.arrays.items():
+            if (len(rows) > 0):
+                append_npy(file_name, np.stack(rows))
+                rows.clear()
+        self.time_flush = time.time()
+
+    def close(self):
+        """ Close all output files
+        """
+        self.flush()
+        self.texts = {}
+        self.arrays = {}
+
+
+# Output writer used by typewriter, None if every output is written directly
+output_writer = None
+
+def open_output_writer(buffer_size=65536, flush_interval=10.):
+    """ Function to start writing outputs with the buffered output writer
+
+        :param integer buffer_size: Size (byte) of buffer for each output file
+        :param double flush_interval: Wall-clock time (s) between flushes of all output files
+    """
+    global output_writer
+    close_output_writer()
+    output_writer = Output_Writer(buffer_size, flush_interval)
+
+def flush_output_writer():
+    """ Function to flush buffers of the output writer
+    """
+    if (output_writer != None):
+        output_writer.flush()
+
+def close_output_writer():
+    """ Function to close the output writer, outputs are written directly after closing
+    """
+    global output_writer
+    if (output_writer != None):
+        output_writer.close()
+        output_writer = None
+
+# Buffers are written even when the dynamics is terminated by an exception
+atexit.register(close_output_writer)
+
 def typewriter(string, dir_name, filename, mode):
     """ Function to open/write any string in dir_name/filename
 
@@ -71,8 +186,97 @@ def typewriter(string, dir_name, filename, mode):
         :param string mode: Fileopen mode
     """
     tmp_name = os.path.join(dir_name, filename)
-    with open(tmp_name, mode) as f:
-        f.write(string + "\n")
+    if (output_writer != None):
+        output_writer.write(string + "\n", os.path.abspath(tmp_name), mode)
+    else:
+        with open(tmp_name, mode) as f:
+            f.write(string + "\n")
+
+def arraywriter(array, dir_name, filename):
+    """ Function to append a row to the binary array in dir_name/filename
+
+        :param double,complex,integer array: Row to be appended
+        :param string dir_name: Directory of binary array file
+        :param string filename: Filename of binary array file
+    """
+    tmp_name = os.path.join(dir_name, filename)
+    if (output_writer != None):
+        output_writer.write_array(array, os.path.abspath(tmp_name))
+    else:
+        append_npy(tmp_name, np.array(array)[np.newaxis])
+
+# Binary arrays are saved in the NumPy format with a fixed size of header,
+# hence the number of rows in the header can be updated in place after appending rows
+npy_header_size = 256
+
+def write_npy_header(f, dtype, shape):
+    """ Function to write the header of binary array file
+
+        :param object f: File object of binary array file
+        :param object dtype: Data type of the array
+        :param integer,tuple shape: Shape of the array
+    """
+    header = repr({"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": tuple(shape)})
+    header = header.ljust(npy_header_size - 10 - 1) + "\n"
+    f.seek(0)
+    f.write(np.lib.format.magic(1, 0) + np.uint16(len(header)).tobytes() + header.encode("latin1"))
+
+def read_npy_header(f):
+    """ Function to read the header of binary array file, the data type and shape are returned
+
+        :param object f: File object of binary array file
+    """
+    f.seek(0)
+    np.lib.format.read_magic(f)
+    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    return dtype, shape
+
+def append_npy(file_name, rows):
+    """ Function to append rows to the binary array file, the file is made if not present
+
+        :param string file_name: Name of binary array file
+        :param double,complex,integer rows: Rows to be appended
+    """
+    rows = np.ascontiguousarray(rows)
+    if (not os.path.exists(file_name)):
+        with open(file_name, "wb") as f:
+            write_npy_header(f, rows.dtype, (0,) + rows.shape[1:])
+
+    with open(file_name, "r+b") as f:
+        dtype, shape = read_npy_header(f)
+        if (dtype != rows.dtype or shape[1:] != rows.shape[1:]):
+            error_message = "Rows are not compatible with the binary array file!"
+            error_vars = f"file_name = {file_name}, dtype = {dtype}, shape = {shape}, rows.dtype = {rows.dtype}, rows.shape = {rows.shape}"
+            raise ValueError (f"( {call_name()} ) {error_message} ( {error_vars} )")
+
+        # Rows beyond the number in the header are overwritten, e.g. those of an interrupted append
+        f.seek(npy_header_size + shape[0] * rows[0].nbytes)
+        f.write(rows.tobytes())
+        f.truncate()
+        write_npy_header(f, dtype, (shape[0] + rows.shape[0],) + shape[1:])
+
+def truncate_npy(file_name, nrows):
+    """ Function to keep only the first rows of the binary array file
+
+        :param string file_name: Name of binary array file
+        :param integer nrows: Number of rows to be kept
+    """
+    with open(file_name, "r+b") as f:
+        dtype, shape = read_npy_header(f)
+        nrows = min(nrows, shape[0])
+        f.truncate(npy_header_size + nrows * dtype.itemsize * int(np.prod(shape[1:])))
+        write_npy_header(f, dtype, (nrows,) + shape[1:])
+
+def read_binary(unixmd_dir):
+    """ Function to read binary outputs of a trajectory, the arrays are memory-mapped without loading
+
+        :param string unixmd_dir: Directory where MD output files are written
+    """
+    arrays = {}
+    for file_name in sorted(os.listdir(unixmd_dir)):
+        if (file_name.endswith(".npy")):
+            arrays[file_name[:-4]] = np.load(os.path.join(unixmd_dir, file_name), mmap_mode="r")
+    return arrays
 
 def gaussian1d(x, const, sigma, x0):
     if (sigma < 0.0):
@@ -4,19 +4,45 @@ import textwrap
 import numpy as np
 
 class State(object):
-    """ Class for BO states
+    """ Class for BO states. Energies and coefficients of the states are saved in contiguous arrays
+        of the molecule object, hence the electronic propagators use them without copying
 
         :param integer ndim: Dimension of space
         :param integer nat: Number of atoms
+        :param object mol: Molecule object where energies and coefficients are saved
+        :param integer ist: Index for the state
     """
-    def __init__(self, ndim, nat):
+    def __init__(self, ndim, nat, mol, ist):
         # Initialize variables
-        self.energy = 0.
-        self.energy_old = 0.
+        self.mol = mol
+        self.ist = ist
         self.force = np.zeros((nat, ndim))
-        self.coef = 0. + 0.j
         self.multiplicity = 1
 
+    @property
+    def energy(self):
+        return self.mol.energy[self.ist]
+
+    @energy.setter
+    def energy(self, energy):
+        self.mol.energy[self.ist] = energy
+
+    @property
+    def energy_old(self):
+        return self.mol.energy_old[self.ist]
+
+    @energy_old.setter
+    def energy_old(self, energy_old):
+        self.mol.energy_old[self.ist] = energy_old
+
+    @property
+    def coef(self):
+        return self.mol.coef[self.ist]
+
+    @coef.setter
+    def coef(self, coef):
+        self.mol.coef[self.ist] = coef
+
 
 class Molecule(object):
     """ Class for a molecule object including State objects
@@ -108,15 +134,21 @@ class Molecule(object):
                 self.ndof = ndof
 
         # Initialize BO states
+        self.energy = np.zeros(self.nst)
+        self.energy_old = np.zeros(self.nst)
+        self.coef = np.zeros(self.nst, dtype=np.complex128)
+
         self.states = []
         for ist in range(self.nst):
-            self.states.append(State(self.ndim, self.nat))
+            self.states.append(State(self.ndim, self.nat, self, ist))
 
         # Initialize couplings
         self.nacme = np.zeros((self.nst, self.nst))
         self.nacme_old = np.zeros((self.nst, self.nst))
         self.socme = np.zeros((self.nst, self.nst), dtype=np.complex128)
         self.socme_old = np.zeros((self.nst, self.nst), dtype=np.complex128)
+        # Overlap matrix between BO states at time t and t + dt, S_ij = <Psi_i(t)|Psi_j(t + dt)>
+        self.st_overlap = np.identity(self.nst)
 
         # Initialize other properties
         self.nac = np.zeros((self.nst, self.nst, self.nat_qm, self.ndim))
@@ -129,6 +161,7 @@ class Molecule(object):
         self.etot = 0.
 
         self.l_nacme = False
+        self.l_st_overlap = False
 
         # Initialize point charges for QM/MM calculations
         if (self.l_qmmm):
@@ -261,14 +294,34 @@ class Molecule(object):
 
             :param boolean calc_coupling: Check whether the dynamics includes coupling calculation
         """
-        for states in self.states:
-            states.energy_old = states.energy
+        self.energy_old[:] = self.energy
 
         if (calc_coupling):
             self.nacme_old = np.copy(self.nacme)
             if (not self.l_nacme):
                 self.nac_old = np.copy(self.nac)
 
+    def update_bo(self, molecule):
+        """ Copy BO quantities calculated in another molecule object, e.g. a copy returned from a worker process
+            Arrays referred by the states are copied in place, hence the states and the ensemble keep their references
+
+            :param object molecule: Molecule object where BO quantities are calculated
+        """
+        self.energy[:] = molecule.energy
+        for state, state_qm in zip(self.states, molecule.states):
+            state.force = np.copy(state_qm.force)
+
+        self.nacme = np.copy(molecule.nacme)
+        self.nac = np.copy(molecule.nac)
+        self.st_overlap = np.copy(molecule.st_overlap)
+        self.l_nacme = molecule.l_nacme
+        self.l_st_overlap = molecule.l_st_overlap
+
+        # Quantities only calculated in some QM or MM programs
+        for name in ["tdp", "tdp_grad", "mm_charge"]:
+            if (hasattr(molecule, name)):
+                setattr(self, name, np.copy(getattr(molecule, name)))
+
     def get_nr_electrons(self):
         """ Get the number of electrons
         """
@@ -331,6 +384,55 @@ class Molecule(object):
                 error_vars = f"(MQC) init_coef = {coef}"
                 raise TypeError (f"( {self.mol_type}.{call_name()} ) {error_message} ( {error_vars} )")
 
+    def get_checkpoint(self):
+        """ Get dynamical variables of molecule to be saved in a checkpoint
+        """
+        state = {}
+        for var in ["pos", "vel", "rho", "nac", "nac_old", "nacme", "nacme_old", "socme", "socme_old", \
+            "st_overlap", "ekin", "ekin_qm", "epot", "etot"]:
+            state[var] = getattr(self, var)
+
+        state["states"] = []
+        for states in self.states:
+            state["states"].append({"energy": states.energy, "energy_old": states.energy_old, \
+                "force": states.force, "coef": states.coef})
+
+        return state
+
+    def set_checkpoint(self, state):
+        """ Set dynamical variables of molecule read from a checkpoint
+
+            :param dictionary state: Dynamical variables of molecule
+        """
+        for var, value in state.items():
+            if (var != "states"):
+                setattr(self, var, value)
+
+        for states, st_state in zip(self.states, state["states"]):
+            for var, value in st_state.items():
+                setattr(states, var, value)
+
+    def __setstate__(self, state):
+        """ Restore molecule object from a pickle, e.g. RESTART.bin file
+            Energies and coefficients saved in State objects of old pickles are moved into the arrays of molecule
+
+            :param dictionary state: Attributes of molecule
+        """
+        self.__dict__.update(state)
+
+        # Attributes of State objects are read from __dict__, since the properties shadow them
+        if (len(self.states) > 0 and "energy" in self.states[0].__dict__):
+            self.energy = np.array([states.__dict__.pop("energy") for states in self.states])
+            self.energy_old = np.array([states.__dict__.pop("energy_old") for states in self.states])
+            self.coef = np.array([states.__dict__.pop("coef") for states in self.states], dtype=np.complex128)
+            for ist, states in enumerate(self.states):
+                states.mol = self
+                states.ist = ist
+
+        if (not hasattr(self, "st_overlap")):
+            self.st_overlap = np.identity(self.nst)
+            self.l_st_overlap = False
+
     def print_init(self, mm):
         """ Print initial information about molecule.py
 
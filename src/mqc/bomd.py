@@ -1,6 +1,6 @@
 from __future__ import division
 from mqc.mqc import MQC
-from misc import au_to_K, call_name
+from misc import au_to_K, call_name, close_output_writer
 import os, shutil, textwrap
 import numpy as np
 import pickle
@@ -21,11 +21,12 @@ class BOMD(MQC):
     def __init__(self, molecule, thermostat=None, istate=0, dt=0.5, nsteps=1000, \
         l_adj_nac=False, unit_dt="fs", out_freq=1, verbosity=0):
         # Initialize input values
-        super().__init__(molecule, thermostat, istate, dt, nsteps, None, None, None, \
+        super().__init__(molecule, thermostat, istate, dt, nsteps, None, None, None, None, None, \
             False, l_adj_nac, None, unit_dt, out_freq, verbosity)
 
     def run(self, qm, mm=None, output_dir="./", l_coupling=False, l_save_bin=False, \
-        l_save_qm_log=False, l_save_mm_log=False, l_save_scr=True, restart=None):
+        l_save_qm_log=False, l_save_mm_log=False, l_save_scr=True, restart=None, checkpoint=None, \
+        output_format="text"):
         """ Run MQC dynamics according to BOMD
 
             :param object qm: QM object containing on-the-fly calculation information
@@ -37,6 +38,8 @@ class BOMD(MQC):
             :param boolean l_save_mm_log: Logical for saving MM calculation log
             :param boolean l_save_scr: Logical for saving scratch directory
             :param string restart: Option for controlling dynamics restarting
+            :param object checkpoint: Checkpoint object to save only the dynamical state of dynamics
+            :param string output_format: Format of MD output files
         """
         # Initialize PyUNIxMD
         qm.calc_coupling = l_coupling
@@ -44,7 +47,7 @@ class BOMD(MQC):
         qm.calc_tdp_grad = False
         base_dir, unixmd_dir, samp_bin_dir, qm_log_dir, mm_log_dir = \
             self.run_init(qm, mm, output_dir, l_coupling, l_save_bin, l_save_qm_log, \
-            l_save_mm_log, l_save_scr, restart)
+            l_save_mm_log, l_save_scr, restart, checkpoint, output_format)
         bo_list = [self.istate]
         self.print_init(qm, mm, l_coupling, restart)
 
@@ -115,6 +118,17 @@ class BOMD(MQC):
                 self.write_final_xyz(unixmd_dir, istep)
 
             self.fstep = istep
+            if (checkpoint != None and checkpoint.check(istep, self.nsteps)):
+                checkpoint.write(base_dir, self.get_checkpoint(), qm.get_checkpoint())
+
+        if (checkpoint != None):
+            checkpoint.wait()
+
+        # Write remaining buffers and close output files
+        close_output_writer()
+
+        # Without checkpoint, the whole objects are pickled only at the end of dynamics
+        if (checkpoint == None):
             restart_file = os.path.join(base_dir, "RESTART.bin")
             with open(restart_file, 'wb') as f:
                 pickle.dump({'qm':qm, 'md':self}, f)
@@ -1,11 +1,122 @@
 from __future__ import division
-from lib.libctmqc import el_run
+from lib.libctmqc import el_run_batch
 from mqc.mqc import MQC
-from misc import eps, au_to_K, au_to_A, call_name, typewriter, gaussian1d
-import os, shutil, textwrap
+from misc import eps, au_to_K, au_to_A, call_name, typewriter, arraywriter, open_output_writer, close_output_writer
+from transport import LocalTransport
+from ensemble import Ensemble
+from concurrent.futures import ProcessPoolExecutor
+import os, shutil, textwrap, copy, io, contextlib, traceback
 import numpy as np
 import pickle
 
+# QM object of the worker process, which keeps the data read once such as the basis set during dynamics
+qm_worker = None
+
+def init_qm_worker(qm, nthreads):
+    """ Initialize a worker process for QM calculations of trajectories
+
+        :param object qm: QM object containing on-the-fly calculation information
+        :param integer nthreads: Number of threads in the worker process
+    """
+    global qm_worker
+    if (nthreads != None):
+        for env_var in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+            os.environ[env_var] = f"{nthreads}"
+        if (hasattr(qm, "nthreads")):
+            qm.nthreads = nthreads
+    qm_worker = qm
+
+def run_qm_worker(molecule, qm_state, base_dir, bo_list, dt, istep):
+    """ Run QM calculation of a trajectory in a worker process
+
+        :param object molecule: Molecule object of the trajectory
+        :param dictionary qm_state: Variables of QM calculator of the trajectory at the previous step
+        :param string base_dir: Base directory of the trajectory
+        :param integer,list bo_list: List of BO states for BO calculation
+        :param double dt: Time interval
+        :param integer istep: Current MD step
+    """
+    # A worker runs the trajectories in any order, so the variables of the trajectory are restored
+    if (istep >= 0):
+        qm_worker.set_checkpoint(qm_state)
+    qm_worker.get_data(molecule, base_dir, bo_list, dt, istep, calc_force_only=False)
+    return molecule, qm_worker.get_checkpoint()
+
+def run_shard(comm, md, qm, itrajs, base_dirs, unixmd_dirs, bo_list, abs_path_output_dir, restart, checkpoint):
+    """ Run CTMQC dynamics for the trajectories owned by a shard
+
+        :param object comm: Communicator of the shard
+        :param object md: CT object
+        :param object qm: QM object containing on-the-fly calculation information
+        :param integer,list itrajs: Indices for trajectories owned by the shard
+        :param string,list base_dirs: Base directories of trajectories
+        :param string,list unixmd_dirs: PyUNIxMD directories of trajectories
+        :param integer,list bo_list: List of BO states for BO calculation
+        :param string abs_path_output_dir: Absolute path of output directory
+        :param string restart: Option for controlling dynamics restarting
+        :param object checkpoint: Checkpoint object to save only the dynamical state of dynamics
+    """
+    try:
+        md.run_dynamics(qm, comm, itrajs, base_dirs, unixmd_dirs, bo_list, abs_path_output_dir, restart, checkpoint)
+        comm.finalize(md.get_shard_state(itrajs))
+    except Exception:
+        # Outputs written before the error are kept
+        close_output_writer()
+        comm.abort(traceback.format_exc())
+
+def merge_shard_states(shard_states):
+    """ Merge the states of shards into a CT object
+
+        :param dictionary,list shard_states: List of states of shards
+    """
+    # Arrays of the first shard are kept to be merged, hence its object is copied
+    md = copy.copy(shard_states[0]['md'])
+    md.mols = [None] * md.ntrajs
+    md.qm_states = [None] * md.ntrajs
+    for var in ["phase", "qmom", "K_lk", "count_ntrajs", "sigma_lk", "slope_i", "g_i", "center_lk", "w_k", \
+        "w_pos", "gauss_error", "prod_g_i", "dotpopnac", "dotpopdec", "nsubsteps", "ncouplings"]:
+        if (isinstance(getattr(md, var, None), np.ndarray)):
+            value = getattr(md, var)
+            setattr(md, var, np.zeros((md.ntrajs,) + value.shape[1:], dtype=value.dtype))
+
+    # Trajectories of a shard are saved in the order of its indices
+    for shard_state in shard_states:
+        itrajs = shard_state['itrajs']
+        for itraj, mol, qm_state in zip(itrajs, shard_state['md'].mols, shard_state['md'].qm_states):
+            md.mols[itraj] = mol
+            md.qm_states[itraj] = qm_state
+        for var in ["phase", "qmom", "K_lk", "count_ntrajs", "sigma_lk", "slope_i", "g_i", "center_lk", "w_k", \
+            "w_pos", "gauss_error", "prod_g_i", "dotpopnac", "dotpopdec", "nsubsteps", "ncouplings"]:
+            if (isinstance(getattr(md, var, None), np.ndarray)):
+                getattr(md, var)[itrajs] = getattr(shard_state['md'], var)
+
+    # Ensemble is not saved in the states of shards, hence it is made again with the merged molecules
+    md.ens = Ensemble(md.mols)
+    md.mol = md.mols[0]
+    return md
+
+def read_shard_restart(output_dir="./"):
+    """ Read checkpoint files of shards and merge them into the objects for restart
+
+        :param string output_dir: Name of directory where checkpoint files are saved
+    """
+    shard_states = []
+    ishard = 1
+    restart_file = os.path.join(output_dir, f"RESTART_SHARD_{ishard}.bin")
+    while (os.path.exists(restart_file)):
+        with open(restart_file, 'rb') as f:
+            restart = pickle.load(f)
+        shard_states.append(restart['shard'])
+        ishard += 1
+        restart_file = os.path.join(output_dir, f"RESTART_SHARD_{ishard}.bin")
+
+    if (len(shard_states) == 0):
+        error_message = "Checkpoint files of shards not found!"
+        error_vars = f"output_dir = {output_dir}"
+        raise FileNotFoundError (f"( {call_name()} ) {error_message} ( {error_vars} )")
+
+    return {'qm':restart['qm'], 'md':merge_shard_states(shard_states)}
+
 class CT(MQC):
     """ Class for coupled-trajectory mixed quantum-classical (CTMQC) dynamics
 
@@ -17,6 +128,8 @@ class CT(MQC):
         :param integer nesteps: Total step of electronic propagation
         :param string elec_object: Electronic equation of motions
         :param string propagator: Electronic propagator
+        :param double elec_tol: Tolerance of local error in adaptive electronic propagators
+        :param double nac_threshold: Threshold of NACME terms neglected in electronic propagators
         :param boolean l_print_dm: Logical to print BO population and coherence
         :param boolean l_adj_nac: Adjust nonadiabatic coupling to align the phases
         :param double rho_threshold: Electronic density threshold for decoherence term calculation
@@ -26,14 +139,24 @@ class CT(MQC):
         :param double min_sigma: Minimum sigma value
         :param double const_dist_cutoff: Distance cutoff to construct Gaussian
         :param double const_center_cutoff: Distance cutoff to determine quantum momentum center
+        :param integer qmom_block_size: Number of trajectories in a block for pairwise quantum momentum quantities
+        :param string cutoff_search: Method to search trajectories within the distance cutoff
+        :param string gauss_transform: Method to calculate the sums of Gaussians for nuclear density
+        :param double gauss_tol: Relative tolerance of Gaussians to be neglected in the truncated Gauss transform
+        :param boolean l_gauss_diag: Logical to compare the truncated Gauss transform with the exact one
+        :param integer nworkers: Number of worker processes for QM calculations of trajectories
+        :param integer nthreads_worker: Number of threads for QM calculation in each worker process
+        :param integer nshards: Number of shards to distribute trajectories
+        :param object transport: Transport object for communication between shards
         :param string unit_dt: Unit of time interval
         :param integer out_freq: Frequency of printing output
         :param integer verbosity: Verbosity of output
     """
     def __init__(self, molecules, thermostat=None, istates=None, dt=0.5, nsteps=1000, nesteps=20, \
-        elec_object="coefficient", propagator="rk4", l_print_dm=True, l_adj_nac=True, rho_threshold=0.01, \
-        init_coefs=None, dist_parameter=10., min_sigma=0.3, const_dist_cutoff=None, const_center_cutoff=None, \
-        l_en_cons=False, unit_dt="fs", out_freq=1, verbosity=0):
+        elec_object="coefficient", propagator="rk4", elec_tol=1E-8, nac_threshold=0., l_print_dm=True, l_adj_nac=True, \
+        rho_threshold=0.01, init_coefs=None, dist_parameter=10., min_sigma=0.3, const_dist_cutoff=None, \
+        const_center_cutoff=None, qmom_block_size=256, cutoff_search="auto", gauss_transform="exact", gauss_tol=1E-10, \
+        l_gauss_diag=False, nworkers=1, nthreads_worker=None, nshards=1, transport=None, l_en_cons=False, unit_dt="fs", out_freq=1, verbosity=0):
         # Save name of MQC dynamics
         self.md_type = self.__class__.__name__
 
@@ -53,7 +176,8 @@ class CT(MQC):
 
         # Initialize input values and coefficient for first trajectory
         super().__init__(self.mols[0], thermostat, self.istates[0], dt, nsteps, nesteps, \
-            elec_object, propagator, l_print_dm, l_adj_nac, self.init_coefs[0], unit_dt, out_freq, verbosity)
+            elec_object, propagator, elec_tol, nac_threshold, l_print_dm, l_adj_nac, self.init_coefs[0], unit_dt, \
+            out_freq, verbosity)
 
         # Exception for electronic propagation
         if (self.elec_object != "coefficient"):
@@ -61,6 +185,11 @@ class CT(MQC):
             error_vars = f"elec_object = {self.elec_object}"
             raise NotImplementedError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
 
+        if (self.propagator in ["exponential", "krylov"]):
+            error_message = "Exponential operators are not implemented for CTMQC yet!"
+            error_vars = f"propagator = {self.propagator}"
+            raise NotImplementedError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
         # Exception for thermostat
         if (self.thermo != None):
             error_message = "Thermostat is not implemented yet!"
@@ -71,6 +200,9 @@ class CT(MQC):
         for itraj in range(1, self.ntrajs):
             self.mols[itraj].get_coefficient(self.init_coefs[itraj], self.istates[itraj])
 
+        # Data of all trajectories are saved in contiguous arrays of the ensemble
+        self.ens = Ensemble(self.mols)
+
         # Initialize variables for CTMQC
         self.phase = np.zeros((self.ntrajs, self.nst, self.nat_qm, self.ndim))
         self.nst_pair = int(self.nst * (self.nst - 1) / 2)
@@ -82,7 +214,6 @@ class CT(MQC):
         self.sigma_lk = np.ones((self.ntrajs, self.nst_pair, self.nat_qm, self.ndim))
         self.slope_i = np.zeros((self.ntrajs, self.nat_qm, self.ndim))
         self.g_i = np.zeros((self.ntrajs)) 
-        self.prod_g_i = np.ones((self.ntrajs, self.ntrajs))
         self.center_lk = np.zeros((self.ntrajs, self.nst_pair, self.nat_qm, self.ndim))
 
         # Determine parameters to calculate decoherenece effect
@@ -97,14 +228,86 @@ class CT(MQC):
         self.dist_parameter = dist_parameter
         self.const_center_cutoff = const_center_cutoff
 
+        self.qmom_block_size = qmom_block_size
+        if (self.qmom_block_size < 1):
+            error_message = "Number of trajectories in a block must be positive!"
+            error_vars = f"qmom_block_size = {self.qmom_block_size}"
+            raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        self.cutoff_search = cutoff_search.lower()
+        if not (self.cutoff_search in ["auto", "dense", "sorted"]):
+            error_message = "Invalid method to search trajectories within distance cutoff!"
+            error_vars = f"cutoff_search = {cutoff_search}"
+            raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        # Sorted coordinates are beneficial only for large number of trajectories
+        if (self.cutoff_search == "auto"):
+            if (self.ntrajs >= 100):
+                self.cutoff_search = "sorted"
+            else:
+                self.cutoff_search = "dense"
+
+        self.gauss_transform = gauss_transform.lower()
+        if not (self.gauss_transform in ["exact", "truncated"]):
+            error_message = "Invalid method to calculate sums of Gaussians!"
+            error_vars = f"gauss_transform = {gauss_transform}"
+            raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        self.gauss_tol = gauss_tol
+        if (self.gauss_tol <= 0. or self.gauss_tol >= 1.):
+            error_message = "Tolerance of Gaussians must be between 0 and 1!"
+            error_vars = f"gauss_tol = {self.gauss_tol}"
+            raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        self.l_gauss_diag = l_gauss_diag
+        if (self.l_gauss_diag and self.gauss_transform == "exact"):
+            error_message = "Diagnosis of Gauss transform is only available for truncated Gauss transform!"
+            error_vars = f"l_gauss_diag = {self.l_gauss_diag}, gauss_transform = {self.gauss_transform}"
+            raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+        # Relative errors of nuclear density and weighted sums of Gaussians for each trajectory
+        self.gauss_error = np.zeros((self.ntrajs, 2))
+
+        # Gaussians of every trajectory pair are saved only for the exact Gauss transform
+        self.prod_g_i = None
+        if (self.gauss_transform == "exact"):
+            self.prod_g_i = np.ones((self.ntrajs, self.ntrajs))
+
+        self.nworkers = nworkers
+        if (self.nworkers < 1):
+            error_message = "Number of worker processes must be positive!"
+            error_vars = f"nworkers = {self.nworkers}"
+            raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+        self.nthreads_worker = nthreads_worker
+
+        self.nshards = nshards
+        if (self.nshards < 1 or self.nshards > self.ntrajs):
+            error_message = "Number of shards must be positive and not larger than number of trajectories!"
+            error_vars = f"nshards = {self.nshards}, ntrajs = {self.ntrajs}"
+            raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        self.transport = transport
+        if (self.nshards > 1 and self.transport == None):
+            self.transport = LocalTransport()
+
         self.l_en_cons = l_en_cons
         self.dotpopnac = np.zeros((self.ntrajs, self.nst))
         self.dotpopdec = np.zeros((self.ntrajs, self.nst))
 
+        # Electronic substeps of each trajectory used in rk45 propagator
+        self.nsubsteps = np.zeros(self.ntrajs, dtype=int)
+
+        # NACME terms of each trajectory used in electronic propagation
+        self.ncouplings = np.zeros(self.ntrajs, dtype=int)
+
+        # Variables of QM calculator needed for the next MD step, such as the geometry, MO and CI coefficients
+        # of the previous step, are different for each trajectory, hence they are kept for each trajectory
+        self.qm_states = [{} for itraj in range(self.ntrajs)]
+
         # Initialize event to print
         self.event = {"DECO": []}
 
-    def run(self, qm, mm=None, output_dir="./", l_save_qm_log=False, l_save_mm_log=False, l_save_scr=True, restart=None):
+    def run(self, qm, mm=None, output_dir="./", l_save_qm_log=False, l_save_mm_log=False, l_save_scr=True, restart=None, \
+        checkpoint=None, output_format="text"):
         """ Run MQC dynamics according to CTMQC dynamics
 
             :param object qm: QM object containing on-the-fly calculation information
@@ -114,6 +317,8 @@ class CT(MQC):
             :param boolean l_save_mm_log: Logical for saving MM calculation log
             :param boolean l_save_scr: Logical for saving scratch directory
             :param string restart: Option for controlling dynamics restarting
+            :param object checkpoint: Checkpoint object to save only the dynamical state of dynamics
+            :param string output_format: Format of MD output files
         """
         # Initialize PyUNIxMD
         qm.calc_coupling = True
@@ -122,18 +327,70 @@ class CT(MQC):
         abs_path_output_dir = os.path.join(os.getcwd(), output_dir)
         base_dirs, unixmd_dirs, samp_bin_dirs, qm_log_dirs, mm_log_dirs = \
             self.run_init(qm, mm, output_dir, False, False, l_save_qm_log, l_save_mm_log, \
-            l_save_scr, restart)
+            l_save_scr, restart, checkpoint, output_format)
         bo_list = [ist for ist in range(self.nst)]
         self.print_init(qm, mm, restart)
 
+        if (self.nshards == 1):
+            itrajs = [itraj for itraj in range(self.ntrajs)]
+            self.run_dynamics(qm, None, itrajs, base_dirs, unixmd_dirs, bo_list, abs_path_output_dir, restart, checkpoint)
+        else:
+            # Each shard owns contiguous trajectories and propagates them in a separate process
+            itrajs_list = [[int(itraj) for itraj in itrajs] for itrajs in np.array_split(np.arange(self.ntrajs), self.nshards)]
+            args_list = [(self, qm, itrajs, base_dirs, unixmd_dirs, bo_list, abs_path_output_dir, restart, checkpoint) \
+                for itrajs in itrajs_list]
+            # Buffers must be written before the shards are forked
+            close_output_writer()
+            self.transport.launch(run_shard, args_list)
+            shard_states = self.transport.serve()
+
+            # Collect the trajectories from shards to keep the final state of dynamics
+            transport = self.transport
+            self.__dict__.update(merge_shard_states(shard_states).__dict__)
+            self.transport = transport
+
+        # Delete scratch directory
+        if (not l_save_scr):
+            for itraj in range(self.ntrajs):
+                tmp_dir = os.path.join(unixmd_dirs[itraj], "scr_qm")
+                if (os.path.exists(tmp_dir)):
+                    shutil.rmtree(tmp_dir)
+
+    def run_dynamics(self, qm, comm, itrajs, base_dirs, unixmd_dirs, bo_list, abs_path_output_dir, restart, checkpoint):
+        """ Routine to propagate the trajectories owned by a shard
+
+            :param object qm: QM object containing on-the-fly calculation information
+            :param object comm: Communicator of the shard, None if the trajectories are not sharded
+            :param integer,list itrajs: Indices for trajectories owned by the shard
+            :param string,list base_dirs: Base directories of trajectories
+            :param string,list unixmd_dirs: PyUNIxMD directories of trajectories
+            :param integer,list bo_list: List of BO states for BO calculation
+            :param string abs_path_output_dir: Absolute path of output directory
+            :param string restart: Option for controlling dynamics restarting
+            :param object checkpoint: Checkpoint object to save only the dynamical state of dynamics
+        """
+        # QM calculations of trajectories are independent, hence they can be run concurrently
+        executor = None
+        if (self.nworkers > 1):
+            executor = ProcessPoolExecutor(max_workers=self.nworkers, initializer=init_qm_worker, \
+                initargs=(qm, self.nthreads_worker))
+
+        # Molecule objects lose the references to the ensemble when they are pickled
+        self.ens.bind(self.mols, itrajs)
+
+        # Each shard keeps the output files of its own trajectories open with buffers
+        open_output_writer()
+
         if (restart == None):
             # Calculate initial input geometry for all trajectories at t = 0.0 s
             self.istep = -1
-            for itraj in range(self.ntrajs):
-                self.mol = self.mols[itraj]
+            for itraj in itrajs:
+                self.mols[itraj].reset_bo(qm.calc_coupling)
 
-                self.mol.reset_bo(qm.calc_coupling)
-                qm.get_data(self.mol, base_dirs[itraj], bo_list, self.dt, self.istep, calc_force_only=False)
+            self.calculate_qm(qm, executor, itrajs, base_dirs, bo_list, self.istep)
+
+            for itraj in itrajs:
+                self.mol = self.mols[itraj]
 
                 # TODO: QM/MM
                 self.mol.get_nacme()
@@ -142,23 +399,31 @@ class CT(MQC):
 
                 self.get_phase(itraj)
 
+            self.exchange_ensemble(comm, itrajs)
             self.calculate_qmom(self.istep)
 
-            for itraj in range(self.ntrajs):
+            f_out = io.StringIO()
+            with contextlib.redirect_stdout(f_out):
+                for itraj in itrajs:
 
-                self.mol = self.mols[itraj]
+                    self.mol = self.mols[itraj]
 
-                self.write_md_output(itraj, unixmd_dirs[itraj], qm.calc_coupling, self.istep)
+                    self.write_md_output(itraj, unixmd_dirs[itraj], qm.calc_coupling, self.istep)
 
-                self.print_step(self.istep, itraj)
+                    self.print_step(self.istep, itraj)
+            self.print_shards(comm, f_out.getvalue())
 
         #TODO: restart
         elif (restart == "write"):
             # Reset initial time step to t = 0.0 s
             self.istep = -1
-            for itraj in range(self.ntrajs):
-                self.write_md_output(itraj, unixmd_dirs[itraj], qm.calc_coupling, self.istep)
-                self.print_step(self.istep, itraj)
+            f_out = io.StringIO()
+            with contextlib.redirect_stdout(f_out):
+                for itraj in itrajs:
+                    self.mol = self.mols[itraj]
+                    self.write_md_output(itraj, unixmd_dirs[itraj], qm.calc_coupling, self.istep)
+                    self.print_step(self.istep, itraj)
+            self.print_shards(comm, f_out.getvalue())
 
         elif (restart == "append"):
             # Set initial time step to last successful step of previous dynamics
@@ -168,28 +433,44 @@ class CT(MQC):
 
         # Main MD loop
         for istep in range(self.istep, self.nsteps):
-            for itraj in range(self.ntrajs):
+            # Forces of all trajectories are calculated with the ensemble arrays
+            self.calculate_force(itrajs)
+
+            for itraj in itrajs:
                 self.mol = self.mols[itraj]
 
-                self.calculate_force(itraj)
+                self.rforce = self.ens.force[itraj]
                 self.cl_update_position()
 
                 self.mol.backup_bo(qm.calc_coupling)
                 self.mol.reset_bo(qm.calc_coupling)
 
-                qm.get_data(self.mol, base_dirs[itraj], bo_list, self.dt, istep, calc_force_only=False)
+            # QM calculations for all trajectories are finished before the electronic propagation
+            self.calculate_qm(qm, executor, itrajs, base_dirs, bo_list, istep)
+
+            for itraj in itrajs:
+                self.mol = self.mols[itraj]
 
                 if (not self.mol.l_nacme and self.l_adj_nac):
                     self.mol.adjust_nac()
 
                 #TODO: QM/MM
 
-                self.calculate_force(itraj)
+            self.calculate_force(itrajs)
+
+            for itraj in itrajs:
+                self.mol = self.mols[itraj]
+
+                self.rforce = self.ens.force[itraj]
                 self.cl_update_velocity()
 
                 self.mol.get_nacme()
 
-                el_run(self, itraj)
+            # Coefficients of all trajectories are propagated in a single call
+            el_run_batch(self, itrajs)
+
+            for itraj in itrajs:
+                self.mol = self.mols[itraj]
 
                 #TODO: thermostat
                 #if (self.thermo != None):
@@ -201,58 +482,230 @@ class CT(MQC):
 
                 self.check_decoherence(itraj)
 
+            # Shards are synchronized only to calculate the quantum momentum
+            self.exchange_ensemble(comm, itrajs)
             self.calculate_qmom(istep)
 
-            for itraj in range(self.ntrajs):
-                self.mol = self.mols[itraj]
+            f_out = io.StringIO()
+            with contextlib.redirect_stdout(f_out):
+                for itraj in itrajs:
+                    self.mol = self.mols[itraj]
 
-                if ((istep + 1) % self.out_freq == 0):
-                    self.write_md_output(itraj, unixmd_dirs[itraj], qm.calc_coupling, istep)
-                    self.print_step(istep, itraj)
-                if (istep == self.nsteps - 1):
-                    self.write_final_xyz(unixmd_dirs[itraj], istep)
+                    if ((istep + 1) % self.out_freq == 0):
+                        self.write_md_output(itraj, unixmd_dirs[itraj], qm.calc_coupling, istep)
+                        self.print_step(istep, itraj)
+                    if (istep == self.nsteps - 1):
+                        self.write_final_xyz(unixmd_dirs[itraj], istep)
+            self.print_shards(comm, f_out.getvalue())
 
             self.fstep = istep
-            restart_file = os.path.join(abs_path_output_dir, "RESTART.bin")
-            with open(restart_file, 'wb') as f:
-                pickle.dump({'qm':qm, 'md':self}, f)
+            if (checkpoint != None):
+                self.write_checkpoint(qm, comm, itrajs, checkpoint, abs_path_output_dir, istep)
 
-        # Delete scratch directory
-        if (not l_save_scr):
-            for itraj in range(self.ntrajs):
-                tmp_dir = os.path.join(unixmd_dirs[itraj], "scr_qm")
-                if (os.path.exists(tmp_dir)):
-                    shutil.rmtree(tmp_dir)
+        if (checkpoint != None):
+            checkpoint.wait()
 
-    def calculate_force(self, itrajectory):
-        """ Routine to calculate force
+        # Write remaining buffers and close output files
+        close_output_writer()
 
-            :param integer itrajectory: Index for trajectories
+        # Without checkpoint, the whole objects are pickled only at the end of dynamics
+        if (checkpoint == None):
+            if (comm == None):
+                restart_file = os.path.join(abs_path_output_dir, "RESTART.bin")
+                with open(restart_file, 'wb') as f:
+                    pickle.dump({'qm':qm, 'md':self}, f)
+            else:
+                # Each shard saves only its own trajectories
+                restart_file = os.path.join(abs_path_output_dir, f"RESTART_SHARD_{comm.ishard + 1}.bin")
+                with open(restart_file, 'wb') as f:
+                    pickle.dump({'qm':qm, 'shard':self.get_shard_state(itrajs)}, f)
+
+        if (executor != None):
+            executor.shutdown()
+
+    def exchange_ensemble(self, comm, itrajs):
+        """ Routine to exchange positions, BO populations and phases of trajectories between shards
+
+            :param object comm: Communicator of the shard, None if the trajectories are not sharded
+            :param integer,list itrajs: Indices for trajectories owned by the shard
         """
-        self.rforce = np.zeros((self.nat_qm, self.ndim))
+        if (comm == None):
+            return
+
+        data = (itrajs, self.ens.pos[itrajs], np.diagonal(self.ens.rho[itrajs], axis1=1, axis2=2), self.phase[itrajs])
+
+        ist = np.arange(self.nst)
+        for jtrajs, pos, rho, phase in comm.allgather(data):
+            self.ens.pos[jtrajs] = pos
+            # Only diagonal elements of density are used in the quantum momentum
+            self.ens.rho[np.array(jtrajs)[:, np.newaxis], ist, ist] = rho
+            self.phase[jtrajs] = phase
+
+    def print_shards(self, comm, text):
+        """ Routine to print the output of trajectories in order of shards
+
+            :param object comm: Communicator of the shard, None if the trajectories are not sharded
+            :param string text: Output of the trajectories owned by the shard
+        """
+        if (comm == None):
+            print (text, end="", flush=True)
+        else:
+            texts = comm.allgather(text)
+            if (comm.ishard == 0):
+                print ("".join(texts), end="", flush=True)
+
+    def get_shard_state(self, itrajs):
+        """ Routine to get the state of dynamics restricted to the trajectories owned by a shard
+
+            :param integer,list itrajs: Indices for trajectories owned by the shard
+        """
+        md = copy.copy(self)
+        # Ensemble arrays of all trajectories are not saved, since the molecules keep the data of their own rows
+        md.ens = None
+        md.mols = [self.mols[itraj] for itraj in itrajs]
+        md.qm_states = [self.qm_states[itraj] for itraj in itrajs]
+        for var in ["phase", "qmom", "K_lk", "count_ntrajs", "sigma_lk", "slope_i", "g_i", "center_lk", "w_k", \
+            "w_pos", "gauss_error", "prod_g_i", "dotpopnac", "dotpopdec", "nsubsteps", "ncouplings"]:
+            if (isinstance(getattr(self, var, None), np.ndarray)):
+                setattr(md, var, getattr(self, var)[itrajs])
+        md.mol = md.mols[0]
+        return {'itrajs':itrajs, 'md':md}
+
+    def get_checkpoint(self, itrajs):
+        """ Routine to get the dynamical state of the trajectories to be saved in a checkpoint
+
+            :param integer,list itrajs: Indices for trajectories to be saved
+        """
+        state = {"fstep": self.fstep, "itrajs": itrajs, "mols": [self.mols[itraj].get_checkpoint() for itraj in itrajs]}
+        state["qm_states"] = [self.qm_states[itraj] for itraj in itrajs]
+        # Quantities of the quantum momentum are needed at the beginning of next step
+        for var in ["phase", "qmom", "K_lk", "sigma_lk", "dotpopnac", "dotpopdec"]:
+            state[var] = getattr(self, var)[itrajs]
+        return state
+
+    def set_checkpoint(self, state):
+        """ Routine to set the dynamical state of the trajectories read from a checkpoint
+
+            :param dictionary state: Dynamical state of the trajectories
+        """
+        self.fstep = state["fstep"]
+        for itraj, mol_state, qm_state in zip(state["itrajs"], state["mols"], state["qm_states"]):
+            self.mols[itraj].set_checkpoint(mol_state)
+            self.qm_states[itraj] = qm_state
+        for var in ["phase", "qmom", "K_lk", "sigma_lk", "dotpopnac", "dotpopdec"]:
+            getattr(self, var)[state["itrajs"]] = state[var]
+
+    def write_checkpoint(self, qm, comm, itrajs, checkpoint, output_dir, istep):
+        """ Routine to write the checkpoint of the trajectories owned by a shard
+
+            :param object qm: QM object containing on-the-fly calculation information
+            :param object comm: Communicator of the shard, None if the trajectories are not sharded
+            :param integer,list itrajs: Indices for trajectories owned by the shard
+            :param object checkpoint: Checkpoint object to save only the dynamical state of dynamics
+            :param string output_dir: Name of directory where the checkpoint files are saved
+            :param integer istep: Current MD step
+        """
+        l_write = checkpoint.check(istep, self.nsteps)
+        if (comm == None):
+            ishard = None
+        else:
+            # All shards must write the checkpoint at the same step to be restarted consistently
+            l_write = any(comm.allgather(l_write))
+            ishard = comm.ishard + 1
+
+        if (l_write):
+            checkpoint.write(output_dir, self.get_checkpoint(itrajs), qm.get_checkpoint(), ishard)
+
+    def read_checkpoint(self, qm, checkpoint, output_dir):
+        """ Routine to read the checkpoint files of all trajectories.
+            The checkpoint files must be written with the same number of shards
+
+            :param object qm: QM object containing on-the-fly calculation information
+            :param object checkpoint: Checkpoint object to save only the dynamical state of dynamics
+            :param string output_dir: Name of directory where the checkpoint files are saved
+        """
+        if (self.nshards == 1):
+            ishards = [None]
+        else:
+            ishards = [ishard + 1 for ishard in range(self.nshards)]
+
+        fsteps = []
+        for ishard in ishards:
+            md_state, qm_state = checkpoint.read(output_dir, ishard)
+            self.set_checkpoint(md_state)
+            fsteps.append(md_state["fstep"])
+        qm.set_checkpoint(qm_state)
+
+        if (len(set(fsteps)) != 1):
+            error_message = "Checkpoint files of shards are written at different steps!"
+            error_vars = f"fsteps = {fsteps}"
+            raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        # Molecule objects lose the references to the ensemble when their data are replaced
+        self.ens.bind(self.mols, range(self.ntrajs))
+
+    def calculate_qm(self, qm, executor, itrajs, base_dirs, bo_list, istep):
+        """ Routine to run QM calculations for trajectories
+
+            :param object qm: QM object containing on-the-fly calculation information
+            :param object executor: Pool of worker processes for QM calculations
+            :param integer,list itrajs: Indices for trajectories
+            :param string,list base_dirs: Base directories of trajectories
+            :param integer,list bo_list: List of BO states for BO calculation
+            :param integer istep: Current MD step
+        """
+        if (executor == None):
+            for itraj in itrajs:
+                # QM calculator is shared by the trajectories, so the variables of the trajectory are restored
+                if (istep >= 0):
+                    qm.set_checkpoint(self.qm_states[itraj])
+                qm.get_data(self.mols[itraj], base_dirs[itraj], bo_list, self.dt, istep, calc_force_only=False)
+                self.qm_states[itraj] = copy.deepcopy(qm.get_checkpoint())
+        else:
+            # Each trajectory has its own base directory, so QM calculations do not interfere with each other
+            # QM object is sent to each worker only once, and the variables of trajectories are sent at each step
+            futures = [executor.submit(run_qm_worker, self.mols[itraj], self.qm_states[itraj], base_dirs[itraj], \
+                bo_list, self.dt, istep) for itraj in itrajs]
+            # Only BO quantities are copied, hence the states and the ensemble keep the references to the molecules
+            for itraj, future in zip(itrajs, futures):
+                molecule, self.qm_states[itraj] = future.result()
+                self.mols[itraj].update_bo(molecule)
+
+    def calculate_force(self, itrajs):
+        """ Routine to calculate the forces of trajectories, which are saved in the ensemble
+
+            :param integer,list itrajs: Indices for trajectories
+        """
+        itrajs = np.array(itrajs)
+        mols = [self.mols[itraj] for itraj in itrajs]
+
+        # Variables of the trajectories with the first dimension of trajectories
+        rho = self.ens.rho.real[itrajs]
+        pop = np.diagonal(rho, axis1=1, axis2=2)
+        energy = np.array([[istate.energy for istate in mol.states] for mol in mols])
+        # Forces of states are broadcast, since model systems give the forces as scalars
+        state_force = np.zeros((len(itrajs), self.nst, self.nat_qm, self.ndim))
+        for imol, mol in enumerate(mols):
+            for ist, istate in enumerate(mol.states):
+                state_force[imol, ist] = istate.force
+        nac = np.array([mol.nac for mol in mols])
 
         # Derivatives of energy
-        for ist, istate in enumerate(self.mols[itrajectory].states):
-            self.rforce += istate.force * self.mol.rho.real[ist, ist]
+        force = np.einsum("ti,tiad->tad", pop, state_force)
 
-        # Non-adiabatic forces 
-        for ist in range(self.nst):
-            for jst in range(ist + 1, self.nst):
-                self.rforce += 2. * self.mol.nac[ist, jst] * self.mol.rho.real[ist, jst] \
-                    * (self.mol.states[ist].energy - self.mol.states[jst].energy)
+        # Non-adiabatic forces, only the pairs of ist < jst are included
+        nac_weight = 2. * np.triu(rho * (energy[:, :, np.newaxis] - energy[:, np.newaxis, :]), k=1)
+        force += np.einsum("tij,tijad->tad", nac_weight, nac)
 
         # CT forces
-        ctforce = np.zeros((self.nat_qm, self.ndim))
-        for ist in range(self.nst):
-            for jst in range(self.nst):
-                ctforce += 0.5 * self.K_lk[itrajectory, ist, jst] * \
-                    (self.phase[itrajectory, jst] - self.phase[itrajectory, ist]) * \
-                    self.mol.rho.real[ist, ist] * self.mol.rho.real[jst, jst] * \
-                    (self.mol.rho.real[ist, ist] + self.mol.rho.real[jst, jst])
+        ct_weight = 0.5 * self.K_lk[itrajs] * pop[:, :, np.newaxis] * pop[:, np.newaxis, :] * \
+            (pop[:, :, np.newaxis] + pop[:, np.newaxis, :])
+        phase = self.phase[itrajs]
+        ctforce = np.einsum("tij,tjad->tad", ct_weight, phase) - np.einsum("tij,tiad->tad", ct_weight, phase)
         ctforce /= self.nst - 1
 
         # Finally, force is Ehrenfest force + CT force
-        self.rforce += ctforce
+        self.ens.force[itrajs] = force + ctforce
 
     def update_energy(self):
         """ Routine to update the energy of molecules in CTMQC dynamics
@@ -302,7 +755,8 @@ class CT(MQC):
 
             :param integer one_st: State index that its population is one
         """
-        self.mol.rho = np.zeros((self.mol.nst, self.mol.nst), dtype=np.complex64)
+        # Density and coefficients refer to the ensemble, hence they are changed in place
+        self.mol.rho[:, :] = 0. + 0.j
         self.mol.rho[one_st, one_st] = 1. + 0.j
         
         if (self.elec_object == "coefficient"):
@@ -330,214 +784,254 @@ class CT(MQC):
         self.calculate_center()
 
         # 4. Compute quantum momentum
-        for itraj in range(self.ntrajs):
-            index_lk = -1
-            for ist in range(self.nst):
-                for jst in range(ist + 1, self.nst):
-                    index_lk += 1
-                    self.qmom[itraj, index_lk] = self.slope_i[itraj] * (self.mols[itraj].pos - self.center_lk[itraj, index_lk])
+        pos = self.ens.pos[:, 0:self.nat_qm]
+        self.qmom = self.slope_i[:, np.newaxis] * (pos[:, np.newaxis] - self.center_lk)
 
         # 5. Calculate 2 * Qmom * phase / mass
+        ist, jst = np.triu_indices(self.nst, k=1)
+        inv_mass = 1. / self.mol.mass[0:self.nat_qm]
         self.K_lk = np.zeros((self.ntrajs, self.nst, self.nst))
-        for itraj in range(self.ntrajs):
-            index_lk = -1
-            for ist in range(self.nst):
-                for jst in range(ist + 1, self.nst):
-                    index_lk += 1
-                    self.K_lk[itraj, ist, jst] += 2. * np.sum(1. / self.mol.mass[0:self.nat_qm] * \
-                        np.sum(self.qmom[itraj, index_lk] * self.phase[itraj, ist], axis = 1))
-                    self.K_lk[itraj, jst, ist] += 2. * np.sum(1. / self.mol.mass[0:self.nat_qm] * \
-                        np.sum(self.qmom[itraj, index_lk] * self.phase[itraj, jst], axis = 1))
+        self.K_lk[:, ist, jst] = 2. * np.einsum('ipad,ipad,a->ip', self.qmom, self.phase[:, ist], inv_mass)
+        self.K_lk[:, jst, ist] = 2. * np.einsum('ipad,ipad,a->ip', self.qmom, self.phase[:, jst], inv_mass)
 
     def calculate_sigma(self, istep):
         """ Routine to calculate variances for each trajectories
 
             :param integer istep: Current MD step
         """
+        pos = self.ens.pos[:, 0:self.nat_qm]
+
         threshold = self.dist_parameter * self.min_sigma #/ self.ntrajs
-        cutoff = np.ones((self.ntrajs, self.nat_qm, self.ndim))
-        for itraj in range(self.ntrajs):
-            if (self.const_dist_cutoff == None):
-                if (istep == -1):
-                    cutoff *= threshold
-                else:
-                    cutoff[itraj] = self.dist_parameter * self.sigma_lk[itraj, 0] 
+        if (self.const_dist_cutoff == None):
+            if (istep == -1):
+                # Every trajectory has the same cutoff at the initial step, since sigma is not calculated yet
+                cutoff = threshold * np.ones((self.ntrajs, self.nat_qm, self.ndim))
             else:
-                cutoff = self.const_dist_cutoff * np.ones((self.ntrajs, self.nat_qm, self.ndim))
-
-            # Variable to determine how many trajecories are in cutoff.
-            self.count_ntrajs[itraj] = np.zeros((self.nat_qm, self.ndim)) 
-
-            R2_tmp = np.zeros((self.nat_qm, self.ndim)) # Temporary variable for R**2
-            R_tmp = np.zeros((self.nat_qm, self.ndim))  # Temporary variable for R
-
-            for jtraj in range(self.ntrajs):
-                pos_diff = self.mols[jtraj].pos - self.mols[itraj].pos # Dimension = (self.nat_qm, self.ndim)
-                for iat in range(self.nat_qm):
-                    for idim in range(self.ndim):
-                        distance = abs(pos_diff[iat, idim]) # Distance between i-th dimenstion of i-th atom in itraj and jtraj
-                        if (distance <= cutoff[itraj, iat, idim]):
-                            R_tmp[iat, idim] += self.mols[jtraj].pos[iat, idim] # Dimension = (self.nat_qm, self.ndim)
-                            R2_tmp[iat, idim] += self.mols[jtraj].pos[iat, idim] * self.mols[jtraj].pos[iat, idim] # Dimension = (self.nat_qm, self.ndim)
-                            self.count_ntrajs[itraj, iat, idim] += 1
-
-            for iat in range(self.nat_qm):
-                for idim in range(self.ndim):
-                    avg_R = R_tmp[iat, idim] / self.count_ntrajs[itraj, iat, idim]
-                    avg_R2 = R2_tmp[iat, idim] / self.count_ntrajs[itraj, iat, idim]
-
-                    self.sigma_lk[itraj, 0, iat, idim] = np.sqrt((avg_R2 - avg_R ** 2)) \
-                        / np.sqrt(np.sqrt(self.count_ntrajs[itraj, iat, idim])) # / np.sqrt(np.sqrt(count_ntrajs)) is artifact to modulate sigma.
-                    if (self.sigma_lk[itraj, 0, iat, idim] <= self.min_sigma or self.count_ntrajs[itraj, iat, idim] == 1):
-                        self.sigma_lk[itraj, 0, iat, idim] = self.min_sigma
+                cutoff = self.dist_parameter * self.sigma_lk[:, 0]
+        else:
+            cutoff = self.const_dist_cutoff * np.ones((self.ntrajs, self.nat_qm, self.ndim))
+
+        # Variable to determine how many trajecories are in cutoff.
+        if (self.cutoff_search == "sorted"):
+            self.count_ntrajs, var_R = self.get_sorted_variance(pos, cutoff)
+        else:
+            self.count_ntrajs, var_R = self.get_dense_variance(pos, cutoff)
+
+        # / np.sqrt(np.sqrt(count_ntrajs)) is artifact to modulate sigma.
+        sigma = np.sqrt(var_R) / np.sqrt(np.sqrt(self.count_ntrajs))
+        l_min = np.logical_or(sigma <= self.min_sigma, self.count_ntrajs == 1)
+        self.sigma_lk[:, 0] = np.where(l_min, self.min_sigma, sigma)
+
+    def get_dense_variance(self, pos, cutoff):
+        """ Routine to calculate variances of positions within the distance cutoff by checking every trajectory pair
+
+            :param double,3D pos: Positions of all trajectories
+            :param double,3D cutoff: Distance cutoff for each trajectory
+        """
+        count_ntrajs = np.zeros((self.ntrajs, self.nat_qm, self.ndim))
+        R2_tmp = np.zeros((self.ntrajs, self.nat_qm, self.ndim)) # Temporary variable for R**2
+        R_tmp = np.zeros((self.ntrajs, self.nat_qm, self.ndim))  # Temporary variable for R
+
+        # Pairwise distances are evaluated for a block of trajectories to bound the memory
+        for iblock in range(0, self.ntrajs, self.qmom_block_size):
+            blk = slice(iblock, iblock + self.qmom_block_size)
+            # Distance between i-th dimenstion of i-th atom in itraj and jtraj, Dimension = (nblock, self.ntrajs, self.nat_qm, self.ndim)
+            l_in = np.abs(pos[np.newaxis] - pos[blk, np.newaxis]) <= cutoff[blk, np.newaxis]
+            count_ntrajs[blk] = np.sum(l_in, axis=1)
+            R_tmp[blk] = np.sum(np.where(l_in, pos, 0.), axis=1)
+            R2_tmp[blk] = np.sum(np.where(l_in, pos * pos, 0.), axis=1)
+
+        avg_R = R_tmp / count_ntrajs
+        avg_R2 = R2_tmp / count_ntrajs
+
+        return count_ntrajs, avg_R2 - avg_R ** 2
+
+    def get_sorted_variance(self, pos, cutoff):
+        """ Routine to calculate variances of positions within the distance cutoff using sorted coordinates.
+            For each atom and dimension, the trajectories within the cutoff window of a trajectory
+            are found by binary search and summed with cumulative sums, instead of checking every pair.
+
+            :param double,3D pos: Positions of all trajectories
+            :param double,3D cutoff: Distance cutoff for each trajectory
+        """
+        pos = pos.reshape(self.ntrajs, -1)
+        cutoff = cutoff.reshape(self.ntrajs, -1)
+
+        count_ntrajs = np.zeros(pos.shape)
+        var_R = np.zeros(pos.shape)
+        for icoord in range(pos.shape[1]):
+            # Positions are shifted by the mean value to reduce the round-off error of cumulative sums
+            pos_sorted = np.sort(pos[:, icoord])
+            dR = pos_sorted - np.mean(pos_sorted)
+            sum_R = np.concatenate(([0.], np.cumsum(dR)))
+            sum_R2 = np.concatenate(([0.], np.cumsum(dR * dR)))
+
+            # Index window of trajectories whose distance is smaller than the cutoff
+            lower = np.searchsorted(pos_sorted, pos[:, icoord] - cutoff[:, icoord], side="left")
+            upper = np.searchsorted(pos_sorted, pos[:, icoord] + cutoff[:, icoord], side="right")
+            count_ntrajs[:, icoord] = upper - lower
+
+            avg_R = (sum_R[upper] - sum_R[lower]) / count_ntrajs[:, icoord]
+            avg_R2 = (sum_R2[upper] - sum_R2[lower]) / count_ntrajs[:, icoord]
+            # Negative variances can appear only due to the round-off error
+            var_R[:, icoord] = np.maximum(avg_R2 - avg_R ** 2, 0.)
+
+        count_ntrajs = count_ntrajs.reshape(self.ntrajs, self.nat_qm, self.ndim)
+        var_R = var_R.reshape(self.ntrajs, self.nat_qm, self.ndim)
+
+        return count_ntrajs, var_R
 
     def calculate_slope(self):
         """ Routine to calculate slope
         """
+        pos = self.ens.pos[:, 0:self.nat_qm]
+        rho = np.diagonal(self.ens.rho.real, axis1=1, axis2=2)
+        sigma = self.sigma_lk[:, 0]
+
         # (2-1) Calculate w_ij
         # g_i means nuclear density at the position of i-th classical trajectory.
-        # prod_g_i is to multiply gaussians with respect to atoms and spaces.
-        self.g_i = np.zeros((self.ntrajs)) 
-        self.prod_g_i = np.ones((self.ntrajs, self.ntrajs))
-        for itraj in range(self.ntrajs):
-            for jtraj in range(self.ntrajs):
-                for iat in range(self.nat_qm):
-                    for idim in range(self.ndim):
-                        # gaussian1d(x, pre-factor, sigma, mean)
-                        # gaussian1d(R^{itraj}, 1.0, sigma^{jtraj}, R^{jtraj})
-                        self.prod_g_i[itraj, jtraj] *= gaussian1d(self.mols[itraj].pos[iat, idim], 1., \
-                            self.sigma_lk[jtraj, 0, iat, idim], self.mols[jtraj].pos[iat, idim])
-                self.g_i[itraj] += self.prod_g_i[itraj, jtraj]
-
         # w_ij is defined as W_IJ in SI of J. Phys. Chem. Lett., 2017, 8, 3048-3055.
-        w_ij = np.zeros((self.ntrajs, self.ntrajs, self.nat_qm, self.ndim))
-        for itraj in range(self.ntrajs):
-            for jtraj in range(self.ntrajs):
-                for iat in range(self.nat_qm):
-                    for idim in range(self.ndim):
-                        w_ij[itraj, jtraj, iat, idim] = self.prod_g_i[itraj, jtraj] /\
-                        (2. * self.sigma_lk[jtraj, 0, iat, idim] ** 2 * self.g_i[itraj])
+        # w_ij = prod_g_i / (2 * sigma_j ** 2 * g_i) is contracted over j without (ntrajs, ntrajs, nat, ndim) intermediates,
+        # hence only the sums of w_ij weighted by densities, inverse variances and positions are needed
+        inv_var = 1. / (2. * sigma.reshape(self.ntrajs, -1) ** 2)
+        weights = np.concatenate((rho, inv_var, pos.reshape(self.ntrajs, -1) * inv_var), axis=1)
+
+        if (self.gauss_transform == "truncated"):
+            self.g_i, w_sum = self.get_truncated_gauss_transform(pos, sigma, weights)
+            if (self.l_gauss_diag):
+                g_i_exact, w_sum_exact = self.get_exact_gauss_transform(pos, sigma, weights)
+                self.gauss_error[:, 0] = np.abs(self.g_i - g_i_exact) / g_i_exact
+                self.gauss_error[:, 1] = np.max(np.abs(w_sum - w_sum_exact) / \
+                    np.maximum(np.abs(w_sum_exact), self.small), axis=1)
+        else:
+            self.g_i, w_sum = self.get_exact_gauss_transform(pos, sigma, weights)
 
-        # Smoothing 
-        self.w_k = np.zeros((self.ntrajs, self.nst))
-        rho = np.zeros((self.ntrajs, self.nst))
-        for itraj in range(self.ntrajs):
-            for jtraj in range(self.ntrajs):
-                for ist in range(self.nst):
-                    self.w_k[itraj, ist] += self.prod_g_i[itraj, jtraj] * self.mols[jtraj].rho.real[ist, ist] / self.g_i[itraj]
+        ncoord = self.nat_qm * self.ndim
+        self.w_pos = w_sum[:, self.nst + ncoord:].reshape(self.ntrajs, self.nat_qm, self.ndim)
 
-            index_lk = -1
-            for ist in range(self.nst):
-                for jst in range(ist + 1, self.nst):
-                    index_lk += 1
-
-                    l_smooth = ((self.w_k[itraj, ist] < self.lower_th) or (self.w_k[itraj, ist] > self.upper_th) 
-                        or (self.w_k[itraj, jst] < self.lower_th) or (self.w_k[itraj, jst] > self.upper_th))
+        # Smoothing 
+        self.w_k = w_sum[:, 0:self.nst]
 
-                    if (l_smooth):
-                        self.phase[itraj, ist] = np.zeros((self.nat_qm, self.ndim))
-                        self.phase[itraj, jst] = np.zeros((self.nat_qm, self.ndim))
+        # Phases of a state pair are removed if any state of the pair is out of the threshold,
+        # hence every phase of the trajectory is removed when a state is out of the threshold
+        if (self.nst > 1):
+            l_smooth = np.any(np.logical_or(self.w_k < self.lower_th, self.w_k > self.upper_th), axis=1)
+            self.phase[l_smooth] = 0.
 
         # (2-2) Calculate slope_i
         # the slope is calculated as a sum over j of w_ij
-        self.slope_i = np.zeros((self.ntrajs, self.nat_qm, self.ndim))
-        for itraj in range(self.ntrajs):
-            for jtraj in range(self.ntrajs):
-                self.slope_i[itraj] -= w_ij[itraj, jtraj]
+        self.slope_i = - w_sum[:, self.nst:self.nst + ncoord].reshape(self.ntrajs, self.nat_qm, self.ndim)
+
+    def get_exact_gauss_transform(self, pos, sigma, weights):
+        """ Routine to calculate nuclear densities and weighted sums of normalized Gaussians
+            by evaluating Gaussians of every trajectory pair
+
+            :param double,3D pos: Positions of all trajectories
+            :param double,3D sigma: Variances of Gaussians of all trajectories
+            :param double,2D weights: Weights of Gaussians of all trajectories
+        """
+        # prod_g_i is to multiply gaussians with respect to atoms and spaces.
+        # gaussian1d(R^{itraj}, 1.0, sigma^{jtraj}, R^{jtraj}) is evaluated for a block of trajectories
+        self.prod_g_i = np.ones((self.ntrajs, self.ntrajs))
+        for iblock in range(0, self.ntrajs, self.qmom_block_size):
+            blk = slice(iblock, iblock + self.qmom_block_size)
+            gaussian = np.exp(- (pos[blk, np.newaxis] - pos[np.newaxis]) ** 2 / (2. * sigma[np.newaxis] ** 2)) \
+                / (sigma[np.newaxis] * np.sqrt(2. * np.pi))
+            self.prod_g_i[blk] = np.prod(gaussian.reshape(gaussian.shape[0], self.ntrajs, -1), axis=2)
+        g_i = np.sum(self.prod_g_i, axis=1)
+
+        return g_i, np.matmul(self.prod_g_i / g_i[:, np.newaxis], weights)
+
+    def get_truncated_gauss_transform(self, pos, sigma, weights):
+        """ Routine to calculate nuclear densities and weighted sums of normalized Gaussians
+            with the truncated Gauss transform. Gaussians smaller than gauss_tol times their maxima are neglected,
+            and the trajectory pairs to be evaluated are found by binary search on the coordinate
+            where the trajectories are most separated, so that the cost is proportional to the number of
+            trajectories within the Gaussian ranges instead of the number of all trajectory pairs.
+
+            :param double,3D pos: Positions of all trajectories
+            :param double,3D sigma: Variances of Gaussians of all trajectories
+            :param double,2D weights: Weights of Gaussians of all trajectories
+        """
+        pos = pos.reshape(self.ntrajs, -1)
+        sigma = sigma.reshape(self.ntrajs, -1)
+
+        # Gaussians are neglected when squared distances in units of sigma exceed this value
+        dist2_cutoff = 2. * np.log(1. / self.gauss_tol)
+        norm = np.prod(sigma * np.sqrt(2. * np.pi), axis=1)
+
+        # Coordinate where trajectories are most separated in units of sigma
+        icoord = np.argmax(np.std(pos, axis=0) / np.mean(sigma, axis=0))
+        index_sorted = np.argsort(pos[:, icoord])
+        pos_sorted = pos[index_sorted, icoord]
+
+        # Window of trajectories within the range of the Gaussian of each trajectory
+        width = np.sqrt(dist2_cutoff) * sigma[:, icoord]
+        lower = np.searchsorted(pos_sorted, pos[:, icoord] - width, side="left")
+        upper = np.searchsorted(pos_sorted, pos[:, icoord] + width, side="right")
+
+        g_i = np.zeros(self.ntrajs)
+        w_sum = np.zeros((self.ntrajs, weights.shape[1]))
+
+        # Trajectory pairs are evaluated for a block of Gaussians to bound the memory
+        for jblock in range(0, self.ntrajs, self.qmom_block_size):
+            jtrajs = np.arange(jblock, min(jblock + self.qmom_block_size, self.ntrajs))
+            counts = upper[jtrajs] - lower[jtrajs]
+            jtraj_pair = np.repeat(jtrajs, counts)
+            shift = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+            itraj_pair = index_sorted[np.repeat(lower[jtrajs], counts) + shift]
+
+            dist2 = np.sum(((pos[itraj_pair] - pos[jtraj_pair]) / sigma[jtraj_pair]) ** 2, axis=1)
+            l_in = dist2 <= dist2_cutoff
+            itraj_pair, jtraj_pair = itraj_pair[l_in], jtraj_pair[l_in]
+            gaussian = np.exp(- 0.5 * dist2[l_in]) / norm[jtraj_pair]
+
+            g_i += np.bincount(itraj_pair, weights=gaussian, minlength=self.ntrajs)
+            for iweight in range(weights.shape[1]):
+                w_sum[:, iweight] += np.bincount(itraj_pair, weights=gaussian * weights[jtraj_pair, iweight], \
+                    minlength=self.ntrajs)
+
+        return g_i, w_sum / g_i[:, np.newaxis]
 
     def calculate_center(self):
         """ Routine to calculate center of quantum momentum
         """
-        rho = np.zeros((self.ntrajs, self.nst))
-        for itraj in range(self.ntrajs):
-            for ist in range(self.nst):
-                rho[itraj, ist] = self.mols[itraj].rho[ist, ist].real
+        pos = self.ens.pos[:, 0:self.nat_qm]
+        rho = np.diagonal(self.ens.rho.real, axis1=1, axis2=2)
+        sigma = self.sigma_lk[:, 0]
+        ist, jst = np.triu_indices(self.nst, k=1)
 
         # (3-1) Compute denominator
-        deno_lk = np.zeros((self.nst_pair, self.nat_qm, self.ndim)) # denominator
-        for itraj in range(self.ntrajs):
-            index_lk = -1
-            for ist in range(self.nst):
-                for jst in range(ist + 1, self.nst):  
-                    index_lk += 1
-                    for iat in range(self.nat_qm):
-                        for idim in range(self.ndim):
-                            deno_lk[index_lk, iat, idim] += rho[itraj, ist] * rho[itraj, jst] * \
-                                (self.phase[itraj, ist, iat, idim] - self.phase[itraj, jst, iat, idim]) * self.slope_i[itraj, iat, idim]
+        # Dimension = (self.ntrajs, self.nst_pair, self.nat_qm, self.ndim)
+        deno_i = (rho[:, ist] * rho[:, jst])[:, :, np.newaxis, np.newaxis] * \
+            (self.phase[:, ist] - self.phase[:, jst]) * self.slope_i[:, np.newaxis]
+        deno_lk = np.sum(deno_i, axis=0) # denominator
 
         # (3-2) Compute numerator
-        ratio_lk = np.zeros((self.ntrajs, self.nst_pair, self.nat_qm, self.ndim)) # numerator / denominator
-        numer_lk = np.zeros((self.ntrajs, self.nst_pair, self.nat_qm, self.ndim)) # numerator
-        for itraj in range(self.ntrajs):
-            index_lk = -1
-            for ist in range(self.nst):
-                for jst in range(ist + 1, self.nst):
-                    index_lk += 1
-                    for iat in range(self.nat_qm):
-                        for idim in range(self.ndim):
-                            numer_lk[itraj, index_lk, iat, idim] = rho[itraj, ist] * rho[itraj, jst] * self.mols[itraj].pos[iat, idim] * \
-                                (self.phase[itraj, ist, iat, idim] - self.phase[itraj, jst, iat, idim]) * self.slope_i[itraj, iat, idim]
-                            if (abs(deno_lk[index_lk, iat, idim]) <= self.small):
-                                ratio_lk[itraj, index_lk, iat, idim] = 0.
-                            else:
-                                ratio_lk[itraj, index_lk, iat, idim] = numer_lk[itraj, index_lk, iat, idim] / \
-                                    deno_lk[index_lk, iat, idim]
+        numer_lk = deno_i * pos[:, np.newaxis] # numerator
+        l_deno = np.abs(deno_lk) > self.small
+        ratio_lk = np.where(l_deno, numer_lk / np.where(l_deno, deno_lk, 1.), 0.) # numerator / denominator
 
         # Center of quantum momentum is calculated by Eq.(S28) of J. Phys. Chem. Lett., 2017, 8, 3048-3055.
-        center_old_lk = np.zeros((self.ntrajs, self.nst_pair, self.nat_qm, self.ndim))
-        for itraj in range(self.ntrajs):
-            index_lk = -1
-            for ist in range(self.nst):
-                for jst in range(ist + 1, self.nst):
-                    index_lk += 1
-                    for iat in range(self.nat_qm):
-                        for idim in range(self.ndim):
-                            for jtraj in range(self.ntrajs):
-                                center_old_lk[itraj, index_lk, iat, idim] += ratio_lk[jtraj, index_lk, iat, idim]
-                            if ((abs(self.slope_i[itraj, iat, idim]) <= self.small) or (center_old_lk[itraj, index_lk, iat, idim] == 0.)):
-                                center_old_lk[itraj, index_lk, iat, idim] = self.mols[itraj].pos[iat, idim]
+        l_slope = np.abs(self.slope_i) <= self.small
+        center_old_lk = np.sum(ratio_lk, axis=0) * np.ones((self.ntrajs, self.nst_pair, self.nat_qm, self.ndim))
+        l_pos = np.logical_or(l_slope[:, np.newaxis], center_old_lk == 0.)
+        center_old_lk = np.where(l_pos, pos[:, np.newaxis], center_old_lk)
 
         # Center of quantum momentum is calculated by Eq.(S21) of J. Phys. Chem. Lett., 2017, 8, 3048-3055.
-        center_new_lk = np.zeros((self.ntrajs, self.nst_pair, self.nat_qm, self.ndim))
-        for itraj in range(self.ntrajs):
-            index_lk = -1
-            for ist in range(self.nst):
-                for jst in range(ist + 1, self.nst):
-                    index_lk += 1
-                    for iat in range(self.nat_qm):
-                        for idim in range(self.ndim):
-                            if (abs(self.slope_i[itraj, iat, idim]) <= self.small):
-                                center_new_lk[itraj, index_lk, iat, idim] = self.mols[itraj].pos[iat, idim]
-                            else:
-                                for jtraj in range(self.ntrajs):
-                                    center_new_lk[itraj, index_lk, iat, idim] += self.mols[jtraj].pos[iat, idim] * self.prod_g_i[itraj, jtraj] /\
-                                        (2. * self.sigma_lk[jtraj, 0, iat, idim] ** 2 * self.g_i[itraj] * (- self.slope_i[itraj, iat, idim]))
+        # Sums of positions weighted by w_ij are calculated together with the slope
+        center_new = np.where(l_slope, pos, self.w_pos / np.where(l_slope, 1., - self.slope_i))
+        center_new_lk = center_new[:, np.newaxis] * np.ones((self.ntrajs, self.nst_pair, self.nat_qm, self.ndim))
 
         # (3-3) Determine qauntum momentum center TODO: atomistic flag
-        self.center_lk = np.zeros((self.ntrajs, self.nst_pair, self.nat_qm, self.ndim)) # Finally, qmom_center
-        for itraj in range(self.ntrajs):
-            index_lk = -1
-            for ist in range(self.nst):
-                for jst in range(ist + 1, self.nst):
-                    index_lk += 1
-                    for iat in range(self.nat_qm):
-                        for idim in range(self.ndim):
-                            # test how far calculated center of quantum momentum is from current atomic position.
-                            # tmp_var is deviation between position of classical trajectory and quantum momentum center.
-                            tmp_var = center_old_lk[itraj, index_lk, iat, idim] - self.mols[itraj].pos[iat, idim]
-                            if (self.const_center_cutoff == None):
-                                cutoff = self.dist_parameter * self.sigma_lk[itraj, 0, iat, idim]
-                            else:
-                                cutoff = self.const_center_cutoff
-
-                            if (abs(tmp_var) > cutoff): 
-                                tmp_var = center_new_lk[itraj, index_lk, iat, idim] - self.mols[itraj].pos[iat, idim]
-                                if (abs(tmp_var) > cutoff): 
-                                    self.center_lk[itraj, index_lk, iat, idim] = self.mols[itraj].pos[iat, idim]
-                                else:
-                                    self.center_lk[itraj, index_lk, iat, idim] = center_new_lk[itraj, index_lk, iat, idim]
-                            else: 
-                                self.center_lk[itraj, index_lk, iat, idim] = center_old_lk[itraj, index_lk, iat, idim]
+        # test how far calculated center of quantum momentum is from current atomic position.
+        if (self.const_center_cutoff == None):
+            cutoff = self.dist_parameter * sigma[:, np.newaxis]
+        else:
+            cutoff = self.const_center_cutoff
+        l_old = np.abs(center_old_lk - pos[:, np.newaxis]) <= cutoff
+        l_new = np.abs(center_new_lk - pos[:, np.newaxis]) <= cutoff
+        self.center_lk = np.where(l_old, center_old_lk, np.where(l_new, center_new_lk, pos[:, np.newaxis])) # Finally, qmom_center
 
     def check_istates(self):
         """ Routine to check istates and init_coefs
@@ -583,6 +1077,14 @@ class CT(MQC):
         # Write the common part
         super().write_md_output(unixmd_dir, calc_coupling, istep)
 
+        # Write electronic substeps of the trajectory
+        if (self.propagator == "rk45"):
+            if (self.output_format == "binary"):
+                arraywriter(self.nsubsteps[itrajectory], unixmd_dir, "NSUBSTEP.npy")
+            else:
+                tmp = f'{istep + 1:9d}{"":14s}{self.nsubsteps[itrajectory]}'
+                typewriter(tmp, unixmd_dir, "NSUBSTEP", "a")
+
         # Write time-derivative BO population
         self.write_dotpop(itrajectory, unixmd_dir, istep)
 
@@ -601,6 +1103,9 @@ class CT(MQC):
             tmp = f'{istep + 1:9d}' + "".join([f'{pop:15.8f}' for pop in self.dotpopnac[itrajectory]])
             typewriter(tmp, unixmd_dir, "DOTPOPNAC", "a")
 
+            # Write the number of NACME terms in NACSPARSE
+            self.write_nac_sparsity(unixmd_dir, istep, self.ncouplings[itrajectory])
+
             # Write decoherence term in DOTPOPDEC
             tmp = f'{istep + 1:9d}' + "".join([f'{pop:15.8f}' for pop in self.dotpopdec[itrajectory]])
             typewriter(tmp, unixmd_dir, "DOTPOPDEC", "a")
@@ -655,6 +1160,11 @@ class CT(MQC):
                     "".join([f'{self.phase[itrajectory, ist, iat, idim]:15.8f}' for idim in range(self.ndim)]) for iat in range(self.nat_qm)])
                 typewriter(tmp, unixmd_dir, f"PHASE_{ist}", "a")
 
+        # Write errors of truncated Gauss transform with respect to exact one
+        if (self.l_gauss_diag):
+            tmp = f'{istep + 1:9d}' + "".join([f'{error:15.6E}' for error in self.gauss_error[itrajectory]])
+            typewriter(tmp, unixmd_dir, "GAUSS_ERR", "a")
+
     def print_init(self, qm, mm, restart):
         """ Routine to print the initial information of dynamics
 
@@ -684,6 +1194,16 @@ class CT(MQC):
             ct_info += f"  const_center_cutoff      = {self.const_center_cutoff:>16f}\n"
         else:
             ct_info += f"  const_center_cutoff      = {str(None):>16s}\n"
+        ct_info += f"  qmom_block_size          = {self.qmom_block_size:>16d}\n"
+        ct_info += f"  cutoff_search            = {self.cutoff_search:>16s}\n"
+        ct_info += f"  gauss_transform          = {self.gauss_transform:>16s}\n"
+        if (self.gauss_transform == "truncated"):
+            ct_info += f"  gauss_tol                = {self.gauss_tol:>16.2E}\n"
+            ct_info += f"  l_gauss_diag             = {str(self.l_gauss_diag):>16s}\n"
+        ct_info += f"  nworkers                 = {self.nworkers:>16d}\n"
+        ct_info += f"  nshards                  = {self.nshards:>16d}\n"
+        if (self.nshards > 1):
+            ct_info += f"  transport                = {self.transport.transport_type:>16s}\n"
         print (ct_info, flush=True)
 
         # Print istate
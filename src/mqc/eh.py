@@ -1,7 +1,7 @@
 from __future__ import division
 from lib.libmqc import el_run
 from mqc.mqc import MQC
-from misc import au_to_K, call_name, typewriter
+from misc import au_to_K, call_name, typewriter, close_output_writer
 import os, shutil, textwrap
 import numpy as np
 import pickle
@@ -17,6 +17,8 @@ class Eh(MQC):
         :param integer nesteps: Total step of electronic propagation
         :param string elec_object: Electronic equation of motions
         :param string propagator: Electronic propagator
+        :param double elec_tol: Tolerance of local error in adaptive electronic propagators
+        :param double nac_threshold: Threshold of NACME terms neglected in electronic propagators
         :param boolean l_print_dm: Logical to print BO population and coherence
         :param boolean l_adj_nac: Logical to adjust nonadiabatic coupling
         :param init_coef: Initial BO coefficient
@@ -26,16 +28,18 @@ class Eh(MQC):
         :param integer verbosity: Verbosity of output
     """
     def __init__(self, molecule, thermostat=None, istate=0, dt=0.5, nsteps=1000, nesteps=20, \
-        elec_object="density", propagator="rk4", l_print_dm=True, l_adj_nac=True, \
+        elec_object="density", propagator="rk4", elec_tol=1E-8, nac_threshold=0., l_print_dm=True, l_adj_nac=True, \
         init_coef=None, unit_dt="fs", out_freq=1, verbosity=0):
         # Initialize input values
         super().__init__(molecule, thermostat, istate, dt, nsteps, nesteps, \
-            elec_object, propagator, l_print_dm, l_adj_nac, init_coef, unit_dt, out_freq, verbosity)
+            elec_object, propagator, elec_tol, nac_threshold, l_print_dm, l_adj_nac, init_coef, unit_dt, \
+            out_freq, verbosity)
 
         # Debug variables
         self.dotpopnac = np.zeros(self.mol.nst)
 
-    def run(self, qm, mm=None, output_dir="./", l_save_qm_log=False, l_save_mm_log=False, l_save_scr=True, restart=None):
+    def run(self, qm, mm=None, output_dir="./", l_save_qm_log=False, l_save_mm_log=False, l_save_scr=True, restart=None, \
+        checkpoint=None, output_format="text"):
         """ Run MQC dynamics according to Ehrenfest dynamics
 
             :param object qm: QM object containing on-the-fly calculation information
@@ -45,6 +49,8 @@ class Eh(MQC):
             :param boolean l_save_mm_log: Logical for saving MM calculation log
             :param boolean l_save_scr: Logical for saving scratch directory
             :param string restart: Option for controlling dynamics restarting
+            :param object checkpoint: Checkpoint object to save only the dynamical state of dynamics
+            :param string output_format: Format of MD output files
         """
         # Initialize PyUNIxMD
         qm.calc_coupling = True
@@ -52,7 +58,7 @@ class Eh(MQC):
         qm.calc_tdp_grad = False
         base_dir, unixmd_dir, samp_bin_dir, qm_log_dir, mm_log_dir = \
             self.run_init(qm, mm, output_dir, False, False, l_save_qm_log, l_save_mm_log, \
-            l_save_scr, restart)
+            l_save_scr, restart, checkpoint, output_format)
         bo_list = [ist for ist in range(self.mol.nst)]
         self.print_init(qm, mm, restart)
 
@@ -116,6 +122,17 @@ class Eh(MQC):
                 self.write_final_xyz(unixmd_dir, istep)
 
             self.fstep = istep
+            if (checkpoint != None and checkpoint.check(istep, self.nsteps)):
+                checkpoint.write(base_dir, self.get_checkpoint(), qm.get_checkpoint())
+
+        if (checkpoint != None):
+            checkpoint.wait()
+
+        # Write remaining buffers and close output files
+        close_output_writer()
+
+        # Without checkpoint, the whole objects are pickled only at the end of dynamics
+        if (checkpoint == None):
             restart_file = os.path.join(base_dir, "RESTART.bin")
             with open(restart_file, 'wb') as f:
                 pickle.dump({'qm':qm, 'md':self}, f)
@@ -178,6 +195,9 @@ class Eh(MQC):
             tmp = f'{istep + 1:9d}' + "".join([f'{pop:15.8f}' for pop in self.dotpopnac])
             typewriter(tmp, unixmd_dir, "DOTPOPNAC", "a")
 
+            # Write the number of NACME terms in NACSPARSE
+            self.write_nac_sparsity(unixmd_dir, istep, self.ncouplings)
+
     def print_init(self, qm, mm, restart):
         """ Routine to print the initial information of dynamics
 
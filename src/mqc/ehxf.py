@@ -1,7 +1,7 @@
 from __future__ import division
 from lib.libmqcxf import el_run
 from mqc.mqc import MQC
-from misc import eps, au_to_K, call_name, typewriter
+from misc import eps, au_to_K, call_name, typewriter, close_output_writer
 import random, os, shutil, textwrap
 import numpy as np
 import pickle
@@ -35,6 +35,8 @@ class EhXF(MQC):
         :param integer nesteps: Total step of electronic propagation
         :param string elec_object: Electronic equation of motions
         :param string propagator: Electronic propagator
+        :param double elec_tol: Tolerance of local error in adaptive electronic propagators
+        :param double nac_threshold: Threshold of NACME terms neglected in electronic propagators
         :param boolean l_print_dm: Logical to print BO population and coherence
         :param boolean l_adj_nac: Logical to adjust nonadiabatic coupling
         :param double rho_threshold: Electronic density threshold for decoherence term calculation
@@ -50,12 +52,13 @@ class EhXF(MQC):
         :param integer verbosity: Verbosity of output
     """
     def __init__(self, molecule, thermostat=None, istate=0, dt=0.5, nsteps=1000, nesteps=20, \
-        elec_object="density", propagator="rk4", l_print_dm=True, l_adj_nac=True, \
+        elec_object="density", propagator="rk4", elec_tol=1E-8, nac_threshold=0., l_print_dm=True, l_adj_nac=True, \
         rho_threshold=0.01, sigma=None, init_coef=None, l_xf_force=True, l_econs_state=True, \
         l_td_sigma=False, unit_dt="fs", out_freq=1, verbosity=0):
         # Initialize input values
         super().__init__(molecule, thermostat, istate, dt, nsteps, nesteps, \
-            elec_object, propagator, l_print_dm, l_adj_nac, init_coef, unit_dt, out_freq, verbosity)
+            elec_object, propagator, elec_tol, nac_threshold, l_print_dm, l_adj_nac, init_coef, unit_dt, \
+            out_freq, verbosity)
 
         # Initialize SH variables
         self.rstate = self.istate
@@ -120,7 +123,8 @@ class EhXF(MQC):
         # Initialize event to print
         self.event = {"HOP": [], "DECO": []}
 
-    def run(self, qm, mm=None, output_dir="./", l_save_qm_log=False, l_save_mm_log=False, l_save_scr=True, restart=None):
+    def run(self, qm, mm=None, output_dir="./", l_save_qm_log=False, l_save_mm_log=False, l_save_scr=True, restart=None, \
+        checkpoint=None, output_format="text"):
         """ Run MQC dynamics according to EhXF dynamics
 
             :param object qm: QM object containing on-the-fly calculation information
@@ -130,6 +134,8 @@ class EhXF(MQC):
             :param boolean l_save_mm_log: Logical for saving MM calculation log
             :param boolean l_save_scr: Logical for saving scratch directory
             :param string restart: Option for controlling dynamics restarting
+            :param object checkpoint: Checkpoint object to save only the dynamical state of dynamics
+            :param string output_format: Format of MD output files
         """
         # Initialize PyUNIxMD
         qm.calc_coupling = True
@@ -137,7 +143,7 @@ class EhXF(MQC):
         qm.calc_tdp_grad = False
         base_dir, unixmd_dir, samp_bin_dir, qm_log_dir, mm_log_dir = \
             self.run_init(qm, mm, output_dir, False, False, l_save_qm_log, l_save_mm_log, \
-            l_save_scr, restart)
+            l_save_scr, restart, checkpoint, output_format)
         bo_list = [self.rstate]
         self.print_init(qm, mm, restart)
 
@@ -234,6 +240,17 @@ class EhXF(MQC):
                 self.write_final_xyz(unixmd_dir, istep)
 
             self.fstep = istep
+            if (checkpoint != None and checkpoint.check(istep, self.nsteps)):
+                checkpoint.write(base_dir, self.get_checkpoint(), qm.get_checkpoint())
+
+        if (checkpoint != None):
+            checkpoint.wait()
+
+        # Write remaining buffers and close output files
+        close_output_writer()
+
+        # Without checkpoint, the whole objects are pickled only at the end of dynamics
+        if (checkpoint == None):
             restart_file = os.path.join(base_dir, "RESTART.bin")
             with open(restart_file, 'wb') as f:
                 pickle.dump({'qm':qm, 'md':self}, f)
@@ -548,10 +565,32 @@ class EhXF(MQC):
             tmp = f'{istep + 1:9d}' + "".join([f'{pop:15.8f}' for pop in self.dotpopnac])
             typewriter(tmp, unixmd_dir, "DOTPOPNAC", "a")
 
+            # Write the number of NACME terms in NACSPARSE
+            self.write_nac_sparsity(unixmd_dir, istep, self.ncouplings)
+
             # Write decoherence term in DOTPOPDEC
             tmp = f'{istep + 1:9d}' + "".join([f'{pop:15.8f}' for pop in self.dotpopdec])
             typewriter(tmp, unixmd_dir, "DOTPOPDEC", "a")
 
+    def get_checkpoint(self):
+        """ Routine to get the dynamical state of MQC dynamics to be saved in a checkpoint
+        """
+        state = super().get_checkpoint()
+        state.update({"rstate": self.rstate, "rstate_old": self.rstate_old, "l_coh": self.l_coh, \
+            "l_first": self.l_first, "sigma": self.sigma, "phase": self.phase})
+        state["aux"] = {"pos": self.aux.pos, "vel": self.aux.vel, "vel_old": self.aux.vel_old}
+        return state
+
+    def set_checkpoint(self, state):
+        """ Routine to set the dynamical state of MQC dynamics read from a checkpoint
+
+            :param dictionary state: Dynamical state of MQC dynamics
+        """
+        state = dict(state)
+        for var, value in state.pop("aux").items():
+            setattr(self.aux, var, value)
+        super().set_checkpoint(state)
+
     def print_init(self, qm, mm, restart):
         """ Routine to print the initial information of dynamics
 
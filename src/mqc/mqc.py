@@ -1,5 +1,5 @@
 from __future__ import division
-from misc import fs_to_au, au_to_A, call_name, typewriter
+from misc import fs_to_au, au_to_A, call_name, typewriter, arraywriter, truncate_npy, open_output_writer
 import textwrap, datetime
 import numpy as np
 import os, shutil
@@ -15,6 +15,8 @@ class MQC(object):
         :param integer nesteps: Electronic step
         :param string elec_object: Electronic equation of motions
         :param string propagator: Electronic propagator
+        :param double elec_tol: Tolerance of local error in adaptive electronic propagators
+        :param double nac_threshold: Threshold of NACME terms neglected in electronic propagators
         :param boolean l_print_dm: Logical to print BO population and coherence
         :param boolean l_adj_nac: Logical to adjust nonadiabatic coupling
         :param init_coef: Initial BO coefficient
@@ -24,7 +26,8 @@ class MQC(object):
         :param integer verbosity: Verbosity of output
     """
     def __init__(self, molecule, thermostat, istate, dt, nsteps, nesteps, \
-        elec_object, propagator, l_print_dm, l_adj_nac, init_coef, unit_dt, out_freq, verbosity):
+        elec_object, propagator, elec_tol, nac_threshold, l_print_dm, l_adj_nac, init_coef, unit_dt, out_freq, \
+        verbosity):
         # Save name of MQC dynamics
         self.md_type = self.__class__.__name__
 
@@ -68,16 +71,41 @@ class MQC(object):
         if (self.propagator != None):
             self.propagator = self.propagator.lower()
 
-        if not (self.propagator in [None, "rk4", "exponential"]):
+        if not (self.propagator in [None, "rk4", "exponential", "rk45", "krylov", "ld"]):
             error_message = "Invalid electronic propagator!"
             error_vars = f"propagator = {self.propagator}"
             raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
 
-        if (self.propagator == "exponential" and self.elec_object != "coefficient"):
-            error_message = "exponential propagator is incompatible with objects other than coefficient"
+        if (self.propagator == "krylov" and self.elec_object != "coefficient"):
+            error_message = "krylov propagator is incompatible with objects other than coefficient"
             error_vars = f"elec_object = {self.elec_object}, propagator = {self.propagator}"
             raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
 
+        # States at time t + dt are connected to the diabatic basis with the overlap matrix in ld propagator,
+        # while the auxiliary wave packets of XF and the CT terms are defined with the NACMEs
+        if (self.propagator == "ld" and self.md_type in ["SHXF", "EhXF", "CT"]):
+            error_message = "ld propagator is not implemented for decoherence-induced or CT dynamics!"
+            error_vars = f"propagator = {self.propagator}"
+            raise NotImplementedError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        # Electronic substeps are adapted from nesteps to satisfy the tolerance in rk45 propagator,
+        # and the dimension of the Krylov subspace is adapted in krylov propagator
+        self.elec_tol = elec_tol
+        if (self.propagator in ["rk45", "krylov"] and not self.elec_tol > 0.):
+            error_message = f"Tolerance for {self.propagator} propagator must be positive!"
+            error_vars = f"elec_tol = {self.elec_tol}"
+            raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+        self.nsubsteps = 0
+
+        # NACME terms not larger than the threshold are excluded from the derivative kernels
+        # of rk4, rk45 and krylov propagators, while exponential propagator uses the full matrix
+        self.nac_threshold = nac_threshold
+        if (self.nac_threshold != None and self.nac_threshold < 0.):
+            error_message = "Threshold for NACME terms must not be negative!"
+            error_vars = f"nac_threshold = {self.nac_threshold}"
+            raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+        self.ncouplings = 0
+
         self.l_print_dm = l_print_dm
 
         self.l_adj_nac = l_adj_nac
@@ -91,7 +119,7 @@ class MQC(object):
         self.mol.get_coefficient(init_coef, self.istate)
 
     def run_init(self, qm, mm, output_dir, l_coupling, l_save_bin, l_save_qm_log, l_save_mm_log, \
-        l_save_scr, restart):
+        l_save_scr, restart, checkpoint, output_format):
         """ Initialize MQC dynamics
 
             :param object qm: QM object containing on-the-fly calculation information
@@ -103,6 +131,8 @@ class MQC(object):
             :param boolean l_save_mm_log: Logical for saving MM calculation log
             :param boolean l_save_scr: Logical for saving scratch directory
             :param string restart: Option for controlling dynamics restarting
+            :param object checkpoint: Checkpoint object to save only the dynamical state of dynamics
+            :param string output_format: Format of MD output files
         """
         # Check whether the restart option is right
         if (restart != None):
@@ -113,6 +143,13 @@ class MQC(object):
             error_vars = f"restart = {restart}"
             raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
 
+        # Check whether the output format is right
+        self.output_format = output_format.lower()
+        if not (self.output_format in ["text", "binary"]):
+            error_message = "Invalid format of MD output files!"
+            error_vars = f"output_format = {output_format}"
+            raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
         # Check whether NACVs are needed for Ehrenfest dynamics or not
         if (self.md_type in ["CT", "Eh", "EhXF"]):
             if (self.mol.l_nacme):
@@ -120,6 +157,12 @@ class MQC(object):
                 error_vars = f"(QM) qm_prog.qm_method = {qm.qm_prog}.{qm.qm_method}"
                 raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
 
+        # Check whether the overlap matrix between the states is provided for ld propagator
+        if (self.propagator == "ld" and not self.mol.l_st_overlap):
+            error_message = "ld propagator needs the overlap matrix between the states, check your QM object!"
+            error_vars = f"(QM) qm_prog.qm_method = {qm.qm_prog}.{qm.qm_method}"
+            raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
         # Check compatibility for nonadiabatic coupling calculation in BOMD
         if (self.md_type == "BOMD" and l_coupling):
             if (not self.mol.l_nacme):
@@ -142,6 +185,9 @@ class MQC(object):
             error_vars = f"mm = {mm}"
             raise NotImplementedError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
 
+        # Output files are kept open with buffers until the end of dynamics
+        open_output_writer()
+
         # Set directory information
         output_dir = os.path.expanduser(output_dir)
         base_dir = []
@@ -168,6 +214,10 @@ class MQC(object):
             if (self.mol.l_qmmm and mm != None):
                 mm_log_dir.append(os.path.join(idir, "mm_log"))
 
+        # Dynamical state is restored from the checkpoint instead of the pickled objects
+        if (restart != None and checkpoint != None):
+            self.read_checkpoint(qm, checkpoint, dir_tmp)
+
         # Check and make directories
         if (restart == "append"):
             # For MD output directory
@@ -177,6 +227,11 @@ class MQC(object):
                     error_vars = f"restart = {restart}, output_dir = {output_dir}"
                     raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
 
+                # Rows of outputs written after the restart point are discarded
+                if (self.output_format == "binary"):
+                    self.truncate_binary(md_idir)
+                self.truncate_text(md_idir)
+
             # For trajectory binary directory
             if (l_save_bin):
                 for samp_idir in samp_bin_dir:
@@ -261,6 +316,51 @@ class MQC(object):
         """
         pass
 
+    def get_checkpoint(self):
+        """ Routine to get the dynamical state of MQC dynamics to be saved in a checkpoint
+        """
+        state = {"fstep": self.fstep, "mol": self.mol.get_checkpoint()}
+        if (self.thermo != None):
+            state["thermo"] = self.thermo.get_checkpoint()
+        return state
+
+    def read_checkpoint(self, qm, checkpoint, output_dir):
+        """ Routine to read the checkpoint file and restore the dynamical state
+
+            :param object qm: QM object containing on-the-fly calculation information
+            :param object checkpoint: Checkpoint object to save only the dynamical state of dynamics
+            :param string output_dir: Name of directory where the checkpoint file is saved
+        """
+        md_state, qm_state = checkpoint.read(output_dir)
+        self.set_checkpoint(md_state)
+        qm.set_checkpoint(qm_state)
+
+    def set_checkpoint(self, state):
+        """ Routine to set the dynamical state of MQC dynamics read from a checkpoint
+
+            :param dictionary state: Dynamical state of MQC dynamics
+        """
+        for var, value in state.items():
+            if (var == "mol"):
+                self.mol.set_checkpoint(value)
+            elif (var == "thermo"):
+                if (self.thermo != None):
+                    self.thermo.set_checkpoint(value)
+            else:
+                setattr(self, var, value)
+
+    def __setstate__(self, state):
+        """ Restore MQC object from a pickle, e.g. RESTART.bin file
+            Variables of the electronic propagators missing in old pickles are set to the default values
+
+            :param dictionary state: Attributes of MQC dynamics
+        """
+        self.__dict__.update(state)
+
+        for var, value in [("elec_tol", 1E-8), ("nsubsteps", 0), ("nac_threshold", 0.), ("ncouplings", 0)]:
+            if (not hasattr(self, var)):
+                setattr(self, var, value)
+
     def print_init(self, qm, mm, l_coupling, restart):
         """ Routine to print the initial information of dynamics
 
@@ -347,6 +447,10 @@ class MQC(object):
         if (self.md_type != "BOMD"):
             dynamics_info += f"  Electronic Step          = {self.nesteps:>16d}\n"
             dynamics_info += f"  Electronic Propagator    = {self.propagator:>16s}\n"
+            if (self.propagator in ["rk45", "krylov"]):
+                dynamics_info += f"  Electronic Tolerance     = {self.elec_tol:>16.3E}\n"
+            if (self.propagator in ["rk4", "rk45", "krylov"]):
+                dynamics_info += f"  NACME Threshold          = {self.nac_threshold:>16.3E}\n"
             dynamics_info += f"  Propagation Scheme       = {self.elec_object:>16s}\n"
         else:
             if (l_coupling):
@@ -412,41 +516,57 @@ class MQC(object):
             :param string unixmd_dir: Directory where MD output files are written
             :param boolean calc_coupling: Check whether the dynamics includes coupling calculation
         """
-        # Energy information file header
-        tmp = f'{"#":5s}{"Step":9s}{"Kinetic(H)":15s}{"Potential(H)":15s}{"Total(H)":15s}' + \
-            "".join([f'E({ist})(H){"":8s}' for ist in range(self.mol.nst)])
-        typewriter(tmp, unixmd_dir, "MDENERGY", "w")
+        if (self.output_format == "binary"):
+            # Symbols are saved to export the binary outputs to text files
+            np.save(os.path.join(unixmd_dir, "SYMBOLS.npy"), np.array(self.mol.symbols))
+        else:
+            # Energy information file header
+            tmp = f'{"#":5s}{"Step":9s}{"Kinetic(H)":15s}{"Potential(H)":15s}{"Total(H)":15s}' + \
+                "".join([f'E({ist})(H){"":8s}' for ist in range(self.mol.nst)])
+            typewriter(tmp, unixmd_dir, "MDENERGY", "w")
 
         if (self.md_type != "BOMD"):
             # BO coefficents, densities file header
-            if (self.elec_object == "density"):
-                tmp = f'{"#":5s} Density Matrix: population Re; see the manual for detail orders'
-                typewriter(tmp, unixmd_dir, "BOPOP", "w")
-                tmp = f'{"#":5s} Density Matrix: coherence Re-Im; see the manual for detail orders'
-                typewriter(tmp, unixmd_dir, "BOCOH", "w")
-            elif (self.elec_object == "coefficient"):
-                tmp = f'{"#":5s} BO State Coefficients: state Re-Im; see the manual for detail orders'
-                typewriter(tmp, unixmd_dir, "BOCOEF", "w")
-                if (self.l_print_dm):
+            if (self.output_format == "text"):
+                if (self.elec_object == "density"):
                     tmp = f'{"#":5s} Density Matrix: population Re; see the manual for detail orders'
                     typewriter(tmp, unixmd_dir, "BOPOP", "w")
                     tmp = f'{"#":5s} Density Matrix: coherence Re-Im; see the manual for detail orders'
                     typewriter(tmp, unixmd_dir, "BOCOH", "w")
+                elif (self.elec_object == "coefficient"):
+                    tmp = f'{"#":5s} BO State Coefficients: state Re-Im; see the manual for detail orders'
+                    typewriter(tmp, unixmd_dir, "BOCOEF", "w")
+                    if (self.l_print_dm):
+                        tmp = f'{"#":5s} Density Matrix: population Re; see the manual for detail orders'
+                        typewriter(tmp, unixmd_dir, "BOPOP", "w")
+                        tmp = f'{"#":5s} Density Matrix: coherence Re-Im; see the manual for detail orders'
+                        typewriter(tmp, unixmd_dir, "BOCOH", "w")
+
+            # NSUBSTEP file header
+            if (self.propagator == "rk45" and self.output_format == "text"):
+                tmp = f'{"#":5s}{"Step":8s}{"Electronic Substeps":10s}'
+                typewriter(tmp, unixmd_dir, "NSUBSTEP", "w")
 
             # DOTPOPNAC file header
             if (self.verbosity >= 1):
                 tmp = f'{"#":5s} Time-derivative Density Matrix by NAC: population; see the manual for detail orders'
                 typewriter(tmp, unixmd_dir, "DOTPOPNAC", "w")
 
-        if (calc_coupling):
+                # NACSPARSE file header
+                if (self.propagator in ["rk4", "rk45", "krylov"]):
+                    tmp = f'{"#":5s}{"Step":8s}{"Couplings":15s}{"Fraction":15s}'
+                    typewriter(tmp, unixmd_dir, "NACSPARSE", "w")
+
+        if (calc_coupling and self.output_format == "text"):
             # NACME file header
             tmp = f'{"#":5s}Non-Adiabatic Coupling Matrix Elements: off-diagonal'
             typewriter(tmp, unixmd_dir, "NACME", "w")
 
         # file header for SH-based methods
         if (self.md_type in ["SH", "SHXF"]):
-            tmp = f'{"#":5s}{"Step":8s}{"Running State":10s}'
-            typewriter(tmp, unixmd_dir, "SHSTATE", "w")
+            if (self.output_format == "text"):
+                tmp = f'{"#":5s}{"Step":8s}{"Running State":10s}'
+                typewriter(tmp, unixmd_dir, "SHSTATE", "w")
 
             tmp = f'{"#":5s}{"Step":12s}' + "".join([f'Prob({ist}){"":8s}' for ist in range(self.mol.nst)])
             typewriter(tmp, unixmd_dir, "SHPROB", "w")
@@ -457,6 +577,12 @@ class MQC(object):
                 tmp = f'{"#":5s} Time-derivative Density Matrix by decoherence: population; see the manual for detail orders'
                 typewriter(tmp, unixmd_dir, "DOTPOPDEC", "w")
 
+        # file header for truncated Gauss transform in CTMQC
+        if (self.md_type == "CT"):
+            if (self.l_gauss_diag):
+                tmp = f'{"#":5s}{"Step":12s}{"Error(g_i)":15s}{"Error(w_ij)":15s}'
+                typewriter(tmp, unixmd_dir, "GAUSS_ERR", "w")
+
     def write_md_output(self, unixmd_dir, calc_coupling, istep):
         """ Write output files
 
@@ -464,6 +590,10 @@ class MQC(object):
             :param boolean calc_coupling: Check whether the dynamics includes coupling calculation
             :param integer istep: Current MD step
         """
+        if (self.output_format == "binary"):
+            self.write_binary(unixmd_dir, calc_coupling, istep)
+            return
+
         # Write MOVIE.xyz file including positions and velocities
         tmp = f'{self.mol.nat:6d}\n{"":2s}Step:{istep + 1:6d}{"":12s}Position(A){"":34s}Velocity(au)' + \
             "".join(["\n" + f'{self.mol.symbols[iat]:5s}' + \
@@ -495,6 +625,11 @@ class MQC(object):
                         for ist in range(self.mol.nst) for jst in range(ist + 1, self.mol.nst)])
                     typewriter(tmp, unixmd_dir, "BOCOH", "a")
 
+            # Write NSUBSTEP file, the substeps of CTMQC trajectories are written separately
+            if (self.propagator == "rk45" and self.md_type != "CT"):
+                tmp = f'{istep + 1:9d}{"":14s}{self.nsubsteps}'
+                typewriter(tmp, unixmd_dir, "NSUBSTEP", "a")
+
         if (calc_coupling):
             # Write NACME file
             tmp = f'{istep + 1:10d}' + "".join([f'{self.mol.nacme[ist, jst]:15.8f}' \
@@ -510,6 +645,93 @@ class MQC(object):
                             "".join([f'{self.mol.nac[ist, jst, iat, isp]:15.8f}' for isp in range(self.mol.ndim)]) for iat in range(self.mol.nat_qm)])
                         typewriter(tmp, unixmd_dir, f"NACV_{ist}_{jst}", "a")
 
+    def write_nac_sparsity(self, unixmd_dir, istep, ncouplings):
+        """ Write the number of NACME terms used in electronic propagation and their fraction
+
+            :param string unixmd_dir: PyUNIxMD directory
+            :param integer istep: Current MD step
+            :param integer ncouplings: Number of off-diagonal NACME terms larger than the threshold
+        """
+        if (self.propagator in ["rk4", "rk45", "krylov"]):
+            # Fraction of the operations of NACME term is counted from the terms used in the time derivatives
+            nst = self.mol.nst
+            fraction = ncouplings / max(nst * (nst - 1), 1)
+            tmp = f'{istep + 1:9d}{"":4s}{ncouplings:10d}{fraction:15.8f}'
+            typewriter(tmp, unixmd_dir, "NACSPARSE", "a")
+
+    def write_binary(self, unixmd_dir, calc_coupling, istep):
+        """ Write output arrays in binary format, the rows are appended to the arrays of each quantity
+
+            :param string unixmd_dir: Directory where MD output files are written
+            :param boolean calc_coupling: Check whether the dynamics includes coupling calculation
+            :param integer istep: Current MD step
+        """
+        # Positions and velocities are saved in atomic unit
+        arraywriter(istep + 1, unixmd_dir, "STEP.npy")
+        arraywriter(self.mol.pos, unixmd_dir, "POS.npy")
+        arraywriter(self.mol.vel, unixmd_dir, "VEL.npy")
+        arraywriter([self.mol.ekin, self.mol.epot, self.mol.etot], unixmd_dir, "MDENERGY.npy")
+        arraywriter([states.energy for states in self.mol.states], unixmd_dir, "ENERGY.npy")
+
+        if (self.md_type != "BOMD"):
+            if (self.elec_object == "coefficient"):
+                arraywriter([states.coef for states in self.mol.states], unixmd_dir, "COEF.npy")
+            if (self.elec_object == "density" or self.l_print_dm):
+                arraywriter(self.mol.rho, unixmd_dir, "RHO.npy")
+            if (self.propagator == "rk45" and self.md_type != "CT"):
+                arraywriter(self.nsubsteps, unixmd_dir, "NSUBSTEP.npy")
+
+        if (calc_coupling):
+            arraywriter(self.mol.nacme, unixmd_dir, "NACME.npy")
+            if (not self.mol.l_nacme and self.verbosity >= 2):
+                arraywriter(self.mol.nac, unixmd_dir, "NACV.npy")
+
+    def truncate_binary(self, unixmd_dir):
+        """ Discard rows of binary output arrays written after the last successful step
+
+            :param string unixmd_dir: Directory where MD output files are written
+        """
+        step_file = os.path.join(unixmd_dir, "STEP.npy")
+        if (not os.path.exists(step_file)):
+            return
+
+        nrows = np.count_nonzero(np.load(step_file) <= self.fstep + 1)
+        for file_name in os.listdir(unixmd_dir):
+            if (file_name.endswith(".npy") and file_name != "SYMBOLS.npy"):
+                truncate_npy(os.path.join(unixmd_dir, file_name), nrows)
+
+    def truncate_text(self, unixmd_dir):
+        """ Discard lines of text outputs written after the last successful step,
+            which are left when the checkpoint is not written at every step
+
+            :param string unixmd_dir: Directory where MD output files are written
+        """
+        for file_name in os.listdir(unixmd_dir):
+            tmp_name = os.path.join(unixmd_dir, file_name)
+            if (file_name.endswith(".npy") or file_name == "FINAL.xyz" or not os.path.isfile(tmp_name)):
+                continue
+
+            with open(tmp_name, "r") as f:
+                lines = f.readlines()
+
+            # Blocks of xyz format start with the number of atoms followed by the step line,
+            # and the other rows start with the step
+            l_block = any([line.split()[:1] == ["Step:"] for line in lines[:2]])
+            nlines = len(lines)
+            for iline, line in enumerate(lines):
+                field = line.split()
+                if (l_block):
+                    if (len(field) > 1 and field[0] == "Step:" and int(field[1]) > self.fstep + 1):
+                        nlines = iline - 1
+                        break
+                elif (len(field) > 0 and field[0].isdigit() and int(field[0]) > self.fstep + 1):
+                    nlines = iline
+                    break
+
+            if (nlines < len(lines)):
+                with open(tmp_name, "w") as f:
+                    f.writelines(lines[:nlines])
+
     def write_final_xyz(self, unixmd_dir, istep):
         """ Write final positions and velocities
 
@@ -1,7 +1,7 @@
 from __future__ import division
 from lib.libmqc import el_run
 from mqc.mqc import MQC
-from misc import eps, au_to_K, call_name, typewriter
+from misc import eps, au_to_K, call_name, typewriter, arraywriter, close_output_writer
 import random, os, shutil, textwrap
 import numpy as np
 import pickle
@@ -17,6 +17,8 @@ class SH(MQC):
         :param integer nesteps: Total step of electronic propagation
         :param string elec_object: Electronic equation of motions
         :param string propagator: Electronic propagator
+        :param double elec_tol: Tolerance of local error in adaptive electronic propagators
+        :param double nac_threshold: Threshold of NACME terms neglected in electronic propagators
         :param boolean l_print_dm: Logical to print BO population and coherence
         :param boolean l_adj_nac: Adjust nonadiabatic coupling to align the phases
         :param string hop_rescale: Velocity rescaling method after successful hop
@@ -30,12 +32,13 @@ class SH(MQC):
         :param integer verbosity: Verbosity of output
     """
     def __init__(self, molecule, thermostat=None, istate=0, dt=0.5, nsteps=1000, nesteps=20, \
-        elec_object="density", propagator="rk4", l_print_dm=True, l_adj_nac=True, hop_rescale="augment", \
-        hop_reject="reverse", init_coef=None, dec_correction=None, edc_parameter=0.1, \
+        elec_object="density", propagator="rk4", elec_tol=1E-8, nac_threshold=0., l_print_dm=True, l_adj_nac=True, \
+        hop_rescale="augment", hop_reject="reverse", init_coef=None, dec_correction=None, edc_parameter=0.1, \
         unit_dt="fs", out_freq=1, verbosity=0):
         # Initialize input values
         super().__init__(molecule, thermostat, istate, dt, nsteps, nesteps, \
-            elec_object, propagator, l_print_dm, l_adj_nac, init_coef, unit_dt, out_freq, verbosity)
+            elec_object, propagator, elec_tol, nac_threshold, l_print_dm, l_adj_nac, init_coef, unit_dt, \
+            out_freq, verbosity)
 
         # Initialize SH variables
         self.rstate = self.istate
@@ -91,7 +94,8 @@ class SH(MQC):
         # Initialize event to print
         self.event = {"HOP": []}
 
-    def run(self, qm, mm=None, output_dir="./", l_save_qm_log=False, l_save_mm_log=False, l_save_scr=True, restart=None):
+    def run(self, qm, mm=None, output_dir="./", l_save_qm_log=False, l_save_mm_log=False, l_save_scr=True, restart=None, \
+        checkpoint=None, output_format="text"):
         """ Run MQC dynamics according to surface hopping dynamics
 
             :param object qm: QM object containing on-the-fly calculation information
@@ -101,6 +105,8 @@ class SH(MQC):
             :param boolean l_save_mm_log: Logical for saving MM calculation log
             :param boolean l_save_scr: Logical for saving scratch directory
             :param string restart: Option for controlling dynamics restarting
+            :param object checkpoint: Checkpoint object to save only the dynamical state of dynamics
+            :param string output_format: Format of MD output files
         """
         # Initialize PyUNIxMD
         qm.calc_coupling = True
@@ -108,7 +114,7 @@ class SH(MQC):
         qm.calc_tdp_grad = False
         base_dir, unixmd_dir, samp_bin_dir, qm_log_dir, mm_log_dir = \
             self.run_init(qm, mm, output_dir, False, False, l_save_qm_log, l_save_mm_log, \
-            l_save_scr, restart)
+            l_save_scr, restart, checkpoint, output_format)
         bo_list = [self.rstate]
         self.print_init(qm, mm, restart)
 
@@ -211,6 +217,17 @@ class SH(MQC):
                 self.write_final_xyz(unixmd_dir, istep)
 
             self.fstep = istep
+            if (checkpoint != None and checkpoint.check(istep, self.nsteps)):
+                checkpoint.write(base_dir, self.get_checkpoint(), qm.get_checkpoint())
+
+        if (checkpoint != None):
+            checkpoint.wait()
+
+        # Write remaining buffers and close output files
+        close_output_writer()
+
+        # Without checkpoint, the whole objects are pickled only at the end of dynamics
+        if (checkpoint == None):
             restart_file = os.path.join(base_dir, "RESTART.bin")
             with open(restart_file, 'wb') as f:
                 pickle.dump({'qm':qm, 'md':self}, f)
@@ -456,8 +473,11 @@ class SH(MQC):
             :param integer istep: Current MD step
         """
         # Write SHSTATE file
-        tmp = f'{istep + 1:9d}{"":14s}{self.rstate}'
-        typewriter(tmp, unixmd_dir, "SHSTATE", "a")
+        if (self.output_format == "binary"):
+            arraywriter(self.rstate, unixmd_dir, "RSTATE.npy")
+        else:
+            tmp = f'{istep + 1:9d}{"":14s}{self.rstate}'
+            typewriter(tmp, unixmd_dir, "SHSTATE", "a")
 
         # Write SHPROB file
         tmp = f'{istep + 1:9d}' + "".join([f'{self.prob[ist]:15.8f}' for ist in range(self.mol.nst)])
@@ -474,6 +494,16 @@ class SH(MQC):
             tmp = f'{istep + 1:9d}' + "".join([f'{pop:15.8f}' for pop in self.dotpopnac])
             typewriter(tmp, unixmd_dir, "DOTPOPNAC", "a")
 
+            # Write the number of NACME terms in NACSPARSE
+            self.write_nac_sparsity(unixmd_dir, istep, self.ncouplings)
+
+    def get_checkpoint(self):
+        """ Routine to get the dynamical state of MQC dynamics to be saved in a checkpoint
+        """
+        state = super().get_checkpoint()
+        state.update({"rstate": self.rstate, "rstate_old": self.rstate_old})
+        return state
+
     def print_init(self, qm, mm, restart):
         """ Routine to print the initial information of dynamics
 
@@ -22,7 +22,7 @@ class BOMD(MQC_QED):
     def __init__(self, polariton, thermostat=None, istate=0, dt=0.5, nsteps=1000, l_adj_nac=True, \
         l_adj_tdp=True, unit_dt="fs", out_freq=1, verbosity=0):
         # Initialize input values
-        super().__init__(polariton, thermostat, istate, dt, nsteps, None, None, None, \
+        super().__init__(polariton, thermostat, istate, dt, nsteps, None, None, None, None, \
             False, l_adj_nac, l_adj_tdp, None, unit_dt, out_freq, verbosity)
 
         # Initialize SH variables
@@ -2,6 +2,7 @@ from __future__ import division
 from lib.libctmqc import el_run
 from mqc_qed.mqc import MQC_QED
 from misc import eps, au_to_K, au_to_A, call_name, typewriter, gaussian1d
+from ensemble import Ensemble
 import os, shutil, textwrap
 import numpy as np
 import pickle
@@ -17,6 +18,7 @@ class CT(MQC_QED):
         :param integer nesteps: Total step of electronic propagation
         :param string elec_object: Electronic equation of motions
         :param string propagator: Electronic propagator
+        :param double elec_tol: Tolerance of local error in adaptive electronic propagators
         :param boolean l_print_dm: Logical to print BO population and coherence
         :param boolean l_adj_nac: Adjust nonadiabatic coupling to align the phases
         :param boolean l_adj_tdp: Adjust transition dipole moments to align the phases
@@ -32,9 +34,9 @@ class CT(MQC_QED):
         :param integer verbosity: Verbosity of output
     """
     def __init__(self, polaritons, thermostat=None, istates=None, dt=0.5, nsteps=1000, nesteps=20, \
-        elec_object="coefficient", propagator="rk4", l_print_dm=True, l_adj_nac=True, l_adj_tdp=True, \
-        rho_threshold=0.01, init_coefs=None, dist_parameter=10., min_sigma=0.3, const_dist_cutoff=None, \
-        const_center_cutoff=None, l_en_cons=False, unit_dt="fs", out_freq=1, verbosity=0):
+        elec_object="coefficient", propagator="rk4", elec_tol=1E-8, l_print_dm=True, l_adj_nac=True, \
+        l_adj_tdp=True, rho_threshold=0.01, init_coefs=None, dist_parameter=10., min_sigma=0.3, \
+        const_dist_cutoff=None, const_center_cutoff=None, l_en_cons=False, unit_dt="fs", out_freq=1, verbosity=0):
         # Save name of MQC dynamics
         self.md_type = self.__class__.__name__
 
@@ -54,7 +56,7 @@ class CT(MQC_QED):
 
         # Initialize input values and coefficient for first trajectory
         super().__init__(self.pols[0], thermostat, self.istates[0], dt, nsteps, nesteps, elec_object, \
-            propagator, l_print_dm, l_adj_nac, l_adj_tdp, self.init_coefs[0], unit_dt, out_freq, verbosity)
+            propagator, elec_tol, l_print_dm, l_adj_nac, l_adj_tdp, self.init_coefs[0], unit_dt, out_freq, verbosity)
 
         # Exception for electronic propagation
         if (self.elec_object != "coefficient"):
@@ -72,6 +74,9 @@ class CT(MQC_QED):
         for itraj in range(1, self.ntrajs):
             self.pols[itraj].get_coefficient(self.init_coefs[itraj], self.istates[itraj])
 
+        # Data of all trajectories are saved in contiguous arrays of the ensemble
+        self.ens = Ensemble(self.pols)
+
         # Initialize variables for CTMQC
         self.phase = np.zeros((self.ntrajs, self.pst, self.nat_qm, self.ndim))
         self.pst_pair = int(self.pst * (self.pnt - 1) / 2)
@@ -134,6 +139,9 @@ class CT(MQC_QED):
 
         self.print_init(qed, qm, mm, restart)
 
+        # Polariton objects lose the references to the ensemble when they are pickled
+        self.ens.bind(self.pols, range(self.ntrajs))
+
         if (restart == None):
             # Calculate initial input geometry for all trajectories at t = 0.0 s
             self.istep = -1
@@ -343,7 +351,7 @@ class CT(MQC_QED):
             for ist in range(self.nst):
                 for jst in range(ist + 1, self.nst):
                     index_lk += 1
-                    self.qmom[itraj, index_lk] = self.slope_i[itraj] * (self.mols[itraj].pos - self.center_lk[itraj, index_lk])
+                    self.qmom[itraj, index_lk] = self.slope_i[itraj] * (self.ens.pos[itraj] - self.center_lk[itraj, index_lk])
 
         # 5. Calculate 2 * Qmom * phase / mass
         self.K_lk = np.zeros((self.ntrajs, self.nst, self.nst))
@@ -380,13 +388,13 @@ class CT(MQC_QED):
             R_tmp = np.zeros((self.nat_qm, self.ndim))  # Temporary variable for R
 
             for jtraj in range(self.ntrajs):
-                pos_diff = self.mols[jtraj].pos - self.mols[itraj].pos # Dimension = (self.nat_qm, self.ndim)
+                pos_diff = self.ens.pos[jtraj] - self.ens.pos[itraj] # Dimension = (self.nat_qm, self.ndim)
                 for iat in range(self.nat_qm):
                     for idim in range(self.ndim):
                         distance = abs(pos_diff[iat, idim]) # Distance between i-th dimenstion of i-th atom in itraj and jtraj
                         if (distance <= cutoff[itraj, iat, idim]):
-                            R_tmp[iat, idim] += self.mols[jtraj].pos[iat, idim] # Dimension = (self.nat_qm, self.ndim)
-                            R2_tmp[iat, idim] += self.mols[jtraj].pos[iat, idim] * self.mols[jtraj].pos[iat, idim] # Dimension = (self.nat_qm, self.ndim)
+                            R_tmp[iat, idim] += self.ens.pos[jtraj, iat, idim] # Dimension = (self.nat_qm, self.ndim)
+                            R2_tmp[iat, idim] += self.ens.pos[jtraj, iat, idim] * self.ens.pos[jtraj, iat, idim] # Dimension = (self.nat_qm, self.ndim)
                             self.count_ntrajs[itraj, iat, idim] += 1
 
             for iat in range(self.nat_qm):
@@ -413,8 +421,8 @@ class CT(MQC_QED):
                     for idim in range(self.ndim):
                         # gaussian1d(x, pre-factor, sigma, mean)
                         # gaussian1d(R^{itraj}, 1.0, sigma^{jtraj}, R^{jtraj})
-                        self.prod_g_i[itraj, jtraj] *= gaussian1d(self.mols[itraj].pos[iat, idim], 1., \
-                            self.sigma_lk[jtraj, 0, iat, idim], self.mols[jtraj].pos[iat, idim])
+                        self.prod_g_i[itraj, jtraj] *= gaussian1d(self.ens.pos[itraj, iat, idim], 1., \
+                            self.sigma_lk[jtraj, 0, iat, idim], self.ens.pos[jtraj, iat, idim])
                 self.g_i[itraj] += self.prod_g_i[itraj, jtraj]
 
         # w_ij is defined as W_IJ in SI of J. Phys. Chem. Lett., 2017, 8, 3048-3055.
@@ -432,7 +440,7 @@ class CT(MQC_QED):
         for itraj in range(self.ntrajs):
             for jtraj in range(self.ntrajs):
                 for ist in range(self.nst):
-                    self.w_k[itraj, ist] += self.prod_g_i[itraj, jtraj] * self.mols[jtraj].rho.real[ist, ist] / self.g_i[itraj]
+                    self.w_k[itraj, ist] += self.prod_g_i[itraj, jtraj] * self.ens.rho.real[jtraj, ist, ist] / self.g_i[itraj]
 
             index_lk = -1
             for ist in range(self.nst):
@@ -459,7 +467,7 @@ class CT(MQC_QED):
         rho = np.zeros((self.ntrajs, self.nst))
         for itraj in range(self.ntrajs):
             for ist in range(self.nst):
-                rho[itraj, ist] = self.mols[itraj].rho[ist, ist].real
+                rho[itraj, ist] = self.ens.rho.real[itraj, ist, ist]
 
         # (3-1) Compute denominator
         deno_lk = np.zeros((self.nst_pair, self.nat_qm, self.ndim)) # denominator
@@ -483,7 +491,7 @@ class CT(MQC_QED):
                     index_lk += 1
                     for iat in range(self.nat_qm):
                         for idim in range(self.ndim):
-                            numer_lk[itraj, index_lk, iat, idim] = rho[itraj, ist] * rho[itraj, jst] * self.mols[itraj].pos[iat, idim] * \
+                            numer_lk[itraj, index_lk, iat, idim] = rho[itraj, ist] * rho[itraj, jst] * self.ens.pos[itraj, iat, idim] * \
                                 (self.phase[itraj, ist, iat, idim] - self.phase[itraj, jst, iat, idim]) * self.slope_i[itraj, iat, idim]
                             if (abs(deno_lk[index_lk, iat, idim]) <= self.small):
                                 ratio_lk[itraj, index_lk, iat, idim] = 0.
@@ -503,7 +511,7 @@ class CT(MQC_QED):
                             for jtraj in range(self.ntrajs):
                                 center_old_lk[itraj, index_lk, iat, idim] += ratio_lk[jtraj, index_lk, iat, idim]
                             if ((abs(self.slope_i[itraj, iat, idim]) <= self.small) or (center_old_lk[itraj, index_lk, iat, idim] == 0.)):
-                                center_old_lk[itraj, index_lk, iat, idim] = self.mols[itraj].pos[iat, idim]
+                                center_old_lk[itraj, index_lk, iat, idim] = self.ens.pos[itraj, iat, idim]
 
         # Center of quantum momentum is calculated by Eq.(S21) of J. Phys. Chem. Lett., 2017, 8, 3048-3055.
         center_new_lk = np.zeros((self.ntrajs, self.nst_pair, self.nat_qm, self.ndim))
@@ -515,10 +523,10 @@ class CT(MQC_QED):
                     for iat in range(self.nat_qm):
                         for idim in range(self.ndim):
                             if (abs(self.slope_i[itraj, iat, idim]) <= self.small):
-                                center_new_lk[itraj, index_lk, iat, idim] = self.mols[itraj].pos[iat, idim]
+                                center_new_lk[itraj, index_lk, iat, idim] = self.ens.pos[itraj, iat, idim]
                             else:
                                 for jtraj in range(self.ntrajs):
-                                    center_new_lk[itraj, index_lk, iat, idim] += self.mols[jtraj].pos[iat, idim] * self.prod_g_i[itraj, jtraj] /\
+                                    center_new_lk[itraj, index_lk, iat, idim] += self.ens.pos[jtraj, iat, idim] * self.prod_g_i[itraj, jtraj] /\
                                         (2. * self.sigma_lk[jtraj, 0, iat, idim] ** 2 * self.g_i[itraj] * (- self.slope_i[itraj, iat, idim]))
 
         # (3-3) Determine qauntum momentum center TODO: atomistic flag
@@ -532,16 +540,16 @@ class CT(MQC_QED):
                         for idim in range(self.ndim):
                             # test how far calculated center of quantum momentum is from current atomic position.
                             # tmp_var is deviation between position of classical trajectory and quantum momentum center.
-                            tmp_var = center_old_lk[itraj, index_lk, iat, idim] - self.mols[itraj].pos[iat, idim]
+                            tmp_var = center_old_lk[itraj, index_lk, iat, idim] - self.ens.pos[itraj, iat, idim]
                             if (self.const_center_cutoff == None):
                                 cutoff = self.dist_parameter * self.sigma_lk[itraj, 0, iat, idim]
                             else:
                                 cutoff = self.const_center_cutoff
 
                             if (abs(tmp_var) > cutoff): 
-                                tmp_var = center_new_lk[itraj, index_lk, iat, idim] - self.mols[itraj].pos[iat, idim]
+                                tmp_var = center_new_lk[itraj, index_lk, iat, idim] - self.ens.pos[itraj, iat, idim]
                                 if (abs(tmp_var) > cutoff): 
-                                    self.center_lk[itraj, index_lk, iat, idim] = self.mols[itraj].pos[iat, idim]
+                                    self.center_lk[itraj, index_lk, iat, idim] = self.ens.pos[itraj, iat, idim]
                                 else:
                                     self.center_lk[itraj, index_lk, iat, idim] = center_new_lk[itraj, index_lk, iat, idim]
                             else: 
@@ -15,6 +15,7 @@ class MQC_QED(object):
         :param integer nesteps: Electronic step
         :param string elec_object: Electronic equation of motions
         :param string propagator: Electronic propagator
+        :param double elec_tol: Tolerance of local error in adaptive electronic propagators
         :param boolean l_print_dm: Logical to print population and coherence
         :param boolean l_adj_nac: Logical to adjust nonadiabatic coupling
         :param boolean l_adj_tdp: Adjust transition dipole moments to align the phases
@@ -25,7 +26,7 @@ class MQC_QED(object):
         :param integer verbosity: Verbosity of output
     """
     def __init__(self, polariton, thermostat, istate, dt, nsteps, nesteps, elec_object, \
-        propagator, l_print_dm, l_adj_nac, l_adj_tdp, init_coef, unit_dt, out_freq, verbosity):
+        propagator, elec_tol, l_print_dm, l_adj_nac, l_adj_tdp, init_coef, unit_dt, out_freq, verbosity):
         # Save name of MQC dynamics
         self.md_type = self.__class__.__name__
 
@@ -74,11 +75,23 @@ class MQC_QED(object):
         if (self.propagator != None):
             self.propagator = self.propagator.lower()
 
-        if not (self.propagator in [None, "rk4", "exponential"]):
+        if not (self.propagator in [None, "rk4", "exponential", "krylov"]):
             error_message = "Invalid electronic propagator!"
             error_vars = f"propagator = {self.propagator}"
             raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
 
+        if (self.propagator == "krylov" and self.md_type != "SH"):
+            error_message = "krylov propagator is only implemented for SH coupled to cavity mode!"
+            error_vars = f"propagator = {self.propagator}"
+            raise NotImplementedError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        # The dimension of the Krylov subspace is adapted to satisfy the tolerance in krylov propagator
+        self.elec_tol = elec_tol
+        if (self.propagator == "krylov" and not self.elec_tol > 0.):
+            error_message = "Tolerance for krylov propagator must be positive!"
+            error_vars = f"elec_tol = {self.elec_tol}"
+            raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
         self.l_print_dm = l_print_dm
 
         self.l_adj_nac = l_adj_nac
@@ -372,6 +385,8 @@ class MQC_QED(object):
         if (self.md_type != "BOMD"):
             dynamics_info += f"  Electronic Step          = {self.nesteps:>16d}\n"
             dynamics_info += f"  Electronic Propagator    = {self.propagator:>16s}\n"
+            if (self.propagator == "krylov"):
+                dynamics_info += f"  Electronic Tolerance     = {self.elec_tol:>16.3E}\n"
             dynamics_info += f"  Propagation Scheme       = {self.elec_object:>16s}\n"
 
         # Print surface hopping variables
@@ -17,6 +17,7 @@ class SH(MQC_QED):
         :param integer nesteps: Total step of electronic propagation
         :param string elec_object: Electronic equation of motions
         :param string propagator: Electronic propagator
+        :param double elec_tol: Tolerance of local error in adaptive electronic propagators
         :param boolean l_print_dm: Logical to print population and coherence
         :param boolean l_adj_nac: Adjust nonadiabatic coupling to align the phases
         :param boolean l_adj_tdp: Adjust transition dipole moments to align the phases
@@ -31,12 +32,12 @@ class SH(MQC_QED):
         :param integer verbosity: Verbosity of output
     """
     def __init__(self, polariton, thermostat=None, istate=0, dt=0.5, nsteps=1000, nesteps=20, \
-        elec_object="coefficient", propagator="rk4", l_print_dm=True, l_adj_nac=True, l_adj_tdp=True, \
-        hop_rescale="augment", hop_reject="reverse", init_coef=None, dec_correction=None, \
+        elec_object="coefficient", propagator="rk4", elec_tol=1E-8, l_print_dm=True, l_adj_nac=True, \
+        l_adj_tdp=True, hop_rescale="augment", hop_reject="reverse", init_coef=None, dec_correction=None, \
         edc_parameter=0.1, unit_dt="fs", out_freq=1, verbosity=0):
         # Initialize input values
         super().__init__(polariton, thermostat, istate, dt, nsteps, nesteps, elec_object, \
-            propagator, l_print_dm, l_adj_nac, l_adj_tdp, init_coef, unit_dt, out_freq, verbosity)
+            propagator, elec_tol, l_print_dm, l_adj_nac, l_adj_tdp, init_coef, unit_dt, out_freq, verbosity)
 
         # Initialize SH variables
         self.rstate = self.istate
@@ -17,19 +17,51 @@ class State(object):
 
 
 class Polaritonic_State(object):
-    """ Class for polaritonic states
+    """ Class for polaritonic states. Energies and coefficients of the states are saved in contiguous arrays
+        of the polariton object, hence the electronic propagators use them without copying
 
         :param integer ndim: Dimension of space
         :param integer nat: Number of atoms
+        :param object pol: Polariton object where energies and coefficients are saved
+        :param integer ist: Index for the polaritonic state
     """
-    def __init__(self, ndim, nat):
+    def __init__(self, ndim, nat, pol, ist):
         # Initialize variables
-        self.energy = 0.
-        self.energy_old = 0.
+        self.pol = pol
+        self.ist = ist
         self.force = np.zeros((nat, ndim))
-        # Initialize the electronic coefficients (adiabatic and diabatic)
-        self.coef_a = 0. + 0.j
-        self.coef_d = 0. + 0.j
+
+    @property
+    def energy(self):
+        return self.pol.energy[self.ist]
+
+    @energy.setter
+    def energy(self, energy):
+        self.pol.energy[self.ist] = energy
+
+    @property
+    def energy_old(self):
+        return self.pol.energy_old[self.ist]
+
+    @energy_old.setter
+    def energy_old(self, energy_old):
+        self.pol.energy_old[self.ist] = energy_old
+
+    @property
+    def coef_a(self):
+        return self.pol.coef_a[self.ist]
+
+    @coef_a.setter
+    def coef_a(self, coef_a):
+        self.pol.coef_a[self.ist] = coef_a
+
+    @property
+    def coef_d(self):
+        return self.pol.coef_d[self.ist]
+
+    @coef_d.setter
+    def coef_d(self, coef_d):
+        self.pol.coef_d[self.ist] = coef_d
 
 
 class Polariton(object):
@@ -165,9 +197,15 @@ class Polariton(object):
         # Initialize polaritonic states
         self.pst = self.nst * (self.nphotons + 1)
 
+        self.energy = np.zeros(self.pst)
+        self.energy_old = np.zeros(self.pst)
+        # Initialize the electronic coefficients (adiabatic and diabatic)
+        self.coef_a = np.zeros(self.pst, dtype=np.complex128)
+        self.coef_d = np.zeros(self.pst, dtype=np.complex128)
+
         self.pol_states = []
         for ist in range(self.pst):
-            self.pol_states.append(Polaritonic_State(self.ndim, self.nat))
+            self.pol_states.append(Polaritonic_State(self.ndim, self.nat, self, ist))
 
         # Initialize couplings
         self.nacme = np.zeros((self.nst, self.nst))
@@ -402,8 +440,25 @@ class Polariton(object):
     def backup_qed(self):
         """ Backup polaritonic state energies for propagation of auxiliary trajectories
         """
-        for states in self.pol_states:
-            states.energy_old = states.energy
+        self.energy_old[:] = self.energy
+
+    def __setstate__(self, state):
+        """ Restore polariton object from a pickle, e.g. RESTART.bin file
+            Energies and coefficients saved in Polaritonic_State objects of old pickles are moved into the arrays
+
+            :param dictionary state: Attributes of polariton
+        """
+        self.__dict__.update(state)
+
+        # Attributes of Polaritonic_State objects are read from __dict__, since the properties shadow them
+        if (len(self.pol_states) > 0 and "energy" in self.pol_states[0].__dict__):
+            self.energy = np.array([states.__dict__.pop("energy") for states in self.pol_states])
+            self.energy_old = np.array([states.__dict__.pop("energy_old") for states in self.pol_states])
+            self.coef_a = np.array([states.__dict__.pop("coef_a") for states in self.pol_states], dtype=np.complex128)
+            self.coef_d = np.array([states.__dict__.pop("coef_d") for states in self.pol_states], dtype=np.complex128)
+            for ist, states in enumerate(self.pol_states):
+                states.pol = self
+                states.ist = ist
 
     def get_nr_electrons(self):
         """ Get the number of electrons
@@ -2,7 +2,9 @@ from __future__ import division
 from lib.libcioverlap import wf_overlap
 from qm.dftbplus.dftbplus import DFTBplus
 from qm.dftbplus.dftbpar import spin_w, spin_w_lc, onsite_uu, onsite_ud, max_l
+from qm.dftbplus.skoverlap import read_sk_tables, sk_overlap
 from misc import data, eps, eV_to_au, call_name
+from itertools import islice
 import os, shutil, re, textwrap
 import numpy as np
 
@@ -24,12 +26,14 @@ class DFTB(DFTBplus):
         :param string mixer: Charge mixing method used in DFTB
         :param string ex_symmetry: Symmetry of excited state in TDDFTB
         :param double e_window: Energy window for TDDFTB. Increases efficiency of NACME calculation.
+        :param double ci_threshold: Amplitude threshold of CI coefficients in NACME calculation
+        :param double ci_norm_cutoff: Cumulative norm of CI coefficients retained in NACME calculation
         :param integer,list k_point: Number of k-point samplings
         :param boolean l_periodic: Use periodicity in the calculations
         :param double,list cell_length: The lattice vectors of periodic unit cell
         :param string sk_path: Path for Slater-Koster files
         :param string install_path: Path for DFTB+ install directory
-        :param string odin_path: Path for ODIN install directory
+        :param string odin_path: Path for ODIN install directory, not used anymore
         :param boolean mpi: Use MPI parallelization
         :param string mpi_path: Path for MPI binary
         :param integer nthreads: Number of threads in the calculations
@@ -38,8 +42,8 @@ class DFTB(DFTBplus):
     def __init__(self, molecule, l_scc=True, scc_tol=1E-6, scc_max_iter=100, l_onsite=False, \
         l_range_sep=False, lc_method="MatrixBased", l_spin_pol=False, unpaired_elec=0., guess="h0", \
         guess_file="./charges.bin", elec_temp=0., mixer="Broyden", ex_symmetry="singlet", e_window=0., \
-        k_point=[1, 1, 1], l_periodic=False, cell_length=[0., 0., 0., 0., 0., 0., 0., 0., 0.,], \
-        sk_path="./", install_path="./", odin_path="./", mpi=False, mpi_path="./", nthreads=1, version="20.1"):
+        ci_threshold=0., ci_norm_cutoff=1., k_point=[1, 1, 1], l_periodic=False, cell_length=[0., 0., 0., 0., 0., 0., 0., 0., 0.,], \
+        sk_path="./", install_path="./", odin_path=None, mpi=False, mpi_path="./", nthreads=1, version="20.1"):
         # Initialize DFTB+ common variables
         super(DFTB, self).__init__(molecule, sk_path, install_path, nthreads, version)
 
@@ -70,6 +74,19 @@ class DFTB(DFTBplus):
         self.ex_symmetry = ex_symmetry.lower()
         self.e_window = e_window
 
+        # Set truncation of CI coefficients in the overlap between the states
+        self.ci_threshold = ci_threshold
+        if (self.ci_threshold < 0.):
+            error_message = "Amplitude threshold of CI coefficients must be non-negative!"
+            error_vars = f"ci_threshold = {self.ci_threshold}"
+            raise ValueError (f"( {self.qm_method}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        self.ci_norm_cutoff = ci_norm_cutoff
+        if (self.ci_norm_cutoff <= 0. or self.ci_norm_cutoff > 1.):
+            error_message = "Cumulative norm cutoff of CI coefficients must be in (0, 1]!"
+            error_vars = f"ci_norm_cutoff = {self.ci_norm_cutoff}"
+            raise ValueError (f"( {self.qm_method}.{call_name()} ) {error_message} ( {error_vars} )")
+
         self.k_point = k_point
         self.l_periodic = l_periodic
         self.a_axis = np.copy(cell_length[0:3])
@@ -91,29 +108,13 @@ class DFTB(DFTBplus):
         # TDDFTB do not produce NACs, so we should get NACME from CIoverlap
         # TDDFTB cannot compute the gradient of several states simultaneously.
         molecule.l_nacme = True
+        # State overlaps between two time steps are also obtained from CIoverlap
+        molecule.l_st_overlap = True
         self.re_calc = True
 
-        # Define ODIN path to calculate NACME in TDDFTB
-        self.odin_path = odin_path
-        if (not os.path.isdir(self.odin_path)):
-            error_message = "Install directory for ODIN executable not found!"
-            error_vars = f"odin_path = {self.odin_path}"
-            raise FileNotFoundError (f"( {self.qm_method}.{call_name()} ) {error_message} ( {error_vars} )")
-
-        # ODIN: Get maximum l for each element (order as in geometry file)
-        elements = np.copy(self.atom_type)
-        self.max_ang_string = ""
-        for element in elements:
-            if (max_l[element] == 's'):
-                self.max_ang_string += "1 "
-            elif (max_l[element] == 'p'):
-                self.max_ang_string += "2 "
-            elif (max_l[element] == 'd'):
-                self.max_ang_string += "3 "
-            else:
-                error_message = "Number of basis for f orbital not implemented, see '$PYUNIXMDHOME/src/qm/dftbplus/dftb.py'!"
-                error_vars = f"max_l[element] = {max_l[element]}"
-                raise NotImplementedError (f"( {self.qm_method}.{call_name()} ) {error_message} ( {error_vars} )")
+        # AO overlap for NACME is calculated with Slater-Koster tables, hence ODIN is not used anymore
+        if (odin_path != None):
+            print ("\n\n WARNING: odin_path is deprecated and ignored since ODIN is not used anymore! \n\n", flush=True)
 
         # Calculate number of basis for current system
         # Set new variable to decide the position of basis functions in terms of atoms
@@ -152,15 +153,6 @@ class DFTB(DFTBplus):
                 error_vars = f"current atom = {molecule.symbols[iat]}, sym_index = {sym_index}"
                 raise NotImplementedError (f"( {self.qm_method}.{call_name()} ) {error_message} ( {error_vars} )")
 
-        # Set new variable to decide the position of atoms in terms of basis functions
-        self.check_basis = []
-        for ibasis in range(self.nbasis):
-            for iat in range(molecule.nat_qm):
-                ind_a = self.check_atom[iat] + 1
-                ind_b = self.check_atom[iat + 1]
-                if (ibasis + 1 >= ind_a and ibasis + 1 <= ind_b):
-                    self.check_basis.append(iat + 1)
-
         # Initialize NACME variables
         # There is no core orbitals in TDDFTB (fixed occupations)
         # nocc is number of occupied orbitals and nvirt is number of virtual orbitals
@@ -180,6 +172,9 @@ class DFTB(DFTBplus):
             self.orb_ini[0] = self.norb
             self.orb_final[0] = 0
 
+        # AO overlap between two time steps is calculated with Slater-Koster tables read at the first step
+        self.sk_tables = None
+        self.pos_old = np.zeros((molecule.nat_qm, molecule.ndim))
         self.ao_overlap = np.zeros((self.nbasis, self.nbasis))
         self.mo_coef_old = np.zeros((self.norb, self.nbasis))
         self.mo_coef_new = np.zeros((self.norb, self.nbasis))
@@ -205,6 +200,13 @@ class DFTB(DFTBplus):
         self.extract_QM(molecule, base_dir, istep, bo_list, dt, calc_force_only)
         self.move_dir(base_dir)
 
+    def get_checkpoint(self):
+        """ Get the variables of (TD)DFTB calculator which are needed for the next MD step,
+            i.e. geometry, MO and CI coefficients of the previous step to calculate wavefunction overlap
+        """
+        return {"pos_old": self.pos_old, "mo_coef_old": self.mo_coef_old, "ci_coef_old": self.ci_coef_old, \
+            "orb_ini": self.orb_ini, "orb_final": self.orb_final}
+
     def copy_files(self, molecule, istep, calc_force_only):
         """ Copy necessary scratch files in previous step
 
@@ -215,8 +217,6 @@ class DFTB(DFTBplus):
         # Copy required files for NACME
         if (self.calc_coupling and not calc_force_only and istep >= 0 and molecule.nst > 1):
             # After T = 0.0 s
-            shutil.copy(os.path.join(self.scr_qm_dir, "geometry.xyz"), \
-                os.path.join(self.scr_qm_dir, "../geometry.xyz.pre"))
             if (istep == 0):
                 shutil.copy(os.path.join(self.scr_qm_dir, "eigenvec.bin"), \
                     os.path.join(self.scr_qm_dir, "../eigenvec.bin.pre"))
@@ -263,35 +263,11 @@ class DFTB(DFTBplus):
             file_af.close()
             os.rename('tmp.gen', 'geometry.gen')
 
-        # Make 'double.gen' file for CIoverlap in TDDFTB
-        # In this case, we do not need to consider periodicity
-        if (self.calc_coupling and not calc_force_only and istep >= 0 and molecule.nst > 1):
-            # Move previous files to currect directory
-            os.rename('../geometry.xyz.pre', './geometry.xyz.pre')
-            if (istep == 0):
-                os.rename('../eigenvec.bin.pre', './eigenvec.bin.pre')
-                os.rename('../SPX.DAT.pre', './SPX.DAT.pre')
-                os.rename('../XplusY.DAT.pre', './XplusY.DAT.pre')
-            # Open 'geometry.xyz.pre'
-            file_af = open('double.xyz', 'w')
-            file_be = open('geometry.xyz.pre', 'r')
-            first_row = True
-            for row in file_be:
-                if (first_row):
-                    row = f'{molecule.nat_qm * 2}\n'
-                    first_row = False
-                file_af.write(row)
-            file_be.close()
-            # Open 'geometry.xyz'
-            file_be = open('geometry.xyz', 'r')
-            iline = 1
-            for row in file_be:
-                if (iline > 2):
-                    file_af.write(row)
-                iline += 1
-            file_be.close()
-            file_af.close()
-            os.system("xyz2gen double.xyz")
+        # Move previous files to currect directory for CIoverlap in TDDFTB
+        if (self.calc_coupling and not calc_force_only and istep == 0 and molecule.nst > 1):
+            os.rename('../eigenvec.bin.pre', './eigenvec.bin.pre')
+            os.rename('../SPX.DAT.pre', './SPX.DAT.pre')
+            os.rename('../XplusY.DAT.pre', './XplusY.DAT.pre')
 
         # Make 'dftb_in.hsd' file
         input_dftb = ""
@@ -531,64 +507,6 @@ class DFTB(DFTBplus):
         with open(file_name, "w") as f:
             f.write(input_dftb)
 
-        # Write 'dftb_in.hsd.double' file
-        if (self.calc_coupling and not calc_force_only and istep >= 0 and molecule.nst > 1):
-            input_odin = textwrap.dedent(f"""\
-              'double.gen'
-              '{self.sk_path}'
-              '-'
-              '.skf'
-            """)
-            input_odin += self.max_ang_string
-            input_odin += '\n'
-            file_name = "odin.in"
-            with open(file_name, "w") as f:
-                f.write(input_odin)
-            
-            # New input for dftb
-            input_dftb = ""
-
-            # Geometry Block
-            input_geom = textwrap.dedent(f"""\
-            Geometry = GenFormat{{
-              <<< 'double.gen'
-            }}
-            """)
-            input_dftb += input_geom
-            input_dftb += input_ham_init
-            input_ham_basic = textwrap.dedent(f"""\
-              Charge = {2.0 * molecule.charge}
-              Filling = Fermi{{
-                Temperature[K] = {self.elec_temp}
-              }}
-              MaxAngularMomentum = {{
-              {angular_momentum}
-              }}
-              SlaterKosterFiles = Type2FileNames{{
-                Prefix = '{self.sk_path}'
-                Separator = '-'
-                Suffix = '.skf'
-                LowerCaseTypeName = No
-              }}
-            }}
-            """)
-            input_dftb += input_ham_basic
-
-            # Options Block
-            input_options = textwrap.dedent(f"""\
-            Options = {{
-              WriteDetailedXml = Yes
-              WriteDetailedOut = Yes
-              WriteHS = Yes
-              TimingVerbosity = -1
-            }}
-            """)
-            input_dftb += input_options
-
-            file_name = "dftb_in.hsd.double"
-            with open(file_name, "w") as f:
-                f.write(input_dftb)
-
     def run_QM(self, molecule, base_dir, istep, bo_list, calc_force_only):
         """ Run (TD)DFTB calculation and save the output files to qm_log directory
 
@@ -610,12 +528,6 @@ class DFTB(DFTBplus):
             os.environ["OMP_NUM_THREADS"] = f"{self.nthreads}"
             command = f"{qm_command} > log"
 
-        # Run ODIN code for calculation of overlap matrix
-        ovr_path = os.path.join(self.odin_path, "odin")
-        ovr_command = f"{ovr_path} < odin.in > odin.log"
-        if (self.calc_coupling and not calc_force_only and istep >= 0 and molecule.nst > 1):
-            os.system(ovr_command)
-
         # Copy dftb_in.hsd for target state
         file_name = f"dftb_in.hsd.geom.{bo_list[0]}"
         shutil.copy(file_name, "dftb_in.hsd")
@@ -683,6 +595,9 @@ class DFTB(DFTBplus):
             if (istep >= 0):
                 self.CI_overlap(molecule, istep, dt)
 
+            # Save geometry in the buffer
+            self.pos_old = np.copy(molecule.pos[0:molecule.nat_qm])
+
     def CI_overlap(self, molecule, istep, dt):
         """ Read the necessary files and calculate NACME from tdnac.c routine,
             note that only reading of several files is required in this method
@@ -691,199 +606,104 @@ class DFTB(DFTBplus):
             :param integer istep: Current MD step
             :param double dt: Time interval
         """
-        # Read upper right block of 'oversqr.dat' file (< t | t+dt >)
-        file_name_in = "oversqr.dat"
-
-        self.ao_overlap = np.zeros((self.nbasis, self.nbasis))
-        with open(file_name_in, "r") as f_in:
-            lines = f_in.readlines()
-            row = 0
-            iline = 0
-            for line in lines:
-                # Skip first five lines and read upper block
-                if (iline in range(5, 5 + self.nbasis)):
-                    col = 0
-                    count = False
-                    field = line.split()
-                    for element in field:
-                        # Read right block
-                        if (count):
-                            ind_a = self.check_basis[row]
-                            ind_b = self.check_basis[col]
-                            if (ind_a == ind_b):
-                                # Choose onsite (same-atom) block
-                                # Sometimes NaN or too large values appear in the onsite block due to the slater-koster file
-                                # The values set to 1 or 0 regardless of original elements
-                                if (row == col):
-                                    # Diagonal element in onsite block
-                                    new_val = 1.
-                                else:
-                                    # Off-diagonal element in onsite block
-                                    new_val = 0.
-                            else:
-                                # Choose offsite (different-atom) block
-                                new_val = float(element)
-                            # Set overlap matrix element
-                            self.ao_overlap[row, col] = new_val
-                        col += 1
-                        # Read right block
-                        if (col > self.nbasis - 1):
-                            col -= self.nbasis
-                            count = True
-                    row += 1
-                iline += 1
+        # Calculate AO overlap between two time steps (< t | t+dt >) from Slater-Koster tables
+        if (self.sk_tables == None):
+            self.sk_tables = read_sk_tables(self.atom_type, self.sk_path)
+        self.ao_overlap = sk_overlap(molecule.symbols[0:molecule.nat_qm], self.pos_old, \
+            molecule.pos[0:molecule.nat_qm], self.check_atom, self.sk_tables)
 #        np.savetxt("test-over", self.ao_overlap, fmt=f"%6.3f")
 
         # Read 'eigenvec.bin.pre' file at time t
-        dum_byte = 4
         if (istep == 0):
-            file_name_in = "eigenvec.bin.pre"
-
-            self.mo_coef_old = np.zeros((self.norb, self.nbasis))
-            with open(file_name_in, "rb") as f_in:
-                f_in.seek(dum_byte, 1)
-                dummy = np.fromfile(f_in, dtype=np.int32, count=1)
-                f_in.seek(dum_byte, 1)
-                for iorb in range(self.norb):
-                    f_in.seek(dum_byte, 1)
-                    data = np.fromfile(f_in, dtype=np.float64, count=self.nbasis)
-                    f_in.seek(dum_byte, 1)
-                    self.mo_coef_old[iorb] = data
+            self.mo_coef_old = self.read_mo_coef("eigenvec.bin.pre")
 #            np.savetxt("test-mo1", self.mo_coef_old, fmt=f"%12.6f")
 
         # Read 'eigenvec.bin' file at time t + dt
-        file_name_in = "eigenvec.bin"
-
-        self.mo_coef_new = np.zeros((self.norb, self.nbasis))
-        with open(file_name_in, "rb") as f_in:
-            f_in.seek(dum_byte, 1)
-            dummy = np.fromfile(f_in, dtype=np.int32, count=1)
-            f_in.seek(dum_byte, 1)
-            for iorb in range(self.norb):
-                f_in.seek(dum_byte, 1)
-                data = np.fromfile(f_in, dtype=np.float64, count=self.nbasis)
-                f_in.seek(dum_byte, 1)
-                self.mo_coef_new[iorb] = data
+        self.mo_coef_new = self.read_mo_coef("eigenvec.bin")
 #        np.savetxt("test-mo2", self.mo_coef_new, fmt=f"%12.6f")
 
         # The CI coefficients are arranged in order of single-particle excitations
-        # Read 'SPX.DAT.pre' file at time t
+        # Read 'SPX.DAT.pre' and 'XplusY.DAT.pre' files at time t
         if (istep == 0):
-            file_name_in = "SPX.DAT.pre"
-
-            with open(file_name_in, "r") as f_in:
-                lines = f_in.readlines()
-                # Dimension for CI coefficients (number of excitations)
-                ndim_old = int(lines[-2].strip().split()[0])
-                get_wij_ind_old = np.zeros((ndim_old, 2), dtype=np.int32)
-                iline = 0
-                for line in lines:
-                    # Skip first five lines
-                    if (iline in range(5, 5 + ndim_old)):
-                        # Column information: 1st = index, 4th = occ(i), 6th = virt(a)
-                        field = line.split()
-                        # Determine new limits for for-loops
-                        if (int(field[5]) > self.orb_final[0]):
-                            self.orb_final[0] = int(field[5])
-                        if (int(field[3]) < self.orb_ini[0] + 1):
-                            self.orb_ini[0] = int(field[3]) - 1
-                        get_wij_ind_old[int(field[0]) - 1] = [int(field[3]), int(field[5])]
-                    iline += 1
-
-        # Read 'SPX.DAT' file at time t + dt
-        file_name_in = "SPX.DAT"
-
-        with open(file_name_in, "r") as f_in:
-            lines = f_in.readlines()
-            # Dimension for CI coefficients (number of excitations)
-            ndim = int(lines[-2].strip().split()[0])
-            get_wij_ind_new = np.zeros((ndim, 2), dtype=np.int32)
-            iline = 0
-            for line in lines:
-                # Skip first five lines
-                if (iline in range(5, 5 + ndim)):
-                    # Column information: 1st = index, 4th = occ(i), 6th = virt(a)
-                    field = line.split()
-                    if (int(field[5]) > self.orb_final[0]):
-                        self.orb_final[0] = int(field[5])
-                    if (int(field[3]) < self.orb_ini[0] + 1):
-                        self.orb_ini[0] = int(field[3]) - 1
-                    get_wij_ind_new[int(field[0]) - 1] = [int(field[3]), int(field[5])]
-                iline += 1
-
-        # Read 'XplusY.DAT.pre' file at time t
-        if (istep == 0):
-            file_name_in = "XplusY.DAT.pre"
-
-            self.ci_coef_old = np.zeros((molecule.nst, self.nocc, self.nvirt))
-            with open(file_name_in, "r") as f_in:
-                lines = f_in.readlines()
-                iline = 0
-                for line in lines:
-                    if (iline == 0):
-                        field = line.split()
-                        assert (int(field[0]) == ndim_old)
-                        assert (int(field[1]) >= molecule.nst - 1)
-                        # nxply is number of lines for each excited state in 'XplusY.dat'
-                        nxply = int(ndim_old / 6) + 1
-                        if (ndim_old % 6 != 0):
-                            nxply += 1
-                    else:
-                        field = line.split()
-                        if (iline % nxply == 1):
-                            ind = 0
-                            ist = int(field[0]) - 1
-                            # In general, TDDFTB calculate the excited states more than molecule.nst,
-                            # so we do not need to read all data for 'XplusY.DAT'
-                            if (ist == molecule.nst - 1):
-                                break
-                        else:
-                            # Currently, elements for CI coefficients for S0 state are zero (not used values)
-                            for element in field:
-                                ind_occ = get_wij_ind_old[ind, 0] - 1
-                                ind_virt = get_wij_ind_old[ind, 1] - self.nocc - 1
-                                self.ci_coef_old[ist + 1, ind_occ, ind_virt] = float(element)
-                                ind += 1
-                    iline += 1
+            get_wij_ind_old = self.read_spx("SPX.DAT.pre")
+            self.ci_coef_old = self.read_xy_coef(molecule, "XplusY.DAT.pre", get_wij_ind_old)
 #            np.savetxt("test-ci1", self.ci_coef_old[1], fmt=f"%12.6f")
 
-        # Read 'XplusY.DAT' file at time t + dt
-        file_name_in = "XplusY.DAT"
-
-        self.ci_coef_new = np.zeros((molecule.nst, self.nocc, self.nvirt))
-        with open(file_name_in, "r") as f_in:
-            lines = f_in.readlines()
-            iline = 0
-            for line in lines:
-                if (iline == 0):
-                    field = line.split()
-                    assert (int(field[0]) == ndim)
-                    assert (int(field[1]) >= molecule.nst - 1)
-                    # nxply is number of lines for each excited state in 'XplusY.dat'
-                    nxply = int(ndim / 6) + 1
-                    if (ndim % 6 != 0):
-                        nxply += 1
-                else:
-                    field = line.split()
-                    if (iline % nxply == 1):
-                        ind = 0
-                        ist = int(field[0]) - 1
-                        # In general, TDDFTB calculate the excited states more than molecule.nst,
-                        # so we do not need to read all data for 'XplusY.DAT'
-                        if (ist == molecule.nst - 1):
-                            break
-                    else:
-                        # Currently, elements for CI coefficients for S0 state are zero (not used values)
-                        for element in field:
-                            ind_occ = get_wij_ind_new[ind, 0] - 1
-                            ind_virt = get_wij_ind_new[ind, 1] - self.nocc - 1
-                            self.ci_coef_new[ist + 1, ind_occ, ind_virt] = float(element)
-                            ind += 1
-                iline += 1
+        # Read 'SPX.DAT' and 'XplusY.DAT' files at time t + dt
+        get_wij_ind_new = self.read_spx("SPX.DAT")
+        self.ci_coef_new = self.read_xy_coef(molecule, "XplusY.DAT", get_wij_ind_new)
 #        np.savetxt("test-ci2", self.ci_coef_new[1], fmt=f"%12.6f")
 
         # Calculate wavefunction overlap with orbital scheme
         # Reference: J. Phys. Chem. Lett. 2015, 6, 4200-4203
         wf_overlap(self, molecule, istep, dt)
 
+        # Write the norm of CI coefficients retained in the truncation
+        if (self.ci_threshold > 0. or self.ci_norm_cutoff < 1.):
+            self.write_ci_norm(istep)
+
+    def read_mo_coef(self, file_name):
+        """ Read MO coefficients from 'eigenvec.bin' file, which is written as Fortran unformatted records
+
+            :param string file_name: The name of the MO coefficient file
+        """
+        # Each record of MO is enclosed by 4-byte markers, and the first record is an integer
+        dum_byte = 4
+        record = np.dtype([("head", np.int32), ("coef", np.float64, (self.nbasis,)), ("tail", np.int32)])
+        with open(file_name, "rb") as f_in:
+            f_in.seek(3 * dum_byte, 0)
+            data = np.fromfile(f_in, dtype=record, count=self.norb)
+        return np.array(data["coef"])
+
+    def read_spx(self, file_name):
+        """ Read the single-particle excitations from 'SPX.DAT' file and update the limits of active orbitals
+
+            :param string file_name: The name of the single-particle excitation file
+        """
+        with open(file_name, "r") as f_in:
+            lines = f_in.readlines()
+        # Dimension for CI coefficients (number of excitations)
+        ndim = int(lines[-2].strip().split()[0])
+
+        # Skip first five lines, column information: 1st = index, 4th = occ(i), 6th = virt(a)
+        spx = np.loadtxt(lines[5:5 + ndim], usecols=(0, 3, 5), dtype=np.int32, ndmin=2)
+
+        # Determine new limits for for-loops
+        self.orb_final[0] = max(self.orb_final[0], np.max(spx[:, 2]))
+        self.orb_ini[0] = min(self.orb_ini[0], np.min(spx[:, 1]) - 1)
+
+        get_wij_ind = np.zeros((ndim, 2), dtype=np.int32)
+        get_wij_ind[spx[:, 0] - 1] = spx[:, 1:]
+        return get_wij_ind
+
+    def read_xy_coef(self, molecule, file_name, get_wij_ind):
+        """ Read CI coefficients of the excited states from 'XplusY.DAT' file
+
+            :param object molecule: Molecule object
+            :param string file_name: The name of the CI coefficient file
+            :param integer,list get_wij_ind: Occupied and virtual orbitals of the single-particle excitations
+        """
+        ndim = get_wij_ind.shape[0]
+        # nxply is number of lines for each excited state in 'XplusY.dat'
+        nxply = int(ndim / 6) + 1
+        if (ndim % 6 != 0):
+            nxply += 1
+
+        # In general, TDDFTB calculate the excited states more than molecule.nst,
+        # so we read only the lines of the first (molecule.nst - 1) excited states in 'XplusY.DAT'
+        with open(file_name, "r") as f_in:
+            field = f_in.readline().split()
+            assert (int(field[0]) == ndim)
+            assert (int(field[1]) >= molecule.nst - 1)
+            lines = list(islice(f_in, (molecule.nst - 1) * nxply))
+
+        # The first line for each excited state contains the index of the state
+        data = "".join([line for iline, line in enumerate(lines) if (iline % nxply != 0)])
+        xply = np.array(data.split(), dtype=np.float64).reshape(molecule.nst - 1, ndim)
+
+        # Currently, elements for CI coefficients for S0 state are zero (not used values)
+        ci_coef = np.zeros((molecule.nst, self.nocc, self.nvirt))
+        ci_coef[1:, get_wij_ind[:, 0] - 1, get_wij_ind[:, 1] - self.nocc - 1] = xply
+        return ci_coef
+
 
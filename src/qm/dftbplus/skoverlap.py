@@ -0,0 +1,181 @@
+from __future__ import division
+from qm.dftbplus.dftbpar import max_l
+from misc import call_name
+import numpy as np
+
+# Angular momenta of the shells for each maximum angular momentum
+# The orbitals are ordered as s, (p_y, p_z, p_x), (d_xy, d_yz, d_z2, d_xz, d_x2-y2) in DFTB+
+shells = {"s": [0], "p": [0, 1], "d": [0, 1, 2]}
+shell_offset = {0: 0, 1: 1, 2: 4}
+
+# Columns of the overlap integrals in the Slater-Koster table for (l1, l2, |m|) with l1 <= l2,
+# the first ten columns are the Hamiltonian integrals which are not used
+sk_column = {(2, 2, 0): 10, (2, 2, 1): 11, (2, 2, 2): 12, (1, 2, 0): 13, (1, 2, 1): 14, \
+    (1, 1, 0): 15, (1, 1, 1): 16, (0, 2, 0): 17, (0, 1, 0): 18, (0, 0, 0): 19}
+
+# Real d orbitals as quadratic forms, r^T Q r, in the order of DFTB+ with the same norm
+d_forms = np.zeros((5, 3, 3))
+d_forms[0, 0, 1] = d_forms[0, 1, 0] = np.sqrt(3.) / 2.
+d_forms[1, 1, 2] = d_forms[1, 2, 1] = np.sqrt(3.) / 2.
+d_forms[2] = np.diag([- 0.5, - 0.5, 1.])
+d_forms[3, 0, 2] = d_forms[3, 2, 0] = np.sqrt(3.) / 2.
+d_forms[4] = np.diag([np.sqrt(3.) / 2., - np.sqrt(3.) / 2., 0.])
+
+def read_sk_tables(atom_type, sk_path):
+    """ Read the overlap integrals in Slater-Koster files for all pairs of atomic species,
+        the file names are same as the ones used in DFTB+, i.e. '{sk_path}{A}-{B}.skf'
+
+        :param string,list atom_type: Atomic species in the system
+        :param string sk_path: Path for Slater-Koster files
+    """
+    sk_tables = {}
+    for spec_a in atom_type:
+        for spec_b in atom_type:
+            file_name = f"{sk_path}{spec_a}-{spec_b}.skf"
+            with open(file_name, "r") as f:
+                lines = f.readlines()
+
+            # Extended format including f orbitals starts with '@'
+            if (lines[0].startswith("@")):
+                error_message = "Extended format of Slater-Koster file not implemented!"
+                error_vars = f"file_name = {file_name}"
+                raise NotImplementedError (f"( {call_name()} ) {error_message} ( {error_vars} )")
+
+            field = lines[0].replace(",", " ").split()
+            grid_dist = float(field[0])
+            ngrid = int(field[1])
+
+            # Homo-nuclear files contain the on-site energies in the second line
+            iline = 3 if (spec_a == spec_b) else 2
+            table = []
+            for line in lines[iline:iline + ngrid]:
+                # Repeated values are written as 'n*value' in the table
+                values = []
+                for element in line.replace(",", " ").split():
+                    if ("*" in element):
+                        nrepeat, value = element.split("*")
+                        values += [float(value)] * int(nrepeat)
+                    else:
+                        values.append(float(element))
+                if (len(values) < 20):
+                    break
+                table.append(values[:20])
+
+            if (len(table) < 4):
+                error_message = "Too few grid points in Slater-Koster file!"
+                error_vars = f"file_name = {file_name}, grid points = {len(table)}"
+                raise ValueError (f"( {call_name()} ) {error_message} ( {error_vars} )")
+
+            sk_tables[(spec_a, spec_b)] = (grid_dist, np.array(table))
+
+    return sk_tables
+
+def sk_interpolate(grid_dist, table, dist):
+    """ Interpolate the integrals in Slater-Koster table with cubic polynomials on the uniform grid,
+        the integrals vanish beyond the last grid point
+
+        :param double grid_dist: Distance between the grid points
+        :param double,list table: Integrals at the grid points
+        :param double,list dist: Interatomic distances
+    """
+    ngrid = table.shape[0]
+    # Grid point i is located at the distance (i + 1) * grid_dist, shorter distances use the first point
+    x = np.maximum(dist / grid_dist - 1., 0.)
+    ind = np.clip(np.floor(x).astype(np.int64) - 1, 0, ngrid - 4)
+    t = (x - ind)[:, np.newaxis]
+
+    # Lagrange polynomials for the four grid points around the distance
+    values = - (t - 1.) * (t - 2.) * (t - 3.) / 6. * table[ind] \
+        + t * (t - 2.) * (t - 3.) / 2. * table[ind + 1] \
+        - t * (t - 1.) * (t - 3.) / 2. * table[ind + 2] \
+        + t * (t - 1.) * (t - 2.) / 6. * table[ind + 3]
+    values[x > ngrid - 1] = 0.
+    return values
+
+def sk_rotation(direction, lmax):
+    """ Get the transformation matrices of the real p and d orbitals from the frame whose z axis is
+        along the interatomic direction to the molecular frame, in the order of DFTB+
+
+        :param double,list direction: Unit vectors along the interatomic directions
+        :param integer lmax: Maximum angular momentum of the orbitals
+    """
+    # Orthonormal frame whose z axis is along the direction, the frame is arbitrary around the axis
+    # since the integrals of m and -m orbitals are same in Slater-Koster table
+    ref = np.where(np.abs(direction[:, 0:1]) < 0.9, np.array([1., 0., 0.]), np.array([0., 1., 0.]))
+    ex = np.cross(ref, direction)
+    ex /= np.linalg.norm(ex, axis=1)[:, np.newaxis]
+    ey = np.cross(direction, ex)
+    rot = np.stack([ex, ey, direction], axis=2)
+
+    npair = direction.shape[0]
+    rot_l = [np.ones((npair, 1, 1))]
+
+    # p orbitals transform as the Cartesian coordinates, (p_y, p_z, p_x)
+    if (lmax >= 1):
+        perm = [1, 2, 0]
+        rot_l.append(rot[:, perm][:, :, perm])
+
+    # d orbitals transform as the quadratic forms, Q' = R^T Q R, which are projected onto the forms
+    if (lmax >= 2):
+        forms = np.matmul(np.matmul(np.transpose(rot, (0, 2, 1))[:, np.newaxis], d_forms), rot[:, np.newaxis])
+        rot_l.append(np.matmul(forms.reshape(npair, 5, 9), d_forms.reshape(5, 9).T) / 1.5)
+
+    return rot_l
+
+def sk_overlap(symbols, pos_old, pos_new, check_atom, sk_tables):
+    """ Calculate AO overlap matrix between the geometries at time t and t + dt with Slater-Koster tables,
+        < t | t + dt >, where the onsite (same-atom) blocks are set to the identity
+
+        :param string,list symbols: Symbols of atoms
+        :param double,list pos_old: Positions of atoms at time t
+        :param double,list pos_new: Positions of atoms at time t + dt
+        :param integer,list check_atom: Indices of the first basis function of each atom
+        :param dictionary sk_tables: Grid distances and integrals of Slater-Koster tables for pairs of species
+    """
+    nat = len(symbols)
+    nbasis = check_atom[nat]
+    ao_overlap = np.zeros((nbasis, nbasis))
+
+    symbols = np.array(symbols)
+    atom_type = list(dict.fromkeys(symbols))
+    for spec_a in atom_type:
+        for spec_b in atom_type:
+            # Pairs of different atoms of species A at time t and species B at time t + dt
+            ind_a, ind_b = np.meshgrid(np.where(symbols == spec_a)[0], np.where(symbols == spec_b)[0], indexing="ij")
+            l_pair = (ind_a != ind_b)
+            ind_a, ind_b = ind_a[l_pair], ind_b[l_pair]
+            if (len(ind_a) == 0):
+                continue
+
+            vec = pos_new[ind_b] - pos_old[ind_a]
+            dist = np.linalg.norm(vec, axis=1)
+            rot = sk_rotation(vec / dist[:, np.newaxis], max(shells[max_l[spec_a]] + shells[max_l[spec_b]]))
+
+            # Integrals of the orbitals on A and B, and of the orbitals on B and A for l1 > l2
+            integral_ab = sk_interpolate(*sk_tables[(spec_a, spec_b)], dist)
+            integral_ba = sk_interpolate(*sk_tables[(spec_b, spec_a)], dist)
+
+            for l1 in shells[max_l[spec_a]]:
+                for l2 in shells[max_l[spec_b]]:
+                    lmin, lmax = min(l1, l2), max(l1, l2)
+                    integral = integral_ab if (l1 <= l2) else integral_ba
+                    m_list = np.arange(- lmin, lmin + 1)
+                    sk_int = np.stack([integral[:, sk_column[(lmin, lmax, abs(m))]] for m in m_list], axis=1)
+
+                    # S(mu, nu) = sum_m D^l1(mu, m) * D^l2(nu, m) * S(l1, l2, |m|) along the direction
+                    # The parity of real orbitals, (-1)^(l1 + l2), is used to reverse the direction for l1 > l2
+                    block = np.einsum("pim,pm,pjm->pij", rot[l1][:, :, l1 + m_list], sk_int, \
+                        rot[l2][:, :, l2 + m_list])
+                    if (l1 > l2):
+                        block *= (- 1.) ** (l1 + l2)
+
+                    rows = np.array(check_atom)[ind_a, np.newaxis] + shell_offset[l1] + np.arange(2 * l1 + 1)
+                    cols = np.array(check_atom)[ind_b, np.newaxis] + shell_offset[l2] + np.arange(2 * l2 + 1)
+                    ao_overlap[rows[:, :, np.newaxis], cols[:, np.newaxis, :]] = block
+
+    # Onsite blocks are set to the identity since the displacements of atoms are small during a time step
+    for iat in range(nat):
+        ao_overlap[check_atom[iat]:check_atom[iat + 1], check_atom[iat]:check_atom[iat + 1]] = \
+            np.identity(check_atom[iat + 1] - check_atom[iat])
+
+    return ao_overlap
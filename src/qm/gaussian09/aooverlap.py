@@ -0,0 +1,196 @@
+from __future__ import division
+from misc import call_name
+import re
+import numpy as np
+
+# Cartesian components (l_x, l_y, l_z) of the shells in the order of Gaussian 09
+cart_comp = {0: [(0, 0, 0)], \
+    1: [(1, 0, 0), (0, 1, 0), (0, 0, 1)], \
+    2: [(2, 0, 0), (0, 2, 0), (0, 0, 2), (1, 1, 0), (1, 0, 1), (0, 1, 1)], \
+    3: [(3, 0, 0), (0, 3, 0), (0, 0, 3), (1, 2, 0), (2, 1, 0), (2, 0, 1), (1, 0, 2), (0, 1, 2), (0, 2, 1), \
+    (1, 1, 1)]}
+
+# Pure (spherical) functions as the Cartesian polynomials in the order of Gaussian 09,
+# i.e. D 0, D+1, D-1, D+2, D-2 and F 0, F+1, F-1, F+2, F-2, F+3, F-3, the norms are set afterwards
+pure_comp = {2: [{(0, 0, 2): 2., (2, 0, 0): - 1., (0, 2, 0): - 1.}, {(1, 0, 1): 1.}, {(0, 1, 1): 1.}, \
+    {(2, 0, 0): 1., (0, 2, 0): - 1.}, {(1, 1, 0): 1.}], \
+    3: [{(0, 0, 3): 2., (2, 0, 1): - 3., (0, 2, 1): - 3.}, {(1, 0, 2): 4., (3, 0, 0): - 1., (1, 2, 0): - 1.}, \
+    {(0, 1, 2): 4., (2, 1, 0): - 1., (0, 3, 0): - 1.}, {(2, 0, 1): 1., (0, 2, 1): - 1.}, {(1, 1, 1): 1.}, \
+    {(3, 0, 0): 1., (1, 2, 0): - 3.}, {(2, 1, 0): 3., (0, 3, 0): - 1.}]}
+
+shell_type = {"S": [0], "P": [1], "SP": [0, 1], "L": [0, 1], "D": [2], "F": [3]}
+
+def read_basis(log, nbasis):
+    """ Read the basis set printed by 'gfinput' keyword in the log of Gaussian 09,
+        the shells are grouped by angular momentum with the indices of basis functions in the AO order
+
+        :param string log: Output log of Gaussian 09
+        :param integer nbasis: Number of basis functions
+    """
+    # Pure or Cartesian d and f functions, e.g. 'Standard basis: 6-31G(d) (6D, 7F)'
+    find_pure = re.findall('basis.*\((\d)D,\s*(\d+)F\)', log)
+    if (len(find_pure) == 0):
+        error_message = "Type of d and f functions not found in the log!"
+        error_vars = f"pattern = (5D, 7F)"
+        raise ValueError (f"( {call_name()} ) {error_message} ( {error_vars} )")
+    l_pure = {0: False, 1: False, 2: (find_pure[0][0] == "5"), 3: (find_pure[0][1] == "7")}
+
+    header = "AO basis set in the form of general basis input"
+    if (not header in log):
+        error_message = "Basis set not found in the log, 'gfinput' keyword is required!"
+        error_vars = f"header = {header}"
+        raise ValueError (f"( {call_name()} ) {error_message} ( {error_vars} )")
+    lines = log[log.index(header):].split("\n")[1:]
+
+    # Read the shells of each atom until the blank line at the end of the basis set
+    shells = []
+    iline = 0
+    while (lines[iline].strip() != ""):
+        field = lines[iline].split()
+        iline += 1
+        if (field[0] == "****"):
+            continue
+        elif (field[0].isdigit()):
+            iat = int(field[0]) - 1
+            continue
+
+        if (not field[0] in shell_type):
+            error_message = "Angular momentum of the shell not implemented!"
+            error_vars = f"shell = {field[0]}"
+            raise NotImplementedError (f"( {call_name()} ) {error_message} ( {error_vars} )")
+
+        nprim = int(field[1])
+        prim = np.array([line.replace("D", "e").split() for line in lines[iline:iline + nprim]], dtype=np.float64)
+        iline += nprim
+
+        # SP shells share the exponents of s and p functions
+        for ishell, l in enumerate(shell_type[field[0]]):
+            shells.append((iat, l, prim[:, 0], prim[:, ishell + 1]))
+
+    # Group the shells with the same angular momentum
+    basis = {}
+    ibasis = 0
+    for iat, l, alpha, coef in shells:
+        nfunc = 2 * l + 1 if (l_pure[l]) else len(cart_comp[l])
+        if (not l in basis):
+            basis[l] = {"atom": [], "alpha": [], "coef": [], "shell": [], "ao_index": []}
+        ishell = len(basis[l]["ao_index"])
+        basis[l]["atom"] += [iat] * len(alpha)
+        basis[l]["alpha"] += list(alpha)
+        # Contraction coefficients refer to the normalized primitives
+        basis[l]["coef"] += list(coef * (2. * alpha / np.pi) ** 0.75 * (4. * alpha) ** (l / 2.))
+        basis[l]["shell"] += [ishell] * len(alpha)
+        basis[l]["ao_index"].append(np.arange(ibasis, ibasis + nfunc))
+        ibasis += nfunc
+
+    if (ibasis != nbasis):
+        error_message = "Number of basis functions in the basis set is different from NBasis!"
+        error_vars = f"basis functions = {ibasis}, nbasis = {nbasis}"
+        raise ValueError (f"( {call_name()} ) {error_message} ( {error_vars} )")
+
+    for l, group in basis.items():
+        for key in ["atom", "alpha", "coef", "shell"]:
+            group[key] = np.array(group[key])
+        group["ao_index"] = np.array(group["ao_index"])
+
+        # Contraction matrix of the primitives for each shell
+        nshell = len(group["ao_index"])
+        group["contract"] = np.zeros((nshell, len(group["alpha"])))
+        group["contract"][group["shell"], np.arange(len(group["alpha"]))] = group["coef"]
+
+        # Transformation from the Cartesian components to the basis functions
+        if (l_pure[l]):
+            group["trans"] = np.array([[func.get(comp, 0.) for comp in cart_comp[l]] for func in pure_comp[l]])
+        else:
+            group["trans"] = np.identity(len(cart_comp[l]))
+
+        # Normalize each contracted basis function with the overlap at the same center
+        origin = np.zeros((len(group["alpha"]), 3))
+        prim_ovlp = prim_overlap(l, l, group["alpha"], group["alpha"], origin, origin, group["trans"], group["trans"])
+        func_ovlp = np.einsum("si,ijfg,sj->sfg", group["contract"], prim_ovlp, group["contract"])
+        group["norm"] = 1. / np.sqrt(np.diagonal(func_ovlp, axis1=1, axis2=2))
+
+    return basis
+
+def overlap_1d(xa, xb, alpha, beta, la, lb):
+    """ Calculate the one-dimensional overlap integrals of the primitive Cartesian Gaussians
+        with Obara-Saika recurrence relations
+
+        :param double,list xa: Coordinates of the centers of the primitives on the bra side
+        :param double,list xb: Coordinates of the centers of the primitives on the ket side
+        :param double,list alpha: Exponents of the primitives on the bra side
+        :param double,list beta: Exponents of the primitives on the ket side
+        :param integer la: Angular momentum on the bra side
+        :param integer lb: Angular momentum on the ket side
+    """
+    p = alpha + beta
+    xp = (alpha * xa + beta * xb) / p
+    xpa, xpb = xp - xa, xp - xb
+
+    s_1d = np.zeros(xp.shape + (la + 1, lb + 1))
+    s_1d[..., 0, 0] = np.sqrt(np.pi / p) * np.exp(- alpha * beta / p * (xa - xb) ** 2)
+
+    # S(i + 1, j) = X_PA * S(i, j) + (i * S(i - 1, j) + j * S(i, j - 1)) / 2p
+    for i in range(la):
+        s_1d[..., i + 1, 0] = xpa * s_1d[..., i, 0]
+        if (i > 0):
+            s_1d[..., i + 1, 0] += i / (2. * p) * s_1d[..., i - 1, 0]
+
+    # S(i, j + 1) = X_PB * S(i, j) + (i * S(i - 1, j) + j * S(i, j - 1)) / 2p
+    for j in range(lb):
+        s_1d[..., :, j + 1] = xpb[..., np.newaxis] * s_1d[..., :, j]
+        if (j > 0):
+            s_1d[..., :, j + 1] += j / (2. * p[..., np.newaxis]) * s_1d[..., :, j - 1]
+        s_1d[..., 1:, j + 1] += np.arange(1, la + 1) / (2. * p[..., np.newaxis]) * s_1d[..., :-1, j]
+
+    return s_1d
+
+def prim_overlap(la, lb, alpha, beta, pos_a, pos_b, trans_a, trans_b):
+    """ Calculate the overlap integrals between all pairs of the primitives on the bra and ket sides,
+        transformed to the basis functions of the shells
+
+        :param integer la: Angular momentum on the bra side
+        :param integer lb: Angular momentum on the ket side
+        :param double,list alpha: Exponents of the primitives on the bra side
+        :param double,list beta: Exponents of the primitives on the ket side
+        :param double,list pos_a: Centers of the primitives on the bra side
+        :param double,list pos_b: Centers of the primitives on the ket side
+        :param double,list trans_a: Transformation from the Cartesian components on the bra side
+        :param double,list trans_b: Transformation from the Cartesian components on the ket side
+    """
+    comp_a = np.array(cart_comp[la])
+    comp_b = np.array(cart_comp[lb])
+
+    # Cartesian integrals are products of the one-dimensional integrals
+    prim_ovlp = 1.
+    for idim in range(3):
+        s_1d = overlap_1d(pos_a[:, np.newaxis, idim], pos_b[np.newaxis, :, idim], \
+            alpha[:, np.newaxis], beta[np.newaxis, :], la, lb)
+        prim_ovlp = prim_ovlp * s_1d[:, :, comp_a[:, idim, np.newaxis], comp_b[np.newaxis, :, idim]]
+
+    return np.matmul(np.matmul(trans_a, prim_ovlp), trans_b.T)
+
+def ao_overlap(basis, pos_old, pos_new, nbasis):
+    """ Calculate AO overlap matrix between the geometries at time t and t + dt, < t | t + dt >
+
+        :param dictionary basis: Basis set grouped by angular momentum
+        :param double,list pos_old: Positions of atoms at time t
+        :param double,list pos_new: Positions of atoms at time t + dt
+        :param integer nbasis: Number of basis functions
+    """
+    ao_overlap = np.zeros((nbasis, nbasis))
+
+    for la, group_a in basis.items():
+        for lb, group_b in basis.items():
+            prim_ovlp = prim_overlap(la, lb, group_a["alpha"], group_b["alpha"], pos_old[group_a["atom"]], \
+                pos_new[group_b["atom"]], group_a["trans"], group_b["trans"])
+
+            # Contract the primitives to the shells and normalize the basis functions
+            block = np.tensordot(group_a["contract"], prim_ovlp, axes=(1, 0))
+            block = np.tensordot(block, group_b["contract"], axes=(1, 1)).transpose(0, 1, 3, 2)
+            block *= group_a["norm"][:, :, np.newaxis, np.newaxis] * group_b["norm"][np.newaxis, np.newaxis, :, :]
+
+            ao_overlap[group_a["ao_index"][:, :, np.newaxis, np.newaxis], \
+                group_b["ao_index"][np.newaxis, np.newaxis, :, :]] = block
+
+    return ao_overlap
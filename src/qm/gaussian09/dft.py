@@ -1,6 +1,7 @@
 from __future__ import division
 from lib.libcioverlap import wf_overlap
 from qm.gaussian09.gaussian09 import Gaussian09
+from qm.gaussian09.aooverlap import read_basis, ao_overlap
 from misc import au_to_A, eV_to_au, call_name
 import os, shutil, re, textwrap, subprocess
 import numpy as np
@@ -14,12 +15,14 @@ class DFT(Gaussian09):
         :param string memory: Allocatable memory
         :param string guess: Initial guess for SCF iterations
         :param string guess_file: Initial guess file
+        :param double ci_threshold: Amplitude threshold of CI coefficients in NACME calculation
+        :param double ci_norm_cutoff: Cumulative norm of CI coefficients retained in NACME calculation
         :param string root_path: Path for Gaussian 09 root directory
         :param integer nthreads: Number of threads in the calculations
         :param string version: Version of Gaussian 09
     """
     def __init__(self, molecule, nthreads=1, memory="1gb", functional="BLYP", basis_set="STO-3G", \
-        guess="Harris", guess_file="./g09.chk", root_path="./", version="Revision A.02"):
+        guess="Harris", guess_file="./g09.chk", ci_threshold=0., ci_norm_cutoff=1., root_path="./", version="Revision A.02"):
         # Initialize Gaussian09 common variables
         super(DFT, self).__init__(basis_set, memory, nthreads, root_path, version)
 
@@ -34,8 +37,23 @@ class DFT(Gaussian09):
             error_vars = f"guess = {self.guess}"
             raise ValueError (f"( {self.qm_method}.{call_name()} ) {error_message} ( {error_vars} )")
 
+        # Set truncation of CI coefficients in the overlap between the states
+        self.ci_threshold = ci_threshold
+        if (self.ci_threshold < 0.):
+            error_message = "Amplitude threshold of CI coefficients must be non-negative!"
+            error_vars = f"ci_threshold = {self.ci_threshold}"
+            raise ValueError (f"( {self.qm_method}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        self.ci_norm_cutoff = ci_norm_cutoff
+        if (self.ci_norm_cutoff <= 0. or self.ci_norm_cutoff > 1.):
+            error_message = "Cumulative norm cutoff of CI coefficients must be in (0, 1]!"
+            error_vars = f"ci_norm_cutoff = {self.ci_norm_cutoff}"
+            raise ValueError (f"( {self.qm_method}.{call_name()} ) {error_message} ( {error_vars} )")
+
         # Set 'l_nacme' with respect to the computational method
         molecule.l_nacme = True
+        # State overlaps between two time steps are also obtained from CIoverlap
+        molecule.l_st_overlap = True
 
         # Re-calculation of excited state forces is not needed for ground state dynamics
         if (molecule.nst > 1):
@@ -50,6 +68,14 @@ class DFT(Gaussian09):
         self.nocc = 0
         self.nvirt = 0
  
+        # Basis set to calculate AO overlap, read from Gaussian09 log at the first NACME calculation
+        self.basis = None
+
+        # Units of rwf files are read from the binary files with the table of units in the header,
+        # and the values of each unit are compared with rwfdump at the first read of the unit
+        self.rwf_table = None
+        self.rwf_checked = {}
+
         # Temporaries for NACME calculation, also initialized later if not allocated
         # ao_overlap - the number of AOs, the number of AOs
         # mo_coef - the number of MOs, the number of AOs
@@ -147,6 +173,10 @@ class DFT(Gaussian09):
 
         if (calc_force_only):
             input_route += f" geom=allcheck"
+
+        # Print the basis set to calculate AO overlap for NACME
+        if (self.calc_coupling and molecule.nst > 1 and not calc_force_only):
+            input_route += f" gfinput"
         input_route += "\n\n"
 
         input_g09 += input_route
@@ -186,40 +216,9 @@ class DFT(Gaussian09):
             input_route += "\n\n"
             input_g09 += input_route
 
-        # Write "doubled molecule" input
-        if (self.calc_coupling and molecule.nst > 1 and not calc_force_only and istep >= 0):
-            if (istep == 0):
-                os.rename('../g09.rwf.pre', './g09.rwf.pre')
- 
-            # Stop the run after L302 calculating overlap
-            # Keep running the job regardless of interatomic distances; IOp(2/12=3)
-            input_route = textwrap.dedent(f"""\
-            --Link1--
-            %kjob l302
-            %rwf=g09_double.rwf
-            # {self.functional}/{self.basis_set} IOp(2/12=3) nosymm\n\n""")
- 
-            input_g09 += input_route
- 
-            # Title section block
-            input_title = f"g09 double input\n\n"
-            input_g09 += input_title
- 
-            # Molecule specification block
-            input_molecule = textwrap.dedent(f"""\
-            {2 * int(molecule.charge)} 1
-            """)
-            for iat in range(molecule.nat_qm):
-                list_pos = list(self.pos_old[iat] * au_to_A)
-                input_molecule += \
-                    f"{molecule.symbols[iat]}{list_pos[0]:15.8f}{list_pos[1]:15.8f}{list_pos[2]:15.8f}\n"
- 
-            for iat in range(molecule.nat_qm):
-                list_pos = list(molecule.pos[iat] * au_to_A)
-                input_molecule += \
-                    f"{molecule.symbols[iat]}{list_pos[0]:15.8f}{list_pos[1]:15.8f}{list_pos[2]:15.8f}\n"
-            input_molecule += "\n"
-            input_g09 += input_molecule
+        # Move the rwf file of the initial step to read MO and CI coefficients
+        if (self.calc_coupling and molecule.nst > 1 and not calc_force_only and istep == 0):
+            os.rename('../g09.rwf.pre', './g09.rwf.pre')
 
         file_name = "g09.inp"
         with open(file_name, "w") as f:
@@ -334,6 +333,30 @@ class DFT(Gaussian09):
         self.ci_coef_old = np.zeros((molecule.nst, self.nocc, self.nvirt))
         self.ci_coef_new = np.zeros((molecule.nst, self.nocc, self.nvirt))
 
+    def get_checkpoint(self):
+        """ Get the variables of DFT calculator which are needed for the next MD step,
+            i.e. geometry, MO and CI coefficients of the previous step to calculate wavefunction overlap
+        """
+        if (len(self.mo_coef_old) == 0):
+            return {}
+
+        return {"nbasis": self.nbasis, "nfc": self.nfc, "nocc": self.nocc, "nvirt": self.nvirt, "norb": self.norb, \
+            "pos_old": self.pos_old, "mo_coef_old": self.mo_coef_old, "ci_coef_old": self.ci_coef_old, \
+            "orb_ini": self.orb_ini, "orb_final": self.orb_final}
+
+    def set_checkpoint(self, state):
+        """ Set the variables of DFT calculator read from a checkpoint
+
+            :param dictionary state: Variables of DFT calculator
+        """
+        super().set_checkpoint(state)
+
+        # Buffers for the current step are allocated with the sizes read from the checkpoint
+        if (len(state) > 0):
+            self.ao_overlap = np.zeros((self.nbasis, self.nbasis))
+            self.mo_coef_new = np.zeros((self.norb, self.nbasis))
+            self.ci_coef_new = np.zeros(self.ci_coef_old.shape)
+
     def CI_overlap(self, molecule, istep, dt):
         """ Read the necessary files and calculate NACME from tdnac.c routine
             note that only reading of several files is required in this method
@@ -343,51 +366,119 @@ class DFT(Gaussian09):
             :param double dt: Time interval
         """
         path_rwfdump = os.path.join(self.root_path, "g09/rwfdump")
- 
-        # Read overlap
-        self.ao_overlap = self.read_ao_overlap(path_rwfdump, "g09_double.rwf")
 
-        # Read mo coefficients
-        if (istep == 0):
-            self.mo_coef_old = self.read_mo_coef(path_rwfdump, "g09.rwf.pre") 
-
-        self.mo_coef_new = self.read_mo_coef(path_rwfdump, "g09.rwf") 
+        # Calculate AO overlap between the geometries at time t and t + dt
+        if (self.basis == None):
+            with open("log", "r") as f:
+                log = f.read()
+            self.basis = read_basis(log, self.nbasis)
+        self.ao_overlap = ao_overlap(self.basis, self.pos_old, molecule.pos, self.nbasis)
 
-        # Read CI coefficients
+        # Read MO and CI coefficients into the buffers of the wavefunction overlap
         if (istep == 0):
+            self.mo_coef_old[:] = self.read_mo_coef(path_rwfdump, "g09.rwf.pre")
             self.ci_coef_old[1:] = self.read_xy_coef(molecule, path_rwfdump, "g09.rwf.pre")
 
-        self.ci_coef_new[1:] = self.read_xy_coef(molecule, path_rwfdump, "g09.rwf") 
+        self.mo_coef_new[:] = self.read_mo_coef(path_rwfdump, "g09.rwf")
+        self.ci_coef_new[1:] = self.read_xy_coef(molecule, path_rwfdump, "g09.rwf")
 
         # Calculate wavefunction overlap with orbital scheme
         wf_overlap(self, molecule, istep, dt)
 
-    def read_ao_overlap(self, path_rwfdump, fn_rwf):
-        """ Read a rwf file to obtain ao_overlap data
+        # Write the norm of CI coefficients retained in the truncation
+        if (self.ci_threshold > 0. or self.ci_norm_cutoff < 1.):
+            self.write_ci_norm(istep)
+
+    def read_rwf_table(self, fn_rwf):
+        """ Read the table of units in the header of a rwf file, which is parsed once for each file
+            The header is assumed to consist of 8-byte integers, where the second word is the number of units,
+            followed by the numbers, the lengths and the offsets of the units in words.
+            None is returned if the table is not consistent with the file, e.g. when the file is split by %rwf
+
+            :param string fn_rwf: The name of the rwf file
+        """
+        file_size = os.path.getsize(fn_rwf)
+        file_key = (os.path.abspath(fn_rwf), file_size, os.path.getmtime(fn_rwf))
+        if (self.rwf_table != None and self.rwf_table[0] == file_key):
+            return self.rwf_table[1]
+
+        table = None
+        nwords = file_size // 8
+        if (nwords > 2):
+            header = np.memmap(fn_rwf, dtype=np.int64, mode="r", shape=(min(nwords, 65536),))
+            nunits = int(header[1])
+            if (nunits > 0 and 2 + 3 * nunits <= header.shape[0]):
+                units, lengths, offsets = np.array(header[2:2 + 3 * nunits]).reshape(3, nunits)
+                if (np.all(units > 0) and np.all(lengths >= 0) and np.all(offsets > 2 + 3 * nunits) \
+                    and np.all(offsets + lengths <= nwords) and len(np.unique(units)) == nunits):
+                    table = {int(unit): (int(offset), int(length)) for unit, offset, length in \
+                        zip(units, offsets, lengths)}
+            del header
+
+        self.rwf_table = (file_key, table)
+        return table
+
+    def read_rwf_unit(self, path_rwfdump, fn_rwf, unit, count=-1):
+        """ Read a unit of a rwf file as an array of double
+            The unit is mapped from the binary file if it is found in the table of units,
+            otherwise it is dumped by rwfdump binary
+
+            :param string path_rwfdump: The path for rwfdump binary
+            :param string fn_rwf: The name of the rwf file
+            :param string unit: The unit of the rwf file, e.g. '524R'
+            :param integer count: The number of values to be read, all values are read for -1
+        """
+        l_binary = False
+        if (self.rwf_checked.get(unit, True)):
+            table = self.read_rwf_table(fn_rwf)
+            unit_number = int(unit.rstrip("R"))
+            if (table != None and unit_number in table and table[unit_number][1] >= count):
+                offset, length = table[unit_number]
+                if (count >= 0):
+                    length = count
+                tmp = np.memmap(fn_rwf, dtype=np.float64, mode="r", offset=8 * offset, shape=(length,))
+                l_binary = True
+
+        # The layout of the header is not documented, hence the unit mapped from the binary file
+        # is compared with rwfdump at the first read, and rwfdump is used for the unit if they differ
+        if (l_binary and not unit in self.rwf_checked):
+            tmp_dump = self.read_rwf_dump(path_rwfdump, fn_rwf, unit, count)
+            self.rwf_checked[unit] = (tmp.shape == tmp_dump.shape and \
+                np.allclose(tmp, tmp_dump, rtol=1E-6, atol=1E-10))
+            l_binary = self.rwf_checked[unit]
+
+        if (not l_binary):
+            tmp = self.read_rwf_dump(path_rwfdump, fn_rwf, unit, count)
+
+        return tmp
+
+    def read_rwf_dump(self, path_rwfdump, fn_rwf, unit, count=-1):
+        """ Read a unit of a rwf file dumped by rwfdump binary as an array of double
 
             :param string path_rwfdump: The path for rwfdump binary
             :param string fn_rwf: The name of the rwf file
+            :param string unit: The unit of the rwf file, e.g. '524R'
+            :param integer count: The number of values to be read, all values are read for -1
         """
-        os.system(path_rwfdump + f" {fn_rwf} ao_overlap.dat 514R")
+        file_name = f"rwf_{unit}.dat"
+        os.system(path_rwfdump + f" {fn_rwf} {file_name} {unit}")
 
-        with open('ao_overlap.dat', "r") as f:
+        with open(file_name, "r") as f:
             log = f.read()
 
-        tmp = re.findall('[-]?\d+\.\d+D[+-]\d\d', log)
-        tmp = [float(x.replace('D', 'e')) for x in tmp]
- 
-        tmp_ovr = np.zeros((self.nbasis * 2, self.nbasis * 2))
- 
-        cnt = 0
-        for ibasis in range(self.nbasis * 2):
-            for jbasis in range(ibasis + 1):
-                tmp_ovr[ibasis, jbasis] = tmp[cnt]
-                cnt += 1
+        # Exponents are converted in the whole text at once, Fortran drops the letter for
+        # three-digit exponents, e.g. '0.1234-100', which is restored for those values only
+        tmp = re.findall('[-]?\d+\.\d+e?[+-]\d+', log.replace('D', 'e'))
+        if (count >= 0):
+            tmp = tmp[:count]
+        tmp = [x if ("e" in x) else re.sub('(\d)([+-])', r'\1e\2', x) for x in tmp]
 
-        tmp_ovr += np.transpose(tmp_ovr) - np.diag(np.diag(tmp_ovr))
+        if (len(tmp) < count):
+            error_message = "Not enough values in the unit of rwf file!"
+            error_vars = f"rwf file = {fn_rwf}, unit = {unit}, values = {len(tmp)}, required = {count}"
+            raise ValueError (f"( {self.qm_method}.{call_name()} ) {error_message} ( {error_vars} )")
 
-        # Slicing the components between t and t+dt
-        return tmp_ovr[:self.nbasis, self.nbasis:]
+        return np.array(tmp, dtype=np.float64)
 
     def read_mo_coef(self, path_rwfdump, fn_rwf):
         """ Read a rwf file to obtain mo_coef data
@@ -395,15 +486,8 @@ class DFT(Gaussian09):
             :param string path_rwfdump: The path for rwfdump binary
             :param string fn_rwf: The name of the rwf file
         """
-        os.system(path_rwfdump + f" {fn_rwf} mo_coef.dat 524R")
-
-        with open('mo_coef.dat', "r") as f:
-            log = f.read()
-
-        tmp = re.findall('[-]?\d+\.\d+D[+-]\d\d', log)
-        tmp = np.array([x.replace('D','e') for x in tmp], dtype=np.float64)
-
-        tmp_mo = tmp.reshape(self.nbasis, self.nbasis)
+        tmp_mo = self.read_rwf_unit(path_rwfdump, fn_rwf, "524R", self.nbasis ** 2)
+        tmp_mo = tmp_mo.reshape(self.nbasis, self.nbasis)
 
         return tmp_mo[self.nfc:self.nbasis]
 
@@ -414,25 +498,16 @@ class DFT(Gaussian09):
             :param string path_rwfdump: The path for rwfdump binary
             :param string fn_rwf: The name of the rwf file
         """
-        os.system(path_rwfdump + f" {fn_rwf} xy_coef.dat 635R")
-
-        with open(f'xy_coef.dat', "r") as f:
-            log = f.read()
-
-        tmp = re.findall('[-]?\d+\.\S+[+-]\d+', log)
-
-        # Drop the first 12 dummy elements
-        tmp = tmp[12:]
- 
         # Gaussian09 deals with 4 times as much roots as the input NStates value.
         # the nr. of excitation function => nocc \times nvirt
         # spin degrees of freedom => 2
         # X+Y, X-Y => 2
         roots = (molecule.nst - 1) * 4
         num_coef = 4 * (self.nocc * self.nvirt) * roots
- 
-        tmp = tmp[:num_coef]
-        tmp = np.array([x.replace('D','e') for x in tmp], dtype=np.float64)
+
+        # Drop the first 12 dummy elements
+        tmp = self.read_rwf_unit(path_rwfdump, fn_rwf, "635R", 12 + num_coef)[12:]
+
         xpy, xmy = tmp.reshape(2, roots, 2, -1)
         x = 0.5 * (xpy + xmy)
  
@@ -441,4 +516,3 @@ class DFT(Gaussian09):
  
         return x.reshape(-1, self.nocc, self.nvirt)
  
-
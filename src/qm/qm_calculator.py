@@ -1,5 +1,5 @@
 from __future__ import division
-from misc import au_to_A
+from misc import au_to_A, typewriter
 import os, shutil
 
 class QM_calculator(object):
@@ -38,6 +38,33 @@ class QM_calculator(object):
                 ftj.write(f"{molecule.symbols[iat]:4}")
                 ftj.write("".join([f"{i:15.8f}" for i in molecule.pos[iat] * au_to_A]) + "\n")
 
+    def write_ci_norm(self, istep):
+        """ Write the norm of CI coefficients retained in the truncation for the wavefunction overlap
+            in 'CINORM' file of the MD output directory
+
+            :param integer istep: Current MD step
+        """
+        unixmd_dir = os.path.dirname(self.scr_qm_dir)
+        if (istep == 0):
+            tmp = f'{"#":5s}{"Step":8s}' + "".join([f'Norm({ist}){"":8s}' for ist in range(len(self.ci_norm))])
+            typewriter(tmp, unixmd_dir, "CINORM", "w")
+
+        tmp = f'{istep + 1:9d}' + "".join([f'{norm:15.8f}' for norm in self.ci_norm])
+        typewriter(tmp, unixmd_dir, "CINORM", "a")
+
+    def get_checkpoint(self):
+        """ Get the variables of QM calculator which are needed for the next MD step
+        """
+        return {}
+
+    def set_checkpoint(self, state):
+        """ Set the variables of QM calculator read from a checkpoint
+
+            :param dictionary state: Variables of QM calculator
+        """
+        for var, value in state.items():
+            setattr(self, var, value)
+
     def move_dir(self, base_dir):
         """ Move to the base directory
 
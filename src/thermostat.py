@@ -16,6 +16,19 @@ class Thermostat(object):
         # Initialize input values
         self.temp = temperature
 
+    def get_checkpoint(self):
+        """ Get dynamical variables of thermostat to be saved in a checkpoint
+        """
+        return {}
+
+    def set_checkpoint(self, state):
+        """ Set dynamical variables of thermostat read from a checkpoint
+
+            :param dictionary state: Dynamical variables of thermostat
+        """
+        for var, value in state.items():
+            setattr(self, var, value)
+
 
 class Rescale1(Thermostat):
     """ Rescale the velocities in a given period
@@ -29,6 +42,11 @@ class Rescale1(Thermostat):
         self.nrescale = nrescale
         self.istep = -1
 
+    def get_checkpoint(self):
+        """ Get dynamical variables of thermostat to be saved in a checkpoint
+        """
+        return {"istep": self.istep}
+
     def run(self, md, molecule):
         """ Control the temperature
 
@@ -236,6 +254,11 @@ class NHC(Thermostat):
             error_vars = f"order = {self.order}"
             raise ValueError (f"( {self.thermostat_type}.{call_name()} ) {error_message} ( {error_vars} )")
 
+    def get_checkpoint(self):
+        """ Get dynamical variables of thermostat to be saved in a checkpoint
+        """
+        return {"x": self.x, "v": self.v, "g": self.g}
+
     def run(self, md, molecule):
         """ Control the temperature
 
@@ -0,0 +1,214 @@
+from __future__ import division
+from misc import call_name
+import multiprocessing, queue
+
+class Transport(object):
+    """ Class for communication between shards of coupled trajectories.
+        The shards are launched by the transport and exchange data with collective operations of a communicator.
+        Actual transport backend is classified by its subclasses.
+    """
+    def __init__(self):
+        # Save name of transport type
+        self.transport_type = self.__class__.__name__
+
+        # Runtime objects such as processes and channels are not saved with the dynamics
+        self.runtime = None
+
+    def launch(self, target, args_list):
+        """ Launch shards, the target is called as target(comm, *args) for each shard
+
+            :param function target: Function to be run in each shard
+            :param tuple,list args_list: List of arguments for each shard
+        """
+        pass
+
+    def serve(self):
+        """ Relay collective operations between shards until all shards are finished
+            and return the final data of each shard
+        """
+        pass
+
+    def __getstate__(self):
+        """ Remove runtime objects when the transport is pickled
+        """
+        state = self.__dict__.copy()
+        state["runtime"] = None
+        return state
+
+
+class Communicator(object):
+    """ Class for communication of a shard with other shards
+
+        :param integer ishard: Index for the shard
+        :param integer nshards: Number of shards
+    """
+    def __init__(self, ishard, nshards):
+        # Save name of communicator type
+        self.comm_type = self.__class__.__name__
+
+        # Initialize input values
+        self.ishard = ishard
+        self.nshards = nshards
+
+    def allgather(self, data):
+        """ Gather data from all shards, the list of data ordered by shard index is returned to every shard
+
+            :param object data: Data of the shard
+        """
+        pass
+
+    def finalize(self, data):
+        """ Send final data of the shard
+
+            :param object data: Final data of the shard
+        """
+        pass
+
+    def abort(self, message):
+        """ Notify an error in the shard
+
+            :param string message: Error message
+        """
+        pass
+
+
+class LocalTransport(Transport):
+    """ Transport with local processes using the multiprocessing package.
+        The main process relays the data between the shards.
+
+        :param string start_method: Start method of the processes (fork, spawn or forkserver)
+        :param double timeout: Interval to check the status of shards in the main process
+    """
+    def __init__(self, start_method=None, timeout=1.):
+        # Initialize input values
+        super().__init__()
+
+        self.start_method = start_method
+        self.timeout = timeout
+
+    def launch(self, target, args_list):
+        """ Launch shards as local processes, the target is called as target(comm, *args) for each shard
+
+            :param function target: Function to be run in each shard
+            :param tuple,list args_list: List of arguments for each shard
+        """
+        ctx = multiprocessing.get_context(self.start_method)
+        nshards = len(args_list)
+
+        queue_main = ctx.Queue()
+        queue_shards = [ctx.Queue() for ishard in range(nshards)]
+
+        procs = []
+        for ishard, args in enumerate(args_list):
+            comm = LocalCommunicator(ishard, nshards, queue_main, queue_shards[ishard])
+            procs.append(ctx.Process(target=target, args=(comm,) + tuple(args)))
+
+        for proc in procs:
+            proc.start()
+
+        self.runtime = {"procs": procs, "queue_main": queue_main, "queue_shards": queue_shards}
+
+    def serve(self):
+        """ Relay collective operations between shards until all shards are finished
+            and return the final data of each shard
+        """
+        procs = self.runtime["procs"]
+        queue_main = self.runtime["queue_main"]
+        queue_shards = self.runtime["queue_shards"]
+        nshards = len(procs)
+
+        while (True):
+            # Every shard sends exactly one message for each collective operation
+            messages = [None] * nshards
+            for imsg in range(nshards):
+                ishard, tag, data = self.receive(queue_main, procs)
+                if (tag == "error"):
+                    self.terminate()
+                    error_message = "Error occurred in a shard!"
+                    error_vars = f"ishard = {ishard}\n{data}"
+                    raise RuntimeError (f"( {self.transport_type}.{call_name()} ) {error_message} ( {error_vars} )")
+                messages[ishard] = (tag, data)
+
+            tags = set([tag for tag, data in messages])
+            if (tags == {"gather"}):
+                gathered = [data for tag, data in messages]
+                for queue_shard in queue_shards:
+                    queue_shard.put(gathered)
+            elif (tags == {"final"}):
+                results = [data for tag, data in messages]
+                break
+            else:
+                self.terminate()
+                error_message = "Collective operations of shards are mismatched!"
+                error_vars = f"tags = {tags}"
+                raise RuntimeError (f"( {self.transport_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+        for proc in procs:
+            proc.join()
+        self.runtime = None
+
+        return results
+
+    def receive(self, queue_main, procs):
+        """ Receive a message from shards while checking that the shards are alive
+
+            :param object queue_main: Queue for messages to the main process
+            :param object,list procs: List of shard processes
+        """
+        while (True):
+            try:
+                return queue_main.get(timeout=self.timeout)
+            except queue.Empty:
+                for ishard, proc in enumerate(procs):
+                    if (not proc.is_alive() and proc.exitcode != 0):
+                        self.terminate()
+                        error_message = "A shard is terminated abnormally!"
+                        error_vars = f"ishard = {ishard}, exitcode = {proc.exitcode}"
+                        raise RuntimeError (f"( {self.transport_type}.{call_name()} ) {error_message} ( {error_vars} )")
+
+    def terminate(self):
+        """ Terminate all shard processes
+        """
+        for proc in self.runtime["procs"]:
+            if (proc.is_alive()):
+                proc.terminate()
+            proc.join()
+        self.runtime = None
+
+
+class LocalCommunicator(Communicator):
+    """ Communicator of a shard for local processes
+
+        :param integer ishard: Index for the shard
+        :param integer nshards: Number of shards
+        :param object queue_main: Queue for messages to the main process
+        :param object queue_shard: Queue for messages to the shard
+    """
+    def __init__(self, ishard, nshards, queue_main, queue_shard):
+        # Initialize input values
+        super().__init__(ishard, nshards)
+
+        self.queue_main = queue_main
+        self.queue_shard = queue_shard
+
+    def allgather(self, data):
+        """ Gather data from all shards, the list of data ordered by shard index is returned to every shard
+
+            :param object data: Data of the shard
+        """
+        self.queue_main.put((self.ishard, "gather", data))
+        return self.queue_shard.get()
+
+    def finalize(self, data):
+        """ Send final data of the shard
+
+            :param object data: Final data of the shard
+        """
+        self.queue_main.put((self.ishard, "final", data))
+
+    def abort(self, message):
+        """ Notify an error in the shard
+
+            :param string message: Error message
+        """
+        self.queue_main.put((self.ishard, "error", message))
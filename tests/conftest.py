@@ -0,0 +1,4 @@
+import os, sys
+
+# Modules of PyUNIxMD are imported from the source directory, where the C libraries are built
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
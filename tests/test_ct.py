@@ -0,0 +1,85 @@
+import contextlib, io, pickle, random
+import numpy as np
+import pytest
+
+pytest.importorskip("lib.libctmqc")
+
+from molecule import Molecule
+from misc import data
+from mqc.ct import read_shard_restart
+import qm, mqc
+
+def run_ct(output_dir, ntrajs=4, nsteps=20, **kwargs):
+    """ Run CTMQC dynamics of the SAC model with fixed random numbers
+    """
+    data["X1"] = 2000.
+    random.seed(1)
+    rng = np.random.RandomState(1)
+    mols = []
+    for itraj in range(ntrajs):
+        pos, vel = -4. + 0.5 * rng.randn(), 0.01 + 0.002 * rng.randn()
+        mols.append(Molecule(geometry=f"\n1\nmodel\nX1 {pos} {vel}\n", ndim=1, nstates=2, ndof=1, \
+            unit_pos="au", l_model=True))
+    qm_model = qm.model.SAC(molecule=mols[0])
+    md = mqc.CT(molecules=mols, nsteps=nsteps, nesteps=10, dt=0.5, unit_dt="au", istates=[1] * ntrajs, \
+        **kwargs)
+    with contextlib.redirect_stdout(io.StringIO()):
+        md.run(qm=qm_model, output_dir=str(output_dir))
+    return md
+
+def test_workers_keep_states_bound(tmp_path):
+    """ QM results of worker processes must not replace the states bound to the ensemble
+    """
+    md_serial = run_ct(tmp_path / "serial", nworkers=1)
+    md_workers = run_ct(tmp_path / "workers", nworkers=2)
+
+    assert np.allclose(md_serial.ens.coef, md_workers.ens.coef, rtol=0., atol=1E-12)
+    assert np.allclose(md_serial.ens.pos, md_workers.ens.pos, rtol=0., atol=1E-12)
+    for mol in md_workers.mols:
+        assert np.array_equal([state.coef for state in mol.states], mol.coef)
+        assert np.array_equal([state.energy for state in mol.states], mol.energy)
+
+def test_shard_restart_merged_by_index(tmp_path):
+    """ Restart files of shards must contain only the trajectories of the shard
+    """
+    md = run_ct(tmp_path, ntrajs=5, nshards=2)
+
+    ntrajs = 0
+    for ishard in [1, 2]:
+        with open(tmp_path / f"RESTART_SHARD_{ishard}.bin", "rb") as f:
+            shard_state = pickle.load(f)["shard"]
+        nshard = len(shard_state["itrajs"])
+        assert shard_state["md"].ens == None
+        assert len(shard_state["md"].mols) == nshard and len(shard_state["md"].qm_states) == nshard
+        assert shard_state["md"].phase.shape[0] == nshard and shard_state["md"].qmom.shape[0] == nshard
+        ntrajs += nshard
+    assert ntrajs == 5
+
+    md_restart = read_shard_restart(output_dir=str(tmp_path))["md"]
+    for var in ["pos", "vel", "coef", "rho"]:
+        assert np.array_equal(getattr(md_restart.ens, var), getattr(md.ens, var))
+    for var in ["phase", "qmom", "K_lk", "sigma_lk", "dotpopnac", "dotpopdec"]:
+        assert np.array_equal(getattr(md_restart, var), getattr(md, var))
+    for itraj, mol in enumerate(md_restart.mols):
+        assert np.shares_memory(mol.pos, md_restart.ens.pos[itraj])
+        assert np.shares_memory(mol.coef, md_restart.ens.coef[itraj])
+
+def test_initial_cutoff_large_ensemble():
+    """ Initial distance cutoff must not vanish for the trajectories with large indices
+    """
+    data["X1"] = 2000.
+    pos = 0.5 * np.random.RandomState(1).randn(1000)
+
+    sigmas = []
+    for pos_ens in [pos, pos[::-1]]:
+        mols = [Molecule(geometry=f"\n1\nmodel\nX1 {x} 0.0\n", ndim=1, nstates=2, ndof=1, \
+            unit_pos="au", l_model=True) for x in pos_ens]
+        md = mqc.CT(molecules=mols, nsteps=1, dt=0.5, unit_dt="au", istates=[1] * len(mols), \
+            dist_parameter=1., min_sigma=0.1)
+        md.calculate_sigma(-1)
+        count = np.sum(np.abs(pos_ens[:, np.newaxis] - pos_ens) <= 0.1, axis=1)
+        assert np.array_equal(md.count_ntrajs[:, 0, 0], count)
+        sigmas.append(np.copy(md.sigma_lk[:, 0]))
+
+    # Variances must not depend on the order of trajectories
+    assert np.allclose(sigmas[0], sigmas[1][::-1], rtol=1E-10, atol=0.)
@@ -0,0 +1,50 @@
+import contextlib, io, os, pickle, random, shutil
+import numpy as np
+import pytest
+
+pytest.importorskip("lib.libmqc")
+
+from misc import data
+
+example_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), \
+    "examples", "qm", "SH-Shin_Metiu")
+
+def read_example():
+    """ Read the restart file of SH example, where energies and coefficients are saved in the states
+    """
+    with open(os.path.join(example_dir, "RESTART.bin"), "rb") as f:
+        restart = pickle.load(f)
+    return restart["md"], restart["qm"]
+
+def test_old_restart_states_bound():
+    """ States of old restart files must be bound to the arrays of molecule
+    """
+    md, qm = read_example()
+
+    for ist, state in enumerate(md.mol.states):
+        assert state.mol is md.mol and state.ist == ist
+        assert "energy" not in state.__dict__ and "coef" not in state.__dict__
+    assert md.mol.coef.dtype == np.complex128
+    assert np.isclose(np.sum(np.abs(md.mol.coef) ** 2), 1.)
+
+    md.mol.coef[1] = 0.
+    assert md.mol.states[1].coef == 0.
+
+def test_old_restart_append(tmp_path):
+    """ Dynamics must be continued from old restart files
+    """
+    md, qm = read_example()
+    shutil.copytree(os.path.join(example_dir, "md"), tmp_path / "md")
+
+    data["X1"] = 1836
+    random.seed(10)
+    md.nsteps += 5
+    with contextlib.redirect_stdout(io.StringIO()):
+        md.run(qm=qm, output_dir=str(tmp_path), restart="append")
+
+    assert md.fstep == md.nsteps - 1
+    assert np.isclose(np.trace(md.mol.rho).real, 1.)
+
+    # Restart file is written at the end of dynamics without checkpoint
+    with open(tmp_path / "RESTART.bin", "rb") as f:
+        assert pickle.load(f)["md"].fstep == md.nsteps - 1
@@ -0,0 +1,116 @@
+import argparse
+import os
+import numpy as np
+
+au_to_A = 0.529177249
+
+def binary_to_text():
+    """ Python utility script for PyUNIxMD output analysis
+        In this script, binary outputs of PyUNIxMD written with output_format = 'binary' are exported to text outputs
+    """
+    parser = argparse.ArgumentParser(description="Export PyUNIxMD binary outputs to text outputs.")
+    parser.add_argument("dirs", nargs='+', type=str, \
+        help="Directories where binary outputs are written, e.g. TRAJ_1/md")
+    parser.add_argument("-o", "--output", action='store', dest='output', type=str, \
+        help="Directory where text outputs are written (default: directory of binary outputs)", default=None)
+    args = parser.parse_args()
+
+    if (args.output != None and len(args.dirs) > 1):
+        parser.error("Output directory can be given only for a single directory of binary outputs.")
+
+    for md_dir in args.dirs:
+        if (not os.path.exists(os.path.join(md_dir, "STEP.npy"))):
+            print (f"\n\n Warning: Binary outputs not found in {md_dir}. \n\n", flush=True)
+            continue
+
+        output_dir = md_dir
+        if (args.output != None):
+            output_dir = args.output
+            os.makedirs(output_dir, exist_ok=True)
+
+        export_text(md_dir, output_dir)
+
+def export_text(md_dir, output_dir):
+    """ Write text outputs from the binary arrays of a trajectory
+    """
+    arrays = {}
+    for file_name in os.listdir(md_dir):
+        if (file_name.endswith(".npy")):
+            arrays[file_name[:-4]] = np.load(os.path.join(md_dir, file_name), mmap_mode="r")
+
+    symbols = arrays["SYMBOLS"]
+    steps = arrays["STEP"]
+    nst = arrays["ENERGY"].shape[1]
+
+    # Write MOVIE.xyz file including positions and velocities
+    with open(os.path.join(output_dir, "MOVIE.xyz"), "w") as f:
+        for istep, pos, vel in zip(steps, arrays["POS"], arrays["VEL"]):
+            nat, ndim = pos.shape
+            f.write(f'{nat:6d}\n{"":2s}Step:{istep:6d}{"":12s}Position(A){"":34s}Velocity(au)' + \
+                "".join(["\n" + f'{symbols[iat]:5s}' + \
+                "".join([f'{pos[iat, isp] * au_to_A:15.8f}' for isp in range(ndim)]) + \
+                "".join([f"{vel[iat, isp]:15.8f}" for isp in range(ndim)]) for iat in range(nat)]) + "\n")
+
+    # Write MDENERGY file including several energy information
+    with open(os.path.join(output_dir, "MDENERGY"), "w") as f:
+        f.write(f'{"#":5s}{"Step":9s}{"Kinetic(H)":15s}{"Potential(H)":15s}{"Total(H)":15s}' + \
+            "".join([f'E({ist})(H){"":8s}' for ist in range(nst)]) + "\n")
+        for istep, md_energy, energy in zip(steps, arrays["MDENERGY"], arrays["ENERGY"]):
+            f.write(f'{istep:9d}' + "".join([f'{value:15.8f}' for value in md_energy]) \
+                + "".join([f'{value:15.8f}' for value in energy]) + "\n")
+
+    # Write BOCOEF file
+    if ("COEF" in arrays):
+        with open(os.path.join(output_dir, "BOCOEF"), "w") as f:
+            f.write(f'{"#":5s} BO State Coefficients: state Re-Im; see the manual for detail orders\n')
+            for istep, coef in zip(steps, arrays["COEF"]):
+                f.write(f'{istep:9d}' + "".join([f'{coef[ist].real:15.8f}{coef[ist].imag:15.8f}' for ist in range(nst)]) + "\n")
+
+    # Write BOPOP, BOCOH files
+    if ("RHO" in arrays):
+        with open(os.path.join(output_dir, "BOPOP"), "w") as f:
+            f.write(f'{"#":5s} Density Matrix: population Re; see the manual for detail orders\n')
+            for istep, rho in zip(steps, arrays["RHO"]):
+                f.write(f'{istep:9d}' + "".join([f'{rho.real[ist, ist]:15.8f}' for ist in range(nst)]) + "\n")
+
+        with open(os.path.join(output_dir, "BOCOH"), "w") as f:
+            f.write(f'{"#":5s} Density Matrix: coherence Re-Im; see the manual for detail orders\n')
+            for istep, rho in zip(steps, arrays["RHO"]):
+                f.write(f'{istep:9d}' + "".join([f"{rho.real[ist, jst]:15.8f}{rho.imag[ist, jst]:15.8f}" \
+                    for ist in range(nst) for jst in range(ist + 1, nst)]) + "\n")
+
+    # Write NACME file
+    if ("NACME" in arrays):
+        with open(os.path.join(output_dir, "NACME"), "w") as f:
+            f.write(f'{"#":5s}Non-Adiabatic Coupling Matrix Elements: off-diagonal\n')
+            for istep, nacme in zip(steps, arrays["NACME"]):
+                f.write(f'{istep:10d}' + "".join([f'{nacme[ist, jst]:15.8f}' \
+                    for ist in range(nst) for jst in range(ist + 1, nst)]) + "\n")
+
+    # Write NACV files
+    if ("NACV" in arrays):
+        nat_qm, ndim = arrays["NACV"].shape[3:]
+        for ist in range(nst):
+            for jst in range(ist + 1, nst):
+                with open(os.path.join(output_dir, f"NACV_{ist}_{jst}"), "w") as f:
+                    for istep, nac in zip(steps, arrays["NACV"]):
+                        f.write(f'{nat_qm:6d}\n{"":2s}Step:{istep:6d}{"":12s}NACV' + \
+                            "".join(["\n" + f'{symbols[iat]:5s}' + \
+                            "".join([f'{nac[ist, jst, iat, isp]:15.8f}' for isp in range(ndim)]) for iat in range(nat_qm)]) + "\n")
+
+    # Write SHSTATE file
+    if ("RSTATE" in arrays):
+        with open(os.path.join(output_dir, "SHSTATE"), "w") as f:
+            f.write(f'{"#":5s}{"Step":8s}{"Running State":10s}\n')
+            for istep, rstate in zip(steps, arrays["RSTATE"]):
+                f.write(f'{istep:9d}{"":14s}{rstate}\n')
+
+    # Write NSUBSTEP file
+    if ("NSUBSTEP" in arrays):
+        with open(os.path.join(output_dir, "NSUBSTEP"), "w") as f:
+            f.write(f'{"#":5s}{"Step":8s}{"Electronic Substeps":10s}\n')
+            for istep, nsubsteps in zip(steps, arrays["NSUBSTEP"]):
+                f.write(f'{istep:9d}{"":14s}{nsubsteps}\n')
+
+if (__name__ == "__main__"):
+    binary_to_text()
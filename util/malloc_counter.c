@@ -0,0 +1,42 @@
+// Counter of the heap allocations for propagator_benchmark.py, which is preloaded before the python interpreter
+// The allocations of the C libraries, numpy and python are counted in the same way, since the calls to malloc,
+// calloc and realloc of the process are passed to the C library after the counter is increased
+// Build : gcc -O2 -shared -fPIC -o libmalloc_counter.so malloc_counter.c
+// Usage : LD_PRELOAD=./libmalloc_counter.so python3 propagator_benchmark.py
+#include <stdio.h>
+#include <stdlib.h>
+
+// Allocation routines of the GNU C library, which are called without the symbol lookup of the next library
+extern void *__libc_malloc(size_t size);
+extern void *__libc_calloc(size_t nmemb, size_t size);
+extern void *__libc_realloc(void *ptr, size_t size);
+
+static long nallocs = 0;
+
+// Routine to get the number of allocations from the start of the process
+long malloc_count(void){
+
+    return __atomic_load_n(&nallocs, __ATOMIC_RELAXED);
+
+}
+
+void *malloc(size_t size){
+
+    __atomic_add_fetch(&nallocs, 1, __ATOMIC_RELAXED);
+    return __libc_malloc(size);
+
+}
+
+void *calloc(size_t nmemb, size_t size){
+
+    __atomic_add_fetch(&nallocs, 1, __ATOMIC_RELAXED);
+    return __libc_calloc(nmemb, size);
+
+}
+
+void *realloc(void *ptr, size_t size){
+
+    __atomic_add_fetch(&nallocs, 1, __ATOMIC_RELAXED);
+    return __libc_realloc(ptr, size);
+
+}
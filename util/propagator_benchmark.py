@@ -0,0 +1,255 @@
+import argparse
+import ctypes
+import importlib
+import json
+import sys
+import time
+from types import SimpleNamespace
+import numpy as np
+
+# Propagators and electronic objects available in each library of electronic propagation
+propagators = {
+    "libmqc": {"rk4": ["coefficient", "density"], "exponential": ["coefficient", "density"], \
+        "rk45": ["coefficient", "density"], "krylov": ["coefficient"], "ld": ["coefficient", "density"]},
+    "libmqcxf": {"rk4": ["coefficient", "density"], "exponential": ["coefficient", "density"], \
+        "rk45": ["coefficient", "density"], "krylov": ["coefficient"]},
+    "libctmqc": {"rk4": ["coefficient"], "rk45": ["coefficient"]},
+    "libmqc_qed": {"rk4": ["coefficient"], "exponential": ["coefficient"], "krylov": ["coefficient"]},
+    "libmqcxf_qed": {"rk4": ["coefficient"], "exponential": ["coefficient"]}}
+
+# Heap allocations are counted only when the counter of 'malloc_counter.c' is preloaded with LD_PRELOAD
+try:
+    malloc_count = ctypes.CDLL(None).malloc_count
+    malloc_count.restype = ctypes.c_long
+except AttributeError:
+    malloc_count = None
+
+def propagator_benchmark():
+    """ Python utility script for PyUNIxMD electronic propagators
+        In this script, the electronic propagators of the C libraries are timed with synthetic random energies
+        and NACMEs, hence neither QM program nor running script is needed
+        WARNING: The libraries must be built and '$PYUNIXMDHOME/src' must be included in PYTHONPATH
+    """
+    parser = argparse.ArgumentParser(description="Python script for benchmark of PyUNIxMD electronic propagators", \
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-l", "--libs", action="store", dest="libs", type=str, nargs="+", \
+        default=list(propagators.keys()), help="Libraries of electronic propagation to be benchmarked")
+    parser.add_argument("-p", "--propagators", action="store", dest="propagators", type=str, nargs="+", \
+        default=None, help="Propagators to be benchmarked (default: all propagators of each library)")
+    parser.add_argument("-e", "--elec-objects", action="store", dest="elec_objects", type=str, nargs="+", \
+        default=["coefficient", "density"], help="Electronic equations of motion to be benchmarked")
+    parser.add_argument("-s", "--nst", action="store", dest="nst", type=int, nargs="+", \
+        default=[2, 10, 50, 200], help="Numbers of electronic states, which are molecular states for QED libraries")
+    parser.add_argument("-n", "--nesteps", action="store", dest="nesteps", type=int, nargs="+", \
+        default=[20], help="Numbers of electronic substeps per nuclear step")
+    parser.add_argument("-a", "--nat", action="store", dest="nat", type=int, nargs="+", \
+        default=[3], help="Numbers of atoms of auxiliary trajectories, only used for XF libraries")
+    parser.add_argument("-r", "--repeat", action="store", dest="repeat", type=int, \
+        default=5, help="Number of timed calls per case, the fastest call is reported")
+    parser.add_argument("--seed", action="store", dest="seed", type=int, \
+        default=0, help="Seed of random numbers for synthetic data")
+    parser.add_argument("--save", action="store", dest="save", type=str, \
+        default=None, help="Filename where the results are saved as baselines")
+    parser.add_argument("--compare", action="store", dest="compare", type=str, \
+        default=None, help="Filename of the baselines to be compared with the results")
+    parser.add_argument("-t", "--tolerance", action="store", dest="tolerance", type=float, \
+        default=0.2, help="Relative slowdown with respect to the baselines regarded as a regression")
+    args = parser.parse_args()
+
+    for lib_name in args.libs:
+        if (not lib_name in propagators.keys()):
+            parser.error(f"Invalid library is given! ( lib = {lib_name} )")
+
+    baselines = {}
+    if (args.compare != None):
+        with open(args.compare, "r") as f:
+            baselines = json.load(f)
+
+    rng = np.random.default_rng(args.seed)
+
+    if (malloc_count == None):
+        print (f"\n Allocations are not counted, since 'libmalloc_counter.so' is not preloaded with LD_PRELOAD \n", \
+            flush=True)
+
+    print (f'{"Library":14s}{"Propagator":13s}{"Object":13s}{"nst":>6s}{"nesteps":>9s}{"nat":>5s}' + \
+        f'{"ns/substep":>14s}{"allocs/call":>13s}{"baseline":>14s}{"ratio":>8s}', flush=True)
+
+    results = {}
+    l_regression = False
+    for lib_name in args.libs:
+        lib = importlib.import_module(f"lib.{lib_name}")
+        l_xf = ("xf" in lib_name)
+        for propagator, elec_objects in propagators[lib_name].items():
+            if (args.propagators != None and not propagator in args.propagators):
+                continue
+            for elec_object in elec_objects:
+                if (not elec_object in args.elec_objects):
+                    continue
+                for nst in args.nst:
+                    for nesteps in args.nesteps:
+                        # Number of atoms is only meaningful for the decoherence term of XF libraries
+                        for nat in (args.nat if (l_xf) else [0]):
+                            case = f"{lib_name}/{propagator}/{elec_object}/nst={nst}/nesteps={nesteps}/nat={nat}"
+                            md, qed = synthetic_md(lib_name, propagator, elec_object, nst, nesteps, nat, rng)
+                            ns_per_substep, nallocs = time_propagator(lib, lib_name, md, qed, args.repeat)
+                            results[case] = {"ns_per_substep": ns_per_substep, "allocs_per_call": nallocs}
+
+                            baseline_string, ratio_string = "", ""
+                            if (case in baselines):
+                                baseline = baselines[case]["ns_per_substep"]
+                                ratio = ns_per_substep / baseline
+                                baseline_string, ratio_string = f"{baseline:14.1f}", f"{ratio:8.2f}"
+                                if (ratio > 1. + args.tolerance):
+                                    ratio_string += "  REGRESSION"
+                                    l_regression = True
+
+                            nallocs_string = "-" if (nallocs == None) else f"{nallocs:.1f}"
+                            print (f"{lib_name:14s}{propagator:13s}{elec_object:13s}{nst:6d}{nesteps:9d}{nat:5d}" + \
+                                f"{ns_per_substep:14.1f}{nallocs_string:>13s}{baseline_string:>14s}{ratio_string}", \
+                                flush=True)
+
+    if (args.save != None):
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    # Return nonzero exit status to make the regressions visible to headless runs
+    if (l_regression):
+        print (f"\n\n Warning: Regressions larger than {args.tolerance * 100.:.0f}% are found. \n\n", flush=True)
+        sys.exit(1)
+
+def synthetic_md(lib_name, propagator, elec_object, nst, nesteps, nat, rng):
+    """ Build the minimal objects read by el_run with random energies and NACMEs
+    """
+    dt = 0.5
+    ndim = 3
+
+    if ("qed" in lib_name):
+        # Uncoupled basis of molecular states with zero or one photon
+        pst = 2 * nst
+        get_d_ind = np.array([[ist, iph] for iph in range(2) for ist in range(nst)], dtype=np.intc)
+        energy, energy_old = random_energy(nst, rng)
+        nacme, nacme_old = random_nacme(nst, rng)
+
+        # JC Hamiltonian couples only the states differing by one photon
+        ham_d, ham_d_old = np.zeros((pst, pst)), np.zeros((pst, pst))
+        coupling = 0.01 * rng.standard_normal((nst, nst))
+        for ham, mol_energy in [(ham_d, energy), (ham_d_old, energy_old)]:
+            ham[np.arange(pst), np.arange(pst)] = mol_energy[get_d_ind[:, 0]] + 0.1 * get_d_ind[:, 1]
+            ham[:nst, nst:] = coupling
+            ham[nst:, :nst] = coupling.T
+        unitary = np.linalg.eigh(ham_d)[1]
+
+        pol = SimpleNamespace(nst=nst, pst=pst, nacme=nacme, nacme_old=nacme_old, \
+            coef_d=random_coef(pst, rng), rho_d=np.zeros((pst, pst), dtype=np.complex128), \
+            dotpopnac_d=np.zeros(pst))
+        qed = SimpleNamespace(get_d_ind=get_d_ind, ham_d=ham_d, ham_d_old=ham_d_old, unitary=unitary)
+        md = SimpleNamespace(pol=pol, nesteps=nesteps, dt=dt, elec_tol=1E-8, propagator=propagator, \
+            elec_object=elec_object, verbosity=0)
+        if (lib_name == "libmqcxf_qed"):
+            md.l_coh = [True] * pst
+            md.sigma = np.full(nat, 0.1)
+            md.dotpopdec_d = np.zeros(pst)
+            add_auxiliary(md, pst, nat, ndim, rng)
+        return md, qed
+
+    energy, energy_old = random_energy(nst, rng)
+    nacme, nacme_old = random_nacme(nst, rng)
+    coef = random_coef(nst, rng)
+    rho = np.conj(coef)[:, np.newaxis] * coef[np.newaxis, :]
+
+    # Overlap between the states at time t and t + dt is close to the identity
+    st_overlap = np.linalg.qr(np.identity(nst) + dt * nacme)[0]
+    st_overlap *= np.sign(np.diagonal(st_overlap))[np.newaxis, :]
+
+    mol = SimpleNamespace(nst=nst, energy=energy, energy_old=energy_old, nacme=nacme, nacme_old=nacme_old, \
+        st_overlap=st_overlap, coef=coef, rho=rho)
+    md = SimpleNamespace(mol=mol, nesteps=nesteps, dt=dt, nac_threshold=0., elec_tol=1E-8, \
+        propagator=propagator, elec_object=elec_object, verbosity=0)
+
+    if (lib_name == "libctmqc"):
+        # CTMQC library propagates the trajectories saved in the ensemble arrays
+        md.nst = nst
+        md.mols = [mol]
+        md.K_lk = 0.01 * rng.standard_normal((1, nst, nst))
+        md.ens = SimpleNamespace(coef=coef[np.newaxis, :].copy(), rho=rho[np.newaxis, :, :].copy())
+        md.nsubsteps = np.zeros(1, dtype=np.intc)
+    elif (lib_name == "libmqcxf"):
+        md.l_coh = [True] * nst
+        md.sigma = np.full((nat, ndim), 0.1)
+        md.dotpopdec = np.zeros(nst)
+        add_auxiliary(md, nst, nat, ndim, rng)
+
+    return md, None
+
+def add_auxiliary(md, nst, nat, ndim, rng):
+    """ Add random auxiliary trajectories used in the decoherence term of XF libraries
+    """
+    md.aux = SimpleNamespace(nat=nat, ndim=ndim, mass=np.full(nat, 1836.), \
+        pos=rng.standard_normal((nst, nat, ndim)))
+    md.pos_0 = rng.standard_normal((nat, ndim))
+    md.phase = rng.standard_normal((nst, nat, ndim))
+    md.qmom = np.zeros((nat, ndim))
+
+def random_energy(nst, rng):
+    """ Random ascending energies at time t + dt and t
+    """
+    energy = np.sort(rng.uniform(0., 0.5, nst))
+    energy_old = energy + 1E-4 * rng.standard_normal(nst)
+    return energy, energy_old
+
+def random_nacme(nst, rng):
+    """ Random antisymmetric NACMEs at time t + dt and t
+    """
+    nacme = 0.01 * rng.standard_normal((nst, nst))
+    nacme -= nacme.T
+    nacme_old = nacme + 1E-4 * (lambda x: x - x.T)(rng.standard_normal((nst, nst)))
+    return nacme, nacme_old
+
+def random_coef(nst, rng):
+    """ Random normalized coefficients
+    """
+    coef = rng.standard_normal(nst) + 1j * rng.standard_normal(nst)
+    return coef / np.linalg.norm(coef)
+
+def time_propagator(lib, lib_name, md, qed, repeat):
+    """ Time the electronic propagation of a nuclear step and count the heap allocations in a call
+        All calls to malloc, calloc and realloc of the process, including the C libraries and the numpy buffers
+        of the interface, are counted if the counter is preloaded, otherwise None is returned
+    """
+    if ("qed" in lib_name):
+        arrays = [md.pol.coef_d, md.pol.rho_d]
+        call = lambda: lib.el_run(md, qed)
+    elif (lib_name == "libctmqc"):
+        arrays = [md.ens.coef, md.ens.rho, md.mol.coef, md.mol.rho]
+        call = lambda: lib.el_run_batch(md, [0])
+    else:
+        arrays = [md.mol.coef, md.mol.rho]
+        call = lambda: lib.el_run(md)
+    arrays_ini = [np.copy(array) for array in arrays]
+
+    # Warm up the call before timing
+    call()
+
+    elapsed = []
+    nallocs = 0
+    for irepeat in range(repeat):
+        # Propagations start from the same coefficients or densities
+        for array, array_ini in zip(arrays, arrays_ini):
+            array[:] = array_ini
+        if (malloc_count != None):
+            count = malloc_count()
+        start = time.perf_counter()
+        call()
+        elapsed.append(time.perf_counter() - start)
+        if (malloc_count != None):
+            nallocs += malloc_count() - count
+
+    if (malloc_count == None):
+        nallocs = None
+    else:
+        nallocs /= repeat
+
+    return min(elapsed) / md.nesteps * 1E9, nallocs
+
+if (__name__ == "__main__"):
+    propagator_benchmark()